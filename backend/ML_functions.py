@@ -18,66 +18,221 @@ NOTE:
 """
 
 import os
+import asyncio
 import base64
 import json
 import openai
 import requests  # Added import for fetching image from URL
-from openai import OpenAI
+import tracing
+import llm_calls
+import prompt_budget
+import deadlines
+import llm_scheduler
+from json_repair import repair_json
+from models import Recipe
+from pydantic import ValidationError
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv  # Add this import for loading .env file
 
 # Load environment variables from .env file
 load_dotenv()  # This will load all variables from .env into os.environ
 
-def generate_delicious_recipes(ingredients_list, preferences=None):
+# API endpoints for the two providers. Override them to point at a local fake server
+# (see perf/fake_llm.py) for offline load tests.
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 
-    """
-    This function uses OpenAI's '4o mini model' to generate a list of three 
-    delicious recipes based on the user's ingredient list and preferences.
+# The async calls share one client per provider and event loop, so they reuse
+# connections (and serve.py workers can open them before the first request)
+_async_clients = {}  # (event loop, base URL) -> AsyncOpenAI
 
-    The function expects a list of tuples with each tuple being of the form:
-    (ingredient_name: str, quantity: int).
+# Models and completion token limits of the two calls
+RECIPE_MODEL = "deepseek-r1-distill-llama-70b"
+RECIPE_MAX_TOKENS = 4000
+# Smaller, faster model for requests whose deadline leaves no time for RECIPE_MODEL
+# (see deadlines.py); it does not think aloud, so it needs fewer tokens
+RECIPE_FAST_MODEL = os.getenv("RECIPE_FAST_MODEL", "llama-3.1-8b-instant")
+RECIPE_FAST_MAX_TOKENS = 1500
+VISION_MODEL = "gpt-4o"
+VISION_MAX_TOKENS = 1000
+# What an image costs in prompt tokens, for the scheduler's token budget (llm_scheduler.py)
+IMAGE_TOKENS = 1000
 
-    Steps:
-      1) Validate the input list and each item in it.
-      2) Format the ingredients into a comma-separated string.
-      3) Construct a user prompt to request recipes.
-      4) Make a call to the OpenAI ChatCompletion endpoint, including a 
-         function specification so that the model can directly return
-         structured data (function calling).
-      5) Return the structured JSON from the model's function call.
+# --- Function specification for structured recipe JSON (generate_delicious_recipes) --- #
+RECIPE_FUNCTIONS = [
+    {
+        "name": "create_recipe_list",
+        "description": "Return three recipes, each with a short name and step by step recipe",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "recipe1": {
+                    "type": "object",
+                    "description": "Information about the first recipe",
+                    "properties": {
+                            "name": {
+                                "type": "string",
+                                "description": "The short name of the recipe"
+                            },
+                        "ingredients": {
+                            "type": "string",
+                            "description": "Detailed list of ingredients required for the recipe"
+                        },
+                        "steps": {
+                            "type": "string",
+                            "description": "Detailed, step by step recipe"
+                        },
+                    },
+                    "required": ["name", "ingredients", "steps"]
 
-    :param ingredients_list: A list of tuples. Each tuple includes a string 
-                            (ingredient name) and an integer (quantity).
-    :param preferences: Optional dictionary containing user preferences for recipes.
-                        Can include 'isVegan', 'isSpicy', 'cuisines', and 'allergens'.
-    :return: A dictionary containing three recipe objects if function call 
-             is successful. Otherwise, a fallback string of the response.
-    """
+                },
+                "recipe2": {
+                    "type": "object",
+                    "description": "Information about the second recipe",
+                    "properties": {
+                        "name": {
+                            "type": "string",
+                            "description": "The short name of the recipe"
+                        },
+                        "ingredients": {
+                            "type": "string",
+                            "description": "Detailed list of ingredients required for the recipe"
+                        },
+                        "steps": {
+                            "type": "string",
+                            "description": "Detailed, step by step recipe"
+                        },
+                    },
+                    "required": ["name", "ingredients", "steps"]
 
-    # --- Step 1: Error checking and validation --- #
-    if not isinstance(ingredients_list, list):
-        # Make sure we're actually dealing with a list
-        raise ValueError("ingredients_list must be a list of tuples.")
-    
-    for item in ingredients_list:
-        # Ensure each item is a tuple
-        if not isinstance(item, tuple):
-            raise ValueError("All items in ingredients_list must be tuples.")
-        # Check correct tuple length
-        if len(item) != 2:
-            raise ValueError("Each tuple must have exactly 2 elements: (ingredient_name, quantity).")
-        # Check types within the tuple
-        if not isinstance(item[0], str):
-            raise ValueError("The first element of each tuple must be a string (ingredient name).")
-        if not isinstance(item[1], int):
-            raise ValueError("The second element of each tuple must be an integer (quantity).")
+                },
+                "recipe3": {
+                    "type": "object",
+                    "description": "Information about the third recipe",
+                    "properties": {
+                        "name": {
+                            "type": "string",
+                            "description": "The short name of the recipe"
+                        },
+                        "ingredients": {
+                            "type": "string",
+                            "description": "Detailed list of ingredients required for the recipe"
+                        },
+                        "steps": {
+                            "type": "string",
+                            "description": "Detailed, step by step recipe"
+                        },
+                    },
+                    "required": ["name", "ingredients", "steps"]
 
-    # --- Step 2: Format the ingredients into a readable string --- #
-    formatted_ingredients = ", ".join([
-        f"{ingredient} ({quantity})" for ingredient, quantity in ingredients_list
-    ])
+                }
+            },
+            "required": ["recipe1", "recipe2", "recipe3"]
+        }
+    }
+]
 
-    # --- Step 3: Format user preferences --- #
+# --- Fan-out mode: one smaller call per recipe slot (generate_recipes_fanout_async) --- #
+RECIPE_SLOTS = ("recipe1", "recipe2", "recipe3")
+RECIPE_SLOT_MAX_TOKENS = 1500
+
+# The three calls cannot see each other, so each slot asks for a different kind of dish
+RECIPE_SLOT_HINTS = {
+    "recipe1": "Make it a quick, simple dish, such as a skillet, stir-fry, omelette or salad.",
+    "recipe2": "Make it a hearty main course, such as a bake, roast, curry or stew.",
+    "recipe3": "Make it something other than an everyday main course, such as a soup, a brunch dish, a snack or a dessert.",
+}
+
+SINGLE_RECIPE_FUNCTIONS = [
+    {
+        "name": "create_recipe",
+        "description": "Return one recipe with a short name and step by step recipe",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "name": {
+                    "type": "string",
+                    "description": "The short name of the recipe"
+                },
+                "ingredients": {
+                    "type": "string",
+                    "description": "Detailed list of ingredients required for the recipe"
+                },
+                "steps": {
+                    "type": "string",
+                    "description": "Detailed, step by step recipe"
+                },
+            },
+            "required": ["name", "ingredients", "steps"]
+        }
+    }
+]
+
+# --- Function specification for structured ingredient JSON (extract_recipe_from_image) --- #
+INGREDIENT_FUNCTIONS = [
+    {
+        "name": "extract_ingredients",
+        "description": "Extract a numbered list of food ingredients with estimated quantities visible in the image",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "ingredients": {
+                    "type": "array",
+                    "description": "List of ingredients with quantities detected in the image",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {
+                                "type": "string",
+                                "description": "Name of the ingredient"
+                            },
+                            "quantity": {
+                                "type": "string",
+                                "description": "Estimated quantity of the ingredient (e.g., '2 cups', '500g', '3 whole')"
+                            }
+                        },
+                        "required": ["name", "quantity"]
+                    }
+                }
+            },
+            "required": ["ingredients"]
+        }
+    }
+]
+
+RECIPE_IMAGE_PROMPT = "Analyze this image and identify all the food ingredients you can see. For each ingredient, try to estimate the quantity based on what's visible in the image."
+
+# Example recipe shown to the model, so it uses the same level of detail
+RECIPE_EXAMPLE = """Here is an example recipe:\n"
+"Broccoli Bacon Quiche\n\n"
+"Instructions:\n"
+"1. Preheat the oven to 375°F (190°C) - 5 minutes\n"
+"2. Cook the chopped bacon in a skillet over medium heat until crispy (about 8-10 minutes). Remove with a slotted spoon and drain on paper towels.\n"
+"3. Cut the broccoli into small florets and steam until just tender (about 4-5 minutes). Let cool slightly and then roughly chop.\n"
+"4. Blind bake the pie crust for 10 minutes until lightly golden.\n"
+"5. In a large bowl, whisk together the eggs, heavy cream, salt, pepper, and nutmeg until well combined (about 2 minutes of whisking).\n"
+"6. Layer the bacon, chopped broccoli, and both cheeses in the pre-baked pie crust.\n"
+"7. Pour the egg mixture over the filling ingredients.\n"
+"8. Bake in the preheated oven for 35-40 minutes, until the center is set and the top is golden brown.\n"
+"9. Let cool for 10 minutes before slicing and serving.\n\n"
+"Ingredients:\n"
+"4 strips of bacon, chopped into small pieces,"
+"1 medium broccoli head (about 2 cups when chopped),"
+"1/2 cup grated cheddar cheese, "
+"1/4 cup grated parmesan cheese, "
+"4 large eggs, "
+"1 cup heavy cream, "
+"1 pre-made pie crust (9-inch), "
+"1/2 teaspoon salt, "
+"1/4 teaspoon black pepper, "
+"1/8 teaspoon nutmeg\n\n"
+"""
+
+
+def format_preferences(preferences):
+    """
+    Turn the optional preferences dictionary into the bullet list added to the recipe prompts.
+    """
     preferences_text = ""
     if preferences:
         if preferences.get('isVegan', False):
@@ -115,6 +270,23 @@ def generate_delicious_recipes(ingredients_list, preferences=None):
         if preferences.get('useOnlyFridgeIngredients', False):
             preferences_text += "- User prefers recipes that only use ingredients available in their fridge.\n"
 
+    return preferences_text
+
+
+def build_recipe_prompt(ingredients_list, preferences=None):
+    """
+    Build the user prompt for generate_delicious_recipes from a validated list of
+    (ingredient_name, quantity) tuples and the optional preferences dictionary.
+    """
+
+    # --- Step 2: Format the ingredients into a readable string --- #
+    formatted_ingredients = ", ".join([
+        f"{ingredient} ({quantity})" for ingredient, quantity in ingredients_list
+    ])
+
+    # --- Step 3: Format user preferences --- #
+    preferences_text = format_preferences(preferences)
+
     # --- Step 4: Construct the user prompt to request recipes --- #
     prompt_text = (
         "You are a recipe creator. The user has the following ingredients in their freezer:\n"
@@ -128,170 +300,379 @@ def generate_delicious_recipes(ingredients_list, preferences=None):
     prompt_text += (
         "Propose a list of three delicious recipes that could be made from these ingredients. "
         "It is not mandatory to use all ingredients. For each recipe, give a short name, the ingredients required (should only include ingredients that the user has in their freezer) and a detailed, step by step recipe.\n\n"
-        """Here is an example recipe:\n"
-"Broccoli Bacon Quiche\n\n"
-"Instructions:\n"
-"1. Preheat the oven to 375°F (190°C) - 5 minutes\n"
-"2. Cook the chopped bacon in a skillet over medium heat until crispy (about 8-10 minutes). Remove with a slotted spoon and drain on paper towels.\n"
-"3. Cut the broccoli into small florets and steam until just tender (about 4-5 minutes). Let cool slightly and then roughly chop.\n"
-"4. Blind bake the pie crust for 10 minutes until lightly golden.\n"
-"5. In a large bowl, whisk together the eggs, heavy cream, salt, pepper, and nutmeg until well combined (about 2 minutes of whisking).\n"
-"6. Layer the bacon, chopped broccoli, and both cheeses in the pre-baked pie crust.\n"
-"7. Pour the egg mixture over the filling ingredients.\n"
-"8. Bake in the preheated oven for 35-40 minutes, until the center is set and the top is golden brown.\n"
-"9. Let cool for 10 minutes before slicing and serving.\n\n"
-"Ingredients:\n"
-"4 strips of bacon, chopped into small pieces,"
-"1 medium broccoli head (about 2 cups when chopped),"
-"1/2 cup grated cheddar cheese, "
-"1/4 cup grated parmesan cheese, "
-"4 large eggs, "
-"1 cup heavy cream, "
-"1 pre-made pie crust (9-inch), "
-"1/2 teaspoon salt, "
-"1/4 teaspoon black pepper, "
-"1/8 teaspoon nutmeg\n\n"
-"Please follow this example format with detailed measurements, precise timing for each step, and complete instructions for your three recipe suggestions, but in a function calling format instead."""
+        + RECIPE_EXAMPLE +
+        """"Please follow this example format with detailed measurements, precise timing for each step, and complete instructions for your three recipe suggestions, but in a function calling format instead."""
     )
 
-    # --- Define the functions parameter for structured JSON --- #
-    functions = [
-        {
-            "name": "create_recipe_list",
-            "description": "Return three recipes, each with a short name and step by step recipe",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "recipe1": {
-                        "type": "object",
-                        "description": "Information about the first recipe",
-                        "properties": {
-                                "name": {
-                                    "type": "string",
-                                    "description": "The short name of the recipe"
-                                },
-                            "ingredients": {
-                                "type": "string",
-                                "description": "Detailed list of ingredients required for the recipe"
-                            },
-                            "steps": {
-                                "type": "string",
-                                "description": "Detailed, step by step recipe"
-                            },
-                        },
-                        "required": ["name", "ingredients", "steps"]
+    return prompt_text
 
-                    },
-                    "recipe2": {
-                        "type": "object",
-                        "description": "Information about the second recipe",
-                        "properties": {
-                            "name": {
-                                "type": "string",
-                                "description": "The short name of the recipe"
-                            },
-                            "ingredients": {
-                                "type": "string",
-                                "description": "Detailed list of ingredients required for the recipe"
-                            },
-                            "steps": {
-                                "type": "string",
-                                "description": "Detailed, step by step recipe"
-                            },
-                        },
-                        "required": ["name", "ingredients", "steps"]
 
-                    },
-                    "recipe3": {
-                        "type": "object",
-                        "description": "Information about the third recipe",
-                        "properties": {
-                            "name": {
-                                "type": "string",
-                                "description": "The short name of the recipe"
-                            },
-                            "ingredients": {
-                                "type": "string",
-                                "description": "Detailed list of ingredients required for the recipe"
-                            },
-                            "steps": {
-                                "type": "string",
-                                "description": "Detailed, step by step recipe"
-                            },
-                        },
-                        "required": ["name", "ingredients", "steps"]
+def build_recipe_slot_prompt(ingredients_list, preferences, slot, avoid=()):
+    """
+    Build the user prompt asking for the single recipe of `slot` ("recipe1" to "recipe3"),
+    steered by its RECIPE_SLOT_HINTS entry so the three concurrent calls propose
+    different dishes. `avoid` lists recipe names the user already got.
+    """
+    formatted_ingredients = ", ".join([
+        f"{ingredient} ({quantity})" for ingredient, quantity in ingredients_list
+    ])
+    preferences_text = format_preferences(preferences)
 
-                    }
+    prompt_text = (
+        "You are a recipe creator. The user has the following ingredients in their freezer:\n"
+        f"{formatted_ingredients}\n"
+    )
+    if preferences_text:
+        prompt_text += f"\nUSER PREFERENCES (IMPORTANT):\n{preferences_text}\n"
+    prompt_text += (
+        "Propose one delicious recipe that could be made from these ingredients. "
+        f"{RECIPE_SLOT_HINTS[slot]} "
+        + (f"The user already has these recipes, so propose a different one: {', '.join(avoid)}. " if avoid else "") +
+        "It is not mandatory to use all ingredients. Give a short name, the ingredients required (should only include ingredients that the user has in their freezer) and a detailed, step by step recipe.\n\n"
+        + RECIPE_EXAMPLE +
+        "\"Please follow this example format with detailed measurements, precise timing for each step, and complete instructions, but in a function calling format instead."
+    )
+    return prompt_text
+
+
+def fit_recipe_ingredients(ingredients_list, preferences, empty_prompt):
+    """
+    Apply the input token budget (prompt_budget.py) to the ingredients of a recipe
+    prompt; `empty_prompt` is that prompt built without any ingredient.
+    Returns (ingredients to use, names of the ingredients left out).
+    """
+    kept, omitted = prompt_budget.fit_ingredients(
+        ingredients_list, preferences, prompt_budget.estimate_tokens(empty_prompt)
+    )
+    if omitted:
+        print(f"Recipe prompt over budget: left out {len(omitted)} of {len(ingredients_list)} ingredients")
+    return kept, omitted
+
+
+def with_omitted(recipes, omitted):
+    """
+    Record the ingredients left out of the prompt in a successful result.
+    """
+    if omitted:
+        recipes["omitted_ingredients"] = omitted
+    return recipes
+
+
+def recipe_messages(prompt_text):
+    """
+    Chat messages for the recipe generation call.
+    """
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": prompt_text}
+    ]
+
+
+def image_messages(encoded_image):
+    """
+    Chat messages for the ingredient extraction call, with the base64-encoded image inline.
+    """
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text", 
+                    "text": RECIPE_IMAGE_PROMPT
                 },
-                "required": ["recipe1", "recipe2", "recipe3"]
-            }
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{encoded_image}",
+                    },
+                },
+            ],
         }
     ]
 
+
+def request_tokens(request):
+    """
+    Tokens a chat completion request may use, for the scheduler's token budget: the text
+    of its messages and functions, IMAGE_TOKENS per image, and its completion limit.
+    """
+    text = [json.dumps(request.get("functions", []))]
+    images = 0
+    for message in request["messages"]:
+        if isinstance(message["content"], str):
+            text.append(message["content"])
+            continue
+        for part in message["content"]:
+            if part["type"] == "image_url":
+                images += 1
+            else:
+                text.append(part.get("text", ""))
+    completion = request.get("max_completion_tokens") or request.get("max_tokens") or 0
+    return llm_calls.estimate_tokens("".join(text)) + images * IMAGE_TOKENS + completion
+
+
+def validate_recipe(data):
+    """
+    Validate one recipe of a function call into the shape of GenerateRecipesResponse's
+    recipe fields. Returns None if it is not a usable recipe.
+    """
+    if not isinstance(data, dict):
+        return None
+    try:
+        return Recipe(**data).dict()
+    except ValidationError:
+        return None
+
+
+def parse_recipe_slots(arguments_str):
+    """
+    Turn the JSON arguments of a create_recipe_list function call (or a text answer
+    containing them) into recipes. The JSON is repaired if needed (json_repair.py) and
+    every slot is validated into a Recipe.
+    Returns (recipes by slot, slots that could not be recovered); a slot that was cut
+    off by truncation counts as not recovered.
+    """
+    try:
+        with tracing.span("json.loads", size=len(arguments_str)) as parse_span:
+            parsed_args, info = repair_json(arguments_str)
+            parse_span.set(repaired=info["repaired"], truncated=info["truncated"])
+    except ValueError:
+        return {}, list(RECIPE_SLOTS)
+
+    if isinstance(parsed_args, list):
+        # A list of recipes instead of recipe1..recipe3
+        parsed_args = dict(zip(RECIPE_SLOTS, parsed_args))
+    elif isinstance(parsed_args, dict) and not any(slot in parsed_args for slot in RECIPE_SLOTS):
+        # The whole function call instead of its arguments: {"name": ..., "arguments": {...}}
+        for wrapper in ("arguments", "parameters"):
+            if isinstance(parsed_args.get(wrapper), dict):
+                parsed_args = parsed_args[wrapper]
+    if not isinstance(parsed_args, dict):
+        return {}, list(RECIPE_SLOTS)
+
+    recipes, missing = {}, []
+    for slot in RECIPE_SLOTS:
+        recipe = None if slot == info["incomplete_key"] else validate_recipe(parsed_args.get(slot))
+        if recipe is None:
+            missing.append(slot)
+        else:
+            recipes[slot] = recipe
+    return recipes, missing
+
+
+def parse_recipe_slot(arguments_str):
+    """
+    Turn the JSON arguments of a create_recipe function call into one recipe, or None
+    if no complete recipe can be recovered.
+    """
+    try:
+        with tracing.span("json.loads", size=len(arguments_str)) as parse_span:
+            parsed_args, info = repair_json(arguments_str)
+            parse_span.set(repaired=info["repaired"], truncated=info["truncated"])
+    except ValueError:
+        return None
+    if info["truncated"]:
+        return None
+    if isinstance(parsed_args, dict) and isinstance(parsed_args.get("arguments"), dict):
+        parsed_args = parsed_args["arguments"]
+    return validate_recipe(parsed_args)
+
+
+def parse_ingredient_arguments(arguments_str):
+    """
+    Turn the JSON arguments of an extract_ingredients function call into the dictionary
+    returned by extract_recipe_from_image.
+    """
+    try:
+        # Parse the JSON arguments provided by the model
+        with tracing.span("json.loads", size=len(arguments_str)):
+            parsed_args = json.loads(arguments_str)
+        ingredients_list = parsed_args.get("ingredients", [])
+
+        # Return the structured data directly as a dictionary matching our response model
+        return {
+            "ingredients": ingredients_list  # This already has the right structure with name and quantity keys
+        }
+
+    except json.JSONDecodeError:
+        return {"error": "Failed to parse function call arguments", "raw_arguments": arguments_str}
+
+
+def validate_ingredients_list(ingredients_list):
+    """
+    Raise ValueError unless `ingredients_list` is a list of (name: str, quantity: int) tuples.
+    """
+    if not isinstance(ingredients_list, list):
+        # Make sure we're actually dealing with a list
+        raise ValueError("ingredients_list must be a list of tuples.")
+    
+    for item in ingredients_list:
+        # Ensure each item is a tuple
+        if not isinstance(item, tuple):
+            raise ValueError("All items in ingredients_list must be tuples.")
+        # Check correct tuple length
+        if len(item) != 2:
+            raise ValueError("Each tuple must have exactly 2 elements: (ingredient_name, quantity).")
+        # Check types within the tuple
+        if not isinstance(item[0], str):
+            raise ValueError("The first element of each tuple must be a string (ingredient name).")
+        if not isinstance(item[1], int):
+            raise ValueError("The second element of each tuple must be an integer (quantity).")
+
+
+def generate_delicious_recipes(ingredients_list, preferences=None):
+
+    """
+    This function uses OpenAI's '4o mini model' to generate a list of three 
+    delicious recipes based on the user's ingredient list and preferences.
+
+    The function expects a list of tuples with each tuple being of the form:
+    (ingredient_name: str, quantity: int).
+
+    Steps:
+      1) Validate the input list and each item in it.
+      2) Format the ingredients into a comma-separated string.
+      3) Construct a user prompt to request recipes.
+      4) Make a call to the OpenAI ChatCompletion endpoint, including a 
+         function specification so that the model can directly return
+         structured data (function calling).
+      5) Return the structured JSON from the model's function call.
+
+    :param ingredients_list: A list of tuples. Each tuple includes a string 
+                            (ingredient name) and an integer (quantity).
+    :param preferences: Optional dictionary containing user preferences for recipes.
+                        Can include 'isVegan', 'isSpicy', 'cuisines', and 'allergens'.
+    :return: A dictionary containing three recipe objects if function call 
+             is successful. Otherwise, a fallback string of the response.
+    """
+
+    # --- Step 1: Error checking and validation --- #
+    validate_ingredients_list(ingredients_list)
+
+    # --- Steps 2-4: Build the prompt from the ingredients and preferences --- #
+    with tracing.span("recipe.prompt_build", ingredients=len(ingredients_list)) as prompt_span:
+        ingredients_list, omitted = fit_recipe_ingredients(
+            ingredients_list, preferences, build_recipe_prompt([], preferences)
+        )
+        prompt_text = build_recipe_prompt(ingredients_list, preferences)
+        prompt_span.set(omitted=len(omitted), estimated_tokens=round(prompt_budget.estimate_tokens(prompt_text)))
+
     # --- Step 5: Make the API call to OpenAI with function calling --- #
     try:
-        client = OpenAI(base_url="https://api.groq.com/openai/v1",
-        api_key=os.getenv("GROQ_API_KEY")
+        client = OpenAI(base_url=GROQ_BASE_URL,
+        api_key=os.getenv("GROQ_API_KEY"),
+        max_retries=0  # retries go through the scheduler (llm_scheduler.py)
         )  # Initialize the groq client
-        response = client.chat.completions.create(
-            model="deepseek-r1-distill-llama-70b",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt_text}
-            ],
-            functions=functions,
+        request = dict(
+            model=RECIPE_MODEL,
+            messages=recipe_messages(prompt_text),
+            functions=RECIPE_FUNCTIONS,
             function_call={"name": "create_recipe_list"},  # Let the model create or skip function calls as it sees fit
-            max_completion_tokens=4000,
+            max_completion_tokens=RECIPE_MAX_TOKENS,
             temperature=0.5
-
         )
+        with tracing.span("llm.chat_completions", provider="groq", model=RECIPE_MODEL) as llm_span:
+            response = llm_scheduler.run_sync("groq", request_tokens(request),
+                                              lambda: scheduled_completion(client, llm_span, request))
     except Exception as e:
         raise RuntimeError(f"OpenAI API call failed: {e}")
 
     # --- Step 6: Retrieve and parse the function call from the response --- #
     try:
-        # Fetch the role to check if the assistant has called the function
-        role = response.choices[0].message.role
+        message = response.choices[0].message
 
         # If the assistant used the function_call approach
-        if hasattr(response.choices[0].message, "function_call"):
-            function_call_data = response.choices[0].message.function_call
+        if getattr(message, "function_call", None):
             # The 'name' should be the function we defined, and the arguments are in JSON format
-            arguments_str = function_call_data.arguments
-
-            try:
-                # Attempt to parse the JSON arguments provided by the model
-                parsed_args = json.loads(arguments_str)
-                
-                # Return the structured data directly as a dictionary matching our response model
-                return {
-                    "recipe1": {
-                        "name": parsed_args["recipe1"]["name"],
-                        "ingredients": parsed_args["recipe1"]["ingredients"].split(", "),
-                        "steps": parsed_args["recipe1"]["steps"]
-                    },
-                    "recipe2": {
-                        "name": parsed_args["recipe2"]["name"],
-                        "ingredients": parsed_args["recipe2"]["ingredients"].split(", "),
-                        "steps": parsed_args["recipe2"]["steps"]
-                    },
-                    "recipe3": {
-                        "name": parsed_args["recipe3"]["name"],
-                        "ingredients": parsed_args["recipe3"]["ingredients"].split(", "),
-                        "steps": parsed_args["recipe3"]["steps"]
-                    }
-                }
-
-            except json.JSONDecodeError:
-                # If the model messed up, return the raw arguments
-                return {"error": "Failed to parse function call arguments", "raw_arguments": arguments_str}
+            arguments_str = message.function_call.arguments
         else:
             print("No function call was used")
-            # If no function_call was used, fallback to raw content
-            return {"fallback_content": response.choices[0].message.content.strip()}
+            # The recipes may still be in the text answer
+            arguments_str = message.content or ""
 
     except (IndexError, AttributeError) as e:
         raise RuntimeError(f"Unexpected response format from OpenAI API: {e}")
+    recipes, missing = parse_recipe_slots(arguments_str)
+
+    # --- Step 7: Ask again for the recipes that could not be recovered, and only those --- #
+    if missing:
+        recipes = regenerate_missing_recipes(ingredients_list, preferences, recipes, missing)
+    return with_omitted(recipes, omitted)
+
+
+def recipe_slot_request(ingredients_list, preferences, slot, avoid=(), model=RECIPE_MODEL):
+    """
+    Chat completion arguments for the single recipe of one slot.
+    """
+    with tracing.span("recipe.prompt_build", ingredients=len(ingredients_list), slot=slot):
+        prompt_text = build_recipe_slot_prompt(ingredients_list, preferences, slot, avoid)
+    return {
+        "model": model,
+        "messages": recipe_messages(prompt_text),
+        "functions": SINGLE_RECIPE_FUNCTIONS,
+        "function_call": {"name": "create_recipe"},
+        "max_completion_tokens": RECIPE_SLOT_MAX_TOKENS,
+        "temperature": 0.5,
+    }
+
+
+def generate_recipe_slot(ingredients_list, preferences, slot, avoid=()):
+    """
+    Blocking version of generate_recipe_slot_async: one recipe, or {"error": ...}.
+    """
+    try:
+        client = OpenAI(base_url=GROQ_BASE_URL, api_key=os.getenv("GROQ_API_KEY"), max_retries=0)
+        request = recipe_slot_request(ingredients_list, preferences, slot, avoid)
+        with tracing.span("llm.chat_completions", provider="groq", model=RECIPE_MODEL, slot=slot) as llm_span:
+            response = llm_scheduler.run_sync("groq", request_tokens(request),
+                                              lambda: scheduled_completion(client, llm_span, request))
+            if getattr(response, "usage", None):
+                llm_calls.record_completed("recipe_slot", response.usage.completion_tokens)
+        message = response.choices[0].message
+    except Exception as e:
+        return {"error": f"OpenAI API call failed: {e}"}
+
+    arguments_str = message.function_call.arguments if getattr(message, "function_call", None) else message.content
+    recipe = parse_recipe_slot(arguments_str or "")
+    return recipe if recipe is not None else {"error": "Failed to parse function call arguments"}
+
+
+def complete_recipes(recipes, missing, regenerated):
+    """
+    Fill the `missing` slots with their `regenerated` recipes (or errors). Raises
+    RuntimeError if no slot holds a recipe.
+    """
+    recipes = dict(recipes)
+    for slot, recipe in zip(missing, regenerated):
+        recipes[slot] = recipe
+    llm_calls.count("recipe_slots_regenerated", len(missing))
+    llm_calls.count("recipe_slots_failed", sum(1 for recipe in regenerated if "error" in recipe))
+    if all("error" in recipes[slot] for slot in RECIPE_SLOTS):
+        raise RuntimeError("Failed to parse function call arguments")
+    return {slot: recipes[slot] for slot in RECIPE_SLOTS}
+
+
+def regenerate_missing_recipes(ingredients_list, preferences, recipes, missing):
+    """
+    Ask the model again for the `missing` slots only, one call each, avoiding the
+    names of the recipes that were recovered.
+    """
+    print(f"Regenerating recipe slots that could not be parsed: {', '.join(missing)}")
+    avoid = [recipe["name"] for recipe in recipes.values()]
+    regenerated = [generate_recipe_slot(ingredients_list, preferences, slot, avoid) for slot in missing]
+    return complete_recipes(recipes, missing, regenerated)
+
+
+async def regenerate_missing_recipes_async(ingredients_list, preferences, recipes, missing, model=RECIPE_MODEL):
+    """
+    Async version of regenerate_missing_recipes; the missing slots are asked for concurrently.
+    """
+    print(f"Regenerating recipe slots that could not be parsed: {', '.join(missing)}")
+    avoid = [recipe["name"] for recipe in recipes.values()]
+    regenerated = await asyncio.gather(*(
+        generate_recipe_slot_async(ingredients_list, preferences, slot, avoid, model) for slot in missing
+    ))
+    return complete_recipes(recipes, missing, regenerated)
 
 
 def extract_recipe_from_image(image_data: bytes) -> dict:
@@ -316,68 +697,26 @@ def extract_recipe_from_image(image_data: bytes) -> dict:
         raise ValueError("No image data received.")
 
     # --- Step 2: Convert image bytes to a base64-encoded string --- #
-    encoded_image = base64.b64encode(image_data).decode("utf-8")
+    with tracing.span("image.encode", size=len(image_data)):
+        encoded_image = base64.b64encode(image_data).decode("utf-8")
 
-    # --- Step 3: Define function calling structure for structured JSON output --- #
-    functions = [
-        {
-            "name": "extract_ingredients",
-            "description": "Extract a numbered list of food ingredients with estimated quantities visible in the image",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "ingredients": {
-                        "type": "array",
-                        "description": "List of ingredients with quantities detected in the image",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "name": {
-                                    "type": "string",
-                                    "description": "Name of the ingredient"
-                                },
-                                "quantity": {
-                                    "type": "string",
-                                    "description": "Estimated quantity of the ingredient (e.g., '2 cups', '500g', '3 whole')"
-                                }
-                            },
-                            "required": ["name", "quantity"]
-                        }
-                    }
-                },
-                "required": ["ingredients"]
-            }
-        }
-    ]
+    # --- Step 3: Function calling structure for structured JSON output (INGREDIENT_FUNCTIONS) --- #
 
     # --- Step 4: Make the API call to the GPT-4o vision model with function calling --- #
     try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))  # Use standard OpenAI client with OpenAI API key
-
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Use OpenAI's GPT-4o model with vision capabilities
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text", 
-                            "text": "Analyze this image and identify all the food ingredients you can see. For each ingredient, try to estimate the quantity based on what's visible in the image."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{encoded_image}",
-                            },
-                        },
-                    ],
-                }
-            ],
-            functions=functions,
+        client = OpenAI(base_url=OPENAI_BASE_URL, api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)  # Use standard OpenAI client with OpenAI API key
+        request = dict(
+            model=VISION_MODEL,  # Use OpenAI's GPT-4o model with vision capabilities
+            messages=image_messages(encoded_image),
+            functions=INGREDIENT_FUNCTIONS,
             function_call={"name": "extract_ingredients"},
-            max_tokens=1000,
+            max_tokens=VISION_MAX_TOKENS,
             temperature=0.3
         )
+
+        with tracing.span("llm.chat_completions", provider="openai", model=VISION_MODEL) as llm_span:
+            response = llm_scheduler.run_sync("openai", request_tokens(request),
+                                              lambda: scheduled_completion(client, llm_span, request))
     except Exception as e:
         raise RuntimeError(f"OpenAI API call failed: {e}")
 
@@ -388,18 +727,7 @@ def extract_recipe_from_image(image_data: bytes) -> dict:
             function_call_data = response.choices[0].message.function_call
             arguments_str = function_call_data.arguments
 
-            try:
-                # Parse the JSON arguments provided by the model
-                parsed_args = json.loads(arguments_str)
-                ingredients_list = parsed_args.get("ingredients", [])
-
-                # Return the structured data directly as a dictionary matching our response model
-                return {
-                    "ingredients": ingredients_list  # This already has the right structure with name and quantity keys
-                }
-
-            except json.JSONDecodeError:
-                return {"error": "Failed to parse function call arguments", "raw_arguments": arguments_str}
+            return parse_ingredient_arguments(arguments_str)
         else:
             # If no function_call was used, fallback to raw content
             raw_content = response.choices[0].message.content.strip()
@@ -409,6 +737,263 @@ def extract_recipe_from_image(image_data: bytes) -> dict:
         raise RuntimeError(f"Unexpected response format from API: {e}")
 
 
+def async_client(base_url, api_key_variable):
+    """
+    The AsyncOpenAI client of this event loop for a provider, created on first use.
+    """
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _async_clients if key[0].is_closed()]:
+        del _async_clients[key]  # left behind by a finished event loop
+    client = _async_clients.get((loop, base_url))
+    if client is None:
+        # No retries of its own: the scheduler retries, and pauses the provider after a 429
+        client = AsyncOpenAI(base_url=base_url, api_key=os.getenv(api_key_variable), max_retries=0)
+        _async_clients[(loop, base_url)] = client
+    return client
+
+
+async def warm_llm_clients(timeout=5.0):
+    """
+    Create the clients of both providers and open a connection to each (a models
+    listing), so the first recipe or image request does not pay for DNS and TLS.
+    Any HTTP answer counts: the connection is what is being warmed.
+    """
+    for base_url, api_key_variable in ((GROQ_BASE_URL, "GROQ_API_KEY"), (OPENAI_BASE_URL, "OPENAI_API_KEY")):
+        if not os.getenv(api_key_variable):
+            continue
+        try:
+            await asyncio.wait_for(async_client(base_url, api_key_variable).models.list(), timeout)
+        except openai.APIStatusError:
+            pass
+
+
+async def close_llm_clients():
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _async_clients if key[0] is loop]:
+        await _async_clients.pop(key).close()
+
+
+def scheduled_completion(client, llm_span, request):
+    """
+    Make a blocking chat completion, inside a slot of the scheduler (llm_scheduler.run_sync),
+    and report its usage.
+    """
+    response = client.chat.completions.create(**request)
+    if getattr(response, "usage", None):
+        llm_span.set(completion_tokens=response.usage.completion_tokens, prompt_tokens=response.usage.prompt_tokens)
+        llm_scheduler.record_usage(response.usage.total_tokens)
+    return response
+
+
+async def stream_function_call(client, provider, kind, llm_span, token_limit, **request):
+    """
+    Make a streamed chat completion and collect it, in a slot of `provider` from the
+    scheduler (llm_scheduler.py; it may wait in the queue, and tries again after a 429).
+    Returns (function call arguments or None, text content). If the calling task is
+    cancelled, the upstream stream is closed right away (so the provider stops
+    generating) and the tokens saved are recorded. The HTTP timeout is the time left
+    before the request's deadline (deadlines.py).
+    """
+    return await llm_scheduler.run(
+        provider, request_tokens(request),
+        lambda: collect_function_call(client, kind, llm_span, token_limit, dict(request)),
+    )
+
+
+async def collect_function_call(client, kind, llm_span, token_limit, request):
+    if deadlines.remaining() is not None:
+        request.setdefault("timeout", max(deadlines.remaining(), 0.001))
+    stream = await client.chat.completions.create(
+        stream=True, stream_options={"include_usage": True}, **request
+    )
+    arguments = []
+    content = []
+    usage = None
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.function_call and delta.function_call.arguments:
+                arguments.append(delta.function_call.arguments)
+            elif delta.tool_calls:
+                arguments.extend(call.function.arguments or "" for call in delta.tool_calls if call.function)
+            elif delta.content:
+                content.append(delta.content)
+    except asyncio.CancelledError:
+        received = llm_calls.estimate_tokens("".join(arguments) + "".join(content))
+        llm_calls.record_cancelled(kind, received, token_limit)
+        llm_span.set(cancelled=True, completion_tokens_received=received)
+        raise
+    finally:
+        await stream.close()
+
+    arguments_str = "".join(arguments)
+    completion_tokens = usage.completion_tokens if usage else llm_calls.estimate_tokens(arguments_str + "".join(content))
+    llm_calls.record_completed(kind, completion_tokens)
+    llm_span.set(completion_tokens=completion_tokens)
+    if usage:
+        llm_span.set(prompt_tokens=usage.prompt_tokens)
+        llm_scheduler.record_usage(usage.total_tokens)
+    return (arguments_str if arguments else None), "".join(content)
+
+
+async def generate_delicious_recipes_async(ingredients_list, preferences=None, model=RECIPE_MODEL):
+    """
+    Cancellable version of generate_delicious_recipes, for async endpoints.
+    Same input and output, but the completion is streamed: cancelling the task
+    closes the upstream stream instead of waiting for up to RECIPE_MAX_TOKENS tokens.
+    `model` can be RECIPE_FAST_MODEL when the request is short of time.
+    """
+    token_limit = RECIPE_MAX_TOKENS if model == RECIPE_MODEL else RECIPE_FAST_MAX_TOKENS
+    # --- Step 1: Error checking and validation --- #
+    validate_ingredients_list(ingredients_list)
+
+    # --- Steps 2-4: Build the prompt from the ingredients and preferences --- #
+    with tracing.span("recipe.prompt_build", ingredients=len(ingredients_list)) as prompt_span:
+        ingredients_list, omitted = fit_recipe_ingredients(
+            ingredients_list, preferences, build_recipe_prompt([], preferences)
+        )
+        prompt_text = build_recipe_prompt(ingredients_list, preferences)
+        prompt_span.set(omitted=len(omitted), estimated_tokens=round(prompt_budget.estimate_tokens(prompt_text)))
+
+    # --- Step 5: Stream the API call with function calling --- #
+    try:
+        client = async_client(GROQ_BASE_URL, "GROQ_API_KEY")
+        with tracing.span("llm.chat_completions", provider="groq", model=model, stream=True) as llm_span:
+            arguments_str, content = await stream_function_call(
+                client, "groq", "recipes", llm_span, token_limit,
+                model=model,
+                messages=recipe_messages(prompt_text),
+                functions=RECIPE_FUNCTIONS,
+                function_call={"name": "create_recipe_list"},
+                max_completion_tokens=token_limit,
+                temperature=0.5
+            )
+    except Exception as e:
+        raise RuntimeError(f"OpenAI API call failed: {e}")
+
+    # --- Step 6: Parse the function call arguments (or the text answer) --- #
+    if arguments_str is None:
+        print("No function call was used")
+    recipes, missing = parse_recipe_slots(arguments_str if arguments_str is not None else content)
+
+    # --- Step 7: Ask again for the recipes that could not be recovered, and only those --- #
+    if missing:
+        recipes = await regenerate_missing_recipes_async(ingredients_list, preferences, recipes, missing, model)
+    return with_omitted(recipes, omitted)
+
+
+async def generate_recipe_slot_async(ingredients_list, preferences, slot, avoid=(), model=RECIPE_MODEL):
+    """
+    Generate the single recipe of one slot ("recipe1" to "recipe3") with its own
+    streamed call. Returns the recipe dictionary, or {"error": ...} if the call failed
+    or did not return a usable function call, so one bad slot does not sink the others.
+    The ingredients must already fit the prompt budget (see generate_recipes_fanout_async).
+    """
+    request = recipe_slot_request(ingredients_list, preferences, slot, avoid, model)
+    try:
+        client = async_client(GROQ_BASE_URL, "GROQ_API_KEY")
+        with tracing.span("llm.chat_completions", provider="groq", model=model, stream=True, slot=slot) as llm_span:
+            arguments_str, content = await stream_function_call(
+                client, "groq", "recipe_slot", llm_span, RECIPE_SLOT_MAX_TOKENS, **request
+            )
+    except Exception as e:
+        return {"error": f"OpenAI API call failed: {e}"}
+
+    recipe = parse_recipe_slot(arguments_str if arguments_str is not None else content)
+    return recipe if recipe is not None else {"error": "Failed to parse function call arguments"}
+
+
+async def generate_recipes_fanout_async(ingredients_list, preferences=None, deadline=None, on_pending=None,
+                                        model=RECIPE_MODEL):
+    """
+    Fan-out version of generate_delicious_recipes_async: one concurrent, smaller call per
+    recipe slot instead of one call writing all three recipes in a row, assembled into the
+    same recipe1-recipe3 dictionary. The answer takes as long as the slowest slot.
+
+    If `deadline` (seconds) passes first, the finished slots are returned and the others
+    are marked {"pending": True}. `on_pending(task)` can take over an unfinished call and
+    return an ID to fetch its recipe later, added as "slot_id"; without it the call is
+    cancelled. A slot that failed is {"error": ...}; if all three failed, RuntimeError
+    is raised. Cancelling this coroutine cancels every slot still running.
+    """
+    # --- Step 1: Error checking and validation, and the prompt budget --- #
+    validate_ingredients_list(ingredients_list)
+    longest_empty_prompt = max(
+        (build_recipe_slot_prompt([], preferences, slot) for slot in RECIPE_SLOTS), key=len
+    )
+    ingredients_list, omitted = fit_recipe_ingredients(ingredients_list, preferences, longest_empty_prompt)
+
+    # --- Step 2: Start one call per slot --- #
+    tasks = {
+        slot: asyncio.ensure_future(generate_recipe_slot_async(ingredients_list, preferences, slot, model=model))
+        for slot in RECIPE_SLOTS
+    }
+
+    # --- Step 3: Wait for all of them, or until the deadline --- #
+    try:
+        with tracing.span("recipe.fanout", slots=len(tasks)) as fanout_span:
+            await asyncio.wait(tasks.values(), timeout=deadline)
+            fanout_span.set(finished=sum(task.done() for task in tasks.values()))
+    except asyncio.CancelledError:
+        for task in tasks.values():
+            task.cancel()
+        raise
+
+    # --- Step 4: Assemble the slots, handing unfinished ones over or cancelling them --- #
+    recipes = {}
+    for slot, task in tasks.items():
+        if task.done():
+            recipes[slot] = task.result()
+        elif on_pending is not None:
+            recipes[slot] = {"pending": True, "slot_id": on_pending(task)}
+        else:
+            task.cancel()
+            recipes[slot] = {"pending": True}
+
+    if all("error" in recipe for recipe in recipes.values()):
+        raise RuntimeError(recipes["recipe1"]["error"])
+    return with_omitted(recipes, omitted)
+
+
+async def extract_recipe_from_image_async(image_data: bytes) -> dict:
+    """
+    Cancellable version of extract_recipe_from_image, for async endpoints.
+    Same input and output, but the completion is streamed and closed when cancelled.
+    """
+    # --- Step 1: Basic validation of the image data --- #
+    if not image_data:
+        raise ValueError("No image data received.")
+
+    # --- Step 2: Convert image bytes to a base64-encoded string --- #
+    with tracing.span("image.encode", size=len(image_data)):
+        encoded_image = base64.b64encode(image_data).decode("utf-8")
+
+    # --- Steps 3-4: Stream the vision call with function calling --- #
+    try:
+        client = async_client(OPENAI_BASE_URL, "OPENAI_API_KEY")
+        with tracing.span("llm.chat_completions", provider="openai", model=VISION_MODEL, stream=True) as llm_span:
+            arguments_str, content = await stream_function_call(
+                client, "openai", "vision", llm_span, VISION_MAX_TOKENS,
+                model=VISION_MODEL,
+                messages=image_messages(encoded_image),
+                functions=INGREDIENT_FUNCTIONS,
+                function_call={"name": "extract_ingredients"},
+                max_tokens=VISION_MAX_TOKENS,
+                temperature=0.3
+            )
+    except Exception as e:
+        raise RuntimeError(f"OpenAI API call failed: {e}")
+
+    # --- Step 5: Parse the model output for ingredients with quantities --- #
+    if arguments_str is not None:
+        return parse_ingredient_arguments(arguments_str)
+    return {"fallback_content": content.strip()}
+
+
 def main():
     """
     Main function to demonstrate usage of the ML functions above.
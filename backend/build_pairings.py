@@ -0,0 +1,75 @@
+"""
+Build the ingredient pairing model served by /fridge/suggestions (see pairings.py)
+from every user's fridge, the favorites and the recently generated recipes.
+
+Run it on a schedule (cron, or --every), on a machine that shares PAIRINGS_DIR with
+the app workers; they switch to the new model within PAIRINGS_RELOAD_SECONDS. A build
+reads the collections once; a hundred thousand fridges take under ten seconds.
+
+Usage (from the backend folder, with MONGODB_URI, MONGODB_DB and FRIDGE_LAYOUT set
+like the app):
+
+    python build_pairings.py
+    python build_pairings.py --every 3600 --top-k 50
+"""
+
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+import pairings
+from favorites_index import favorite_ingredients
+from fridge_store import create_fridge_store
+
+
+def recipes(db):
+    """
+    Yield (title, ingredient lines) of the favorites and the generated recipes.
+    """
+    for document in db["favorite_recipes"].find({}, {"title": 1, "ingredients": 1, "description": 1}):
+        yield document["title"], favorite_ingredients(document)
+    for document in db["generated_recipes"].find({}, {"title": 1, "ingredients": 1}):
+        yield document["title"], document.get("ingredients", [])
+
+
+def build(db, directory: str, top_k: int, min_count: int):
+    started = time.monotonic()
+    manifest = pairings.build_model(
+        create_fridge_store(db).iter_fridges(), recipes(db), directory, top_k=top_k, min_count=min_count
+    )
+    print(f"Generation {manifest['generation']}: {manifest['fridges']} fridges, {manifest['recipes']} recipes, "
+          f"{len(manifest['vocabulary'])} ingredients in {time.monotonic() - started:.1f}s -> {directory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directory", default=pairings.DIRECTORY)
+    parser.add_argument("--top-k", type=int, default=pairings.TOP_K, help="partners kept per ingredient")
+    parser.add_argument("--min-count", type=int, default=pairings.MIN_COUNT)
+    parser.add_argument("--every", type=float, default=0, help="rebuild every N seconds instead of once")
+    args = parser.parse_args()
+
+    load_dotenv()
+    uri = os.getenv("MONGODB_URI")
+    if not uri:
+        raise ValueError("MONGODB_URI environment variable is not set. Please check your .env file.")
+    db = MongoClient(uri, server_api=ServerApi('1'))[os.getenv("MONGODB_DB", "fridge")]
+
+    while True:
+        try:
+            build(db, args.directory, args.top_k, args.min_count)
+        except Exception as e:
+            if not args.every:
+                raise
+            print(f"Error building the pairing model: {e}")
+        if not args.every:
+            return
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+This file defines a small in-process, read-through LRU cache used by main.py to avoid
+re-reading a user's profile, fridge and favorites from MongoDB on every request.
+
+Design notes:
+  - Entries are slotted objects holding plain tuples (not dicts or Pydantic models),
+    which keeps per-entry overhead low and makes the size estimate cheap.
+  - The cache is bounded by an approximate memory budget in bytes (and a TTL, which
+    bounds staleness when several worker processes each have their own copy).
+  - Writers must call `invalidate()` after a successful write; the next read reloads.
+    A load that started before the invalidation does not put its (stale) result in
+    the cache: each key with a load in flight has a generation, bumped by
+    `invalidate()`, and `get_or_load` only keeps a result whose generation is unchanged.
+  - With several workers (serve.py), READ_CACHE_BACKEND=shared keeps one copy for all
+    of them in shared memory instead (shared_cache.py, same interface).
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Sentinel for "not in the cache", since None is a valid cached value
+MISSING = object()
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at")
+
+    def __init__(self, value, size: int, expires_at: float):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+
+
+def estimate_size(value) -> int:
+    """
+    Approximate the memory held by a cached value: tuples, lists, strings and numbers.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        for element in value:
+            size += estimate_size(element)
+    return size
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by an approximate memory budget.
+    Keys are hashable tuples, e.g. ("fridge", user_id).
+    """
+
+    def __init__(self, name: str, max_bytes: int, ttl_seconds: float):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_loads = 0
+        self._loading = {}  # key -> [loads in flight, generation]
+
+    def get(self, key):
+        """
+        Return the cached value for `key`, or MISSING.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key, value):
+        size = estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return  # Never cache something bigger than the whole budget
+        with self._lock:
+            self._insert(key, value, size)
+
+    def _insert(self, key, value, size: int):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(value, size, time.monotonic() + self.ttl_seconds)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """
+        Read-through: return the cached value, or call `loader()` and cache its result,
+        unless `key` was invalidated while it was loading (the result may predate the write).
+        """
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        with self._lock:
+            loading = self._loading.setdefault(key, [0, 0])
+            loading[0] += 1
+            generation = loading[1]
+        value = MISSING
+        try:
+            value = loader()
+            size = estimate_size(key) + estimate_size(value)
+        finally:
+            with self._lock:
+                if value is not MISSING:
+                    if loading[1] != generation:
+                        self.stale_loads += 1
+                    elif size <= self.max_bytes:
+                        self._insert(key, value, size)
+                loading[0] -= 1
+                if loading[0] == 0:
+                    del self._loading[key]
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if key in self._loading:
+                self._loading[key][1] += 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_loads": self.stale_loads,
+            }
+
+
+class NullCache(LRUCache):
+    """
+    Drop-in replacement used when caching is disabled: every lookup is a miss.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name, max_bytes=0, ttl_seconds=0)
+
+    def put(self, key, value):
+        pass
+
+
+def create_read_cache(name: str = "read_cache") -> LRUCache:
+    """
+    Build the read cache from environment variables:
+      READ_CACHE_ENABLED (default "1"), READ_CACHE_MAX_BYTES (default 32 MiB),
+      READ_CACHE_TTL_SECONDS (default 300),
+      READ_CACHE_BACKEND ("memory", the default, or "shared" across worker processes),
+      READ_CACHE_SLOT_BYTES (default 2048) and READ_CACHE_SHARED_DIR (default /dev/shm)
+      for the shared backend.
+    """
+    if os.getenv("READ_CACHE_ENABLED", "1") != "1":
+        return NullCache(name)
+    max_bytes = int(os.getenv("READ_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    ttl_seconds = float(os.getenv("READ_CACHE_TTL_SECONDS", "300"))
+    if os.getenv("READ_CACHE_BACKEND", "memory") == "shared":
+        from shared_cache import SharedCache
+        return SharedCache(
+            name, max_bytes, ttl_seconds,
+            slot_bytes=int(os.getenv("READ_CACHE_SLOT_BYTES", "2048")),
+            directory=os.getenv("READ_CACHE_SHARED_DIR") or None,
+        )
+    return LRUCache(name, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
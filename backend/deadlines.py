@@ -0,0 +1,176 @@
+"""
+This file gives every request a latency budget, and helps the slow endpoints spend it.
+
+Clients give up after about 30 seconds; anything still running after that is wasted.
+DeadlineMiddleware starts the clock when a request arrives. The budget is:
+  - the X-Request-Deadline-Ms header, milliseconds the client is willing to wait
+    (capped at DEADLINE_MAX_MS, default 60000);
+  - otherwise the route's default from DEADLINE_ROUTES_MS, "path=ms,..." (by default
+    25 s for recipe generation and the image scans, below the clients' 30 s);
+  - otherwise none: `remaining()` is None and nothing is bounded.
+
+The deadline is a context variable, so it follows the request into asyncio tasks and
+asyncio.to_thread. Each step bounds its own work with what is left: `mongo_timeout()`
+around MongoDB reads, `time_for(tier)` before an LLM call.
+
+Recipe generation (main.generate_recipes) degrades through tiers as the budget runs
+out, and reports which one served each request with `served(tier)`:
+
+  cached   recipes pre-generated for exactly this fridge (pregen.py)
+  similar  recipes generated for a nearly identical fridge (recipe_cache.py)
+  full     the full recipe model
+  fast     a smaller, faster model (RECIPE_FAST_MODEL), when the full one cannot
+           finish in time
+  partial  no time left for a model: whatever local recipes fit the fridge (near
+           matches, favorites), the other slots marked as not generated
+
+`observe(tier, seconds)` records how long the model tiers take, so `time_for` only
+starts a call that can finish (its median so far, over the last OBSERVATION_SECONDS).
+GET /metrics shows the tier distribution under "deadlines".
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+
+import pymongo
+
+HEADER = b"x-request-deadline-ms"
+MAX_MS = float(os.getenv("DEADLINE_MAX_MS", "60000"))
+ROUTES_MS = {
+    path.strip(): float(ms)
+    for path, _, ms in (entry.partition("=") for entry in os.getenv(
+        "DEADLINE_ROUTES_MS",
+        "/fridge/generate_recipes=25000,/fridge/load_from_image=25000,/fridge/load_from_images=25000",
+    ).split(","))
+    if path.strip() and ms.strip()
+}
+
+TIERS = ("cached", "similar", "full", "fast", "partial")
+
+# Until calls have been observed: typical latencies of the two model tiers (seconds)
+DEFAULT_EXPECTED = {"full": 8.0, "fast": 1.0}
+OBSERVATION_SECONDS = 600
+MAX_OBSERVATIONS = 200
+
+_deadline = contextvars.ContextVar("deadline", default=None)  # time.monotonic() value
+
+_lock = threading.Lock()
+_observations = {tier: deque(maxlen=MAX_OBSERVATIONS) for tier in DEFAULT_EXPECTED}  # (when, seconds)
+_counters = {
+    "requests_with_deadline": 0, "from_header": 0,
+    "served": {tier: 0 for tier in TIERS}, "skipped": {}, "timed_out": {},
+}
+
+
+def start(seconds: float | None):
+    """
+    Set the deadline of the current request (None: no deadline). Returns a token for reset().
+    """
+    return _deadline.set(None if seconds is None else time.monotonic() + seconds)
+
+
+def reset(token):
+    _deadline.reset(token)
+
+
+def remaining() -> float | None:
+    """
+    Seconds left before the deadline (never negative), or None without a deadline.
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def mongo_timeout():
+    """
+    pymongo.timeout() with the time left, so a slow query fails instead of outliving the request.
+    """
+    left = remaining()
+    return pymongo.timeout(None if left is None else max(left, 0.001))
+
+
+def expected(tier: str) -> float:
+    """
+    Median duration of the recent calls of a model tier (or its default).
+    """
+    cutoff = time.monotonic() - OBSERVATION_SECONDS
+    with _lock:
+        recent = sorted(seconds for when, seconds in _observations[tier] if when >= cutoff)
+    return recent[len(recent) // 2] if recent else DEFAULT_EXPECTED[tier]
+
+
+def time_for(tier: str, reserve: float = 0.0) -> float | None:
+    """
+    The timeout for a call of `tier`, keeping `reserve` seconds for the tiers after it:
+    None without a deadline, 0 if the call is not expected to finish in time (skip it).
+    """
+    left = remaining()
+    if left is None:
+        return None
+    available = left - reserve
+    if available < expected(tier):
+        with _lock:
+            _counters["skipped"][tier] = _counters["skipped"].get(tier, 0) + 1
+        return 0
+    return available
+
+
+def observe(tier: str, seconds: float, timed_out: bool = False):
+    """
+    Record how long a call of `tier` took; a timed-out call counts with its timeout,
+    as a lower bound.
+    """
+    with _lock:
+        _observations[tier].append((time.monotonic(), seconds))
+        if timed_out:
+            _counters["timed_out"][tier] = _counters["timed_out"].get(tier, 0) + 1
+
+
+def served(tier: str):
+    with _lock:
+        _counters["served"][tier] += 1
+
+
+class DeadlineMiddleware:
+    """
+    Start the deadline of every HTTP request (X-Request-Deadline-Ms or the route default).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        milliseconds = ROUTES_MS.get(scope["path"])
+        header = dict(scope.get("headers") or []).get(HEADER)
+        if header is not None:
+            try:
+                milliseconds = min(max(float(header), 0.0), MAX_MS)
+                with _lock:
+                    _counters["from_header"] += 1
+            except ValueError:
+                pass
+        if milliseconds is not None:
+            with _lock:
+                _counters["requests_with_deadline"] += 1
+
+        token = start(None if milliseconds is None else milliseconds / 1000)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset(token)
+
+
+def stats() -> dict:
+    with _lock:
+        result = {key: dict(value) if isinstance(value, dict) else value for key, value in _counters.items()}
+    total = sum(result["served"].values())
+    result["tier_share"] = {tier: count / total if total else 0.0 for tier, count in result["served"].items()}
+    result["expected_seconds"] = {tier: round(expected(tier), 3) for tier in DEFAULT_EXPECTED}
+    return result
@@ -0,0 +1,203 @@
+"""
+This file defines a small in-process publish/subscribe bus for fridge change events,
+used by the /fridge/ws WebSocket endpoint in main.py to push item-level changes to
+connected clients instead of having them poll /fridge/get.
+
+Events are plain dicts, for example:
+    {"type": "upsert", "item": {"id": "...", "name": "egg", "quantity": 3}}
+    {"type": "delete", "item": {"id": "...", "name": "egg"}}
+    {"type": "resync"}   # the client fell behind and should re-fetch /fridge/get
+
+Sources of events:
+  1) "local" (default): the fridge mutation endpoints publish directly to the bus.
+     Only clients connected to the same worker process see the change.
+  2) "changestream": a background thread tails a MongoDB change stream on the
+     fridge_items collection, so every worker sees every change (needs a replica set).
+     Pick it with FRIDGE_EVENTS_SOURCE=changestream.
+
+Backpressure: every subscriber has a bounded queue. When a slow client's queue is
+full, its pending events are dropped and replaced by a single "resync" event, so
+a slow consumer never blocks publishers or grows memory without bound.
+"""
+
+import asyncio
+import os
+import threading
+from collections import defaultdict
+
+from pymongo.errors import OperationFailure
+
+# Maximum number of undelivered events buffered per WebSocket connection
+QUEUE_SIZE = int(os.getenv("FRIDGE_EVENTS_QUEUE_SIZE", "64"))
+
+# "local" or "changestream" (see module docstring)
+EVENTS_SOURCE = os.getenv("FRIDGE_EVENTS_SOURCE", "local")
+
+# Pause before a change stream that stopped is opened again
+RESTART_SECONDS = 1.0
+# Server error codes for a resume token the oplog no longer covers
+# (ChangeStreamHistoryLost, ChangeStreamFatalError)
+RESUME_TOKEN_LOST = (286, 280)
+
+
+class Subscription:
+    """
+    One connected client: a bounded queue that lives on the event loop that created it.
+    """
+    __slots__ = ("user_id", "queue", "loop", "dropped")
+
+    def __init__(self, user_id: str, loop: asyncio.AbstractEventLoop, queue_size: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.loop = loop
+        self.dropped = 0  # events discarded because the client was too slow
+
+    def offer(self, event: dict):
+        """
+        Enqueue an event without ever blocking. Must run on `self.loop`.
+        """
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Drop everything pending and ask the client to re-fetch the full list
+            while not self.queue.empty():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait({"type": "resync"})
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+class FridgeEventBus:
+    """
+    Routes events to the subscriptions of a single user. Thread-safe: the sync
+    endpoints publish from the threadpool, subscribers wait on the event loop.
+    """
+
+    def __init__(self, queue_size: int = QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, user_id: str) -> Subscription:
+        """
+        Register a new subscriber. Call this from the event loop that will consume it.
+        """
+        subscription = Subscription(user_id, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id: str, event: dict):
+        """
+        Deliver an event to every subscriber of `user_id`. Safe to call from any thread.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        self.published += 1
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # The subscriber's loop is closed; it will unsubscribe on its own
+                pass
+
+    def publish_all(self, event: dict):
+        """
+        Deliver an event to every subscriber of every user. Safe to call from any thread.
+        """
+        with self._lock:
+            user_ids = list(self._subscriptions)
+        for user_id in user_ids:
+            self.publish(user_id, event)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subs) for subs in self._subscriptions.values())
+
+
+def start_change_stream(collection, bus: FridgeEventBus) -> threading.Thread:
+    """
+    Tail a MongoDB change stream on `collection` (fridge_items) in a daemon thread
+    and publish every change to `bus`. Requires a replica set. Deletes only carry
+    the document _id unless pre-images are enabled, so we try to enable them.
+
+    When the stream stops, it is opened again after the last change it delivered
+    (its resume token). If that point has left the oplog, the stream starts from now
+    and every client gets a "resync" event instead of silently missing the gap.
+    """
+    try:
+        collection.database.command({
+            "collMod": collection.name,
+            "changeStreamPreAndPostImages": {"enabled": True}
+        })
+    except Exception as e:
+        print(f"Could not enable change stream pre-images on {collection.name}: {e}")
+
+    def run():
+        resume_token = None
+        while True:
+            stream = None
+            try:
+                # Pick up where the last stream stopped, so no change made in between is lost
+                stream = collection.watch(
+                    full_document="updateLookup",
+                    full_document_before_change="whenAvailable",
+                    resume_after=resume_token
+                )
+                with stream:
+                    for change in stream:
+                        user_id, event = change_to_event(change)
+                        if user_id is not None:
+                            bus.publish(user_id, event)
+                        resume_token = stream.resume_token
+            except Exception as e:
+                if stream is not None and stream.resume_token is not None:
+                    resume_token = stream.resume_token
+                if isinstance(e, OperationFailure) and e.code in RESUME_TOKEN_LOST and resume_token is not None:
+                    # The oplog no longer reaches back to where we stopped: start from now,
+                    # and have every client re-fetch what it may have missed
+                    print(f"Fridge change stream cannot resume, clients will re-fetch: {e}")
+                    resume_token = None
+                    bus.publish_all({"type": "resync"})
+                    continue
+                print(f"Fridge change stream stopped, restarting: {e}")
+            threading.Event().wait(RESTART_SECONDS)
+
+    thread = threading.Thread(target=run, name="fridge-change-stream", daemon=True)
+    thread.start()
+    return thread
+
+
+def change_to_event(change: dict):
+    """
+    Convert one change stream document into (user_id, event).
+    Returns (None, None) when the change cannot be attributed to a user.
+    """
+    operation = change.get("operationType")
+    document = change.get("fullDocument")
+    item_id = str(change.get("documentKey", {}).get("_id", ""))
+
+    if operation in ("insert", "update", "replace") and document:
+        return document.get("user_id"), {
+            "type": "upsert",
+            "item": {"id": item_id, "name": document.get("name"), "quantity": document.get("quantity")}
+        }
+    if operation == "delete":
+        before = change.get("fullDocumentBeforeChange") or {}
+        if before.get("user_id"):
+            return before["user_id"], {
+                "type": "delete",
+                "item": {"id": item_id, "name": before.get("name")}
+            }
+    return None, None
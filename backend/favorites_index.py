@@ -0,0 +1,242 @@
+"""
+This file keeps an in-process inverted index of each user's favorite recipes, so
+GET /recipes/favorites/search can answer title and ingredient searches, and "which
+favorites can I cook with what is in my fridge", without scanning the favorites.
+
+Per user, the index maps:
+  - every word of the titles and of the canonical ingredient names -> favorite titles;
+  - the last word of every canonical ingredient ("cheddar cheese" -> "cheese")
+    -> (title, ingredient), which is how fridge items find the recipes that use them.
+A fridge item covers a recipe ingredient when one name ends with the other, word for
+word: "rice" covers "basmati rice", and "cheddar cheese" covers "cheese". Pantry
+basics (salt, pepper, oil, water) are assumed to be at hand. A favorite whose
+ingredients are unknown (none saved, or none recoverable from its description) is
+never cookable, since nothing says what it needs.
+
+An index is built from MongoDB on the first search, then updated in place by the
+favorite endpoints (`apply`). It is tagged with the user's favorites version
+(versions.py); a search that sees a newer version (a write handled by another worker)
+rebuilds it. At most FAVORITES_INDEX_USERS users are kept, least recently used first
+out. GET /metrics shows the counters under "favorites_index".
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from ingredients import canonical_name, ingredient_key, split_ingredients
+
+MAX_USERS = int(os.getenv("FAVORITES_INDEX_USERS", "10000"))
+
+# Assumed to be in every kitchen, so never "missing"
+PANTRY = frozenset((
+    "salt", "pepper", "black pepper", "water", "oil", "olive oil", "vegetable oil", "cooking oil",
+    "cooking spray", "sugar", "ice",
+))
+
+
+def words(text: str) -> list:
+    """
+    Canonical search terms of a title or query.
+    """
+    return [term for term in (canonical_name(word) for word in re.split(r"[\s,;/]+", text)) if term]
+
+
+def is_pantry(key: str) -> bool:
+    return all(part in PANTRY for part in re.split(r" (?:and|or) ", key))
+
+
+def covers(fridge_key: str, key: str) -> bool:
+    return fridge_key == key or key.endswith(" " + fridge_key) or fridge_key.endswith(" " + key)
+
+
+def favorite_ingredients(document: dict) -> list:
+    """
+    A favorite's ingredient list. Favorites saved by older clients only have a
+    description: the ingredient lines, a blank line, then the steps.
+    """
+    if document.get("ingredients"):
+        return list(document["ingredients"])
+    description = document.get("description", "")
+    return split_ingredients(description.split("\n\n")[0]) if "\n\n" in description else []
+
+
+class UserFavoritesIndex:
+    """
+    The inverted index of one user's favorites, keyed by title (titles are unique per
+    user, see POST /recipes/favorite).
+    """
+
+    def __init__(self, version: int):
+        self.version = version
+        self.favorites = {}  # title -> favorite dict
+        self.needed = {}     # title -> ingredient keys that are not pantry basics
+        self.terms = {}      # word -> titles
+        self.heads = {}      # last word of an ingredient key -> {(title, key)}
+        self.by_size = {}    # number of needed ingredients -> titles, unknown ingredients left out
+
+    def add(self, favorite: dict):
+        title = favorite["title"]
+        self.remove(title)
+        keys = {key for key in map(ingredient_key, favorite["ingredients"]) if key}
+        self.favorites[title] = favorite
+        self.needed[title] = {key for key in keys if not is_pantry(key)}
+        if keys:
+            self.by_size.setdefault(len(self.needed[title]), set()).add(title)
+        for term in set(words(title)).union(*(key.split() for key in keys)):
+            self.terms.setdefault(term, set()).add(title)
+        for key in self.needed[title]:
+            self.heads.setdefault(key.rsplit(" ", 1)[-1], set()).add((title, key))
+
+    def remove(self, title: str):
+        favorite = self.favorites.pop(title, None)
+        if favorite is None:
+            return
+        for term in set(words(title)).union(*(key.split() for key in map(ingredient_key, favorite["ingredients"]))):
+            self._discard(self.terms, term, title)
+        needed = self.needed.pop(title)
+        self._discard(self.by_size, len(needed), title)  # a no-op for unknown ingredients
+        for key in needed:
+            self._discard(self.heads, key.rsplit(" ", 1)[-1], (title, key))
+
+    @staticmethod
+    def _discard(postings: dict, term: str, value):
+        entries = postings.get(term)
+        if entries is not None:
+            entries.discard(value)
+            if not entries:
+                del postings[term]
+
+    def search(self, query: str) -> set:
+        """
+        Titles matching every word of `query` (in the title or an ingredient).
+        """
+        matches = None
+        for term in words(query):
+            titles = self.terms.get(term, set())
+            matches = set(titles) if matches is None else matches & titles
+            if not matches:
+                return set()
+        return set(self.favorites) if matches is None else matches
+
+    def missing_ingredients(self, fridge_names, candidates: set, max_missing: int) -> dict:
+        """
+        {title: ingredients not covered by the fridge} for the `candidates` missing at
+        most `max_missing` ingredients. Favorites with unknown ingredients never qualify.
+        """
+        covered = {}
+        for fridge_key in {ingredient_key(name) for name in fridge_names}:
+            if not fridge_key:
+                continue
+            for title, key in self.heads.get(fridge_key.rsplit(" ", 1)[-1], ()):
+                if title in candidates and covers(fridge_key, key):
+                    covered.setdefault(title, set()).add(key)
+        # Only favorites using a fridge item, or needing few ingredients at all, can qualify
+        small = set().union(*(self.by_size.get(size, ()) for size in range(max_missing + 1)))
+        result = {}
+        for title in set(covered).union(small & candidates):
+            if len(self.needed[title]) - len(covered.get(title, ())) <= max_missing:
+                result[title] = sorted(self.needed[title] - covered.get(title, set()))
+        return result
+
+
+class FavoritesIndexes:
+    """
+    The indexes of the most recently searched users.
+    """
+
+    def __init__(self, collection, max_users: int = MAX_USERS):
+        self.collection = collection
+        self.max_users = max_users
+        self._indexes = OrderedDict()  # user_id -> UserFavoritesIndex
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.stale_rebuilds = 0
+        self.updates = 0
+        self.searches = 0
+
+    def _build(self, user_id: str, version: int) -> UserFavoritesIndex:
+        index = UserFavoritesIndex(version)
+        for document in self.collection.find({"user_id": user_id}):
+            index.add(as_favorite(document))
+        return index
+
+    def search(self, user_id: str, version: int, query: str = "", fridge_names=None,
+               max_missing: int = 0, limit: int = 20) -> list:
+        """
+        Favorites matching `query`, and when `fridge_names` is given, only those missing
+        at most `max_missing` ingredients (fewest missing first, in "missing").
+        """
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.version == version:
+                self._indexes.move_to_end(user_id)
+            else:
+                index = None
+        if index is None:
+            # Build outside the lock; a concurrent build of the same user is harmless
+            rebuilt = self._build(user_id, version)
+            with self._lock:
+                if user_id in self._indexes:
+                    self.stale_rebuilds += 1
+                self.builds += 1
+                current = self._indexes.get(user_id)
+                if current is None or current.version < version:
+                    self._indexes[user_id] = rebuilt
+                    self._indexes.move_to_end(user_id)
+                    while len(self._indexes) > self.max_users:
+                        self._indexes.popitem(last=False)
+                index = self._indexes.get(user_id) or rebuilt
+
+        with self._lock:
+            self.searches += 1
+            titles = index.search(query)
+            if fridge_names is None:
+                return [dict(index.favorites[title]) for title in sorted(titles)[:limit]]
+            missing = index.missing_ingredients(fridge_names, titles, max_missing)
+            ranked = sorted(missing, key=lambda title: (len(missing[title]), title))[:limit]
+            return [dict(index.favorites[title], missing=missing[title]) for title in ranked]
+
+    def apply(self, user_id: str, version: int, added: dict | None = None, removed: str | None = None):
+        """
+        Apply a write that moved the user's favorites to `version`. An index that did not
+        see the previous version is dropped instead, to be rebuilt by the next search.
+        """
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                return
+            if index.version != version - 1:
+                del self._indexes[user_id]
+                return
+            if added is not None:
+                index.add(added)
+            if removed is not None:
+                index.remove(removed)
+            index.version = version
+            self.updates += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._indexes),
+                "favorites": sum(len(index.favorites) for index in self._indexes.values()),
+                "builds": self.builds,
+                "stale_rebuilds": self.stale_rebuilds,
+                "updates": self.updates,
+                "searches": self.searches,
+            }
+
+
+def as_favorite(document: dict) -> dict:
+    """
+    The API shape of a favorite_recipes document.
+    """
+    return {
+        "id": str(document["_id"]),
+        "title": document["title"],
+        "description": document.get("description", ""),
+        "ingredients": favorite_ingredients(document),
+        "steps": document.get("steps", ""),
+    }
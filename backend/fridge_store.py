@@ -0,0 +1,328 @@
+"""
+This file defines how a user's fridge is stored in MongoDB. main.py only talks to a
+fridge store, so the storage layout can be switched with FRIDGE_LAYOUT:
+
+  1) "items" (default): one document per (user, ingredient) in `fridge_items`:
+         {"_id": ObjectId, "user_id": "...", "name": "egg", "quantity": 3}
+  2) "document": one document per user in `fridges`, with the items embedded in a map
+     keyed by the (escaped) item name and a version counter bumped by every write:
+         {"_id": "<user_id>", "version": 7,
+          "items": {"egg": {"id": "...", "name": "egg", "quantity": 3}, ...}}
+     A read is one find_one by _id, and a quantity change is one $inc on
+     "items.<name>.quantity", however many items the fridge holds.
+  3) "migrating": reads and writes both layouts while migrate_fridge_layout.py moves
+     users over. A user is moved on their first write, or by the tool, whichever
+     comes first; after that only the document layout is used for them.
+
+Every store returns the fridge as (id, name, quantity) rows, the shape main.py caches.
+"""
+
+import os
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne, DeleteOne
+from pymongo.errors import DuplicateKeyError
+
+import writebehind
+
+ITEMS = "items"
+DOCUMENT = "document"
+MIGRATING = "migrating"
+LAYOUTS = (ITEMS, DOCUMENT, MIGRATING)
+
+
+def field_key(name: str) -> str:
+    """
+    Escape an item name for use as a MongoDB field name ("." and "$" are not allowed).
+    """
+    return name.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+class ItemsFridgeStore:
+    """
+    One document per (user, ingredient) in the fridge_items collection.
+    """
+    layout = ITEMS
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        self.collection.create_index([("user_id", 1), ("name", 1)])
+
+    def load_rows(self, user_id: str) -> tuple:
+        # Query only the items corresponding to the user_id
+        items_cursor = self.collection.find({"user_id": user_id}, {"name": 1, "quantity": 1})
+        return tuple((str(doc["_id"]), doc["name"], doc["quantity"]) for doc in items_cursor)
+
+    def find_quantity(self, user_id: str, name: str) -> int | None:
+        existing_item = self.collection.find_one({"user_id": user_id, "name": name}, {"quantity": 1})
+        return existing_item["quantity"] if existing_item else None
+
+    def increment(self, user_id: str, name: str, delta: int):
+        # Upsert the item using both user_id and name.
+        self.collection.update_one(
+            {"user_id": user_id, "name": name},
+            {"$inc": {"quantity": delta}},
+            upsert=True
+        )
+
+    def set_quantity(self, user_id: str, name: str, quantity: int):
+        """
+        Set an existing item's quantity; zero or less removes the item.
+        """
+        if quantity <= 0:
+            self.collection.delete_one({"user_id": user_id, "name": name})
+        else:
+            self.collection.update_one(
+                {"user_id": user_id, "name": name},
+                {"$set": {"quantity": quantity}}
+            )
+
+    def apply_changes(self, user_id: str, changes: dict):
+        """
+        Write coalesced changes ({name: PendingChange}) in one bulk_write.
+        """
+        operations = []
+        for name, change in changes.items():
+            query = {"user_id": user_id, "name": name}
+            if change.kind == writebehind.DELETE:
+                operations.append(DeleteOne(query))
+            else:
+                operator = "$inc" if change.kind == writebehind.INC else "$set"
+                operations.append(UpdateOne(
+                    query,
+                    {operator: {"quantity": change.quantity}, "$setOnInsert": {"_id": ObjectId(change.item_id)}},
+                    upsert=True
+                ))
+        self.collection.bulk_write(operations, ordered=False)
+
+    def delete_user(self, user_id: str):
+        self.collection.delete_many({"user_id": user_id})
+
+    def iter_fridges(self):
+        """
+        Yield the item names of every user's fridge (for offline jobs such as
+        build_pairings.py).
+        """
+        for doc in self.collection.aggregate(
+            [{"$group": {"_id": "$user_id", "names": {"$push": "$name"}}}], allowDiskUse=True
+        ):
+            yield doc["names"]
+
+
+class DocumentFridgeStore:
+    """
+    One document per user in the fridges collection, items embedded by name.
+    """
+    layout = DOCUMENT
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        pass  # every query is by _id
+
+    def load_document(self, user_id: str) -> dict | None:
+        return self.collection.find_one({"_id": user_id}, {"items": 1, "version": 1})
+
+    @staticmethod
+    def document_rows(document: dict) -> tuple:
+        return tuple((item["id"], item["name"], item["quantity"]) for item in document.get("items", {}).values())
+
+    def load_rows(self, user_id: str) -> tuple:
+        document = self.load_document(user_id)
+        return self.document_rows(document) if document else ()
+
+    def find_quantity(self, user_id: str, name: str) -> int | None:
+        key = field_key(name)
+        document = self.collection.find_one({"_id": user_id}, {f"items.{key}.quantity": 1})
+        item = (document or {}).get("items", {}).get(key)
+        return item["quantity"] if item else None
+
+    def _insert_item(self, user_id: str, name: str, quantity: int) -> bool:
+        """
+        Add an item that is not in the fridge yet, creating the fridge if needed.
+        Returns False if the item appeared meanwhile (the caller should retry).
+        """
+        key = field_key(name)
+        try:
+            result = self.collection.update_one(
+                {"_id": user_id, f"items.{key}": {"$exists": False}},
+                {
+                    "$set": {f"items.{key}": {"id": str(ObjectId()), "name": name, "quantity": quantity}},
+                    "$inc": {"version": 1}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The fridge exists and already has the item, so the upsert tried to insert a second fridge
+            return False
+        return result.matched_count > 0 or result.upserted_id is not None
+
+    def increment(self, user_id: str, name: str, delta: int):
+        key = field_key(name)
+        while True:
+            result = self.collection.update_one(
+                {"_id": user_id, f"items.{key}": {"$exists": True}},
+                {"$inc": {f"items.{key}.quantity": delta, "version": 1}}
+            )
+            if result.matched_count or self._insert_item(user_id, name, delta):
+                return
+
+    def set_quantity(self, user_id: str, name: str, quantity: int):
+        """
+        Set an item's quantity (adding the item if needed); zero or less removes it.
+        """
+        key = field_key(name)
+        if quantity <= 0:
+            self.collection.update_one(
+                {"_id": user_id},
+                {"$unset": {f"items.{key}": ""}, "$inc": {"version": 1}}
+            )
+            return
+        while True:
+            result = self.collection.update_one(
+                {"_id": user_id, f"items.{key}": {"$exists": True}},
+                {"$set": {f"items.{key}.quantity": quantity}, "$inc": {"version": 1}}
+            )
+            if result.matched_count or self._insert_item(user_id, name, quantity):
+                return
+
+    def apply_changes(self, user_id: str, changes: dict):
+        """
+        Write coalesced changes ({name: PendingChange}) as one update of the fridge
+        document, guarded by its version (retried if another write got in between).
+        """
+        while True:
+            document = self.load_document(user_id) or {}
+            version = document.get("version", 0)
+            items = document.get("items", {})
+            update = {"$set": {}, "$unset": {}, "$inc": {"version": 1}}
+            for name, change in changes.items():
+                key = field_key(name)
+                if change.kind == writebehind.DELETE:
+                    if key in items:
+                        update["$unset"][f"items.{key}"] = ""
+                elif key in items:
+                    quantity = change.quantity + (items[key]["quantity"] if change.kind == writebehind.INC else 0)
+                    update["$set"][f"items.{key}.quantity"] = quantity
+                else:
+                    update["$set"][f"items.{key}"] = {"id": change.item_id, "name": name, "quantity": change.quantity}
+            update = {operator: fields for operator, fields in update.items() if fields}
+            try:
+                # A missing fridge has version 0: the upsert creates it
+                result = self.collection.update_one({"_id": user_id, "version": version}, update, upsert=not document)
+            except DuplicateKeyError:
+                continue  # created concurrently
+            if result.matched_count or result.upserted_id is not None:
+                return
+
+    def delete_user(self, user_id: str):
+        self.collection.delete_one({"_id": user_id})
+
+    def iter_fridges(self):
+        for document in self.collection.find({}, {"items": 1}):
+            yield [name for _, name, _ in self.document_rows(document)]
+
+    def insert_fridge(self, user_id: str, rows: tuple) -> bool:
+        """
+        Create the user's fridge document from (id, name, quantity) rows.
+        Returns False if the user already has one.
+        """
+        try:
+            self.collection.insert_one({
+                "_id": user_id,
+                "version": 1,
+                "items": {field_key(name): {"id": item_id, "name": name, "quantity": quantity}
+                          for item_id, name, quantity in rows}
+            })
+        except DuplicateKeyError:
+            return False
+        return True
+
+
+class MigratingFridgeStore:
+    """
+    Both layouts at once, for the duration of an online migration (see module docstring).
+    """
+    layout = MIGRATING
+
+    def __init__(self, items_store: ItemsFridgeStore, document_store: DocumentFridgeStore):
+        self.items_store = items_store
+        self.document_store = document_store
+        self._migrated = set()  # users known to be on the document layout
+
+    def ensure_indexes(self):
+        self.items_store.ensure_indexes()
+        self.document_store.ensure_indexes()
+
+    def migrate_user(self, user_id: str) -> bool:
+        """
+        Move one user's items into a fridge document. Safe to run concurrently with
+        itself (here or in the migration tool): the document is created exactly once,
+        and the old item documents are deleted only after it exists.
+        Returns True if this call created the document.
+        """
+        if user_id in self._migrated:
+            return False
+        created = self.document_store.insert_fridge(user_id, self.items_store.load_rows(user_id))
+        self.items_store.delete_user(user_id)
+        self._migrated.add(user_id)
+        return created
+
+    def load_rows(self, user_id: str) -> tuple:
+        if user_id in self._migrated:
+            return self.document_store.load_rows(user_id)
+        # Read the old layout first: the document is created before the items are
+        # deleted, so if there is no document yet, these rows are still complete
+        rows = self.items_store.load_rows(user_id)
+        document = self.document_store.load_document(user_id)
+        if document is None:
+            return rows
+        self._migrated.add(user_id)
+        return self.document_store.document_rows(document)
+
+    def find_quantity(self, user_id: str, name: str) -> int | None:
+        for _, item_name, quantity in self.load_rows(user_id):
+            if item_name == name:
+                return quantity
+        return None
+
+    def increment(self, user_id: str, name: str, delta: int):
+        self.migrate_user(user_id)
+        self.document_store.increment(user_id, name, delta)
+
+    def set_quantity(self, user_id: str, name: str, quantity: int):
+        self.migrate_user(user_id)
+        self.document_store.set_quantity(user_id, name, quantity)
+
+    def apply_changes(self, user_id: str, changes: dict):
+        self.migrate_user(user_id)
+        self.document_store.apply_changes(user_id, changes)
+
+    def delete_user(self, user_id: str):
+        self.items_store.delete_user(user_id)
+        self.document_store.delete_user(user_id)
+        self._migrated.discard(user_id)
+
+    def iter_fridges(self):
+        # A user being moved right now may be seen twice; fine for statistics
+        yield from self.document_store.iter_fridges()
+        yield from self.items_store.iter_fridges()
+
+
+def create_fridge_store(db):
+    """
+    Build the store for FRIDGE_LAYOUT ("items", "document" or "migrating").
+    """
+    layout = os.getenv("FRIDGE_LAYOUT", ITEMS)
+    if layout not in LAYOUTS:
+        raise ValueError(f"FRIDGE_LAYOUT must be one of {', '.join(LAYOUTS)}, not {layout!r}")
+    items_store = ItemsFridgeStore(db["fridge_items"])
+    document_store = DocumentFridgeStore(db["fridges"])
+    if layout == ITEMS:
+        return items_store
+    if layout == DOCUMENT:
+        return document_store
+    return MigratingFridgeStore(items_store, document_store)
@@ -0,0 +1,220 @@
+"""
+This file contains helpers for working with ingredient names and quantities:
+
+  1) canonical_name: normalize an ingredient name so "Tomatoes " and "tomato" match.
+  2) parse_quantity: turn a free-text quantity such as "2 cups" or "500g" into
+     (amount, unit), when it is in a form we understand.
+  3) merge_ingredient_lists: merge the ingredient lists detected in several images,
+     de-duplicating by canonical name and summing quantities when the units agree.
+  4) split_ingredients: split a recipe's free-text ingredient list into one string
+     per ingredient.
+  5) ingredient_key: the canonical name of the ingredient in one recipe line, without
+     its quantity and preparation, e.g. "2 cloves of garlic, minced" -> "garlic".
+"""
+
+import re
+from fractions import Fraction
+
+# Words that mean "roughly" and can be dropped before a quantity
+_APPROXIMATE_WORDS = ("about", "approximately", "approx.", "approx", "around", "roughly", "~")
+
+# Unit spellings mapped to (canonical unit, factor to convert into that unit)
+_UNITS = {
+    "": ("", 1),
+    "whole": ("", 1),
+    "piece": ("", 1), "pieces": ("", 1), "pc": ("", 1), "pcs": ("", 1),
+    "item": ("", 1), "items": ("", 1),
+    "g": ("g", 1), "gram": ("g", 1), "grams": ("g", 1), "gr": ("g", 1),
+    "kg": ("g", 1000), "kilogram": ("g", 1000), "kilograms": ("g", 1000),
+    "mg": ("g", Fraction(1, 1000)),
+    "ml": ("ml", 1), "milliliter": ("ml", 1), "milliliters": ("ml", 1),
+    "l": ("ml", 1000), "liter": ("ml", 1000), "liters": ("ml", 1000), "litre": ("ml", 1000), "litres": ("ml", 1000),
+    "oz": ("oz", 1), "ounce": ("oz", 1), "ounces": ("oz", 1),
+    "lb": ("lb", 1), "lbs": ("lb", 1), "pound": ("lb", 1), "pounds": ("lb", 1),
+    "cup": ("cup", 1), "cups": ("cup", 1),
+    "tbsp": ("tbsp", 1), "tablespoon": ("tbsp", 1), "tablespoons": ("tbsp", 1),
+    "tsp": ("tsp", 1), "teaspoon": ("tsp", 1), "teaspoons": ("tsp", 1),
+    "dozen": ("", 12),
+}
+
+# "1", "1.5", "1/2" or "1 1/2", followed by an optional unit
+_QUANTITY_PATTERN = re.compile(
+    r"^(?P<number>\d+(?:\.\d+)?(?:\s+\d+/\d+)?|\d+/\d+)\s*(?P<unit>[a-z.]*)\s*$"
+)
+
+# Plural nouns that should not lose their trailing "s"
+_KEEP_TRAILING_S = ("ss", "us", "is", "ous", "ies")
+
+
+def canonical_name(name: str) -> str:
+    """
+    Normalize an ingredient name for matching: lowercase, collapse whitespace,
+    drop punctuation and reduce simple English plurals to the singular.
+    """
+    cleaned = re.sub(r"[^a-z0-9\s-]", " ", name.lower())
+    words = cleaned.split()
+    if not words:
+        return ""
+    words[-1] = _singular(words[-1])
+    return " ".join(words)
+
+
+def _singular(word: str) -> str:
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"          # berries -> berry
+    if word.endswith(("oes", "ches", "shes", "xes", "sses")):
+        return word[:-2]                # tomatoes -> tomato, peaches -> peach
+    if word.endswith("s") and not word.endswith(_KEEP_TRAILING_S):
+        return word[:-1]                # eggs -> egg
+    return word
+
+
+def parse_quantity(quantity) -> tuple | None:
+    """
+    Parse a quantity into (amount: Fraction, unit: str), or return None if the text is
+    not a simple "<number> <unit>" form. Units are normalized, e.g. "1 kg" -> (1000, "g").
+    """
+    if isinstance(quantity, (int, float)):
+        return Fraction(quantity).limit_denominator(1000), ""
+    if not isinstance(quantity, str):
+        return None
+
+    text = quantity.strip().lower()
+    for word in _APPROXIMATE_WORDS:
+        if text.startswith(word):
+            text = text[len(word):].strip()
+    if text.startswith(("a dozen", "one dozen")):
+        text = "12"
+
+    match = _QUANTITY_PATTERN.match(text)
+    if not match:
+        return None
+
+    unit_text = match.group("unit").rstrip(".")
+    if unit_text not in _UNITS:
+        return None
+    unit, factor = _UNITS[unit_text]
+
+    amount = sum(Fraction(part) for part in match.group("number").split())
+    return amount * factor, unit
+
+
+def format_quantity(amount: Fraction, unit: str) -> str:
+    """
+    Render (amount, unit) back to text, e.g. (Fraction(3, 2), "cup") -> "1.5 cup".
+    """
+    if amount.denominator == 1:
+        number = str(amount.numerator)
+    else:
+        number = f"{float(amount):.2f}".rstrip("0").rstrip(".")
+    return f"{number} {unit}".strip()
+
+
+def merge_ingredient_lists(ingredient_lists: list) -> list:
+    """
+    Merge several lists of {"name": ..., "quantity": ...} dicts into one list.
+
+    Ingredients are matched by canonical name; the first spelling seen is kept.
+    Quantities are summed when they parse to the same unit; otherwise the distinct
+    quantities are joined with " + " so nothing is silently lost.
+    """
+    merged = {}  # canonical name -> {"name", "sums": {unit: amount}, "other": [str]}
+
+    for ingredients in ingredient_lists:
+        for ingredient in ingredients:
+            name = str(ingredient.get("name", "")).strip()
+            key = canonical_name(name)
+            if not key:
+                continue
+
+            entry = merged.setdefault(key, {"name": name, "sums": {}, "other": []})
+            quantity = ingredient.get("quantity", "")
+            parsed = parse_quantity(quantity)
+            if parsed is not None:
+                amount, unit = parsed
+                entry["sums"][unit] = entry["sums"].get(unit, 0) + amount
+            elif quantity and str(quantity) not in entry["other"]:
+                entry["other"].append(str(quantity))
+
+    result = []
+    for entry in merged.values():
+        parts = [format_quantity(amount, unit) for unit, amount in entry["sums"].items()]
+        parts.extend(entry["other"])
+        result.append({"name": entry["name"], "quantity": " + ".join(parts)})
+    return result
+
+
+# Bullets and numbers in front of list items
+_LIST_BULLET = re.compile(r"^\s*(?:[-*\u2022]|\d+[.)])\s+")
+
+# A part that only says how to prepare the previous ingredient ("4 strips of bacon,
+# chopped into small pieces") stays with it
+_PREPARATION_NOTE = re.compile(
+    r"^(?:(?:finely|roughly|thinly) )?"
+    r"(?:chopped|diced|sliced|minced|grated|peeled|softened|melted|beaten|divided|cubed|crushed|drained|rinsed|cut)"
+    r"(?:$|\s+(?:into|and|in|to|for|at|or)\b)"
+    r"|^(?:to taste|optional|at room temperature)",
+    re.IGNORECASE
+)
+
+
+def split_ingredients(text: str) -> list:
+    """
+    Split a recipe's ingredient text into one string per ingredient, at newlines,
+    semicolons and commas, except commas inside parentheses or between digits, e.g.
+    "2 eggs, 1 head broccoli (about 2 cups, chopped); salt" gives
+    ["2 eggs", "1 head broccoli (about 2 cups, chopped)", "salt"].
+    """
+    parts = []
+    current = []
+    depth = 0
+    for i, char in enumerate(text):
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth = max(0, depth - 1)
+        between_digits = 0 < i < len(text) - 1 and text[i - 1].isdigit() and text[i + 1].isdigit()
+        if char in "\n;" or (char == "," and depth == 0 and not between_digits):
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+
+    ingredients = []
+    for part in parts:
+        part = _LIST_BULLET.sub("", part).strip().rstrip(".")
+        if part and ingredients and _PREPARATION_NOTE.match(part):
+            ingredients[-1] += ", " + part
+        elif part:
+            ingredients.append(part)
+    return ingredients
+
+
+# Words that may come before the ingredient itself: amounts, units and sizes
+_MEASURE_WORDS = frozenset(_UNITS) | frozenset(_APPROXIMATE_WORDS) | {
+    "a", "an", "of", "few", "some", "large", "medium", "small", "big", "heaping", "level",
+    "pinch", "pinches", "dash", "dashes", "handful", "handfuls", "clove", "cloves", "can", "cans",
+    "slice", "slices", "head", "heads", "bunch", "bunches", "package", "packages", "jar", "jars",
+    "stick", "sticks", "sprig", "sprigs", "strip", "strips", "splash", "drizzle",
+}
+_AMOUNT_TOKEN = re.compile(r"^[\d.,/\-\u00bc-\u00be\u2150-\u215e]+$|^to$|^x$")
+_AMOUNT_WITH_UNIT = re.compile(r"^[\d.,/]+(?:" + "|".join(re.escape(unit) for unit in _UNITS if unit) + r")$")
+_TRAILING_NOTE = re.compile(r"\b(?:to taste|for serving|for garnish|as needed|optional)\b.*$")
+
+
+def ingredient_key(text: str) -> str:
+    """
+    Canonical name of the ingredient in a recipe line: parenthesized text, anything
+    after the first comma, and the leading amount and unit are dropped, e.g.
+    "1 1/2 cups cooked rice (leftover is fine)" -> "cooked rice".
+    """
+    text = re.sub(r"\([^)]*\)?", " ", str(text).lower()).split(",")[0]
+    text = _TRAILING_NOTE.sub("", text)
+    words = text.split()
+    while words and (words[0].rstrip(".") in _MEASURE_WORDS or _AMOUNT_TOKEN.match(words[0])
+                     or _AMOUNT_WITH_UNIT.match(words[0])):
+        words.pop(0)
+    return canonical_name(" ".join(words))
@@ -0,0 +1,230 @@
+"""
+This file implements a tolerant JSON parser for the function-call arguments the LLMs
+return. A slightly malformed answer used to fail the whole recipe generation, and the
+user had to wait another 10-20 s for a new one.
+
+`repair_json(text)` returns (value, info) and fixes, in one pass over the text:
+  - reasoning or chatter around the JSON (`<think>...</think>`, markdown code fences,
+    text before the first "{" or after the end of the value);
+  - trailing commas before "}" or "]";
+  - unescaped double quotes and raw newlines or tabs inside strings;
+  - truncated output (max tokens reached, or a closed stream): open strings and
+    containers are closed, and an unfinished key or value is dropped.
+
+`info` says whether anything was repaired and, for truncated output, which top-level
+key was still being written ("incomplete_key"), so callers can distrust that part.
+Raises ValueError when no JSON object or array can be recovered.
+GET /metrics shows the counters under "json_repair".
+"""
+
+import json
+import re
+import threading
+
+_THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL | re.IGNORECASE)
+_CODE_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_WHITESPACE = " \t\r\n"
+
+_lock = threading.Lock()
+_counters = {"clean": 0, "repaired": 0, "truncated": 0, "failed": 0}
+
+
+def _count(outcome: str):
+    with _lock:
+        _counters[outcome] += 1
+
+
+def strip_reasoning(text: str) -> str:
+    """
+    Remove <think> blocks and code fences. An unclosed <think> (reasoning cut off
+    before the answer) leaves nothing usable before the next "{".
+    """
+    text = _THINK_BLOCK.sub("", text)
+    if "</think>" in text.lower():
+        text = text[text.lower().rindex("</think>") + len("</think>"):]
+    text = re.sub(r"<think>", "", text, flags=re.IGNORECASE)
+    return _CODE_FENCE.sub("", text)
+
+
+def _skip_whitespace(text: str, i: int) -> int:
+    while i < len(text) and text[i] in _WHITESPACE:
+        i += 1
+    return i
+
+
+def _string_end(text: str, i: int) -> int | None:
+    """
+    Index of the quote ending the string that starts at text[i] (a quote), or None.
+    """
+    i += 1
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+            continue
+        if text[i] == '"':
+            return i
+        i += 1
+    return None
+
+
+def _closes_string(text: str, i: int, container: str | None) -> bool:
+    """
+    Whether the quote at text[i], inside a string, ends it (rather than being an
+    unescaped quote in the text). `container` is "}" inside an object, "]" in an array.
+    """
+    j = _skip_whitespace(text, i + 1)
+    if j >= len(text) or text[j] in "}]":
+        return True
+    if text[j] == ":":
+        return container == "}"
+    if text[j] != ",":
+        return False
+    k = _skip_whitespace(text, j + 1)
+    if k >= len(text) or text[k] in "}]":
+        return True  # truncated, or a trailing comma
+    if container == "]":
+        return text[k] in '"{[-0123456789tfn'
+    # In an object a comma must be followed by the next key: a string, then ":"
+    if text[k] != '"':
+        return False
+    end = _string_end(text, k)
+    if end is None:
+        return True  # truncated inside the next key
+    after = _skip_whitespace(text, end + 1)
+    return after >= len(text) or text[after] == ":"
+
+
+def _escape_control(char: str) -> str:
+    return {"\n": "\\n", "\r": "\\r", "\t": "\\t"}.get(char, f"\\u{ord(char):04x}")
+
+
+def _drop_trailing_comma(out: list):
+    while out and out[-1] in _WHITESPACE:
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def _close(out: list, stack: list) -> str:
+    """
+    Text of `out` with the containers in `stack` closed, dropping a dangling comma.
+    """
+    text = "".join(out).rstrip(_WHITESPACE)
+    if text.endswith(","):
+        text = text[:-1]
+    return text + "".join(reversed(stack))
+
+
+def repair_json(text: str):
+    """
+    Parse `text` as JSON, repairing it if needed. Returns (value, info) where info is
+    {"repaired": bool, "truncated": bool, "incomplete_key": str | None}.
+    """
+    info = {"repaired": False, "truncated": False, "incomplete_key": None}
+
+    # --- Step 1: The common case: valid JSON, possibly with text around it --- #
+    try:
+        value = json.loads(text)
+        _count("clean")
+        return value, info
+    except (json.JSONDecodeError, TypeError):
+        pass
+    info["repaired"] = True
+    text = strip_reasoning(text)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        _count("failed")
+        raise ValueError("No JSON object found in the model output")
+    start = min(starts)
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text, start)
+        _count("repaired")
+        return value, info
+    except json.JSONDecodeError:
+        pass
+
+    # --- Step 2: Re-emit the text token by token, fixing what we recognize --- #
+    out = []
+    stack = []           # closers of the open containers
+    checkpoints = []     # (len(out), stack) after each complete value, to fall back to
+    in_string = False
+    string_start = 0     # index in `out` of the open string's quote
+    last_string = None   # text of the last complete string
+    open_key = None      # last key seen at the top level
+    i = start
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            if char == "\\":
+                if i + 1 < len(text):
+                    out.append(text[i:i + 2])
+                i += 2
+                continue
+            if char == '"':
+                if _closes_string(text, i, stack[-1] if stack else None):
+                    in_string = False
+                    out.append(char)
+                    last_string = "".join(out[string_start + 1:-1])
+                else:
+                    out.append('\\"')
+            elif char < " ":
+                out.append(_escape_control(char))
+            else:
+                out.append(char)
+            i += 1
+            continue
+
+        if char == '"':
+            in_string = True
+            string_start = len(out)
+            out.append(char)
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            out.append(char)
+            checkpoints.append((len(out), list(stack)))
+        elif char in "}]":
+            _drop_trailing_comma(out)
+            if char in stack:
+                while stack[-1] != char:
+                    out.append(stack.pop())  # close what the model forgot to close
+                out.append(stack.pop())
+            if not stack:
+                break  # the value is complete; ignore whatever follows
+            checkpoints.append((len(out), list(stack)))
+        elif char == ",":
+            checkpoints.append((len(out), list(stack)))
+            out.append(char)
+        elif char == ":":
+            if len(stack) == 1:
+                open_key = last_string
+            out.append(char)
+        else:
+            out.append(char)
+        i += 1
+
+    # --- Step 3: Parse, closing what the truncation left open --- #
+    if not stack and not in_string:
+        candidates = ["".join(out)]
+    else:
+        info["truncated"] = True
+        if len(stack) >= 2:
+            info["incomplete_key"] = open_key
+        if in_string:
+            out = out + ['"']
+        candidates = [_close(out, stack)]
+        candidates += [_close(out[:length], saved) for length, saved in reversed(checkpoints)]
+
+    for candidate in candidates:
+        try:
+            value = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        _count("truncated" if info["truncated"] else "repaired")
+        return value, info
+    _count("failed")
+    raise ValueError("Could not repair the JSON in the model output")
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_counters)
@@ -0,0 +1,86 @@
+"""
+This file tracks where a server worker is in its life, for serve.py and GET /ready.
+
+  1) Warming up: main.py's lifespan runs `warm_up(steps)` before the worker accepts
+     connections: open the MongoDB pool, connect the LLM clients, load the caches.
+     Each step is timed; a failed step is reported on /ready but does not keep the
+     worker down (the endpoints cope with a slow first call, as before).
+  2) Ready: /ready answers 200 from here on.
+  3) Draining: `start_draining()` is called on SIGTERM, or when the worker reached its
+     request limit and is being recycled. /ready answers 503 again, so a load balancer
+     stops sending traffic, and `remaining()` counts down the SERVE_DRAIN_SECONDS the
+     worker has left to finish its in-flight requests (mostly LLM calls).
+
+GET /metrics shows the state and the warm-up timings under "lifecycle".
+"""
+
+import os
+import time
+
+DRAIN_SECONDS = float(os.getenv("SERVE_DRAIN_SECONDS", "30"))
+
+WARMING_UP, READY, DRAINING = "warming_up", "ready", "draining"
+
+_state = {"state": WARMING_UP, "pid": os.getpid(), "started_at": time.monotonic(), "drain_deadline": None}
+_warm_up = {}  # step name -> {"ms": ...} or {"ms": ..., "error": ...}
+
+
+def forked():
+    """
+    Start over in a worker freshly forked by serve.py (which imports this module).
+    """
+    _state.update(state=WARMING_UP, pid=os.getpid(), started_at=time.monotonic(), drain_deadline=None)
+    _warm_up.clear()
+
+
+async def warm_up(steps: dict):
+    """
+    Run the warm-up steps in order: name -> coroutine function. Then mark the worker ready.
+    """
+    for name, step in steps.items():
+        started = time.perf_counter()
+        try:
+            await step()
+            _warm_up[name] = {"ms": round((time.perf_counter() - started) * 1000, 1)}
+        except Exception as e:
+            _warm_up[name] = {"ms": round((time.perf_counter() - started) * 1000, 1), "error": str(e)}
+            print(f"Warm-up step {name} failed: {e}")
+    if _state["state"] == WARMING_UP:
+        _state["state"] = READY
+    print(f"Worker {_state['pid']} ready in {time.monotonic() - _state['started_at']:.1f}s")
+
+
+def start_draining(seconds: float = DRAIN_SECONDS):
+    """
+    Stop reporting ready and start the drain deadline. Safe to call from a signal handler.
+    """
+    if _state["state"] != DRAINING:
+        _state["state"] = DRAINING
+        _state["drain_deadline"] = time.monotonic() + seconds
+
+
+def is_ready() -> bool:
+    return _state["state"] == READY
+
+
+def is_draining() -> bool:
+    return _state["state"] == DRAINING
+
+
+def remaining() -> float:
+    """
+    Seconds left before the drain deadline (DRAIN_SECONDS if not draining).
+    """
+    if _state["drain_deadline"] is None:
+        return DRAIN_SECONDS
+    return max(0.0, _state["drain_deadline"] - time.monotonic())
+
+
+def stats() -> dict:
+    return {
+        "state": _state["state"],
+        "pid": _state["pid"],
+        "uptime_seconds": round(time.monotonic() - _state["started_at"], 1),
+        "drain_seconds_left": round(remaining(), 1) if is_draining() else None,
+        "warm_up": {name: dict(result) for name, result in _warm_up.items()},
+    }
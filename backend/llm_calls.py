@@ -0,0 +1,234 @@
+"""
+This file holds the plumbing that makes LLM calls cancellable from main.py.
+
+  - `run_until_disconnect(request, awaitable)` runs an awaitable while watching the
+    HTTP connection; if the client goes away first (the user left the recipe screen),
+    the awaitable is cancelled and ClientDisconnected is raised.
+  - `SingleFlight` shares one in-flight call between concurrent identical requests
+    (double taps, retries). Cancelling one waiter does not cancel the call while other
+    waiters remain; when the last waiter leaves, the call itself is cancelled.
+  - The streaming calls in ML_functions.py close the upstream stream when cancelled, so
+    the provider stops generating. They report here how many completion tokens were
+    received and how many were saved, estimated from the average length of completed
+    calls of the same kind.
+
+  - `PendingResults` keeps calls that outlived their request (recipe slots still
+    generating when the fan-out deadline passed) so the client can fetch them later.
+
+GET /metrics shows the counters under "llm".
+"""
+
+import asyncio
+import secrets
+import threading
+import time
+
+CHARS_PER_TOKEN = 4  # rough estimate for English text and JSON
+
+
+class ClientDisconnected(Exception):
+    """
+    The HTTP client disconnected before the response was ready.
+    """
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+_lock = threading.Lock()
+_usage = {}         # kind ("recipes", "vision") -> counters
+_counters = {"disconnects": 0}
+
+
+def _kind_usage(kind: str) -> dict:
+    return _usage.setdefault(kind, {
+        "completed": 0, "cancelled": 0, "completion_tokens": 0,
+        "tokens_received_before_cancel": 0, "estimated_tokens_saved": 0,
+    })
+
+
+def record_completed(kind: str, completion_tokens: int):
+    with _lock:
+        usage = _kind_usage(kind)
+        usage["completed"] += 1
+        usage["completion_tokens"] += completion_tokens
+
+
+def record_cancelled(kind: str, tokens_received: int, max_tokens: int):
+    """
+    Count a call cancelled after `tokens_received` completion tokens. Until a call of
+    this kind has completed, the expected length is half of `max_tokens`.
+    """
+    with _lock:
+        usage = _kind_usage(kind)
+        if usage["completed"]:
+            expected = usage["completion_tokens"] / usage["completed"]
+        else:
+            expected = max_tokens / 2
+        usage["cancelled"] += 1
+        usage["tokens_received_before_cancel"] += tokens_received
+        usage["estimated_tokens_saved"] += max(0, round(expected) - tokens_received)
+
+
+def count(name: str, amount: int = 1):
+    """
+    Add to a plain counter shown in the "llm" metrics.
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    At most one in-flight call per key; later callers with the same key join it.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+        self.counters = {"calls": 0, "joined": 0, "cancelled": 0}
+
+    async def run(self, key, factory):
+        """
+        Await the result of `factory()` (a coroutine function), shared by key.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()))
+            self._flights[key] = flight
+            self.counters["calls"] += 1
+
+            def forget(_task, key=key, flight=flight):
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.task.add_done_callback(forget)
+        else:
+            self.counters["joined"] += 1
+
+        flight.waiters += 1
+        try:
+            # shield: cancelling this waiter must not cancel the call for the others
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+                self.counters["cancelled"] += 1
+                if self._flights.get(key) is flight:
+                    del self._flights[key]  # a new request must not join a cancelled call
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def stats(self) -> dict:
+        return dict(self.counters, in_flight=len(self._flights))
+
+
+class PendingResults:
+    """
+    Background tasks whose result the owning user can fetch later by ID. A finished
+    result is kept for `ttl_seconds`; at most `max_entries` are kept, dropping (and
+    cancelling) the oldest. Must be used from a single event loop.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float = 300, max_entries: int = 1000):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}  # result ID -> [owner, task, finished_at or None], oldest first
+        self.counters = {"added": 0, "fetched": 0, "expired": 0}
+
+    def add(self, owner: str, task: asyncio.Task) -> str:
+        self._prune()
+        result_id = secrets.token_urlsafe(12)
+        entry = [owner, task, None]
+        self._entries[result_id] = entry
+        self.counters["added"] += 1
+
+        def finished(_task, entry=entry):
+            entry[2] = time.monotonic()
+        task.add_done_callback(finished)
+        return result_id
+
+    def get(self, owner: str, result_id: str) -> tuple:
+        """
+        Returns ("pending", None), ("done", result) or (None, None) if the ID is
+        unknown, expired or belongs to another user. A failed task is re-raised.
+        """
+        self._prune()
+        entry = self._entries.get(result_id)
+        if entry is None or entry[0] != owner:
+            return None, None
+        task = entry[1]
+        if not task.done():
+            return "pending", None
+        if task.cancelled():
+            return None, None
+        self.counters["fetched"] += 1
+        return "done", task.result()
+
+    def _prune(self):
+        now = time.monotonic()
+        for result_id, (_, task, finished_at) in list(self._entries.items()):
+            expired = finished_at is not None and now - finished_at > self.ttl_seconds
+            if expired or len(self._entries) >= self.max_entries:
+                task.cancel()
+                del self._entries[result_id]
+                self.counters["expired"] += 1
+
+    def cancel_all(self) -> int:
+        """
+        Cancel the unfinished tasks (the worker is stopping; nobody could fetch them).
+        """
+        pending = [task for _, task, _ in self._entries.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        return len(pending)
+
+    def stats(self) -> dict:
+        return dict(self.counters, pending=sum(not entry[1].done() for entry in self._entries.values()),
+                    kept=len(self._entries))
+
+
+async def run_until_disconnect(request, awaitable):
+    """
+    Await `awaitable`, cancelling it and raising ClientDisconnected if the client
+    disconnects first. The request body must already have been read.
+    """
+    async def wait_for_disconnect():
+        while True:
+            message = await request.receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    work = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        if not work.done():
+            work.cancel()
+        watcher.cancel()
+    if work.done() and not work.cancelled():
+        return work.result()
+    with _lock:
+        _counters["disconnects"] += 1
+    raise ClientDisconnected()
+
+
+def stats(*flights: SingleFlight) -> dict:
+    with _lock:
+        result = {kind: dict(usage) for kind, usage in _usage.items()}
+        result.update(_counters)
+    for flight in flights:
+        result[f"single_flight_{flight.name}"] = flight.stats()
+    return result
@@ -0,0 +1,396 @@
+"""
+This file implements the process-wide scheduler that every outbound LLM call in
+ML_functions.py goes through, so interactive generations, image scans and background
+pre-generation stop competing blindly for the providers' rate limits.
+
+Per provider ("groq", "openai"):
+  - at most LLM_<PROVIDER>_MAX_CONCURRENT calls run at once (default 16), and
+    background calls may only use LLM_BACKGROUND_SHARE of them (default 0.5), so an
+    interactive call always finds room soon;
+  - with LLM_<PROVIDER>_TOKENS_PER_MINUTE set (default 0 = no limit), a token bucket
+    of that size: a call reserves its prompt estimate plus its completion limit, and
+    gets back what it did not use when it finishes;
+  - a 429 pauses the whole provider for its Retry-After, instead of every queued call
+    hitting it again, and empties the bucket. The call is queued again, up to
+    LLM_RATE_LIMIT_RETRIES times (default 2); 5xx answers and dropped connections are
+    retried the same way, without the pause. The clients' own retries are off.
+
+Waiting calls are served interactive first. Within a class, users take turns, one
+call each, so one user's burst does not starve the others. The class and the user come
+from `caller(priority, user)`, a context variable set by the endpoints and the
+pre-generator; it follows the request into asyncio tasks.
+
+GET /metrics shows running and queued calls, 429s and queue waits under "llm_scheduler".
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+import openai
+
+INTERACTIVE, BACKGROUND = "interactive", "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)  # served in this order
+
+BACKGROUND_SHARE = float(os.getenv("LLM_BACKGROUND_SHARE", "0.5"))
+RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "2"))
+DEFAULT_RETRY_AFTER = 1.0  # seconds, when a 429 does not say
+WAIT_SAMPLES = 1000        # queue waits kept per class for the percentiles
+
+_caller = contextvars.ContextVar("llm_caller", default=(INTERACTIVE, None))
+_ticket = contextvars.ContextVar("llm_ticket", default=None)
+
+
+@contextmanager
+def caller(priority: str = INTERACTIVE, user: str | None = None):
+    """
+    LLM calls made inside this block (and the tasks it starts) are `priority` work for `user`.
+    """
+    token = _caller.set((priority, user))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def record_usage(tokens: int):
+    """
+    Report the tokens the current call actually used (prompt + completion).
+    """
+    ticket = _ticket.get()
+    if ticket is not None:
+        ticket.used_tokens = tokens
+
+
+class _Ticket:
+    """
+    One call waiting for, or holding, a slot.
+    """
+    __slots__ = ("priority", "user", "tokens", "enqueued_at", "granted", "used_tokens", "event", "future", "loop")
+
+    def __init__(self, priority: str, user, tokens: int, loop=None):
+        self.priority = priority
+        self.user = user
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.used_tokens = None
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+
+    def wake(self) -> bool:
+        if self.future is None:
+            self.event.set()
+            return True
+        try:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+            return True
+        except RuntimeError:  # its event loop is gone
+            return False
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ProviderScheduler:
+    """
+    Concurrency cap, token bucket and priority/fair queue of one provider. Safe to
+    use from several threads and event loops.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, tokens_per_minute: float,
+                 background_share: float = BACKGROUND_SHARE):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_background = max(1, int(self.max_concurrent * background_share))
+        self.tokens_per_minute = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.refilled_at = time.monotonic()
+        self.paused_until = 0.0
+        self.running = {priority: 0 for priority in PRIORITIES}
+        self.queues = {priority: OrderedDict() for priority in PRIORITIES}  # user -> deque of tickets
+        self.waits = {priority: deque(maxlen=WAIT_SAMPLES) for priority in PRIORITIES}
+        self.counters = {"calls": 0, "queued": 0, "rate_limited": 0, "retries": 0, "abandoned": 0}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._timer_due = None
+
+    # --- Queueing (all under self._lock) --- #
+
+    def _refill(self, now: float):
+        if self.tokens_per_minute:
+            self.tokens = min(self.tokens_per_minute,
+                              self.tokens + (now - self.refilled_at) * self.tokens_per_minute / 60)
+        self.refilled_at = now
+
+    def _blocked_for(self, ticket: _Ticket, now: float) -> float | None:
+        """
+        None if `ticket` can start now, else the seconds until it may (0: when a call ends).
+        """
+        if now < self.paused_until:
+            return self.paused_until - now
+        if sum(self.running.values()) >= self.max_concurrent:
+            return 0
+        if ticket.priority == BACKGROUND and self.running[BACKGROUND] >= self.max_background:
+            return 0
+        if self.tokens_per_minute and self.tokens < ticket.tokens:
+            return (ticket.tokens - self.tokens) * 60 / self.tokens_per_minute
+        return None
+
+    def _dispatch(self):
+        """
+        Start queued calls while the head of the highest non-empty class can start.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        while True:
+            priority = next((priority for priority in PRIORITIES if self.queues[priority]), None)
+            if priority is None:
+                return
+            queue = self.queues[priority]
+            user, tickets = next(iter(queue.items()))
+            ticket = tickets[0]
+            wait = self._blocked_for(ticket, now)
+            if wait is not None:
+                if wait > 0:
+                    self._wake_in(wait)
+                return
+            tickets.popleft()
+            del queue[user]
+            if tickets:
+                queue[user] = tickets  # back of the line: users take turns
+            self.running[priority] += 1
+            if self.tokens_per_minute:
+                self.tokens -= ticket.tokens
+            self.waits[priority].append(now - ticket.enqueued_at)
+            self.counters["calls"] += 1
+            ticket.granted = True
+            if not ticket.wake():
+                self._finish(ticket)
+
+    def _wake_in(self, seconds: float):
+        due = time.monotonic() + seconds
+        if self._timer is not None and self._timer_due <= due:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(seconds + 0.001, self._on_timer)
+        self._timer.daemon = True
+        self._timer_due = due
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _finish(self, ticket: _Ticket):
+        self.running[ticket.priority] -= 1
+        if self.tokens_per_minute and ticket.used_tokens is not None:
+            self.tokens = min(self.tokens_per_minute, self.tokens + ticket.tokens - ticket.used_tokens)
+
+    def _enqueue(self, ticket: _Ticket):
+        if self.tokens_per_minute:
+            ticket.tokens = min(ticket.tokens, self.tokens_per_minute)  # or it could never start
+        with self._lock:
+            self.queues[ticket.priority].setdefault(ticket.user, deque()).append(ticket)
+            self._dispatch()
+            if not ticket.granted:
+                self.counters["queued"] += 1
+
+    # --- Acquire and release --- #
+
+    def acquire(self, priority: str, user, tokens: int) -> _Ticket:
+        """
+        Block the calling thread until the call may start.
+        """
+        ticket = _Ticket(priority, user, tokens)
+        self._enqueue(ticket)
+        ticket.event.wait()
+        return ticket
+
+    async def acquire_async(self, priority: str, user, tokens: int) -> _Ticket:
+        """
+        Wait until the call may start. Cancelling the wait leaves the queue.
+        """
+        ticket = _Ticket(priority, user, tokens, asyncio.get_running_loop())
+        self._enqueue(ticket)
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if ticket.granted:
+                    self._finish(ticket)
+                else:
+                    tickets = self.queues[priority].get(user)
+                    tickets.remove(ticket)
+                    if not tickets:
+                        del self.queues[priority][user]
+                    self.counters["abandoned"] += 1
+                self._dispatch()
+            raise
+        return ticket
+
+    def release(self, ticket: _Ticket):
+        with self._lock:
+            self._finish(ticket)
+            self._dispatch()
+
+    def rate_limited(self, retry_after: float):
+        """
+        The provider answered 429: pause it and empty the bucket.
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.tokens = min(self.tokens, 0.0)
+            self.counters["rate_limited"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refill(time.monotonic())
+            result = dict(self.counters)
+            result.update(
+                max_concurrent=self.max_concurrent,
+                running=dict(self.running),
+                waiting={priority: sum(len(tickets) for tickets in queue.values())
+                         for priority, queue in self.queues.items()},
+                paused_seconds=round(max(0.0, self.paused_until - time.monotonic()), 3),
+                tokens_available=round(self.tokens) if self.tokens_per_minute else None,
+            )
+            waits = {priority: sorted(samples) for priority, samples in self.waits.items()}
+        result["queue_wait_ms"] = {
+            priority: {
+                "p50": round(samples[len(samples) // 2] * 1000, 1),
+                "p95": round(samples[int(len(samples) * 0.95)] * 1000, 1),
+                "max": round(samples[-1] * 1000, 1),
+            } if samples else None
+            for priority, samples in waits.items()
+        }
+        return result
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def configure(provider: str, max_concurrent: int, tokens_per_minute: float = 0) -> ProviderScheduler:
+    """
+    Replace the scheduler of `provider` (calls already running keep their slots).
+    """
+    with _schedulers_lock:
+        _schedulers[provider] = ProviderScheduler(provider, max_concurrent, tokens_per_minute)
+        return _schedulers[provider]
+
+
+def scheduler(provider: str) -> ProviderScheduler:
+    with _schedulers_lock:
+        if provider not in _schedulers:
+            prefix = f"LLM_{provider.upper()}_"
+            _schedulers[provider] = ProviderScheduler(
+                provider,
+                max_concurrent=int(os.getenv(prefix + "MAX_CONCURRENT", "16")),
+                tokens_per_minute=float(os.getenv(prefix + "TOKENS_PER_MINUTE", "0")),
+            )
+        return _schedulers[provider]
+
+
+def retry_after(error: Exception) -> float:
+    """
+    Seconds to wait after a 429, from its retry-after-ms or retry-after header.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return max(0.0, float(headers[name]) * scale)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return DEFAULT_RETRY_AFTER
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, openai.APITimeoutError):
+        return False  # the deadline is spent; trying again would only overrun it
+    return isinstance(error, (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError))
+
+
+def _failed(provider_scheduler: ProviderScheduler, error: Exception, attempt: int) -> float:
+    """
+    Book a failed attempt; returns the backoff before the next one (0 after a 429:
+    the pause already applies to everybody).
+    """
+    if attempt < RATE_LIMIT_RETRIES:
+        with provider_scheduler._lock:
+            provider_scheduler.counters["retries"] += 1
+    if isinstance(error, openai.RateLimitError):
+        provider_scheduler.rate_limited(retry_after(error))
+        return 0.0
+    return 0.5 * 2 ** attempt
+
+
+@asynccontextmanager
+async def slot(provider: str, tokens: int):
+    priority, user = _caller.get()
+    provider_scheduler = scheduler(provider)
+    ticket = await provider_scheduler.acquire_async(priority, user, tokens)
+    token = _ticket.set(ticket)
+    try:
+        yield ticket
+    finally:
+        _ticket.reset(token)
+        provider_scheduler.release(ticket)
+
+
+@contextmanager
+def slot_sync(provider: str, tokens: int):
+    priority, user = _caller.get()
+    provider_scheduler = scheduler(provider)
+    ticket = provider_scheduler.acquire(priority, user, tokens)
+    token = _ticket.set(ticket)
+    try:
+        yield ticket
+    finally:
+        _ticket.reset(token)
+        provider_scheduler.release(ticket)
+
+
+async def run(provider: str, tokens: int, call):
+    """
+    Await `call()` (a coroutine function) in a slot of `provider`, reserving `tokens`.
+    """
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        async with slot(provider, tokens):
+            try:
+                return await call()
+            except Exception as e:
+                if not _retryable(e) or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                backoff = _failed(scheduler(provider), e, attempt)
+        await asyncio.sleep(backoff)
+
+
+def run_sync(provider: str, tokens: int, call):
+    """
+    Blocking version of run(), for the calls made from threads.
+    """
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        with slot_sync(provider, tokens):
+            try:
+                return call()
+            except Exception as e:
+                if not _retryable(e) or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                backoff = _failed(scheduler(provider), e, attempt)
+        time.sleep(backoff)
+
+
+def stats() -> dict:
+    with _schedulers_lock:
+        schedulers = dict(_schedulers)
+    return {name: provider_scheduler.stats() for name, provider_scheduler in schedulers.items()}
@@ -10,23 +10,101 @@ We configure the docs to show at the root URL ("/") by setting docs_url="/".
 We also remove or repurpose the existing root endpoint to avoid conflicts.
 """
 
-from fastapi import FastAPI, HTTPException, File, UploadFile, Depends
+import tracing
+from fastapi import FastAPI, HTTPException, File, UploadFile, Depends, Query, Response, WebSocket, Header, Request
+from fastapi.responses import StreamingResponse
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
 from fastapi.middleware.cors import CORSMiddleware
 from routers import login
 from pydantic import BaseModel
 import os
+import asyncio
+import hashlib
+import json
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from datetime import datetime
 
 # Import `get_current_user` from `login.py`
-from routers.login import get_current_user, get_user_profile
+from routers.login import get_current_user, get_user_profile, decode_user_id
+
+# In-process pub/sub bus for pushing fridge changes over WebSockets
+from events import FridgeEventBus, EVENTS_SOURCE, start_change_stream
+
+# Per-user version counters behind the ETag / If-None-Match support
+import versions
+from versions import ResourceVersions, make_etag, etag_matches
+
+# Merging ingredient lists detected in several images
+from ingredients import merge_ingredient_lists
+
+# Optional speculative recipe pre-generation after fridge changes
+from pregen import create_pregenerator, fridge_fingerprint
+
+# Optional near-duplicate fridge cache in front of recipe generation
+from recipe_cache import create_recipe_cache
+
+# Read-through cache for profiles, fridges and favorites, and the /metrics registry
+from cache import create_read_cache
+import metrics
+
+# Inverted index over favorite titles and ingredients, for /recipes/favorites/search
+from favorites_index import FavoritesIndexes, as_favorite
+
+# Local ingredient pairing model behind /fridge/suggestions (built by build_pairings.py)
+import pairings
+
+# Response encoding negotiation (MessagePack, gzip, brotli)
+import wire
+
+# Optional write-behind coalescing of rapid fridge quantity changes
+from writebehind import create_write_behind_buffer
+
+# Fridge storage layouts (one document per item, or one per user)
+from fridge_store import create_fridge_store, ITEMS
+
+# Warm-up, readiness and drain state of this worker (see serve.py)
+import lifecycle
+
+# Per-request latency budgets, and the tiers recipe generation degrades through
+import deadlines
+
+# Priorities and per-provider limits of the outbound LLM calls
+import llm_scheduler
+
+# Several meals generated together and budgeted against the fridge
+import meal_plan
+from meal_plan import plan_meals, MEAL_PLAN_MAX_MEALS
+
+# On-demand profiling of a chosen route, armed by admins
+from profiling import RouteProfiler, is_admin
+from fastapi.responses import PlainTextResponse
 
 
 # Import the ML functions
-from ML_functions import generate_delicious_recipes, extract_recipe_from_image
+from ML_functions import (
+    generate_delicious_recipes_async,
+    generate_recipes_fanout_async,
+    generate_recipe_slot_async,
+    build_recipe_slot_prompt,
+    fit_recipe_ingredients,
+    extract_recipe_from_image_async,
+    RECIPE_SLOTS,
+    RECIPE_MODEL,
+    RECIPE_FAST_MODEL,
+    warm_llm_clients,
+    close_llm_clients
+)
+
+# Cancelling LLM calls when the client disconnects, and sharing identical calls
+import llm_calls
+import prompt_budget
+import json_repair
+from llm_calls import SingleFlight, PendingResults, ClientDisconnected, run_until_disconnect
 
 # Import the Pydantic models from app/models.py 
 from models import (
@@ -39,12 +117,16 @@ from models import (
     GenerateSuggestionsResponse,
     GenerateRecipesResponse,
     ImageRecipeResponse,
+    MultiImageRecipeResponse,
+    ImageScanFailure,
     FavoriteRecipe,
     RemoveFavoriteRequest,
     RecipePreferences,
+    MealPlanRequest,
     UserProfile,
     UpdateProfilePictureRequest,
-    UpdateProfileResponse
+    UpdateProfileResponse,
+    ProfileArmRequest
 )
 
 # MongoDB URI
@@ -58,12 +140,27 @@ uri = os.getenv("MONGODB_URI")
 # Check if the URI is available
 if not uri:
     raise ValueError("MONGODB_URI environment variable is not set. Please check your .env file.")
-client = MongoClient(uri, server_api=ServerApi('1'))
+
+# Time every MongoDB command as a span of the current request's trace
+tracing.register_mongo_listener()
+# MONGODB_MIN_POOL_SIZE connections are kept open (and opened by the warm-up)
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+client = MongoClient(uri, server_api=ServerApi('1'), minPoolSize=MONGODB_MIN_POOL_SIZE)
 
 # Connect to the database and collection
-db = client["fridge"]
+# (MONGODB_DB lets benchmarks and local tools point at a scratch database)
+db = client[os.getenv("MONGODB_DB", "fridge")]
 fridge_items = db["fridge_items"]
 
+# How fridges are stored, picked with FRIDGE_LAYOUT (see fridge_store.py)
+fridge_store = create_fridge_store(db)
+
+# The change stream understands the one-document-per-item layout only; with the
+# other layouts the endpoints publish fridge events themselves
+FRIDGE_EVENTS_FROM_STREAM = EVENTS_SOURCE == "changestream" and fridge_store.layout == ITEMS
+if EVENTS_SOURCE == "changestream" and not FRIDGE_EVENTS_FROM_STREAM:
+    print(f"FRIDGE_EVENTS_SOURCE=changestream needs FRIDGE_LAYOUT={ITEMS}; publishing fridge events locally")
+
 class Item(BaseModel):
     name: str
     quantity: int 
@@ -74,8 +171,60 @@ favorite_recipes = db["favorite_recipes"]
 # Create a new collection for user profiles
 user_profiles = db["user_profiles"]
 
-# Connect to MongoDB collections
-favorite_recipes = db["favorite_recipes"]
+# Per-user, per-resource version counters (see versions.py)
+resource_versions = ResourceVersions(db["resource_versions"])
+
+# Search index over each user's favorites, kept in sync by the favorite endpoints
+favorites_index = FavoritesIndexes(favorite_recipes)
+
+# Ingredient lists of generated recipes, kept for a while as input to build_pairings.py
+generated_recipes = db["generated_recipes"]
+GENERATED_RECIPES_TTL_DAYS = int(os.getenv("GENERATED_RECIPES_TTL_DAYS", "30"))
+pairing_engine = pairings.PairingEngine()
+
+# Read-through cache; keys are (resource, user_id) tuples, values are plain tuples
+read_cache = create_read_cache()
+metrics.register("read_cache", read_cache.stats)
+
+# Fridge change events pushed to clients connected to /fridge/ws
+fridge_events = FridgeEventBus()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start background workers and warm up when the app starts; the server accepts
+    connections only once this is done. On shutdown, uvicorn has already drained the
+    in-flight requests (serve.py gives it SERVE_DRAIN_SECONDS).
+    """
+    if FRIDGE_EVENTS_FROM_STREAM:
+        # Every worker tails MongoDB, so clients see changes made by other workers too
+        start_change_stream(fridge_items, fridge_events)
+    if fridge_write_buffer:
+        fridge_write_buffer.start()
+    await lifecycle.warm_up({
+        "mongodb": warm_mongo_pool,
+        "llm_clients": warm_llm_clients,
+        "pairing_model": lambda: asyncio.get_running_loop().run_in_executor(None, pairing_engine.current),
+    })
+    yield
+    lifecycle.start_draining()
+    if recipe_pregenerator:
+        recipe_pregenerator.close()
+    cancelled = recipe_slots.cancel_all()
+    if cancelled:
+        print(f"Cancelled {cancelled} pending recipe slots on shutdown")
+    await close_llm_clients()
+    if fridge_write_buffer:
+        # Don't lose buffered fridge changes on shutdown
+        fridge_write_buffer.close()
+
+async def warm_mongo_pool():
+    """
+    Open MONGODB_MIN_POOL_SIZE connections (at least one) with concurrent pings.
+    """
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(None, client.admin.command, "ping")
+                           for _ in range(max(1, MONGODB_MIN_POOL_SIZE))))
 
 # -----------------------------------------------------------------------------
 # 1) Configure the FastAPI instance so that docs_url="/" serves the Swagger UI.
@@ -84,7 +233,8 @@ favorite_recipes = db["favorite_recipes"]
 app = FastAPI(
     docs_url="/",                 # Serve the Swagger docs at the root URL
     openapi_url="/openapi.json",  # Keep the OpenAPI specification accessible
-    redoc_url="/redoc"            # Keep or remove ReDoc by setting it to None
+    redoc_url="/redoc",           # Keep or remove ReDoc by setting it to None
+    lifespan=lifespan
 )
 
 app.include_router(login.router)
@@ -100,8 +250,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Total-Count", "X-Request-ID"],  # Let browser clients read these
 )
 
+# MessagePack and gzip/brotli responses for clients that ask for them (see wire.py)
+app.add_middleware(wire.WireFormatMiddleware)
+metrics.register("wire", wire.stats)
+
+# Per-request latency budget (X-Request-Deadline-Ms or the route's default, see deadlines.py)
+app.add_middleware(deadlines.DeadlineMiddleware)
+metrics.register("deadlines", deadlines.stats)
+
+# Per-request tracing and X-Request-ID propagation (see tracing.py)
+app.add_middleware(tracing.TracingMiddleware)
+metrics.register("tracing", tracing.stats)
+
 def unpack_item(item: dict) -> FridgeItem:
     """
     Convert a raw MongoDB document into a FridgeItem Pydantic model.
@@ -116,6 +279,33 @@ def unpack_item(item: dict) -> FridgeItem:
         quantity=item["quantity"]
     )
 
+def publish_fridge_change(user_id: str, name: str, all_items: list[FridgeItem]):
+    """
+    Push an item-level change event for `name` to the user's connected clients.
+    `all_items` is the fridge after the change; if `name` is missing it was deleted.
+    """
+    if FRIDGE_EVENTS_FROM_STREAM:
+        return  # the change stream publishes it instead
+    for fridge_item in all_items:
+        if fridge_item.name == name:
+            fridge_events.publish(user_id, {"type": "upsert", "item": fridge_item.dict()})
+            return
+    fridge_events.publish(user_id, {"type": "delete", "item": {"name": name}})
+
+def not_modified(
+    response: Response, if_none_match: str | None, user_id: str, resource: str, extra: str = ""
+) -> Response | None:
+    """
+    Conditional GET helper. Looks up the user's version of `resource`, sets the ETag
+    header on `response`, and returns a 304 response if the client already has it.
+    Returns None when the caller should build the full response.
+    """
+    etag = make_etag(user_id, resource, resource_versions.get(user_id, resource), extra)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
+
 # Test MongoDB connection
 try:
     client.admin.command("ping")  # Attempt to ping the database
@@ -123,6 +313,16 @@ try:
 except Exception as e:
     print(f"Error connecting to MongoDB: {e}")
 
+# Make sure the lookups keyed by user_id (friends aggregation, favorites) are indexed
+try:
+    user_profiles.create_index("user_id")
+    favorite_recipes.create_index([("user_id", 1), ("title", 1)])
+    resource_versions.ensure_indexes()
+    fridge_store.ensure_indexes()
+    generated_recipes.create_index("created_at", expireAfterSeconds=GENERATED_RECIPES_TTL_DAYS * 86400)
+except Exception as e:
+    print(f"Error creating MongoDB indexes: {e}")
+
 # -----------------------------------------------------------------------------
 # 2) Remove or rename the existing root endpoint to avoid conflicts.
 #    If you want a 'root' endpoint, rename it for example to @app.get("/welcome").
@@ -135,31 +335,127 @@ def opening_page():
     """
     return OpeningPageResponse(Message="Welcome to the fridge app!")
 
+def load_fridge_rows(user_id: str) -> tuple:
+    """
+    Read the user's fridge from MongoDB as compact (id, name, quantity) tuples.
+    """
+    return fridge_store.load_rows(user_id)
+
+# Buffered fridge writes (None unless FRIDGE_WRITE_BEHIND_MS is set); once a user's
+# changes are in MongoDB, their cached rows are stale
+fridge_write_buffer = create_write_behind_buffer(
+    fridge_store.apply_changes, on_flushed=lambda user_id: read_cache.invalidate(("fridge", user_id))
+)
+if fridge_write_buffer:
+    metrics.register("fridge_write_behind", fridge_write_buffer.stats)
+
+def read_fridge_rows(user_id: str) -> tuple:
+    """
+    The user's fridge as (id, name, quantity) rows: MongoDB through the read cache,
+    with any buffered changes merged on top.
+    """
+    def load():
+        return read_cache.get_or_load(("fridge", user_id), lambda: load_fridge_rows(user_id))
+    if fridge_write_buffer:
+        return fridge_write_buffer.read(user_id, load)
+    return load()
+
+def fridge_item_quantity(user_id: str, name: str) -> int | None:
+    """
+    Current quantity of one item, or None if it is not in the fridge.
+    """
+    if fridge_write_buffer:
+        for _, item_name, quantity in read_fridge_rows(user_id):
+            if item_name == name:
+                return quantity
+        return None
+    return fridge_store.find_quantity(user_id, name)
+
+def increment_item(user_id: str, name: str, delta: int):
+    """
+    Add `delta` to an item's quantity, creating the item if needed.
+    """
+    if fridge_write_buffer:
+        fridge_write_buffer.increment(user_id, name, delta)
+    else:
+        fridge_store.increment(user_id, name, delta)
+
+def set_item_quantity(user_id: str, name: str, quantity: int):
+    """
+    Set an item's quantity; zero or less removes the item.
+    """
+    if fridge_write_buffer:
+        fridge_write_buffer.set_quantity(user_id, name, quantity)
+    else:
+        fridge_store.set_quantity(user_id, name, quantity)
+
+def get_items(user_id: str) -> list[FridgeItem]:
+    """
+    Retrieve all items in the user's fridge (through the read cache). Each item is 
+    represented by the FridgeItem model.
+    """
+    rows = read_fridge_rows(user_id)
+    with tracing.span("pydantic.validate", model="FridgeItem", count=len(rows)):
+        return [FridgeItem(id=item_id, name=name, quantity=quantity) for item_id, name, quantity in rows]
+
+def fridge_changed(user_id: str, name: str) -> list[FridgeItem]:
+    """
+    Bookkeeping after a successful write to the user's fridge: drop the cached fridge,
+    bump the ETag version, push the change to WebSocket clients.
+    Returns the fridge after the change.
+    """
+    # Invalidate first: once the new version is visible, no read may still see the old rows
+    if not fridge_write_buffer:
+        read_cache.invalidate(("fridge", user_id))  # buffered writes invalidate when flushed
+    resource_versions.bump(user_id, versions.FRIDGE)
+    all_items_fridge = get_items(user_id)
+    publish_fridge_change(user_id, name, all_items_fridge)
+    if recipe_pregenerator:
+        recipe_pregenerator.fridge_changed(user_id)
+    return all_items_fridge
+
+def get_fridge_contents(user_id: str) -> list[tuple]:
+    """
+    The user's fridge as (name, quantity) tuples, the shape the ML functions expect.
+    """
+    # Oldest first: item IDs are ObjectIds, which start with their creation time
+    # (prompt_budget.py keeps the most recently added items when it has to choose)
+    rows = sorted(read_fridge_rows(user_id))
+    return [(name, quantity) for _, name, quantity in rows]
+
+# Background recipe generation after fridge changes (None unless RECIPE_PREGEN_ENABLED=1)
+recipe_pregenerator = create_pregenerator(generate_delicious_recipes_async, get_fridge_contents)
+if recipe_pregenerator:
+    metrics.register("recipe_pregen", recipe_pregenerator.stats)
+
+similar_recipe_cache = create_recipe_cache()
+if similar_recipe_cache:
+    metrics.register("recipe_cache", similar_recipe_cache.stats)
+
 @app.get("/fridge/get", response_model=list[FridgeItem])
-def get_items(user_id: str = Depends(get_current_user)):
+def get_fridge(
+    response: Response,
+    user_id: str = Depends(get_current_user),
+    if_none_match: str | None = Header(None)
+):
     """
     Retrieve all items in the fridge. Each item is represented 
     by the FridgeItem model.
+    Answers 304 Not Modified when If-None-Match matches the current ETag.
     """
-    items_cursor = fridge_items.find()  # Query all items from the DB
-    # Query only the item correcponding to the user_id
-    items_cursor = fridge_items.find({"user_id": user_id}) 
-    # Convert each MongoDB document into a FridgeItem using unpack_item
-    return [unpack_item(item) for item in items_cursor]
+    cached = not_modified(response, if_none_match, user_id, versions.FRIDGE)
+    if cached:
+        return cached
+    return get_items(user_id)
 
 @app.post("/fridge/add", response_model=AddItemResponse)
 def add_item(item: Item, user_id: str = Depends(get_current_user)):
     """
     Add an item to the fridge for the current user.
     """
-    # Upsert the item using both user_id and name.
-    fridge_items.update_one(
-        {"user_id": user_id, "name": item.name},
-        {"$inc": {"quantity": item.quantity}},
-        upsert=True
-    )
+    increment_item(user_id, item.name, item.quantity)
     print(f"Authenticated user: {user_id}")
-    all_items_fridge = get_items(user_id)
+    all_items_fridge = fridge_changed(user_id, item.name)
     return AddItemResponse(
         message=f"{item.quantity} {item.name}(s) added to the fridge.",
         all_items=all_items_fridge
@@ -170,30 +466,27 @@ def remove_item(item: Item, user_id: str = Depends(get_current_user)):
     """
     Remove an item from the fridge for the current user.
     """
-    existing_item = fridge_items.find_one({"user_id": user_id, "name": item.name})
-    if not existing_item:
+    existing_quantity = fridge_item_quantity(user_id, item.name)
+    if existing_quantity is None:
         raise HTTPException(status_code=404, detail="Item not found in the fridge.")
 
     if item.quantity == 1000000000:  # Remove the entire item
-        fridge_items.delete_one({"user_id": user_id, "name": item.name})
+        set_item_quantity(user_id, item.name, 0)
         message = f"{item.name} completely removed."
     else:
-        if existing_item["quantity"] < item.quantity:
+        if existing_quantity < item.quantity:
             raise HTTPException(status_code=400, detail="Not enough items in the fridge.")
-        new_quantity = existing_item["quantity"] - item.quantity
+        new_quantity = existing_quantity - item.quantity
+        set_item_quantity(user_id, item.name, new_quantity)
         if new_quantity > 0:
-            fridge_items.update_one(
-                {"user_id": user_id, "name": item.name},
-                {"$set": {"quantity": new_quantity}}
-            )
             message = f"Decremented {item.name} by {item.quantity}."
         else:
-            fridge_items.delete_one({"user_id": user_id, "name": item.name})
             message = f"{item.name} removed."
 
+    all_items_fridge = fridge_changed(user_id, item.name)
     return RemoveItemResponse(
         message=message,
-        all_items=get_items(user_id)
+        all_items=all_items_fridge
     )
 
 @app.put("/fridge/update_quantity", response_model=UpdateItemResponse)
@@ -201,57 +494,223 @@ def update_quantity(item: Item, user_id: str = Depends(get_current_user)):
     """
     Update the quantity of an item in the fridge for the current user.
     """
-    existing_item = fridge_items.find_one({"user_id": user_id, "name": item.name})
-    if not existing_item:
+    if fridge_item_quantity(user_id, item.name) is None:
         raise HTTPException(status_code=404, detail="Item not found in the fridge.")
 
+    set_item_quantity(user_id, item.name, item.quantity)
     if item.quantity <= 0:
-        fridge_items.delete_one({"user_id": user_id, "name": item.name})
         message = f"{item.name} removed from the fridge."
     else:
-        fridge_items.update_one(
-            {"user_id": user_id, "name": item.name},
-            {"$set": {"quantity": item.quantity}}
-        )
         message = f"{item.name} quantity updated to {item.quantity}."
 
+    all_items_fridge = fridge_changed(user_id, item.name)
     return UpdateItemResponse(
         message=message,
-        all_items=get_items(user_id)
+        all_items=all_items_fridge
     )
 
+@app.websocket("/fridge/ws")
+async def fridge_changes_socket(websocket: WebSocket, token: str = Query(...)):
+    """
+    Push item-level fridge changes to the client instead of having it poll /fridge/get.
+    Authenticate with the same JWT as the HTTP API, passed as ?token=... since
+    browsers cannot set headers on WebSocket connections.
+
+    Each message is a JSON event (see events.py): "upsert", "delete" or "resync".
+    On "resync" the client fell behind and should re-fetch /fridge/get once.
+    """
+    user_id = decode_user_id(token)
+    if not user_id:
+        await websocket.close(code=1008)  # Policy violation: invalid token
+        return
+
+    await websocket.accept()
+    subscription = fridge_events.subscribe(user_id)
+
+    async def send_events():
+        while True:
+            await websocket.send_json(await subscription.get())
+
+    sender = asyncio.create_task(send_events())
+    try:
+        # We don't expect messages from the client; just wait until it disconnects
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    finally:
+        sender.cancel()
+        fridge_events.unsubscribe(subscription)
+
 @app.get("/fridge/suggestions", response_model=GenerateSuggestionsResponse)
 def generate_suggestions(user_id: str = Depends(get_current_user)):
     """
     Generate item-based suggestions based on what is currently in the fridge. 
     Response is enforced by GenerateSuggestionsResponse.
+
+    Suggestions come from the local pairing model (pairings.py): ingredients that pair
+    well with the fridge, and ingredients that would complete known recipes. Until a
+    model has been built, every item gets a generic suggestion.
     
     If the fridge is empty, raises a 400 error.
     """
-    items_cursor = fridge_items.find({"user_id": user_id})
-    item_names = [doc["name"] for doc in items_cursor]
+    item_names = [fridge_item.name for fridge_item in get_items(user_id)]
 
     if not item_names:
         raise HTTPException(status_code=400, detail="The fridge is empty!")
 
-    # Generate simple suggestions for each item
+    scored = pairing_engine.suggest(item_names)
+    if not scored or not (scored["pairings"] or scored["one_away"]):
+        # Generate simple suggestions for each item
+        suggestions = [
+            f"How about making something with {name}?" for name in item_names
+        ]
+        return GenerateSuggestionsResponse(suggestions=suggestions)
+
     suggestions = [
-        f"How about making something with {name}?" for name in item_names
+        f"Add {entry['ingredient']} to make {entry['recipes'][0]}"
+        + (f" (and {entry['recipe_count'] - 1} more)" if entry["recipe_count"] > 1 else "")
+        for entry in scored["one_away"]
+    ] + [
+        f"{entry['ingredient'].capitalize()} pairs well with your {' and '.join(entry['with'])}"
+        for entry in scored["pairings"]
     ]
+    return GenerateSuggestionsResponse(
+        suggestions=suggestions, pairings=scored["pairings"], one_away=scored["one_away"]
+    )
 
-    return GenerateSuggestionsResponse(suggestions=suggestions)
+# In-flight LLM calls shared by identical concurrent requests (see llm_calls.py)
+recipe_calls = SingleFlight("recipes")
+vision_calls = SingleFlight("vision")
+metrics.register("llm", lambda: llm_calls.stats(recipe_calls, vision_calls))
+metrics.register("prompt_budget", prompt_budget.stats)
+metrics.register("json_repair", json_repair.stats)
+metrics.register("favorites_index", favorites_index.stats)
+metrics.register("pairings", pairing_engine.stats)
+metrics.register("lifecycle", lifecycle.stats)
+metrics.register("llm_scheduler", llm_scheduler.stats)
+
+# Status code for a request the client abandoned (nginx uses the same one)
+CLIENT_CLOSED_REQUEST = 499
+
+# RECIPE_FANOUT=1 generates the three recipes with three concurrent calls. With
+# RECIPE_FANOUT_DEADLINE_MS set, slots not done by then are answered as pending and
+# can be fetched from /fridge/recipe_slot/{slot_id} once they finish.
+RECIPE_FANOUT = os.getenv("RECIPE_FANOUT", "0") == "1"
+RECIPE_FANOUT_DEADLINE_MS = float(os.getenv("RECIPE_FANOUT_DEADLINE_MS", "0"))  # 0 = wait for all slots
+recipe_slots = PendingResults("recipe_slots")
+metrics.register("recipe_slots", recipe_slots.stats)
+
+def recipe_call(user_id: str, fridge_contents: list, preferences_dict: dict, model: str = RECIPE_MODEL):
+    """
+    Coroutine function for the recipe LLM call(s), single call or fan-out. The recipes
+    are recorded for the pairing model once, however many requests share the call.
+    """
+    if not RECIPE_FANOUT:
+        generate = lambda: generate_delicious_recipes_async(fridge_contents, preferences_dict, model)
+    else:
+        deadline = RECIPE_FANOUT_DEADLINE_MS / 1000 if RECIPE_FANOUT_DEADLINE_MS > 0 else None
+        generate = lambda: generate_recipes_fanout_async(
+            fridge_contents, preferences_dict, deadline=deadline,
+            on_pending=lambda task: recipe_slots.add(user_id, task), model=model
+        )
+
+    async def generate_and_record():
+        # Interactive work of this user for the outbound scheduler (llm_scheduler.py)
+        with llm_scheduler.caller(llm_scheduler.INTERACTIVE, user_id):
+            recipes = await generate()
+        # Feed the next build_pairings.py run, without waiting for the write
+        asyncio.get_running_loop().run_in_executor(None, pairings.record_recipes, generated_recipes, recipes)
+        return recipes
+
+    return generate_and_record
+
+# Seconds kept for the partial answer when deciding whether a model call fits the deadline
+PARTIAL_RESERVE_SECONDS = 0.5
+
+def with_mongo_deadline(function, *args):
+    """
+    Run a blocking MongoDB read with the request's remaining time as its timeout.
+    """
+    with deadlines.mongo_timeout():
+        return function(*args)
+
+def local_recipes(user_id: str, fridge_contents: list, preferences_dict: dict) -> dict:
+    """
+    The "partial" tier: up to three recipes found locally for this fridge (near
+    matches from the recipe cache, then the user's favorites cookable with it), the
+    other slots marked as not generated.
+    """
+    recipes = []
+    if similar_recipe_cache:
+        near = similar_recipe_cache.lookup(user_id, fridge_contents, preferences_dict, minimum=1)
+        if near:
+            recipes = [near[slot] for slot in ("recipe1", "recipe2", "recipe3") if slot in near]
+    if len(recipes) < 3:
+        version = resource_versions.get(user_id, versions.FAVORITES)
+        names = {recipe["name"] for recipe in recipes}
+        fridge_names = [name for name, quantity in fridge_contents if quantity > 0]
+        for favorite in favorites_index.search(user_id, version, "", fridge_names, 0, 3):
+            if len(recipes) < 3 and favorite["title"] not in names:
+                recipes.append({"name": favorite["title"], "ingredients": favorite["ingredients"],
+                                "steps": favorite["steps"], "favorite": True})
+    while len(recipes) < 3:
+        recipes.append({"error": "Not enough time left to generate this recipe"})
+    return dict(zip(("recipe1", "recipe2", "recipe3"), recipes), omitted_ingredients=[])
+
+async def generate_within_deadline(request: Request, user_id: str, fridge_contents: list,
+                                   preferences_dict: dict) -> tuple:
+    """
+    (recipes, tier) from the best model tier the request's remaining time allows:
+    the full model if it is expected to finish with time left for the fast one, then
+    the fast model, then a partial answer from local recipes (see deadlines.py).
+    Without a deadline this is the full model, as before.
+    """
+    fingerprint = fridge_fingerprint(fridge_contents, preferences_dict)
+    fast_reserve = deadlines.expected("fast") + PARTIAL_RESERVE_SECONDS
+    for tier, model, reserve in (("full", RECIPE_MODEL, fast_reserve),
+                                 ("fast", RECIPE_FAST_MODEL, PARTIAL_RESERVE_SECONDS)):
+        timeout = deadlines.time_for(tier, reserve)
+        if timeout == 0:
+            continue
+        started = time.monotonic()
+        try:
+            recipes_dict = await run_until_disconnect(request, asyncio.wait_for(
+                recipe_calls.run((user_id, fingerprint, model), recipe_call(user_id, fridge_contents, preferences_dict, model)),
+                timeout
+            ))
+        except asyncio.TimeoutError:
+            deadlines.observe(tier, time.monotonic() - started, timed_out=True)
+            continue
+        deadlines.observe(tier, time.monotonic() - started)
+        return recipes_dict, tier
+    return await asyncio.to_thread(local_recipes, user_id, fridge_contents, preferences_dict), "partial"
+
+def served_recipes(tier: str, recipes_dict: dict) -> GenerateRecipesResponse:
+    deadlines.served(tier)
+    with tracing.span("pydantic.validate", model="GenerateRecipesResponse"):
+        return GenerateRecipesResponse(**dict(recipes_dict, tier=tier))
 
 @app.post("/fridge/generate_recipes", response_model=GenerateRecipesResponse)
-def generate_recipes(preferences: RecipePreferences, user_id: str = Depends(get_current_user)):
+async def generate_recipes(
+    request: Request, preferences: RecipePreferences, user_id: str = Depends(get_current_user)
+):
     """
     Generate three recipe suggestions based on current fridge contents and user preferences 
     using an ML function. Response is enforced by GenerateRecipesResponse, returning structured JSON.
+
+    If the client disconnects while the recipes are being generated (the user left the
+    screen), the upstream LLM call is cancelled, unless an identical request from the
+    same user is still waiting for it.
+
+    The request has a latency budget (X-Request-Deadline-Ms, 25 s by default). As it
+    runs out, the answer degrades from the full model to a faster one, then to a
+    partial answer; "tier" in the response says which served it (see deadlines.py).
     
     Raises a 400 error if the fridge is empty, or a 500 error if recipe generation fails.
     """
     # Get all items from the fridge as (name, quantity) tuples
-    items_cursor = fridge_items.find({"user_id": user_id})
-    fridge_contents = [(doc["name"], doc["quantity"]) for doc in items_cursor]
+    fridge_contents = await asyncio.to_thread(with_mongo_deadline, get_fridge_contents, user_id)
 
     if not fridge_contents:
         raise HTTPException(
@@ -261,10 +720,31 @@ def generate_recipes(preferences: RecipePreferences, user_id: str = Depends(get_
     try:
         # Convert preferences from Pydantic model to dict
         preferences_dict = preferences.dict() if preferences else {}
+
+        # Serve recipes generated in the background for this exact fridge, if any
+        if recipe_pregenerator:
+            recipe_pregenerator.remember_preferences(user_id, preferences_dict)
+            pregenerated = await asyncio.to_thread(
+                recipe_pregenerator.take, user_id, fridge_contents, preferences_dict, deadlines.remaining()
+            )
+            if pregenerated is not None:
+                return served_recipes("cached", pregenerated)
+
+        # Reuse recipes generated for a nearly identical fridge, if any
+        if similar_recipe_cache:
+            cached = await asyncio.to_thread(
+                similar_recipe_cache.lookup, user_id, fridge_contents, preferences_dict
+            )
+            if cached is not None:
+                return served_recipes("similar", cached)
         
         # Pass both fridge contents and preferences to the recipe generator
-        recipes_dict = generate_delicious_recipes(fridge_contents, preferences_dict)
-        return recipes_dict
+        recipes_dict, tier = await generate_within_deadline(request, user_id, fridge_contents, preferences_dict)
+        if similar_recipe_cache and tier == "full":
+            similar_recipe_cache.add(user_id, fridge_contents, preferences_dict, recipes_dict)
+        return served_recipes(tier, recipes_dict)
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -272,7 +752,7 @@ def generate_recipes(preferences: RecipePreferences, user_id: str = Depends(get_
         )
 
 @app.get("/fridge/generate_recipes", response_model=GenerateRecipesResponse)
-def generate_recipes_get(user_id: str = Depends(get_current_user)):
+async def generate_recipes_get(request: Request, user_id: str = Depends(get_current_user)):
     """
     Legacy GET endpoint for backward compatibility.
     Generate three recipe suggestions based on current fridge contents using an ML function.
@@ -281,28 +761,92 @@ def generate_recipes_get(user_id: str = Depends(get_current_user)):
     # Create empty preferences
     empty_preferences = RecipePreferences()
     # Call the POST version with empty preferences
-    return generate_recipes(empty_preferences, user_id)
+    return await generate_recipes(request, empty_preferences, user_id)
 
-@app.post("/fridge/load_from_image", response_model=ImageRecipeResponse)
-async def convert_image_to_recipes(image_file: UploadFile = File(...)):
+@app.get("/fridge/recipe_slot/{slot_id}")
+async def get_recipe_slot(slot_id: str, response: Response, user_id: str = Depends(get_current_user)):
     """
-    Accepts an image file in the request body (JPEG, PNG, etc.) and uses the ML function
-    to convert it into structured recipe information.
+    Fetch a recipe that was still pending when /fridge/generate_recipes answered
+    (RECIPE_FANOUT_DEADLINE_MS). Answers 202 with {"pending": true} while it is being
+    generated, and 404 if the ID is unknown or expired.
+    """
+    status, recipe = recipe_slots.get(user_id, slot_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired recipe slot.")
+    if status == "pending":
+        response.status_code = 202
+        return {"slot_id": slot_id, "pending": True}
+    return {"slot_id": slot_id, "pending": False, "recipe": recipe}
+
+# Meal plans (see meal_plan.py)
+metrics.register("meal_plan", meal_plan.stats)
+
+@app.post("/fridge/meal_plan")
+async def generate_meal_plan(plan: MealPlanRequest, user_id: str = Depends(get_current_user)):
+    """
+    Plan several meals from the current fridge contents: `days` x `mealsPerDay` meals,
+    or `meals`. Together the recipes never use more of an item than the fridge has, and
+    no two are near-duplicates (see meal_plan.py).
 
-    Returns a JSON response with a list of ingredients detected in the image.
+    The plan is streamed as newline-delimited JSON, one event per line: "plan" first,
+    then one "meal" per meal as soon as it is generated, then "done" with the
+    leftovers. The calls still running are cancelled if the client disconnects.
+
+    Raises a 400 error if the number of meals is missing or above MEAL_PLAN_MAX_MEALS,
+    or if the fridge is empty.
+    """
+    meals = plan.meals if plan.meals is not None else (plan.days or 0) * plan.mealsPerDay
+    if not 1 <= meals <= MEAL_PLAN_MAX_MEALS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Give a number of days or meals, at most {MEAL_PLAN_MAX_MEALS} meals in all."
+        )
+
+    fridge_contents = await asyncio.to_thread(with_mongo_deadline, get_fridge_contents, user_id)
+    if not fridge_contents:
+        raise HTTPException(
+            status_code=400,
+            detail="The fridge is empty! Please add some ingredients first."
+        )
+
+    preferences_dict = plan.preferences.dict()
+    longest_empty_prompt = max(
+        (build_recipe_slot_prompt([], preferences_dict, slot) for slot in RECIPE_SLOTS), key=len
+    )
+
+    async def generate(ingredients_list, slot, avoid):
+        ingredients_list, _ = fit_recipe_ingredients(ingredients_list, preferences_dict, longest_empty_prompt)
+        with llm_scheduler.caller(llm_scheduler.INTERACTIVE, user_id):
+            return await generate_recipe_slot_async(ingredients_list, preferences_dict, slot, avoid)
+
+    async def plan_lines():
+        async for event in plan_meals(fridge_contents, meals, generate, plan.mealsPerDay):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(plan_lines(), media_type="application/x-ndjson")
+
+# Supported image extensions for the image upload endpoints
+ALLOWED_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff'}
+
+# Maximum number of concurrent vision calls for one /fridge/load_from_images request
+IMAGE_SCAN_CONCURRENCY = int(os.getenv("IMAGE_SCAN_CONCURRENCY", "4"))
+
+async def read_image_upload(image_file: UploadFile) -> bytes:
+    """
+    Validate an uploaded image (extension, MIME type, non-empty) and return its bytes.
+    Raises HTTPException (400 or 500) when the upload is not usable.
     """
     # --- Step 1: Validate the input file and its format --- #
     if not image_file:
         raise HTTPException(status_code=400, detail="No image file provided.")
     
     # Check if the file has a valid image extension
-    allowed_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff'}
-    file_ext = os.path.splitext(image_file.filename)[1].lower()
+    file_ext = os.path.splitext(image_file.filename or "")[1].lower()
     
-    if file_ext not in allowed_extensions:
+    if file_ext not in ALLOWED_IMAGE_EXTENSIONS:
         raise HTTPException(
             status_code=400, 
-            detail=f"Unsupported file format. Supported formats: {', '.join(allowed_extensions)}"
+            detail=f"Unsupported file format. Supported formats: {', '.join(ALLOWED_IMAGE_EXTENSIONS)}"
         )
     
     # Check content type (MIME type) for additional validation
@@ -316,19 +860,43 @@ async def convert_image_to_recipes(image_file: UploadFile = File(...)):
     # --- Step 2: Read the file contents --- #
     try:
         file_bytes = await image_file.read()  # Read the uploaded file as bytes
-        
-        # Ensure we have actual image data
-        if len(file_bytes) == 0:
-            raise HTTPException(status_code=400, detail="Empty image file provided.")
-            
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading uploaded file: {str(e)}")
 
+    # Ensure we have actual image data
+    if len(file_bytes) == 0:
+        raise HTTPException(status_code=400, detail="Empty image file provided.")
+
+    return file_bytes
+
+async def scan_image(request: Request, file_bytes: bytes) -> dict:
+    """
+    Run the vision call for one image; identical images in flight share one call.
+    The scans are not signed in, so the scheduler's fair queueing goes by client address.
+    """
+    key = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+    with llm_scheduler.caller(llm_scheduler.INTERACTIVE, request.client.host if request.client else None):
+        return await vision_calls.run(key, lambda: extract_recipe_from_image_async(file_bytes))
+
+@app.post("/fridge/load_from_image", response_model=ImageRecipeResponse)
+async def convert_image_to_recipes(request: Request, image_file: UploadFile = File(...)):
+    """
+    Accepts an image file in the request body (JPEG, PNG, etc.) and uses the ML function
+    to convert it into structured recipe information.
+
+    Returns a JSON response with a list of ingredients detected in the image.
+    The vision call is cancelled if the client disconnects before it finishes.
+    """
+    # --- Steps 1-2: Validate and read the upload --- #
+    file_bytes = await read_image_upload(image_file)
+
     # --- Step 3: Call the ML function to extract recipe info --- #
     try:
         # The extract_recipe_from_image function now returns a dictionary with an ingredients list
-        ingredients_dict = extract_recipe_from_image(file_bytes)
+        ingredients_dict = await run_until_disconnect(request, scan_image(request, file_bytes))
         return ingredients_dict
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
     except ValueError as e:
         # For known validation errors, raise a 400
         raise HTTPException(status_code=400, detail=str(e))
@@ -336,27 +904,124 @@ async def convert_image_to_recipes(image_file: UploadFile = File(...)):
         # General fallback for unexpected errors
         raise HTTPException(status_code=500, detail=f"Error extracting recipes from image: {str(e)}")
 
+@app.post("/fridge/load_from_images", response_model=MultiImageRecipeResponse)
+async def convert_images_to_ingredients(request: Request, image_files: list[UploadFile] = File(...)):
+    """
+    Accepts several images of the same fridge and returns one merged ingredient list.
+
+    The vision calls run concurrently (at most IMAGE_SCAN_CONCURRENCY at a time), so the
+    wall time is about one call rather than one per image. Ingredients seen in several
+    images are de-duplicated and their quantities summed when the units agree.
+    If some images fail, the ingredients from the others are still returned and the
+    failures are listed in `failed`; only if every image fails is an error raised.
+    All vision calls are cancelled if the client disconnects.
+    """
+    if not image_files:
+        raise HTTPException(status_code=400, detail="No image files provided.")
+
+    semaphore = asyncio.Semaphore(IMAGE_SCAN_CONCURRENCY)
+
+    async def scan(image_file: UploadFile):
+        # Returns (ingredients, None) on success or (None, error message) on failure
+        try:
+            file_bytes = await read_image_upload(image_file)
+        except HTTPException as e:
+            return None, e.detail
+        async with semaphore:
+            try:
+                result = await scan_image(request, file_bytes)
+            except Exception as e:
+                return None, f"Error extracting ingredients from image: {str(e)}"
+        if "ingredients" not in result:
+            return None, result.get("error", "The model did not return an ingredient list.")
+        return result["ingredients"], None
 
-    # --- Step 4: Return the result in the ImageRecipeResponse model --- #
-    return ImageRecipeResponse(recipes=recipes_from_image)
+    try:
+        results = await run_until_disconnect(
+            request, asyncio.gather(*(scan(image_file) for image_file in image_files))
+        )
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+    ingredient_lists = [ingredients for ingredients, error in results if error is None]
+    failed = [
+        ImageScanFailure(filename=image_file.filename or f"image {index + 1}", error=error)
+        for index, (image_file, (ingredients, error)) in enumerate(zip(image_files, results))
+        if error is not None
+    ]
+
+    if not ingredient_lists:
+        raise HTTPException(
+            status_code=500,
+            detail="No image could be processed: " + "; ".join(f"{f.filename}: {f.error}" for f in failed)
+        )
+
+    return MultiImageRecipeResponse(
+        ingredients=merge_ingredient_lists(ingredient_lists),
+        images_processed=len(ingredient_lists),
+        failed=failed
+    )
 
 
 @app.get("/fridge/get_favorite_recipes")
-def get_favorite_recipes(user_id: str = Depends(get_current_user)):
+def get_favorite_recipes(
+    response: Response,
+    user_id: str = Depends(get_current_user),
+    if_none_match: str | None = Header(None)
+):
     """
     Retrieve all favorite recipes for the current user.
+    Answers 304 Not Modified when If-None-Match matches the current ETag.
     """
-    favorite_recipes_cursor = favorite_recipes.find({"user_id": user_id})
+    cached = not_modified(response, if_none_match, user_id, versions.FAVORITES)
+    if cached:
+        return cached
+
+    def load_favorites():
+        favorite_recipes_cursor = favorite_recipes.find({"user_id": user_id})
+        return tuple(
+            (favorite["id"], favorite["title"], favorite["description"], tuple(favorite["ingredients"]),
+             favorite["steps"])
+            for favorite in map(as_favorite, favorite_recipes_cursor)
+        )
+
+    rows = read_cache.get_or_load(("favorites", user_id), load_favorites)
     favorite_recipes_list = [
-        {
-            "id": str(recipe["_id"]),
-            "title": recipe["title"],
-            "description": recipe.get("description", "")
-        }
-        for recipe in favorite_recipes_cursor
+        {"id": recipe_id, "title": title, "description": description, "ingredients": list(ingredients),
+         "steps": steps}
+        for recipe_id, title, description, ingredients, steps in rows
     ]
     return favorite_recipes_list
 
+@app.get("/recipes/favorites/search")
+def search_favorite_recipes(
+    q: str = Query("", description="Words to find in the title or the ingredients (all must match)."),
+    cookable: bool = Query(False, description="Only favorites that can be cooked with the fridge contents."),
+    max_missing: int = Query(0, ge=0, le=20, description="With cookable, how many ingredients may be missing."),
+    limit: int = Query(20, ge=1, le=100),
+    user_id: str = Depends(get_current_user)
+):
+    """
+    Search the current user's favorite recipes by title and ingredient words, e.g.
+    q=chicken rice. With cookable=true, only favorites whose ingredients are all in the
+    fridge (salt, pepper, oil and water are assumed) are returned, fewest missing first,
+    each with the list of "missing" ingredients (see favorites_index.py). Favorites
+    saved without a usable ingredient list are never returned as cookable.
+    """
+    version = resource_versions.get(user_id, versions.FAVORITES)
+    fridge_names = None
+    if cookable:
+        fridge_names = [name for name, quantity in get_fridge_contents(user_id) if quantity > 0]
+    return favorites_index.search(user_id, version, q, fridge_names, max_missing, limit)
+
+def favorites_changed(user_id: str, added: dict | None = None, removed: str | None = None):
+    """
+    Bookkeeping after a successful write to the user's favorites.
+    """
+    read_cache.invalidate(("favorites", user_id))
+    version = resource_versions.bump(user_id, versions.FAVORITES)
+    favorites_index.apply(user_id, version, added, removed)
+
 @app.post("/recipes/favorite")
 def favorite_recipe(recipe: FavoriteRecipe, user_id: str = Depends(get_current_user)):
     """
@@ -364,14 +1029,22 @@ def favorite_recipe(recipe: FavoriteRecipe, user_id: str = Depends(get_current_u
     If `isFavorited` is True, add it; otherwise, remove it.
     """
     if recipe.isFavorited:
-        favorite_recipes.update_one(
+        document = favorite_recipes.find_one_and_update(
             {"user_id": user_id, "title": recipe.title},
-            {"$set": {"description": recipe.description, "user_id": user_id}},
-            upsert=True
+            {"$set": {
+                "description": recipe.description,
+                "ingredients": recipe.ingredients,
+                "steps": recipe.steps,
+                "user_id": user_id
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
+        favorites_changed(user_id, added=as_favorite(document))
         return {"message": f"Added {recipe.title} to favorites"}
     else:
         favorite_recipes.delete_one({"user_id": user_id, "title": recipe.title})
+        favorites_changed(user_id, removed=recipe.title)
         return {"message": f"Removed {recipe.title} from favorites"}
 
 @app.post("/fridge/remove_favorite_recipe")
@@ -382,24 +1055,44 @@ def remove_favorite_recipe(recipe: RemoveFavoriteRequest, user_id: str = Depends
     result = favorite_recipes.delete_one({"user_id": user_id, "title": recipe.title})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Recipe not found")
+    favorites_changed(user_id, removed=recipe.title)
     return {"message": f"Removed {recipe.title} from favorites"}
 
 # --- User Profile Endpoints --- #
 
 @app.get("/user/profile", response_model=UserProfile)
-def get_user_profile_info(profile_data = Depends(get_user_profile)):
+def get_user_profile_info(
+    response: Response,
+    profile_data = Depends(get_user_profile),
+    if_none_match: str | None = Header(None)
+):
     """
     Get the current user's profile information from the JWT token.
     If the user has a stored profile in the database, use that information.
     Otherwise, use the profile information from the JWT token.
+    Answers 304 Not Modified when If-None-Match matches the current ETag.
     """
     user_id = profile_data["user_id"]
+
+    # The response also depends on the token's claims, so they are part of the ETag
+    claims = f'{profile_data.get("name")}|{profile_data.get("email")}|{profile_data.get("picture")}'
+    cached = not_modified(response, if_none_match, user_id, versions.PROFILE, extra=claims)
+    if cached:
+        return cached
     
-    # Try to find the user's profile in the database
-    stored_profile = user_profiles.find_one({"user_id": user_id})
+    # Try to find the user's profile in the database (through the read cache).
+    # Cached as a tuple of (field, value) pairs, or None if there is no stored profile.
+    def load_profile():
+        document = user_profiles.find_one({"user_id": user_id}, {"name": 1, "email": 1, "picture": 1})
+        if not document:
+            return None
+        return tuple((field, document[field]) for field in ("name", "email", "picture") if field in document)
+
+    cached_profile = read_cache.get_or_load(("profile", user_id), load_profile)
     
-    if stored_profile:
+    if cached_profile is not None:
         # Return profile from database if it exists
+        stored_profile = dict(cached_profile)
         return UserProfile(
             name=stored_profile.get("name", profile_data.get("name")),
             email=stored_profile.get("email", profile_data.get("email")),
@@ -435,6 +1128,12 @@ def update_profile_picture(
             }},
             upsert=True
         )
+        read_cache.invalidate(("profile", user_id))
+        resource_versions.bump(user_id, versions.PROFILE)
+
+        # Friends see this picture in their friend lists
+        user_doc = user_profiles.find_one({"user_id": user_id}, {"friends": 1})
+        resource_versions.bump_many(user_doc.get("friends", []) if user_doc else [], versions.FRIENDS)
         
         # Create a UserProfile response object
         updated_profile = UserProfile(
@@ -489,6 +1188,7 @@ def add_friend(
         {"user_id": friend_user_id},
         {"$addToSet": {"friends": user_id}}
     )
+    resource_versions.bump_many([user_id, friend_user_id], versions.FRIENDS)
 
     # 3) Build a JSON response for the newly added friend
     new_friend_data = {
@@ -506,6 +1206,7 @@ def add_friend(
 def remove_friend(friend_id: str, user_id: str = Depends(get_current_user)):
     user_profiles.update_one({"user_id": user_id}, {"$pull": {"friends": friend_id}})
     user_profiles.update_one({"user_id": friend_id}, {"$pull": {"friends": user_id}})
+    resource_versions.bump_many([user_id, friend_id], versions.FRIENDS)
     return {"message": "Friend removed"}
 
 
@@ -525,19 +1226,30 @@ def friend_favorites(friend_id: str, user_id: str = Depends(get_current_user)):
     # Convert each doc into a simpler JSON structure
     friend_favorites_list = [
         {
-            "title": recipe["title"],
-            "description": recipe.get("description", "")
+            "title": favorite["title"],
+            "description": favorite["description"],
+            "ingredients": favorite["ingredients"],
+            "steps": favorite["steps"]
         }
-        for recipe in friend_favorites_cursor
+        for favorite in map(as_favorite, friend_favorites_cursor)
     ]
 
     return friend_favorites_list
 
 @app.get("/user/friends")
-def get_user_friends(user_id: str = Depends(get_current_user)):
+def get_user_friends(
+    response: Response,
+    user_id: str = Depends(get_current_user),
+    if_none_match: str | None = Header(None)
+):
     """
     Return a list of the current user's friends.
+    Answers 304 Not Modified when If-None-Match matches the current ETag.
     """
+    cached = not_modified(response, if_none_match, user_id, versions.FRIENDS)
+    if cached:
+        return cached
+
     # Get the current user's profile
     user_doc = user_profiles.find_one({"user_id": user_id})
     if not user_doc:
@@ -559,3 +1271,179 @@ def get_user_friends(user_id: str = Depends(get_current_user)):
             "picture": doc.get("picture", "")
         })
     return friend_list
+
+
+@app.get("/user/friends_with_favorites")
+def get_user_friends_with_favorites(
+    response: Response,
+    skip: int = Query(0, ge=0, description="Number of friends to skip (paging)."),
+    limit: int = Query(50, ge=1, le=500, description="Maximum number of friends to return."),
+    recipes_per_friend: int = Query(5, ge=1, le=50, description="Maximum favorites returned per friend."),
+    user_id: str = Depends(get_current_user)
+):
+    """
+    Return a page of the current user's friends with their favorite recipes filled in.
+
+    This replaces calling /user/friends followed by one /user/friend_favorites request
+    per friend. Everything is answered by a single aggregation on user_profiles:
+      - 1) Slice the requested page out of the user's 'friends' array
+      - 2) $lookup each friend's profile
+      - 3) $lookup each friend's favorites, keeping the newest `recipes_per_friend`
+           and counting all of them
+    The total number of friends is returned in the X-Total-Count header.
+    Requires MongoDB 5.2+ (concise $lookup syntax and $firstN).
+    """
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$project": {
+            "_id": 0,
+            "total": {"$size": {"$ifNull": ["$friends", []]}},
+            "friends": {"$slice": [{"$ifNull": ["$friends", []]}, skip, limit]}
+        }},
+        {"$unwind": {"path": "$friends", "includeArrayIndex": "position"}},
+        {"$lookup": {
+            "from": user_profiles.name,
+            "localField": "friends",
+            "foreignField": "user_id",
+            "pipeline": [{"$project": {"_id": 0, "name": 1, "email": 1, "picture": 1}}],
+            "as": "profile"
+        }},
+        {"$unwind": "$profile"},
+        {"$lookup": {
+            "from": favorite_recipes.name,
+            "localField": "friends",
+            "foreignField": "user_id",
+            "pipeline": [
+                {"$sort": {"_id": -1}},
+                {"$group": {
+                    "_id": None,
+                    "count": {"$sum": 1},
+                    "recipes": {"$firstN": {
+                        "input": {"title": "$title", "description": {"$ifNull": ["$description", ""]}},
+                        "n": recipes_per_friend
+                    }}
+                }}
+            ],
+            "as": "favorites"
+        }},
+        {"$sort": {"position": 1}}
+    ]
+
+    friend_list = []
+    total = 0
+    for doc in user_profiles.aggregate(pipeline):
+        total = doc["total"]
+        profile = doc["profile"]
+        favorites = doc["favorites"][0] if doc["favorites"] else {"count": 0, "recipes": []}
+        friend_list.append({
+            "id": doc["friends"],
+            "name": profile.get("name", ""),
+            "recipes": favorites["recipes"],
+            "recipes_count": favorites["count"],
+            "email": profile.get("email", ""),
+            "picture": profile.get("picture", "")
+        })
+
+    if not friend_list:
+        # Empty page (past the end, or no friend profiles); still report the total
+        user_doc = user_profiles.find_one({"user_id": user_id}, {"friends": 1})
+        total = len(user_doc.get("friends", [])) if user_doc else 0
+
+    response.headers["X-Total-Count"] = str(total)
+    return friend_list
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Return internal counters (cache hit rates, memory use, ...) as JSON.
+    Each section comes from a provider registered in metrics.py.
+    """
+    return metrics.snapshot()
+
+
+@app.get("/ready")
+def readiness(response: Response):
+    """
+    Readiness probe: 200 once this worker has warmed up, 503 while it is warming up
+    or draining (see lifecycle.py), with the warm-up timings.
+    """
+    if not lifecycle.is_ready():
+        response.status_code = 503
+    return lifecycle.stats()
+
+
+# -----------------------------------------------------------------------------
+# Admin: on-demand route profiling (see profiling.py)
+# -----------------------------------------------------------------------------
+route_profiler = RouteProfiler(app)
+
+def get_admin_user(user_id: str = Depends(get_current_user)) -> str:
+    """
+    Dependency that only lets through users listed in ADMIN_USER_IDS.
+    """
+    if not is_admin(user_id):
+        raise HTTPException(status_code=403, detail="Admin only")
+    return user_id
+
+@app.post("/admin/profile/arm")
+def arm_profiler(request: ProfileArmRequest, admin_id: str = Depends(get_admin_user)):
+    """
+    Profile the next `requests` calls of one route. Only one route can be armed at a time.
+    """
+    try:
+        session = route_profiler.arm(
+            request.path, request.method, request.requests, request.mode, request.interval_ms
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return session.status()
+
+@app.post("/admin/profile/disarm")
+def disarm_profiler(admin_id: str = Depends(get_admin_user)):
+    """
+    Stop profiling early. The profile collected so far can still be downloaded.
+    """
+    session = route_profiler.disarm()
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profile session")
+    return session.status()
+
+@app.get("/admin/profile")
+def get_profile_status(admin_id: str = Depends(get_admin_user)):
+    """
+    Status of the current (or last) profile session.
+    """
+    if route_profiler.session is None:
+        raise HTTPException(status_code=404, detail="No profile session")
+    return route_profiler.session.status()
+
+@app.get("/admin/profile/download")
+def download_profile(
+    format: str = Query("collapsed", pattern="^(collapsed|top|pstats)$"),
+    limit: int = Query(30, ge=1, le=500),
+    admin_id: str = Depends(get_admin_user)
+):
+    """
+    Download the aggregated profile:
+      - collapsed: collapsed stacks for flamegraph.pl or speedscope
+      - top: top-functions table (cProfile in deterministic mode, samples otherwise)
+      - pstats: cProfile data for snakeviz / pstats (deterministic mode only)
+    """
+    session = route_profiler.session
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profile session")
+    name = f"profile{session.route.path.replace('/', '_')}"
+    if format == "collapsed":
+        return PlainTextResponse(
+            session.collapsed(), headers={"Content-Disposition": f'attachment; filename="{name}.collapsed"'}
+        )
+    if format == "top":
+        return PlainTextResponse(session.top(limit))
+    data = session.pstats_bytes()
+    if data is None:
+        raise HTTPException(status_code=409, detail="pstats is only available for deterministic profiles")
+    return Response(
+        data, media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{name}.pstats"'}
+    )
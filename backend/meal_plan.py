@@ -0,0 +1,239 @@
+"""
+This file plans several meals at once from one fridge, for POST /fridge/meal_plan.
+
+The recipes of a plan must be cookable together: a fridge with two chicken breasts
+cannot feed seven chicken dinners, and seven variations of the same stir-fry are not
+a plan. Each meal is one single-recipe call (ML_functions.generate_recipe_slot_async),
+and:
+
+  1) at most MEAL_PLAN_CONCURRENCY meals are generated at a time, so one plan does not
+     take over the provider (the calls also queue in llm_scheduler.py);
+  2) each meal is offered a share of what the fridge has left: the units not used by a
+     planned meal nor offered to another meal in progress, divided over the meals still
+     to plan, rounded up (a scarce item goes whole to one meal rather than to none);
+  3) a finished recipe is matched against the fridge (ingredients.ingredient_key,
+     covered as in favorites_index.covers, pantry basics left out). It is kept if it
+     uses no more of any item than its share plus what nobody was offered, and is not
+     a near-duplicate of a planned meal: the same name, or canonical ingredient sets
+     with a Jaccard similarity of at least MEAL_PLAN_DUPLICATE_JACCARD. Otherwise the
+     meal is generated again with what is left, avoiding the planned names, up to
+     MEAL_PLAN_ATTEMPTS calls in all;
+  4) the meals are yielded as they complete, in whatever order that is.
+
+Fridge quantities are counts: a recipe line with a count ("2 eggs") uses that many
+units, a line with any other measure ("200 g chicken breast") uses one. Ingredients
+the fridge does not have are not rejected but reported as "missing", the plan's
+shopping list. GET /metrics shows the counters under "meal_plan".
+"""
+
+import asyncio
+import math
+import os
+import threading
+from collections import Counter, deque
+
+from favorites_index import covers, is_pantry
+from ingredients import canonical_name, ingredient_key, parse_quantity
+from recipe_cache import jaccard
+from ML_functions import RECIPE_SLOTS
+
+MEAL_PLAN_CONCURRENCY = int(os.getenv("MEAL_PLAN_CONCURRENCY", "3"))
+MEAL_PLAN_ATTEMPTS = int(os.getenv("MEAL_PLAN_ATTEMPTS", "3"))
+MEAL_PLAN_DUPLICATE_JACCARD = float(os.getenv("MEAL_PLAN_DUPLICATE_JACCARD", "0.8"))
+MEAL_PLAN_MAX_MEALS = int(os.getenv("MEAL_PLAN_MAX_MEALS", "21"))
+
+_lock = threading.Lock()
+_counters = {"plans": 0, "meals_planned": 0, "meals_failed": 0, "calls": 0,
+             "rejected_duplicate": 0, "rejected_over_budget": 0, "call_errors": 0}
+
+
+def line_units(line: str) -> int:
+    """
+    Fridge units used by one recipe line: its count if it starts with one ("2 eggs",
+    "1 1/2 onions", "a dozen eggs"), otherwise one.
+    """
+    words = str(line).split()
+    for size in (2, 1):
+        parsed = parse_quantity(" ".join(words[:size])) if len(words) > size else None
+        if parsed is not None:
+            amount, unit = parsed
+            return max(1, math.ceil(amount)) if unit == "" else 1
+    return 1
+
+
+class MealPlanBudget:
+    """
+    The fridge of one plan: the units left per item (by canonical name), and the
+    share set aside for each meal being generated.
+    """
+
+    def __init__(self, fridge_contents: list, meals: int):
+        self.names = {}
+        self.left = Counter()
+        for name, quantity in fridge_contents:
+            key = ingredient_key(name)
+            if key and quantity > 0:
+                self.names.setdefault(key, name)
+                self.left[key] += int(quantity)
+        self.unplanned = meals  # neither planned nor given up
+        self.offered = {}       # meal -> Counter
+
+    def unoffered(self) -> Counter:
+        offered = Counter()
+        for share in self.offered.values():
+            offered.update(share)
+        return self.left - offered
+
+    def offer(self, meal: int) -> list:
+        """
+        Set the share of `meal` aside, and return it as the (name, quantity) list of its prompt.
+        """
+        self.offered.pop(meal, None)
+        waiting = max(1, self.unplanned - len(self.offered))
+        share = Counter({key: math.ceil(units / waiting) for key, units in self.unoffered().items()})
+        self.offered[meal] = share
+        return [(self.names[key], units) for key, units in share.items()]
+
+    def usage(self, recipe: dict) -> tuple:
+        """
+        (units of each fridge item the recipe uses, its lines the fridge does not have).
+        """
+        used, missing = Counter(), []
+        for line in recipe.get("ingredients", []):
+            key = ingredient_key(line)
+            if not key or is_pantry(key):
+                continue
+            fridge_key = key if key in self.names else next(
+                (fridge_key for fridge_key in self.names if covers(fridge_key, key)), None
+            )
+            if fridge_key is None:
+                missing.append(line)
+            else:
+                used[fridge_key] += line_units(line)
+        return used, missing
+
+    def fits(self, meal: int, used: Counter) -> bool:
+        share, free = self.offered.get(meal, Counter()), self.unoffered()
+        return all(units <= share[key] + free[key] for key, units in used.items())
+
+    def commit(self, meal: int, used: Counter):
+        self.offered.pop(meal, None)
+        self.left -= used
+        self.unplanned -= 1
+
+    def give_up(self, meal: int):
+        self.offered.pop(meal, None)
+        self.unplanned -= 1
+
+    def leftovers(self) -> list:
+        return [{"name": self.names[key], "quantity": units} for key, units in self.left.items()]
+
+    def described(self, used: Counter) -> list:
+        return [{"name": self.names[key], "quantity": units} for key, units in used.items()]
+
+
+def _count(**increments):
+    with _lock:
+        for name, value in increments.items():
+            _counters[name] += value
+
+
+async def plan_meals(fridge_contents: list, meals: int, generate, meals_per_day: int = 1,
+                     concurrency: int = MEAL_PLAN_CONCURRENCY, attempts: int = MEAL_PLAN_ATTEMPTS):
+    """
+    Plan `meals` meals from `fridge_contents`, (name, quantity) tuples. `generate(
+    ingredients_list, slot, avoid)` is a coroutine function returning one recipe
+    dictionary, or {"error": ...}. Yields, as dictionaries:
+
+      {"type": "plan", "meals", "mealsPerDay"}                           first;
+      {"type": "meal", "meal", "day", "recipe", "uses", "missing", "attempts"}
+                                                                          per planned meal;
+      {"type": "meal", "meal", "day", "error", "attempts"}               per meal given up;
+      {"type": "done", "planned", "failed", "rejected", "leftovers"}     last.
+
+    Meals and days are numbered from 1. Closing the generator (the client went away)
+    cancels the calls still running.
+    """
+    # --- Step 1: The fridge budget and the queue of meals --- #
+    budget = MealPlanBudget(fridge_contents, meals)
+    planned = []       # (name, canonical name, ingredient keys) of the meals kept
+    calls = Counter()  # meal -> calls made
+    rejected = Counter()
+    queue = deque(range(meals))
+    running = {}       # task -> meal
+    _count(plans=1)
+    yield {"type": "plan", "meals": meals, "mealsPerDay": meals_per_day}
+
+    def failure(meal, error):
+        budget.give_up(meal)
+        _count(meals_failed=1)
+        return {"type": "meal", "meal": meal + 1, "day": meal // meals_per_day + 1,
+                "error": error, "attempts": calls[meal]}
+
+    try:
+        while queue or running:
+            # --- Step 2: Start meals up to the concurrency limit, each with its share --- #
+            while queue and len(running) < concurrency:
+                meal = queue.popleft()
+                ingredients_list = budget.offer(meal)
+                if not ingredients_list:
+                    yield failure(meal, "Nothing is left in the fridge for this meal")
+                    continue
+                calls[meal] += 1
+                slot = RECIPE_SLOTS[(meal + calls[meal] - 1) % len(RECIPE_SLOTS)]
+                avoid = tuple(name for name, _, _ in planned)
+                running[asyncio.ensure_future(generate(ingredients_list, slot, avoid))] = meal
+                _count(calls=1)
+            if not running:
+                continue
+
+            # --- Step 3: Keep each finished recipe, or generate its meal again --- #
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                meal = running.pop(task)
+                try:
+                    recipe = task.result()
+                except Exception as e:
+                    recipe = {"error": str(e)}
+
+                if "error" in recipe:
+                    error = recipe["error"]
+                    _count(call_errors=1)
+                else:
+                    used, missing = budget.usage(recipe)
+                    name = canonical_name(recipe["name"])
+                    keys = frozenset(used) | frozenset(ingredient_key(line) for line in missing)
+                    if any(name == other or jaccard(keys, other_keys) >= MEAL_PLAN_DUPLICATE_JACCARD
+                           for _, other, other_keys in planned):
+                        error = "Only near-duplicates of the planned meals were proposed"
+                        rejected["duplicate"] += 1
+                        _count(rejected_duplicate=1)
+                    elif not budget.fits(meal, used):
+                        error = "The proposed recipes needed more than is left in the fridge"
+                        rejected["over_budget"] += 1
+                        _count(rejected_over_budget=1)
+                    else:
+                        budget.commit(meal, used)
+                        planned.append((recipe["name"], name, keys))
+                        _count(meals_planned=1)
+                        yield {"type": "meal", "meal": meal + 1, "day": meal // meals_per_day + 1,
+                               "recipe": recipe, "uses": budget.described(used), "missing": missing,
+                               "attempts": calls[meal]}
+                        continue
+
+                if calls[meal] < attempts:
+                    queue.appendleft(meal)
+                else:
+                    yield failure(meal, error)
+
+        # --- Step 4: What the plan leaves in the fridge --- #
+        yield {"type": "done", "planned": len(planned), "failed": meals - len(planned),
+               "rejected": dict(rejected), "leftovers": budget.leftovers()}
+    finally:
+        for task in running:
+            task.cancel()
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_counters, concurrency=MEAL_PLAN_CONCURRENCY, max_meals=MEAL_PLAN_MAX_MEALS)
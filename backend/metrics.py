@@ -0,0 +1,37 @@
+"""
+This file keeps a tiny registry of metric providers for the /metrics endpoint.
+
+Any module can register a function that returns a JSON-serializable dict:
+
+    metrics.register("read_cache", read_cache.stats)
+
+GET /metrics then returns {"read_cache": {...}, ...} with one section per provider.
+"""
+
+import threading
+
+_providers = {}
+_lock = threading.Lock()
+
+
+def register(name: str, provider):
+    """
+    Register (or replace) the provider for a section of the /metrics output.
+    """
+    with _lock:
+        _providers[name] = provider
+
+
+def snapshot() -> dict:
+    """
+    Collect the current values from every registered provider.
+    """
+    with _lock:
+        providers = dict(_providers)
+    result = {}
+    for name, provider in providers.items():
+        try:
+            result[name] = provider()
+        except Exception as e:
+            result[name] = {"error": str(e)}
+    return result
@@ -0,0 +1,92 @@
+"""
+Online migration of fridges from the one-document-per-item layout (fridge_items) to
+the one-document-per-user layout (fridges). See fridge_store.py.
+
+Steps:
+  1) Deploy every worker with FRIDGE_LAYOUT=migrating. From then on no worker writes
+     to fridge_items anymore: a user's first write moves their fridge first.
+  2) Run this tool. It walks the user IDs in fridge_items in batches and moves each
+     user the same way, so it is safe to run while the app serves traffic, to stop
+     and to re-run (users already moved are skipped).
+  3) When it reports nothing left, deploy with FRIDGE_LAYOUT=document.
+
+Usage (from the backend folder, with MONGODB_URI and MONGODB_DB set like the app):
+
+    python migrate_fridge_layout.py --batch-size 500 --pause-ms 100
+    python migrate_fridge_layout.py --dry-run
+"""
+
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+
+from fridge_store import ItemsFridgeStore, DocumentFridgeStore, MigratingFridgeStore
+
+
+def user_id_batches(fridge_items, batch_size: int):
+    """
+    Yield lists of distinct user IDs in fridge_items, in order, `batch_size` at a time.
+    Pages by the last user ID seen, so each batch uses the (user_id, name) index.
+    """
+    last_user_id = None
+    while True:
+        match = {"user_id": {"$gt": last_user_id}} if last_user_id is not None else {}
+        batch = [doc["_id"] for doc in fridge_items.aggregate([
+            {"$match": match},
+            {"$sort": {"user_id": 1}},
+            {"$group": {"_id": "$user_id"}},
+            {"$sort": {"_id": 1}},
+            {"$limit": batch_size},
+        ])]
+        if not batch:
+            return
+        yield batch
+        last_user_id = batch[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause-ms", type=float, default=100, help="pause between batches, to limit the load")
+    parser.add_argument("--dry-run", action="store_true", help="only count the users left to move")
+    args = parser.parse_args()
+
+    load_dotenv()
+    uri = os.getenv("MONGODB_URI")
+    if not uri:
+        raise ValueError("MONGODB_URI environment variable is not set. Please check your .env file.")
+    db = MongoClient(uri, server_api=ServerApi('1'))[os.getenv("MONGODB_DB", "fridge")]
+
+    items_store = ItemsFridgeStore(db["fridge_items"])
+    store = MigratingFridgeStore(items_store, DocumentFridgeStore(db["fridges"]))
+    store.ensure_indexes()
+
+    users = moved = already_moved = 0
+    started = time.monotonic()
+    for batch in user_id_batches(items_store.collection, args.batch_size):
+        users += len(batch)
+        if args.dry_run:
+            continue
+        for user_id in batch:
+            if store.migrate_user(user_id):
+                moved += 1
+            else:
+                # The app moved this user first; migrate_user still deleted leftovers
+                already_moved += 1
+        elapsed = time.monotonic() - started
+        print(f"{users} users: {moved} moved, {already_moved} already moved ({users / elapsed:.0f} users/s)")
+        time.sleep(args.pause_ms / 1000)
+
+    if args.dry_run:
+        print(f"{users} users still have fridge_items documents")
+    else:
+        left = items_store.collection.estimated_document_count()
+        print(f"Done: {moved} moved, {already_moved} already moved; fridge_items has ~{left} documents left")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,45 @@ models into their own file, we maintain a clear, modular structure that is
 easy to understand and maintain.
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import List
 
+from ingredients import split_ingredients
+
+def ingredient_items(value):
+    """
+    Ingredients as one string are split into items; image-style {"name", "quantity"}
+    items are written as "<quantity> <name>".
+    """
+    if isinstance(value, str):
+        return split_ingredients(value)
+    if isinstance(value, list):
+        return [f"{item.get('quantity', '')} {item.get('name', '')}".strip() if isinstance(item, dict) else item
+                for item in value]
+    return value
+
+def joined_steps(value):
+    """
+    Steps as a list are joined with newlines.
+    """
+    if isinstance(value, list):
+        return "\n".join(str(step) for step in value)
+    return value
+
 class FavoriteRecipe(BaseModel):
+    """
+    Model for adding or removing a favorite. Older clients only send the title and a
+    description; newer ones send the whole recipe, which is stored and searchable.
+    """
     title: str
-    description: str
+    description: str = ""
+    ingredients: List[str] = Field([], description="Ingredients of the recipe, one per item")
+    steps: str = Field("", description="Step by step recipe")
     isFavorited: bool  # Indicates if the recipe is favorited
 
+    _split_ingredients = field_validator("ingredients", mode="before")(ingredient_items)
+    _join_steps = field_validator("steps", mode="before")(joined_steps)
+
 class RemoveFavoriteRequest(BaseModel):
     title: str  # Only expecting title when removing
     
@@ -68,20 +99,42 @@ class RemoveItemResponse(BaseModel):
 class GenerateSuggestionsResponse(BaseModel):
     """
     Model for the response returned by the /fridge/generate endpoint.
-    Contains a list of recipe or cooking suggestions, each as a string.
+    Contains a list of recipe or cooking suggestions, each as a string, and the
+    structured pairing results they were written from.
     """
     # A list of suggestions, each as a string
     suggestions: List[str] = Field(..., description="List of cooking suggestions.")
+    pairings: List[dict] = Field([], description="Ingredients that pair well with the fridge: ingredient, score, with")
+    one_away: List[dict] = Field([], description="Ingredients completing known recipes: ingredient, recipes, recipe_count")
+
+
+class Recipe(BaseModel):
+    """
+    Model for one generated recipe, validated from the model's function call arguments.
+    The ingredients may come as one string (split into items) or as a list, and the
+    steps as one string or as a list of steps (joined with newlines).
+    """
+    name: str = Field(..., min_length=1, description="The short name of the recipe")
+    ingredients: List[str] = Field(..., min_length=1, description="Ingredients required, one per item")
+    steps: str = Field(..., min_length=1, description="Detailed, step by step recipe")
+
+    _split_ingredients = field_validator("ingredients", mode="before")(ingredient_items)
+    _join_steps = field_validator("steps", mode="before")(joined_steps)
 
 
 class GenerateRecipesResponse(BaseModel):
     """
     Model for the response returned by the /fridge/recipes endpoint.
     Contains a structured JSON response with recipe details.
+    In fan-out mode with a deadline, a recipe not ready in time is
+    {"pending": true, "slot_id": "..."} (see GET /fridge/recipe_slot/{slot_id}).
+    In a "partial" answer, a slot nothing could be found for in time is {"error": "..."}.
     """
     recipe1: dict = Field(..., description="First recipe with name, ingredients, and steps")
     recipe2: dict = Field(..., description="Second recipe with name, ingredients, and steps")
     recipe3: dict = Field(..., description="Third recipe with name, ingredients, and steps")
+    omitted_ingredients: List[str] = Field([], description="Fridge items left out of the prompt to keep it within the token budget")
+    tier: str = Field("full", description="What served the recipes: cached, similar, full, fast or partial (see deadlines.py)")
 
 
 class RecipePreferences(BaseModel):
@@ -95,6 +148,17 @@ class RecipePreferences(BaseModel):
     allergens: List[str] = Field([], description="List of allergens to avoid")
 
 
+class MealPlanRequest(BaseModel):
+    """
+    Model for the request body of /fridge/meal_plan: how many meals to plan, as
+    `days` x `mealsPerDay` or as `meals` directly, and the preferences for all of them.
+    """
+    days: int | None = Field(None, ge=1, description="Number of days to plan")
+    meals: int | None = Field(None, ge=1, description="Number of meals to plan; overrides days")
+    mealsPerDay: int = Field(1, ge=1, le=5, description="Meals per day")
+    preferences: RecipePreferences = Field(default_factory=RecipePreferences, description="Preferences for every meal")
+
+
 class ImageRecipeResponse(BaseModel):
     """
     Model for the response returned by the /fridge/load_from_image endpoint.
@@ -103,6 +167,36 @@ class ImageRecipeResponse(BaseModel):
     ingredients: List[dict] = Field(..., description="List of ingredients with quantities detected in the image")
 
 
+class ImageScanFailure(BaseModel):
+    """
+    One image that could not be processed by /fridge/load_from_images.
+    """
+    filename: str = Field(..., description="Name of the uploaded file")
+    error: str = Field(..., description="Why the image could not be processed")
+
+
+class MultiImageRecipeResponse(BaseModel):
+    """
+    Model for the response returned by the /fridge/load_from_images endpoint.
+    Contains the merged, de-duplicated ingredients detected across all images,
+    plus the images that failed (the others are still returned).
+    """
+    ingredients: List[dict] = Field(..., description="Merged list of ingredients with quantities")
+    images_processed: int = Field(..., description="Number of images that were processed successfully")
+    failed: List[ImageScanFailure] = Field([], description="Images that could not be processed")
+
+
+class ProfileArmRequest(BaseModel):
+    """
+    Model for arming the on-demand route profiler (/admin/profile/arm).
+    """
+    path: str = Field(..., description="Route path as declared, e.g. /fridge/generate_recipes")
+    method: str = Field("GET", description="HTTP method of the route")
+    requests: int = Field(10, ge=1, le=1000, description="Number of requests to profile")
+    mode: str = Field("sampling", description="sampling or deterministic")
+    interval_ms: float = Field(5, ge=1, le=1000, description="Sampling interval in milliseconds")
+
+
 class UserProfile(BaseModel):
     """
     Model for user profile information.
@@ -0,0 +1,343 @@
+"""
+This file implements the local ingredient pairing engine behind /fridge/suggestions:
+no LLM call, just lookups in precomputed sparse matrices.
+
+The model is built by build_pairings.py (on a schedule) from every user's fridge and
+from recipes (favorites and recently generated recipes), with ingredients reduced to
+canonical names (ingredients.ingredient_key). It holds:
+  1) a co-occurrence matrix S (vocabulary x vocabulary, scipy CSR): S[i, j] is how
+     often i and j appear together, normalized by how common each is
+     (count(i, j) / sqrt(count(i) * count(j))), keeping the PAIRINGS_TOP_K strongest
+     partners of each ingredient;
+  2) a recipe matrix R (recipes x vocabulary, CSR, 1 where the recipe uses the
+     ingredient) with the recipe titles, pantry basics left out.
+Scoring a fridge f (the vocabulary IDs of its items) is then:
+  - "pairs well with": the column sums of S[f], fridge items excluded, top ones first;
+  - "one ingredient away": recipes where R @ f covers all but one ingredient, grouped
+    by that missing ingredient.
+
+The arrays are written as .npy files next to a manifest.json (replaced atomically,
+last), and loaded with mmap_mode="r": every worker process on a machine shares one
+copy through the page cache, and loading a new model costs no parsing. Workers pick up
+a new manifest within PAIRINGS_RELOAD_SECONDS. GET /metrics shows the counters under
+"pairings".
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from scipy import sparse
+
+from favorites_index import is_pantry
+from ingredients import ingredient_key
+
+DIRECTORY = os.getenv("PAIRINGS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pairings_data"))
+RELOAD_SECONDS = float(os.getenv("PAIRINGS_RELOAD_SECONDS", "30"))
+TOP_K = int(os.getenv("PAIRINGS_TOP_K", "50"))
+MIN_COUNT = 2  # ingredients seen fewer times than this are left out of the vocabulary
+MANIFEST = "manifest.json"
+ARRAYS = ("pair_data", "pair_indices", "pair_indptr", "recipe_indices", "recipe_indptr")
+
+
+def basket(names, key=ingredient_key) -> list:
+    """
+    The distinct canonical ingredient names in a fridge or recipe, pantry basics left out.
+    """
+    keys = {key(name) for name in names}
+    return sorted(key for key in keys if key and not is_pantry(key))
+
+
+# --- Building --- #
+
+def _top_k_per_row(matrix: sparse.csr_matrix, k: int) -> sparse.csr_matrix:
+    """
+    Keep the `k` largest entries of every row.
+    """
+    rows, cols, values = [], [], []
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        if end - start > k:
+            keep = start + np.argpartition(matrix.data[start:end], -k)[-k:]
+        else:
+            keep = np.arange(start, end)
+        rows.append(np.full(len(keep), row, dtype=np.int32))
+        cols.append(matrix.indices[keep])
+        values.append(matrix.data[keep])
+    if not rows:
+        return sparse.csr_matrix(matrix.shape, dtype=np.float32)
+    return sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=matrix.shape, dtype=np.float32
+    )
+
+
+def _incidence(baskets: list, ids: dict) -> sparse.csr_matrix:
+    """
+    Baskets x vocabulary CSR matrix, 1 where a basket holds an ingredient.
+    """
+    indptr = [0]
+    indices = []
+    for names in baskets:
+        indices.extend(ids[name] for name in names if name in ids)
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.float32)
+    return sparse.csr_matrix((data, np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+                             shape=(len(baskets), len(ids)))
+
+
+def build_model(fridges, recipes, directory: str = DIRECTORY, top_k: int = TOP_K,
+                min_count: int = MIN_COUNT) -> dict:
+    """
+    Build and write a model. `fridges` yields lists of item names, `recipes` yields
+    (title, ingredient lines). Returns the new manifest.
+    """
+    # --- Step 1: Reduce everything to baskets of canonical names --- #
+    key = functools.lru_cache(maxsize=200000)(ingredient_key)  # the same names come up again and again
+    fridge_baskets = [names for names in (basket(fridge, key) for fridge in fridges) if names]
+    recipe_baskets = []
+    titles = []
+    for title, ingredients in recipes:
+        names = basket(ingredients, key)
+        if len(names) >= 2:
+            recipe_baskets.append(names)
+            titles.append(title)
+
+    # --- Step 2: The vocabulary: names seen at least `min_count` times --- #
+    counts = {}
+    for names in fridge_baskets + recipe_baskets:
+        for name in names:
+            counts[name] = counts.get(name, 0) + 1
+    vocabulary = sorted(name for name, count in counts.items() if count >= min_count)
+    ids = {name: index for index, name in enumerate(vocabulary)}
+
+    # --- Step 3: Co-occurrence counts, normalized, strongest partners only --- #
+    baskets = _incidence(fridge_baskets + recipe_baskets, ids)
+    cooccurrence = (baskets.T @ baskets).tocsr()
+    totals = cooccurrence.diagonal().astype(np.float32)
+    cooccurrence.setdiag(0)
+    cooccurrence.eliminate_zeros()
+    norms = np.sqrt(np.maximum(totals, 1))
+    rows = np.repeat(np.arange(len(vocabulary)), np.diff(cooccurrence.indptr))
+    cooccurrence.data = (cooccurrence.data / (norms[rows] * norms[cooccurrence.indices])).astype(np.float32)
+    pairs = _top_k_per_row(cooccurrence, top_k)
+    pairs.sort_indices()
+
+    # --- Step 4: Recipes whose ingredients are all in the vocabulary, once each --- #
+    complete = {}
+    for index, names in enumerate(recipe_baskets):
+        if all(name in ids for name in names):
+            complete.setdefault((titles[index].strip().lower(), tuple(names)), index)
+    complete = sorted(complete.values())
+    recipe_matrix = _incidence([recipe_baskets[index] for index in complete], ids)
+    titles = [titles[index] for index in complete]
+
+    # --- Step 5: Write the arrays, then the manifest that points at them --- #
+    os.makedirs(directory, exist_ok=True)
+    previous = read_manifest(directory)
+    generation = (previous["generation"] + 1) if previous else 1
+    arrays = {
+        "pair_data": pairs.data.astype(np.float32),
+        "pair_indices": pairs.indices.astype(np.int32),
+        "pair_indptr": pairs.indptr.astype(np.int64),
+        "recipe_indices": recipe_matrix.indices.astype(np.int32),
+        "recipe_indptr": recipe_matrix.indptr.astype(np.int64),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{generation}.{name}.npy"), array)
+    manifest = {
+        "generation": generation,
+        "built_at": time.time(),
+        "fridges": len(fridge_baskets),
+        "recipes": len(titles),
+        "vocabulary": vocabulary,
+        "titles": titles,
+    }
+    temporary = os.path.join(directory, MANIFEST + ".tmp")
+    with open(temporary, "w") as f:
+        json.dump(manifest, f)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+
+    # Older generations can go; workers still mapping them keep their pages (Linux)
+    for filename in os.listdir(directory):
+        prefix = filename.split(".", 1)[0]
+        if prefix.isdigit() and int(prefix) < generation - 1:
+            os.remove(os.path.join(directory, filename))
+    return manifest
+
+
+def read_manifest(directory: str = DIRECTORY) -> dict | None:
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# --- Serving --- #
+
+class PairingModel:
+    """
+    A model loaded from disk, its arrays memory-mapped.
+    """
+
+    def __init__(self, directory: str, manifest: dict):
+        generation = manifest["generation"]
+        arrays = {name: np.load(os.path.join(directory, f"{generation}.{name}.npy"), mmap_mode="r")
+                  for name in ARRAYS}
+        size = len(manifest["vocabulary"])
+        self.generation = generation
+        self.vocabulary = manifest["vocabulary"]
+        self.ids = {name: index for index, name in enumerate(self.vocabulary)}
+        self.titles = manifest["titles"]
+        self.pairs = sparse.csr_matrix((arrays["pair_data"], arrays["pair_indices"], arrays["pair_indptr"]),
+                                       shape=(size, size), copy=False)
+        recipe_indices, recipe_indptr = arrays["recipe_indices"], arrays["recipe_indptr"]
+        self.recipe_indices = recipe_indices
+        self.recipe_indptr = recipe_indptr
+        self.recipes = sparse.csr_matrix(
+            (np.ones(len(recipe_indices), dtype=np.float32), recipe_indices, recipe_indptr),
+            shape=(len(self.titles), size), copy=False
+        )
+        self.recipe_sizes = np.diff(recipe_indptr)
+        self.recipe_rows = np.repeat(np.arange(len(self.titles), dtype=np.int32), self.recipe_sizes)
+
+    def lookup(self, name: str) -> int | None:
+        """
+        Vocabulary ID of a fridge item, dropping leading words until a known name is
+        left ("shredded cheddar cheese" -> "cheddar cheese").
+        """
+        words = ingredient_key(name).split()
+        while words:
+            index = self.ids.get(" ".join(words))
+            if index is not None:
+                return index
+            words.pop(0)
+        return None
+
+    def suggest(self, fridge_names, pairs: int = 5, one_away: int = 5) -> dict:
+        """
+        {"pairings": [{"ingredient", "score", "with"}], "one_away": [{"ingredient",
+        "recipes", "recipe_count"}]} for a fridge.
+        """
+        fridge = np.array(sorted({index for index in map(self.lookup, fridge_names) if index is not None}),
+                          dtype=np.int32)
+        result = {"pairings": [], "one_away": []}
+        if len(fridge) == 0:
+            return result
+
+        # --- Step 1: Pairs well with: sum the fridge items' rows of S --- #
+        rows = self.pairs[fridge]
+        scores = np.asarray(rows.sum(axis=0)).ravel()
+        scores[fridge] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates):
+            top = candidates[np.argsort(-scores[candidates], kind="stable")[:pairs]]
+            contributions = rows[:, top].toarray()  # fridge items x top candidates
+            for column, index in enumerate(top):
+                partners = np.argsort(-contributions[:, column], kind="stable")[:2]
+                result["pairings"].append({
+                    "ingredient": self.vocabulary[index],
+                    "score": round(float(scores[index]), 4),
+                    "with": [self.vocabulary[fridge[row]] for row in partners if contributions[row, column] > 0],
+                })
+
+        # --- Step 2: One ingredient away: recipes missing exactly one ingredient --- #
+        if self.recipes.shape[0]:
+            in_fridge = np.zeros(len(self.vocabulary), dtype=np.float32)
+            in_fridge[fridge] = 1
+            missing = self.recipe_sizes - (self.recipes @ in_fridge).astype(np.int64)
+            # Every (recipe, ingredient) entry of R where the recipe misses just that one
+            entries = np.flatnonzero((in_fridge[self.recipe_indices] == 0) & (missing[self.recipe_rows] == 1))
+            needed = self.recipe_indices[entries]
+            counts = np.bincount(needed, minlength=len(self.vocabulary))
+            for index in np.argsort(-counts, kind="stable")[:one_away]:
+                if counts[index] == 0:
+                    break
+                recipes = self.recipe_rows[entries[needed == index][:3]]
+                result["one_away"].append({
+                    "ingredient": self.vocabulary[index],
+                    "recipes": [self.titles[recipe] for recipe in recipes],
+                    "recipe_count": int(counts[index]),
+                })
+        return result
+
+
+class PairingEngine:
+    """
+    The current model of a directory, reloaded when build_pairings.py writes a new one.
+    """
+
+    def __init__(self, directory: str = DIRECTORY, reload_seconds: float = RELOAD_SECONDS):
+        self.directory = directory
+        self.reload_seconds = reload_seconds
+        self.model = None
+        self._manifest_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.load_errors = 0
+        self.suggestions = 0
+        self.without_model = 0
+
+    def current(self) -> PairingModel | None:
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_seconds and self._checked_at:
+            return self.model
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(os.path.join(self.directory, MANIFEST)).st_mtime_ns
+            except FileNotFoundError:
+                return self.model
+            if mtime != self._manifest_mtime:
+                try:
+                    self.model = PairingModel(self.directory, read_manifest(self.directory))
+                    self.loads += 1
+                except Exception as e:
+                    self.load_errors += 1
+                    print(f"Could not load the pairing model from {self.directory}: {e}")
+                self._manifest_mtime = mtime
+            return self.model
+
+    def suggest(self, fridge_names, pairs: int = 5, one_away: int = 5) -> dict | None:
+        """
+        Suggestions for a fridge, or None while no model has been built.
+        """
+        model = self.current()
+        if model is None:
+            self.without_model += 1
+            return None
+        self.suggestions += 1
+        return model.suggest(fridge_names, pairs, one_away)
+
+    def stats(self) -> dict:
+        model = self.model
+        return {
+            "generation": model.generation if model else None,
+            "vocabulary": len(model.vocabulary) if model else 0,
+            "recipes": len(model.titles) if model else 0,
+            "loads": self.loads,
+            "load_errors": self.load_errors,
+            "suggestions": self.suggestions,
+            "without_model": self.without_model,
+        }
+
+
+def record_recipes(collection, recipes: dict):
+    """
+    Keep the ingredient lists of generated recipes for the next build (best effort).
+    """
+    documents = [
+        {"title": recipe["name"], "ingredients": list(recipe["ingredients"]), "created_at": datetime.now(timezone.utc)}
+        for recipe in recipes.values()
+        if isinstance(recipe, dict) and recipe.get("name") and isinstance(recipe.get("ingredients"), list)
+    ]
+    try:
+        if documents:
+            collection.insert_many(documents)
+    except Exception as e:
+        print(f"Error recording generated recipes: {e}")
@@ -0,0 +1,8 @@
+"""
+Performance tooling for the backend: benchmarks, load generators and test doubles.
+
+Nothing in this package is imported by the running application. Every module is a
+script meant to be run from the backend folder, for example:
+
+    python -m perf.bench_friends_favorites --friends 500
+"""
@@ -0,0 +1,122 @@
+"""
+Benchmark: deadline-aware recipe generation (deadlines.py) for several latency budgets.
+
+The app runs in this process with mongomock and the fake LLM server (perf/fake_llm.py),
+whose full recipe model (--full-ttft-ms, --full-tokens-per-second) is much slower than
+the fast one (--fast-ttft-ms, --fast-tokens-per-second). Every user has a small fridge
+and one favorite cookable with it. --warmup requests without a deadline first teach
+the app how long the full model takes; then, for each budget in --budgets-ms, --requests
+generations (--concurrency at a time, each for a different user so no call is shared)
+are sent with X-Request-Deadline-Ms. This prints, per budget, the latency percentiles,
+how many answers came after the deadline, and which tier served them.
+
+Usage (from the backend folder):
+
+    python -m perf.bench_deadlines --budgets-ms 1000 2500 6000 25000 --requests 40
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import jwt
+
+from perf.common import summarize, print_table
+from perf.fake_llm import create_app, start_in_thread, LatencyModel
+from perf.stack import patch_mongomock
+
+FRIDGE = [("chicken breast", 2), ("rice", 1), ("broccoli", 1), ("soy sauce", 1), ("egg", 6), ("spinach", 1)]
+FAVORITE = {"title": "Chicken Fried Rice", "ingredients": ["1 cup rice", "1 chicken breast", "2 eggs"],
+            "steps": "Fry.", "isFavorited": True}
+TIERS = ("cached", "similar", "full", "fast", "partial")
+
+
+def headers(user_id: str) -> dict:
+    token = jwt.encode({"sub": user_id, "name": user_id, "email": f"{user_id}@example.com"},
+                       os.getenv("SECRET_KEY", "default-secret-key"), algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def new_user(client: httpx.AsyncClient, user_id: str) -> dict:
+    user_headers = headers(user_id)
+    for name, quantity in FRIDGE:
+        await client.post("/fridge/add", json={"name": name, "quantity": quantity}, headers=user_headers)
+    await client.post("/recipes/favorite", json=FAVORITE, headers=user_headers)
+    return user_headers
+
+
+async def run_budget(client, users, budget_ms, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, tiers = [], Counter()
+
+    async def one(user_headers):
+        async with semaphore:
+            request_headers = dict(user_headers)
+            if budget_ms:
+                request_headers["X-Request-Deadline-Ms"] = str(budget_ms)
+            start = time.perf_counter()
+            response = await client.post("/fridge/generate_recipes", json={}, headers=request_headers)
+            latencies.append((time.perf_counter() - start) * 1000)
+            tiers[response.json().get("tier", "error") if response.status_code == 200 else "error"] += 1
+
+    await asyncio.gather(*(one(next(users)) for _ in range(requests)))
+    latency = summarize(latencies)
+    row = {
+        "budget_ms": budget_ms or "none",
+        "p50_ms": latency["p50_ms"],
+        "p99_ms": latency.get("p99_ms", latency["max_ms"]),
+        "late_pct": 100.0 * sum(1 for ms in latencies if budget_ms and ms > budget_ms) / len(latencies),
+    }
+    row.update({f"{tier}_pct": 100.0 * tiers[tier] / requests for tier in TIERS + ("error",)})
+    return row
+
+
+async def bench(args, app_url: str) -> list:
+    import deadlines
+
+    async with httpx.AsyncClient(base_url=app_url, timeout=120) as client:
+        users = itertools.cycle([await new_user(client, f"bench-{i}") for i in range(args.requests)])
+        await run_budget(client, users, None, args.warmup, args.concurrency)
+        print(f"Learned model latencies: {deadlines.stats()['expected_seconds']}")
+        return [await run_budget(client, users, budget, args.requests, args.concurrency)
+                for budget in args.budgets_ms]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budgets-ms", type=int, nargs="+", default=[1000, 2500, 6000, 25000])
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--full-ttft-ms", type=float, default=1500)
+    parser.add_argument("--full-tokens-per-second", type=float, default=150)
+    parser.add_argument("--fast-ttft-ms", type=float, default=200)
+    parser.add_argument("--fast-tokens-per-second", type=float, default=800)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TRACE_SLOW_MS", "1e9")  # no span trees for every slow generation
+    patch_mongomock()
+    model_latency = {}  # filled once ML_functions says which model is the fast one
+    llm_url, _ = start_in_thread(create_app(
+        LatencyModel(args.full_ttft_ms, 0.2, args.full_tokens_per_second, seed=1), model_latency=model_latency
+    ))
+    os.environ.update(GROQ_BASE_URL=f"{llm_url}/openai/v1", GROQ_API_KEY="fake")
+    from ML_functions import RECIPE_FAST_MODEL
+    model_latency[RECIPE_FAST_MODEL] = LatencyModel(args.fast_ttft_ms, 0.2, args.fast_tokens_per_second, seed=2)
+    import main as app_module
+    app_url, _ = start_in_thread(app_module.app)
+
+    rows = asyncio.run(bench(args, app_url))
+    print()
+    print_table(rows, ["budget_ms", "p50_ms", "p99_ms", "late_pct"] + [f"{tier}_pct" for tier in TIERS])
+
+
+if __name__ == "__main__":
+    main()
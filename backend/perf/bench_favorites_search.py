@@ -0,0 +1,129 @@
+"""
+Benchmark: searching a user's favorites with the inverted index (favorites_index.py)
+versus scanning every favorite, for "q=<word>" searches and for "what can I cook with
+my fridge" (cookable=true).
+
+Synthetic favorites (--favorites per user, each with 5-12 ingredients written the way
+the models write them, e.g. "2 cups cooked rice", plus a few whose ingredients are
+unknown, as older clients saved them) are indexed in memory, with a fridge of --fridge
+items. Favorites with unknown ingredients must never be cookable. Both paths return the same favorites; the scan baseline computes
+the ingredient keys on every search, as a query over the stored documents would.
+Also reported: the time to build one user's index (after a restart, or a write by
+another worker) and to apply one added favorite.
+
+Usage (from the backend folder):
+
+    python -m perf.bench_favorites_search --favorites 200 500 2000 --fridge 15
+"""
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perf.common import time_calls, print_table
+from perf.bench_prompt_budget import BASE_NAMES, QUALIFIERS
+from favorites_index import favorite_ingredients
+
+AMOUNTS = ["1", "2", "1/2", "3", "1 1/2", "200g", "a pinch of", "2 tbsp.", "1 cup", "4 large"]
+DISHES = ["Bowl", "Stir Fry", "Bake", "Soup", "Salad", "Omelette", "Tacos", "Curry", "Skillet", "Pasta"]
+
+
+def synthetic_favorites(count: int, rnd: random.Random) -> list:
+    favorites = []
+    for i in range(count):
+        names = rnd.sample(BASE_NAMES, rnd.randint(5, 12))
+        favorites.append({
+            "id": str(i),
+            "title": f"{names[0].title()} {rnd.choice(DISHES)} #{i}",
+            "description": "",
+            "ingredients": [f"{rnd.choice(AMOUNTS)} {rnd.choice(QUALIFIERS)} {name}".replace("  ", " ")
+                            for name in names] + ["Salt and pepper to taste"],
+            "steps": "Cook everything.",
+        })
+    # Saved without ingredients: an empty list, or the app's "Unknown Recipe" fallback
+    favorites.append({"id": "empty", "title": "Nothing Listed", "description": "", "ingredients": [], "steps": ""})
+    favorites.append({"id": "unknown", "title": "Unknown Recipe", "description": "\n\nMix and serve.",
+                      "ingredients": favorite_ingredients({"description": "\n\nMix and serve."}), "steps": ""})
+    return favorites
+
+
+def scan_search(favorites: list, query: str, fridge_names, max_missing: int) -> list:
+    from favorites_index import words, is_pantry, covers
+    from ingredients import ingredient_key
+    terms = words(query)
+    fridge_keys = [ingredient_key(name) for name in fridge_names or ()]
+    result = []
+    for favorite in favorites:
+        keys = {key for key in map(ingredient_key, favorite["ingredients"]) if key}
+        if fridge_names is not None and not keys:
+            continue  # unknown ingredients: not cookable
+        searchable = set(words(favorite["title"])).union(*(key.split() for key in keys))
+        if not all(term in searchable for term in terms):
+            continue
+        if fridge_names is not None:
+            missing = [key for key in keys
+                       if not is_pantry(key) and not any(covers(fridge_key, key) for fridge_key in fridge_keys)]
+            if len(missing) > max_missing:
+                continue
+        result.append(favorite["title"])
+    return sorted(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--favorites", type=int, nargs="+", default=[200, 500, 2000])
+    parser.add_argument("--fridge", type=int, default=15)
+    parser.add_argument("--max-missing", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from favorites_index import UserFavoritesIndex
+
+    rnd = random.Random(args.seed)
+    fridge_names = rnd.sample(BASE_NAMES, min(args.fridge, len(BASE_NAMES)))
+    rows = []
+    for count in args.favorites:
+        favorites = synthetic_favorites(count, rnd)
+
+        def build():
+            index = UserFavoritesIndex(0)
+            for favorite in favorites:
+                index.add(favorite)
+            return index
+
+        index = build()
+        extra = synthetic_favorites(1, rnd)[0]
+        cases = [("q=rice", "rice", None), ("q=chicken rice", "chicken rice", None),
+                 ("cookable", "", fridge_names)]
+        for label, query, fridge in cases:
+            def indexed():
+                titles = index.search(query)
+                if fridge is None:
+                    return sorted(titles)
+                return sorted(index.missing_ingredients(fridge, titles, args.max_missing))
+
+            assert indexed() == scan_search(favorites, query, fridge, args.max_missing), label
+            if fridge is not None:
+                assert not {"Nothing Listed", "Unknown Recipe"} & set(indexed()), "unknown ingredients cookable"
+                assert not index.missing_ingredients([], index.search(""), 0).keys() & {"Nothing Listed", "Unknown Recipe"}
+            rows.append({
+                "favorites": count,
+                "search": label,
+                "matches": len(indexed()),
+                "index_p50_ms": time_calls(indexed, repeat=50)["p50_ms"],
+                "scan_p50_ms": time_calls(lambda: scan_search(favorites, query, fridge, args.max_missing),
+                                          repeat=10)["p50_ms"],
+            })
+        build_ms = time_calls(build, repeat=5, warmup=1)["p50_ms"]
+        add_ms = time_calls(lambda: index.add(dict(extra)), repeat=50)["p50_ms"]
+        for row in rows[-len(cases):]:
+            row.update(build_ms=build_ms, add_ms=add_ms)
+
+    print_table(rows, ["favorites", "search", "matches", "index_p50_ms", "scan_p50_ms", "build_ms", "add_ms"])
+
+
+if __name__ == "__main__":
+    main()
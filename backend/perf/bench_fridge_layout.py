@@ -0,0 +1,100 @@
+"""
+Benchmark: fridge storage layouts (fridge_store.py) at 10, 100 and 1000 items per user.
+
+For each fridge size, one user is seeded in each layout and these operations are timed
+directly against the stores (no HTTP, no cache), against the MongoDB in MONGODB_URI:
+  - read:         load the whole fridge
+  - inc:          add 1 to an existing item
+  - set:          set an existing item's quantity
+  - add+remove:   add a new item, then remove it
+  - write+read:   inc followed by a full read, which is what every fridge endpoint does
+
+Usage (from the backend folder):
+
+    python -m perf.bench_fridge_layout --sizes 10 100 1000 --repeat 50
+
+The data goes to a database created for the run ("fridge_bench_layout_<pid>_<time>",
+whatever MONGODB_DB says), which is dropped afterwards.
+--mongo mock runs against mongomock, which only checks that the script works.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perf.common import time_calls, print_table, scratch_database
+from perf.stack import patch_mongomock
+
+BENCH_USER = "bench_user"
+
+
+def seed(store, size: int):
+    store.delete_user(BENCH_USER)
+    for i in range(size):
+        store.increment(BENCH_USER, f"ingredient {i:04d}", 1 + i % 5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--mongo", choices=["real", "mock"], default="real")
+    args = parser.parse_args()
+
+    if args.mongo == "mock":
+        patch_mongomock()
+    from dotenv import load_dotenv
+    from pymongo.mongo_client import MongoClient
+    from pymongo.server_api import ServerApi
+
+    load_dotenv()
+    client = MongoClient(os.environ["MONGODB_URI"], server_api=ServerApi('1'))
+    db = client[scratch_database("fridge_bench_layout")]
+    try:
+        run(args, db)
+    finally:
+        client.drop_database(db.name)
+
+
+def run(args, db):
+    from fridge_store import ItemsFridgeStore, DocumentFridgeStore
+
+    stores = {"items": ItemsFridgeStore(db["fridge_items"]), "document": DocumentFridgeStore(db["fridges"])}
+    for store in stores.values():
+        store.ensure_indexes()
+
+    rows = []
+    for size in args.sizes:
+        for layout, store in stores.items():
+            print(f"Seeding {size} items ({layout})...")
+            seed(store, size)
+            existing = "ingredient 0000"
+
+            def add_remove():
+                store.increment(BENCH_USER, "bench extra", 1)
+                store.set_quantity(BENCH_USER, "bench extra", 0)
+
+            def write_read():
+                store.increment(BENCH_USER, existing, 1)
+                store.load_rows(BENCH_USER)
+
+            operations = {
+                "read": lambda: store.load_rows(BENCH_USER),
+                "inc": lambda: store.increment(BENCH_USER, existing, 1),
+                "set": lambda: store.set_quantity(BENCH_USER, existing, 3),
+                "add+remove": add_remove,
+                "write+read": write_read,
+            }
+            assert len(store.load_rows(BENCH_USER)) == size
+            for operation, fn in operations.items():
+                rows.append({"items": size, "layout": layout, "operation": operation,
+                             **time_calls(fn, repeat=args.repeat, warmup=3)})
+
+    print()
+    print_table(rows, ["items", "layout", "operation", "mean_ms", "p50_ms", "p95_ms", "max_ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: friends list with favorites, N+1 requests vs. the aggregated endpoint.
+
+The app used to load the friends screen with GET /user/friends followed by one
+GET /user/friend_favorites per friend. /user/friends_with_favorites answers the same
+question with one request and one aggregation. This script seeds a scratch database
+with one user who has N friends (each with a few favorites), then times both patterns
+in-process through FastAPI's TestClient against the real MongoDB in MONGODB_URI.
+
+Usage (from the backend folder, with MONGODB_URI pointing at a test MongoDB 5.2+):
+
+    python -m perf.bench_friends_favorites --friends 500 --favorites 10
+
+The data goes to a database created for the run ("fridge_bench_friends_<pid>_<time>",
+whatever MONGODB_DB says), which is dropped afterwards.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perf.common import time_calls, print_table, scratch_database
+
+# Point the app at a database of this run's own before it is imported: it is dropped at the end
+os.environ["MONGODB_DB"] = scratch_database("fridge_bench_friends")
+
+import jwt
+from fastapi.testclient import TestClient
+
+import main
+from routers.login import SECRET_KEY, ALGORITHM
+
+BENCH_USER = "bench_user"
+
+
+def seed(num_friends, favorites_per_friend):
+    """
+    Create one user with `num_friends` friends, each with `favorites_per_friend` favorites.
+    """
+    friend_ids = [f"bench_friend_{i:05d}" for i in range(num_friends)]
+    main.user_profiles.insert_one({"user_id": BENCH_USER, "name": "Bench User", "friends": friend_ids})
+    main.user_profiles.insert_many([
+        {"user_id": fid, "name": f"Friend {i}", "email": f"{fid}@example.com", "picture": ""}
+        for i, fid in enumerate(friend_ids)
+    ])
+    main.favorite_recipes.insert_many([
+        {"user_id": fid, "title": f"Recipe {j} of {fid}", "description": "Ingredients...\n\nSteps..." * 5}
+        for fid in friend_ids
+        for j in range(favorites_per_friend)
+    ])
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--friends", type=int, default=500)
+    parser.add_argument("--favorites", type=int, default=10, help="favorites per friend")
+    parser.add_argument("--per-friend", type=int, default=5, help="recipes_per_friend for the aggregated endpoint")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"Seeding {args.friends} friends x {args.favorites} favorites into '{main.db.name}'...")
+    try:
+        run(args)
+    finally:
+        main.client.drop_database(main.db.name)
+
+
+def run(args):
+    seed(args.friends, args.favorites)
+
+    token = jwt.encode({"sub": BENCH_USER, "name": "Bench User"}, SECRET_KEY, algorithm=ALGORITHM)
+    client = TestClient(main.app, headers={"Authorization": f"Bearer {token}"})
+
+    def n_plus_one():
+        friends = client.get("/user/friends").json()
+        for friend in friends:
+            client.get("/user/friend_favorites", params={"friend_id": friend["id"]}).json()
+        return friends
+
+    def aggregated():
+        return client.get(
+            "/user/friends_with_favorites",
+            params={"limit": args.friends, "recipes_per_friend": args.per_friend}
+        ).json()
+
+    # Sanity check: both patterns see the same friends
+    assert len(n_plus_one()) == len(aggregated()) == args.friends
+
+    rows = [
+        {"pattern": "friends + N x friend_favorites", "requests": args.friends + 1,
+         **time_calls(n_plus_one, repeat=args.repeat, warmup=1)},
+        {"pattern": "friends_with_favorites", "requests": 1,
+         **time_calls(aggregated, repeat=args.repeat, warmup=1)},
+    ]
+    print()
+    print_table(rows, ["pattern", "requests", "mean_ms", "p50_ms", "p95_ms", "max_ms"])
+    print("\nTimings are in-process (no network); each extra request also costs a real round trip on a phone.")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,86 @@
+"""
+Benchmark: the local pairing engine behind /fridge/suggestions (pairings.py).
+
+A synthetic population of --fridges fridges and --recipes recipes is drawn from a
+vocabulary of ~700 ingredient names with skewed (Zipf-like) popularity, so a few
+ingredients are in most fridges and most are rare. This reports:
+  - the time to build and write the model, and its size on disk;
+  - the time for a worker to load it (memory-mapped, so mostly the manifest);
+  - the latency of suggestions for fridges of several sizes (p50 / p99), which the
+    endpoint's target is under 10 ms for.
+
+Usage (from the backend folder):
+
+    python -m perf.bench_pairings --fridges 100000 --recipes 20000 --fridge-sizes 10 50 200
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perf.common import time_calls, print_table
+from perf.bench_prompt_budget import BASE_NAMES, QUALIFIERS
+
+
+def population(size: int, rnd: random.Random):
+    names = [f"{qualifier} {base}".strip() for qualifier in QUALIFIERS for base in BASE_NAMES]
+    rnd.shuffle(names)
+    weights = [1 / (rank + 1) for rank in range(len(names))]
+    return names[:size] if size else names, weights
+
+
+def draw(names: list, weights: list, count: int, rnd: random.Random) -> list:
+    return list(set(rnd.choices(names, weights=weights, k=count)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fridges", type=int, default=100000)
+    parser.add_argument("--recipes", type=int, default=20000)
+    parser.add_argument("--fridge-sizes", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    import pairings
+
+    rnd = random.Random(args.seed)
+    names, weights = population(0, rnd)
+    fridges = [draw(names, weights, rnd.randint(5, 40), rnd) for _ in range(args.fridges)]
+    recipes = [(f"Recipe {i}", draw(names, weights, rnd.randint(4, 10), rnd)) for i in range(args.recipes)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        manifest = pairings.build_model(fridges, recipes, directory, top_k=args.top_k)
+        build_s = time.perf_counter() - started
+        disk_mb = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory)) / 1e6
+        load_ms = time_calls(lambda: pairings.PairingModel(directory, pairings.read_manifest(directory)),
+                             repeat=10)["p50_ms"]
+        print(f"Built {len(manifest['vocabulary'])} ingredients, {manifest['recipes']} recipes from "
+              f"{manifest['fridges']} fridges in {build_s:.1f}s; {disk_mb:.1f} MB on disk; load p50 {load_ms:.1f} ms")
+
+        model = pairings.PairingModel(directory, manifest)
+        rows = []
+        for size in args.fridge_sizes:
+            samples = [draw(names, weights, size * 3, rnd)[:size] for _ in range(50)]
+            cursor = iter(samples * 10)
+            stats = time_calls(lambda: model.suggest(next(cursor)), repeat=200, warmup=5)
+            example = model.suggest(samples[0])
+            rows.append({
+                "fridge_items": size,
+                "p50_ms": stats["p50_ms"],
+                "p99_ms": stats.get("p99_ms", stats["max_ms"]),
+                "pairings": len(example["pairings"]),
+                "one_away": len(example["one_away"]),
+            })
+    print()
+    print_table(rows, ["fridge_items", "p50_ms", "p99_ms", "pairings", "one_away"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark: recipe prompt size and end-to-end latency for large fridges, with and
+without the input token budget (prompt_budget.py).
+
+A synthetic fridge of --items items (default 500) is built, plus a few items that match
+the preferences used (a Mexican cuisine preference and a nut allergy). For each budget
+in --budgets (0 = no limit) this reports:
+  - the prompt size (characters and estimated tokens) and how many items were kept;
+  - the time to fit and build the prompt;
+  - the latency (and completion tokens) of a whole generate_delicious_recipes_async
+    call against the fake LLM server (perf/fake_llm.py) started in this process. Its
+    first-token delay grows with the prompt at --prefill-tokens-per-second, on top of
+    --ttft-ms.
+
+Usage (from the backend folder):
+
+    python -m perf.bench_prompt_budget --items 500 --budgets 0 4000 2000 1000 --repeat 10
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perf.common import time_calls, summarize, print_table
+from perf.fake_llm import create_app, start_in_thread, LatencyModel
+
+BASE_NAMES = [
+    "egg", "milk", "butter", "cheddar cheese", "chicken breast", "broccoli", "carrot", "onion",
+    "garlic", "tomato", "spinach", "rice", "pasta", "bell pepper", "yogurt", "lemon", "potato",
+    "mushroom", "bacon", "tofu", "apple", "ham", "salmon", "ground beef", "zucchini", "lettuce",
+    "cucumber", "strawberry", "blueberry", "orange juice", "cream cheese", "sour cream", "ketchup",
+    "mustard", "pickle", "olive", "hummus", "bread", "tortilla", "corn", "pea", "green bean",
+]
+QUALIFIERS = [
+    "", "organic", "frozen", "fresh", "leftover", "sliced", "smoked", "low-fat", "homemade",
+    "canned", "chopped", "baby", "wild", "spicy", "roasted", "diced",
+]
+PREFERENCES = {"isVegan": False, "isSpicy": True, "cuisines": ["Mexican"], "allergens": ["Nuts"]}
+RELEVANT = [("avocado", 2), ("black beans", 1), ("jalapeno", 3), ("peanut butter", 1), ("cashews", 1)]
+
+
+def synthetic_fridge(size: int, seed: int) -> list:
+    """
+    `size` distinct (name, quantity) items, in the order they were "added".
+    """
+    rnd = random.Random(seed)
+    names = [f"{qualifier} {base}".strip() for qualifier in QUALIFIERS for base in BASE_NAMES]
+    rnd.shuffle(names)
+    names = names[:size - len(RELEVANT)]
+    while len(names) < size - len(RELEVANT):
+        names.append(f"item {len(names)}")
+    fridge = [(name, rnd.randint(1, 6)) for name in names]
+    for item in RELEVANT:
+        fridge.insert(rnd.randrange(len(fridge) + 1), item)
+    return fridge
+
+
+async def time_generations(generate, fridge: list, repeat: int) -> list:
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await generate(fridge, PREFERENCES)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--budgets", type=int, nargs="+", default=[0, 4000, 2000, 1000])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--tokens-per-second", type=float, default=250)
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=3000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    llm_url, server = start_in_thread(create_app(LatencyModel(
+        args.ttft_ms, 0.2, args.tokens_per_second, args.seed, args.prefill_tokens_per_second
+    )))
+    # Read by ML_functions at import time
+    os.environ["GROQ_BASE_URL"] = f"{llm_url}/openai/v1"
+    os.environ.setdefault("GROQ_API_KEY", "fake")
+    import llm_calls
+    import prompt_budget
+    from ML_functions import build_recipe_prompt, fit_recipe_ingredients, generate_delicious_recipes_async
+
+    fridge = synthetic_fridge(args.items, args.seed)
+    rows = []
+    try:
+        for budget in args.budgets:
+            prompt_budget.TOKEN_BUDGET = budget
+            print(f"Budget {budget or 'unlimited'}...")
+
+            def build():
+                kept, omitted = fit_recipe_ingredients(fridge, PREFERENCES, build_recipe_prompt([], PREFERENCES))
+                return build_recipe_prompt(kept, PREFERENCES), kept, omitted
+
+            prompt_text, kept, omitted = build()
+            build_ms = time_calls(build, repeat=50, warmup=3)["p50_ms"]
+            tokens_before = llm_calls.stats().get("recipes", {}).get("completion_tokens", 0)
+            latencies = asyncio.run(time_generations(generate_delicious_recipes_async, fridge, args.repeat))
+            completion_tokens = llm_calls.stats()["recipes"]["completion_tokens"] - tokens_before
+            stats = summarize(latencies)
+            rows.append({
+                "budget": budget or "none",
+                "items_kept": len(kept),
+                "prompt_chars": len(prompt_text),
+                "prompt_tokens": round(prompt_budget.estimate_tokens(prompt_text)),
+                "build_ms": build_ms,
+                "p50_ms": stats["p50_ms"],
+                "p95_ms": stats["p95_ms"],
+                "completion_tokens": completion_tokens // args.repeat,
+                "kept_relevant": ", ".join(name for name, _ in RELEVANT if name not in omitted),
+            })
+    finally:
+        server.should_exit = True
+
+    print()
+    print_table(rows, ["budget", "items_kept", "prompt_chars", "prompt_tokens", "build_ms", "p50_ms", "p95_ms",
+                       "completion_tokens", "kept_relevant"])
+    print("\nThe synthetic answers differ in length between prompts; compare latencies with completion_tokens.")
+
+
+if __name__ == "__main__":
+    main()
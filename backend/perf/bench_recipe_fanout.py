@@ -0,0 +1,117 @@
+"""
+Benchmark: recipe generation with one call for all three recipes versus the fan-out
+mode (one concurrent call per recipe slot, see generate_recipes_fanout_async).
+
+Both paths run the real code in ML_functions.py against the fake LLM server
+(perf/fake_llm.py) started in this process, so the numbers only depend on the latency
+model: time to first token (--ttft-ms, log-normal) and the completion token rate
+(--tokens-per-second; ~250 is typical of a 70B model on Groq, ~80 of GPT-4o). Each
+mode makes --repeat generations, --concurrency at a time, and reports the latency of a
+whole generation plus the completion tokens used. With --deadline-ms, a third row shows
+the fan-out mode answering at the deadline, with the slots not done by then pending.
+
+Usage (from the backend folder):
+
+    python -m perf.bench_recipe_fanout --repeat 30 --ttft-ms 400 --tokens-per-second 250
+    python -m perf.bench_recipe_fanout --deadline-ms 1500
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perf.common import summarize, print_table
+from perf.fake_llm import create_app, start_in_thread, LatencyModel
+
+RECIPE_SLOTS = ("recipe1", "recipe2", "recipe3")
+
+FRIDGE = [
+    ("egg", 6), ("milk", 1), ("cheddar cheese", 1), ("spinach", 2), ("tomato", 4),
+    ("onion", 2), ("garlic", 3), ("chicken breast", 2), ("rice", 1), ("bell pepper", 2),
+]
+PREFERENCES = {"isVegan": False, "isSpicy": True, "cuisines": ["mexican"], "allergens": []}
+
+
+async def run_mode(generate, repeat: int, concurrency: int) -> tuple:
+    """
+    Run `generate()` `repeat` times, `concurrency` at a time. Returns (latencies in ms,
+    pending slots in the answers).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    pending = 0
+
+    async def one():
+        nonlocal pending
+        async with semaphore:
+            start = time.perf_counter()
+            recipes = await generate()
+            latencies.append((time.perf_counter() - start) * 1000)
+            pending += sum(1 for slot in RECIPE_SLOTS if recipes[slot].get("pending"))
+
+    await asyncio.gather(*(one() for _ in range(repeat)))
+    return latencies, pending
+
+
+def completion_tokens(llm_calls, kind: str) -> int:
+    return llm_calls.stats().get(kind, {}).get("completion_tokens", 0)
+
+
+async def main_async(args):
+    import llm_calls
+    from ML_functions import generate_delicious_recipes_async, generate_recipes_fanout_async
+
+    modes = [
+        ("single call", "recipes",
+         lambda: generate_delicious_recipes_async(FRIDGE, PREFERENCES)),
+        ("fan-out", "recipe_slot",
+         lambda: generate_recipes_fanout_async(FRIDGE, PREFERENCES)),
+    ]
+    if args.deadline_ms:
+        modes.append((f"fan-out, {args.deadline_ms:.0f} ms deadline", "recipe_slot",
+                      lambda: generate_recipes_fanout_async(FRIDGE, PREFERENCES, deadline=args.deadline_ms / 1000)))
+
+    rows = []
+    for label, kind, generate in modes:
+        print(f"Running {label}...")
+        tokens_before = completion_tokens(llm_calls, kind)
+        latencies, pending = await run_mode(generate, args.repeat, args.concurrency)
+        tokens = completion_tokens(llm_calls, kind) - tokens_before
+        rows.append({"mode": label, **summarize(latencies),
+                     "tokens_per_generation": tokens // args.repeat,
+                     "pending_slots": pending})
+
+    print()
+    print_table(rows, ["mode", "n", "mean_ms", "p50_ms", "p95_ms", "max_ms", "tokens_per_generation", "pending_slots"])
+    print("\nTokens of calls cancelled at the deadline are not counted.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--ttft-ms", type=float, default=400)
+    parser.add_argument("--ttft-sigma", type=float, default=0.35)
+    parser.add_argument("--tokens-per-second", type=float, default=250)
+    parser.add_argument("--deadline-ms", type=float, default=0, help="also run the fan-out mode with this deadline")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    llm_url, server = start_in_thread(create_app(LatencyModel(
+        args.ttft_ms, args.ttft_sigma, args.tokens_per_second, args.seed
+    )))
+    # Read by ML_functions at import time
+    os.environ["GROQ_BASE_URL"] = f"{llm_url}/openai/v1"
+    os.environ.setdefault("GROQ_API_KEY", "fake")
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
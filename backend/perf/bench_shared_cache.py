@@ -0,0 +1,122 @@
+"""
+Benchmark: the read cache with one in-process LRU per worker (cache.py) against one
+cache shared by all workers in memory-mapped storage (shared_cache.py).
+
+For each worker count in --workers, that many processes are forked and run
+--lookups read-through lookups each, at the same time, as uvicorn workers behind one
+socket would: the keys are ("fridge", user) for --users users, drawn with a Zipf-like
+skew (--skew), and a miss "loads" a fridge of 5-25 rows and caches it. A fraction
+--write-fraction of the operations are fridge writes, which invalidate the key (for
+the memory backend, only in the worker that took the write; the other copies stay
+stale until their TTL).
+
+Every backend gets --max-bytes of cache: per worker for "memory" (so N times the
+memory in total), once for "shared". This prints, per backend and worker count, the
+hit rate, how many loads reached the database, and the cost of a lookup.
+
+Usage (from the backend folder):
+
+    python -m perf.bench_shared_cache --workers 1 4 16 --users 5000 --lookups 20000
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perf.common import summarize, print_table
+from cache import LRUCache, MISSING
+from shared_cache import SharedCache
+
+
+def fridge_rows(rnd: random.Random) -> tuple:
+    return tuple((f"{rnd.getrandbits(96):024x}", f"ingredient {rnd.randint(1, 500)}", rnd.randint(1, 6))
+                 for _ in range(rnd.randint(5, 25)))
+
+
+def worker(cache_factory, args, seed: int, barrier, results):
+    cache = cache_factory()
+    rnd = random.Random(seed)
+    weights = [1 / (rank + 1) ** args.skew for rank in range(args.users)]
+    users = rnd.choices(range(args.users), weights=weights, k=args.lookups)
+    hit_ns, miss_ns = [], []
+    loads = 0
+    barrier.wait()
+    for user in users:
+        key = ("fridge", f"user-{user}")
+        if rnd.random() < args.write_fraction:
+            cache.invalidate(key)
+            continue
+        start = time.perf_counter_ns()
+        value = cache.get(key)
+        elapsed = time.perf_counter_ns() - start
+        if value is MISSING:
+            miss_ns.append(elapsed)
+            loads += 1
+            cache.put(key, fridge_rows(rnd))
+        else:
+            hit_ns.append(elapsed)
+    results.put({"hits": len(hit_ns), "loads": loads, "hit_ns": hit_ns, "miss_ns": miss_ns})
+
+
+def run(backend: str, workers: int, args) -> dict:
+    name = f"bench-shared-cache-{os.getpid()}-{workers}"
+    if backend == "shared":
+        os.environ["SERVE_GENERATION"] = name  # the workers share the table, as under serve.py
+        cache = SharedCache(name, args.max_bytes, args.ttl_seconds, slot_bytes=args.slot_bytes)
+        factory = lambda: SharedCache(name, args.max_bytes, args.ttl_seconds, slot_bytes=args.slot_bytes)
+    else:
+        factory = lambda: LRUCache(name, args.max_bytes, args.ttl_seconds)
+
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(factory, args, seed, barrier, results))
+                 for seed in range(workers)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    if backend == "shared":
+        os.unlink(cache.path)
+
+    hits = sum(outcome["hits"] for outcome in outcomes)
+    loads = sum(outcome["loads"] for outcome in outcomes)
+    hit_us = summarize([ns / 1000 for outcome in outcomes for ns in outcome["hit_ns"]])
+    miss_us = summarize([ns / 1000 for outcome in outcomes for ns in outcome["miss_ns"]])
+    return {
+        "backend": backend,
+        "workers": workers,
+        "hit_rate": round(hits / (hits + loads), 3) if hits + loads else 0.0,
+        "db_loads": loads,
+        "hit_p50_us": round(hit_us["p50_ms"], 2),
+        "hit_p99_us": round(hit_us["p99_ms"], 2),
+        "miss_p50_us": round(miss_us["p50_ms"], 2),
+        "cache_mib": round(args.max_bytes * (workers if backend == "memory" else 1) / 2 ** 20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--backends", nargs="+", choices=["memory", "shared"], default=["memory", "shared"])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=20000, help="per worker")
+    parser.add_argument("--skew", type=float, default=0.8)
+    parser.add_argument("--write-fraction", type=float, default=0.02)
+    parser.add_argument("--max-bytes", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--slot-bytes", type=int, default=2048)
+    parser.add_argument("--ttl-seconds", type=float, default=300)
+    args = parser.parse_args()
+
+    rows = [run(backend, workers, args) for workers in args.workers for backend in args.backends]
+    print_table(rows, list(rows[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark: response encodings offered by wire.py, for typical response payloads.
+
+For each payload the JSON body (as FastAPI serializes it) is re-encoded the way
+WireFormatMiddleware would for each Accept / Accept-Encoding combination, and this
+prints the bytes on the wire and the CPU cost of encoding (and of decoding, as a
+client would):
+  - recipes:        a GenerateRecipesResponse with three recipes
+  - fridge-N:       an AddItemResponse for a fridge of N items
+
+Usage (from the backend folder):
+
+    python -m perf.bench_wire_format --fridge-sizes 10 50 200 --repeat 200
+
+Variants whose library (msgpack, brotli) is not installed are skipped.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perf.common import time_calls, print_table
+
+import wire
+from models import AddItemResponse, FridgeItem, GenerateRecipesResponse
+
+INGREDIENTS = [
+    "egg", "milk", "butter", "cheddar cheese", "spinach", "tomato", "onion", "garlic",
+    "chicken breast", "rice", "black beans", "bell pepper", "carrot", "potato", "lemon",
+    "greek yogurt", "olive oil", "flour", "parsley", "mushroom",
+]
+
+
+def recipes_payload() -> bytes:
+    recipes = {}
+    for r in range(3):
+        names = INGREDIENTS[r * 4:r * 4 + 8]
+        recipes[f"recipe{r + 1}"] = {
+            "name": f"{names[0].title()} and {names[1]} skillet with {names[2]}",
+            "ingredients": [{"name": name, "quantity": f"{1 + i % 3} {['whole', 'cups', 'tbsp'][i % 3]}"}
+                            for i, name in enumerate(names)],
+            "steps": [f"Step {s + 1}: prepare the {names[s % len(names)]} and cook it over medium heat "
+                      f"for about {3 + s} minutes, stirring occasionally until golden."
+                      for s in range(8)],
+            "cooking_time": f"{25 + 5 * r} minutes",
+            "difficulty": ["easy", "medium", "easy"][r],
+        }
+    return json.dumps(GenerateRecipesResponse(**recipes).dict()).encode()
+
+
+def fridge_payload(size: int) -> bytes:
+    items = [FridgeItem(id=f"{0x64a1f0c2e4b0000000000000 + i:024x}",
+                        name=f"{INGREDIENTS[i % len(INGREDIENTS)]}{'' if i < len(INGREDIENTS) else f' {i}'}",
+                        quantity=1 + i % 6)
+             for i in range(size)]
+    response = AddItemResponse(message="Item 'egg' added successfully.", all_items=items)
+    return json.dumps(response.dict()).encode()
+
+
+def variants() -> list:
+    """
+    (label, to_msgpack, content encoding) for every combination the libraries allow.
+    """
+    formats = [("json", False)] + ([("msgpack", True)] if wire.msgpack is not None else [])
+    encodings = [None, "gzip"] + (["br"] if wire.brotli is not None else [])
+    return [(fmt + (f"+{encoding}" if encoding else ""), to_msgpack, encoding)
+            for fmt, to_msgpack in formats for encoding in encodings]
+
+
+def decoder(to_msgpack: bool, encoding: str | None):
+    def decode(body: bytes):
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "br":
+            body = wire.brotli.decompress(body)
+        return wire.msgpack.unpackb(body) if to_msgpack else json.loads(body)
+    return decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fridge-sizes", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    min_compress_bytes = wire.MIN_COMPRESS_BYTES
+    # Compress everything, so small payloads show what compression would cost them
+    wire.MIN_COMPRESS_BYTES = 0
+
+    payloads = {"recipes": recipes_payload()}
+    for size in args.fridge_sizes:
+        payloads[f"fridge-{size}"] = fridge_payload(size)
+
+    rows = []
+    for payload, body in payloads.items():
+        expected = json.loads(body)
+        for label, to_msgpack, encoding in variants():
+            encoded, _, _ = wire.encode_body(body, "application/json", to_msgpack, encoding)
+            decode = decoder(to_msgpack, encoding)
+            assert decode(encoded) == expected
+            encode_ms = time_calls(lambda: wire.encode_body(body, "application/json", to_msgpack, encoding),
+                                   repeat=args.repeat, warmup=5)["p50_ms"]
+            decode_ms = time_calls(lambda: decode(encoded), repeat=args.repeat, warmup=5)["p50_ms"]
+            rows.append({
+                "payload": payload, "variant": label, "bytes": len(encoded),
+                "ratio": len(encoded) / len(body), "encode_ms": encode_ms, "decode_ms": decode_ms,
+            })
+
+    print_table(rows, ["payload", "variant", "bytes", "ratio", "encode_ms", "decode_ms"])
+    print(f"\nThe middleware only compresses bodies of at least {min_compress_bytes} bytes.")
+
+
+if __name__ == "__main__":
+    main()
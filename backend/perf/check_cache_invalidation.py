@@ -0,0 +1,169 @@
+"""
+Check that the read cache (cache.py, and shared_cache.py across worker processes)
+never keeps a value loaded before an invalidation.
+
+A reader misses and starts loading; while its loader is still running (it has read
+the old value from the database), a writer changes the value and invalidates the key;
+then the loader returns. The old value must not end up in the cache: the next get()
+must miss, and the next get_or_load must return the new value. The interleaving is
+forced with events, so the check is deterministic. --rounds repeats it with random
+sleeps instead, many readers and writers racing freely; at the end no key may be
+cached with anything but its current value.
+
+The shared cache goes through the same checks, and one more across two processes: the
+slow load runs in a forked worker, and the write and invalidation in another, as
+under serve.py.
+
+Usage (from the backend folder):
+
+    python -m perf.check_cache_invalidation --rounds 2000
+
+Exits with status 1 on a stale value.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUCache, MISSING
+from shared_cache import SharedCache
+
+
+def fail(message):
+    print(f"STALE: {message}")
+    sys.exit(1)
+
+
+def check_interleaving(cache) -> None:
+    """
+    Loader reads, writer writes and invalidates, loader returns.
+    """
+    database = {"value": "old"}
+    key = ("fridge", "user-1")
+    loading, written = threading.Event(), threading.Event()
+
+    def slow_loader():
+        value = database["value"]
+        loading.set()
+        written.wait()
+        return value
+
+    reader = threading.Thread(target=cache.get_or_load, args=(key, slow_loader))
+    reader.start()
+    loading.wait()
+    database["value"] = "new"
+    cache.invalidate(key)
+    written.set()
+    reader.join()
+
+    cached = cache.get(key)
+    if cached is not MISSING:
+        fail(f"{cache.name}: the value loaded before the invalidation was cached ({cached!r})")
+    loaded = cache.get_or_load(key, lambda: database["value"])
+    if loaded != "new":
+        fail(f"{cache.name}: get_or_load returned {loaded!r} after the invalidation")
+    if cache.get(key) != "new":
+        fail(f"{cache.name}: the value loaded after the invalidation was not cached")
+    print(f"{cache.name}: forced interleaving OK")
+
+
+def check_races(cache, rounds: int, seed: int) -> None:
+    """
+    Readers and writers racing on a few keys; every write invalidates after writing.
+    """
+    database = {("fridge", f"user-{i}"): 0 for i in range(4)}
+    keys = list(database)
+    lock = threading.Lock()
+
+    def reader(rng):
+        for _ in range(rounds):
+            key = rng.choice(keys)
+
+            def loader():
+                value = database[key]
+                time.sleep(rng.random() / 10000)
+                return value
+            cache.get_or_load(key, loader)
+
+    def writer(rng):
+        for _ in range(rounds // 4):
+            key = rng.choice(keys)
+            with lock:
+                database[key] += 1
+            cache.invalidate(key)
+            time.sleep(rng.random() / 10000)
+
+    threads = [threading.Thread(target=reader, args=(random.Random(seed + i),)) for i in range(4)]
+    threads += [threading.Thread(target=writer, args=(random.Random(seed + 100 + i),)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for key in keys:
+        cached = cache.get(key)
+        if cached is not MISSING and cached != database[key]:
+            fail(f"{cache.name}: {key} cached as {cached}, the database has {database[key]}")
+    print(f"{cache.name}: {rounds} racing rounds OK ({cache.stats().get('stale_loads', 0)} stale loads dropped)")
+
+
+def slow_load_in_worker(create_cache, key, loading, written):
+    """
+    Worker A: read the old value, let worker B write and invalidate, then finish the load.
+    """
+    def slow_loader():
+        loading.set()
+        written.wait()
+        return "old"
+    create_cache().get_or_load(key, slow_loader)
+
+
+def check_across_workers(create_cache) -> None:
+    cache = create_cache()
+    key = ("fridge", "user-2")
+    context = multiprocessing.get_context("fork")
+    loading, written = context.Event(), context.Event()
+    worker = context.Process(target=slow_load_in_worker, args=(create_cache, key, loading, written))
+    worker.start()
+    loading.wait()
+    cache.invalidate(key)  # after the write to the database
+    written.set()
+    worker.join()
+
+    cached = cache.get(key)
+    if cached is not MISSING:
+        fail(f"{cache.name}: another worker cached the value it loaded before the invalidation ({cached!r})")
+    print(f"{cache.name}: forced interleaving across workers OK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    check_interleaving(LRUCache("memory", 1024 * 1024, 300))
+    check_races(LRUCache("memory", 1024 * 1024, 300), args.rounds, args.seed)
+
+    name = f"check-cache-invalidation-{os.getpid()}"
+    os.environ["SERVE_GENERATION"] = name  # the workers share the table, as under serve.py
+    create_cache = lambda: SharedCache(name, 1024 * 1024, 300)
+    shared = create_cache()
+    try:
+        check_interleaving(shared)
+        check_races(shared, args.rounds, args.seed)
+        shared.clear()
+        check_across_workers(create_cache)
+    finally:
+        os.unlink(shared.path)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
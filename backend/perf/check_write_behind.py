@@ -0,0 +1,120 @@
+"""
+Check the fridge write-behind buffer (writebehind.py) against the direct-write path.
+
+The same random sequence of /fridge/add, /fridge/remove and /fridge/update_quantity
+calls is sent for two users: one with the buffer switched off and one with it on.
+After every call the status codes and returned fridges must match; at the end the
+buffer is flushed and both users' documents in MongoDB must match too. Item ids of the
+buffered user must not change when their changes are flushed.
+
+Usage (from the backend folder):
+
+    python -m perf.check_write_behind --mongo mock --steps 2000 --seed 1
+
+With --mongo real it uses MONGODB_URI and MONGODB_DB (default "fridge_loadtest").
+Exits with status 1 on the first mismatch. tests/test_write_behind.py runs the same
+comparison against mongomock under pytest.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perf.stack import patch_mongomock
+
+NAMES = ["egg", "milk", "tomato", "onion"]
+
+
+def random_call(rng: random.Random) -> tuple:
+    name = rng.choice(NAMES)
+    kind = rng.choices(["add", "remove", "remove_all", "update"], weights=[5, 4, 1, 2])[0]
+    if kind == "add":
+        return "POST", "/fridge/add", {"name": name, "quantity": rng.randint(1, 3)}
+    if kind == "remove":
+        return "DELETE", "/fridge/remove", {"name": name, "quantity": rng.randint(1, 3)}
+    if kind == "remove_all":
+        return "DELETE", "/fridge/remove", {"name": name, "quantity": 1000000000}
+    return "PUT", "/fridge/update_quantity", {"name": name, "quantity": rng.randint(1, 5)}
+
+
+def fridge_state(items: list) -> list:
+    return sorted((item["name"], item["quantity"]) for item in items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", choices=["real", "mock"], default="real")
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--window-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    if args.mongo == "mock":
+        patch_mongomock()
+    os.environ.setdefault("MONGODB_DB", "fridge_loadtest")
+    os.environ["FRIDGE_WRITE_BEHIND_MS"] = str(args.window_ms)
+    os.environ.setdefault("TRACING_ENABLED", "0")
+
+    import jwt
+    from fastapi.testclient import TestClient
+    import main as backend
+    from routers.login import SECRET_KEY, ALGORITHM
+
+    buffer = backend.fridge_write_buffer
+    run_id = f"{os.getpid()}-{int(time.time())}"
+    users = {"direct": f"wb-check-direct-{run_id}", "buffered": f"wb-check-buffered-{run_id}"}
+    headers = {
+        mode: {"Authorization": "Bearer " + jwt.encode({"sub": user_id, "name": mode}, SECRET_KEY, algorithm=ALGORITHM)}
+        for mode, user_id in users.items()
+    }
+
+    def call(client, mode, method, path, body):
+        # The endpoints read the module-level buffer, so switch it per call
+        backend.fridge_write_buffer = buffer if mode == "buffered" else None
+        try:
+            return client.request(method, path, json=body, headers=headers[mode])
+        finally:
+            backend.fridge_write_buffer = buffer
+
+    def fail(message):
+        print(f"MISMATCH: {message}")
+        sys.exit(1)
+
+    rng = random.Random(args.seed)
+    with TestClient(backend.app) as client:  # runs the lifespan, so the flusher thread is on
+        for step in range(args.steps):
+            method, path, body = random_call(rng)
+            direct = call(client, "direct", method, path, body)
+            buffered = call(client, "buffered", method, path, body)
+            if direct.status_code != buffered.status_code:
+                fail(f"step {step} {method} {path} {body}: status {direct.status_code} != {buffered.status_code}")
+            if direct.status_code == 200:
+                if fridge_state(direct.json()["all_items"]) != fridge_state(buffered.json()["all_items"]):
+                    fail(f"step {step} {method} {path} {body}: {direct.json()['all_items']} != {buffered.json()['all_items']}")
+            if rng.random() < 0.05:
+                time.sleep(args.window_ms / 1000)  # let the background flush run now and then
+
+        ids_before = {row[1]: row[0] for row in backend.read_fridge_rows(users["buffered"])}
+    # Leaving the TestClient ran the shutdown flush
+
+    backend.read_cache.clear()
+    direct_rows = backend.load_fridge_rows(users["direct"])
+    buffered_rows = backend.load_fridge_rows(users["buffered"])
+    if sorted(row[1:] for row in direct_rows) != sorted(row[1:] for row in buffered_rows):
+        fail(f"final state {direct_rows} != {buffered_rows}")
+    ids_after = {row[1]: row[0] for row in buffered_rows}
+    if ids_before != ids_after:
+        fail(f"item ids changed on flush: {ids_before} != {ids_after}")
+
+    for user_id in users.values():
+        backend.fridge_store.delete_user(user_id)
+    print(f"OK: {args.steps} steps, final fridge {sorted(row[1:] for row in direct_rows)}")
+    print(f"Write-behind: {buffer.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Small helpers shared by the benchmark scripts in this package:
+timing a callable repeatedly, printing the results as a table, and naming the
+scratch databases they seed and drop.
+"""
+
+import os
+import statistics
+import time
+
+
+def scratch_database(prefix: str) -> str:
+    """
+    A database name of its own for this run, so dropping it afterwards can never hit
+    the app's database or another run's, whatever MONGODB_DB says.
+    """
+    return f"{prefix}_{os.getpid()}_{int(time.time())}"
+
+
+def time_calls(fn, repeat=20, warmup=2):
+    """
+    Call `fn` `warmup` times (discarded) and then `repeat` times, and return a dict
+    with the mean, median, p95 and max latency in milliseconds.
+    """
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return summarize(samples)
+
+
+def summarize(samples_ms):
+    """
+    Summarize a list of latency samples (milliseconds).
+    """
+    ordered = sorted(samples_ms)
+    if not ordered:
+        return {"n": 0, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    return {
+        "n": len(ordered),
+        "mean_ms": statistics.fmean(ordered),
+        "p50_ms": percentile(ordered, 50),
+        "p95_ms": percentile(ordered, 95),
+        "p99_ms": percentile(ordered, 99),
+        "max_ms": ordered[-1],
+    }
+
+
+def percentile(ordered, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def print_table(rows, columns):
+    """
+    Print a list of dicts as a fixed-width table using the given column names.
+    Floats are printed with two decimals.
+    """
+    def fmt(value):
+        return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+    widths = {col: max(len(col), *(len(fmt(row.get(col, ""))) for row in rows)) for col in columns}
+    print("  ".join(col.ljust(widths[col]) for col in columns))
+    print("  ".join("-" * widths[col] for col in columns))
+    for row in rows:
+        print("  ".join(fmt(row.get(col, "")).ljust(widths[col]) for col in columns))
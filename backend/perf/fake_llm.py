@@ -0,0 +1,560 @@
+"""
+A fake OpenAI-compatible chat-completions server for offline, deterministic perf tests.
+
+It implements the subset of POST /v1/chat/completions that ML_functions.py uses:
+function calling (`functions` + `function_call`, or `tools` + `tool_choice`), with and
+without `stream=True`. Three ways to produce an answer:
+
+  1) synthetic (default): build function-call arguments from the JSON schema in the
+     request. Recipe-shaped schemas are filled with the ingredients found in the prompt,
+     so the real parsing code in ML_functions.py runs on realistic output.
+  2) --replay CASSETTE: serve responses previously recorded from a real provider.
+  3) --record CASSETTE --upstream URL: forward requests to a real provider (using the
+     client's Authorization header), return the answer and append it to the cassette.
+
+Timing follows a latency model: time-to-first-token is drawn from a log-normal
+distribution (--ttft-ms median, --ttft-sigma), plus the prompt read at
+--prefill-tokens-per-second if given, then completion tokens are emitted at
+--tokens-per-second. Streaming responses are paced chunk by chunk. Replayed responses
+use their recorded timing unless --replay-timing model is given. Completions longer than
+max_tokens are cut off with finish_reason "length", like the real thing. Synthetic
+answers of a given model can follow their own latency (--model-latency, e.g. to make
+the fast recipe model of deadlines.py actually faster).
+
+Like the real providers it can enforce rate limits: --max-concurrent requests at a
+time, --requests-per-minute and --tokens-per-minute (see RateLimit). A request over a
+limit gets a 429 with Retry-After (see llm_scheduler.py for the client side).
+
+Usage (from the backend folder):
+
+    python -m perf.fake_llm --port 9100 --ttft-ms 400 --tokens-per-second 250
+
+and point the app at it:
+
+    GROQ_BASE_URL=http://127.0.0.1:9100/openai/v1 OPENAI_BASE_URL=http://127.0.0.1:9100/v1
+
+Both /v1/... and /openai/v1/... paths are served, so one server can stand in for Groq
+and OpenAI at the same time. For use inside another script, see `start_in_thread()`.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Roughly how many characters make one token for English text and JSON
+CHARS_PER_TOKEN = 4
+
+# Ingredients used when the prompt does not list any (e.g. image requests)
+_PANTRY = [
+    "egg", "milk", "butter", "cheddar cheese", "chicken breast", "broccoli", "carrot",
+    "onion", "garlic", "tomato", "spinach", "rice", "pasta", "bell pepper", "yogurt",
+    "lemon", "potato", "mushroom", "bacon", "tofu", "apple", "soy sauce", "ham",
+]
+
+
+class LatencyModel:
+    """
+    Time-to-first-token (log-normal around a median) plus a steady token rate.
+    With `prefill_tokens_per_second`, reading the prompt adds to the first-token delay.
+    """
+
+    def __init__(self, ttft_ms: float = 400, ttft_sigma: float = 0.35,
+                 tokens_per_second: float = 250, seed: int | None = None,
+                 prefill_tokens_per_second: float = 0):
+        self.ttft_ms = ttft_ms
+        self.ttft_sigma = ttft_sigma
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self._random = random.Random(seed)
+
+    def first_token_delay(self, prompt_tokens: int = 0) -> float:
+        prefill = prompt_tokens / self.prefill_tokens_per_second if self.prefill_tokens_per_second > 0 else 0.0
+        if self.ttft_ms <= 0:
+            return prefill
+        return prefill + self._random.lognormvariate(0, self.ttft_sigma) * self.ttft_ms / 1000
+
+    def token_delay(self, tokens: int) -> float:
+        if self.tokens_per_second <= 0:
+            return 0.0
+        return tokens / self.tokens_per_second
+
+
+class RateLimit:
+    """
+    Provider-side limits (0 = no limit): concurrent requests, and requests and tokens
+    per minute as buckets that refill continuously, like the real providers. A request
+    holds prompt + max_tokens from the token bucket until it finishes, then only what it
+    used. Used from the server's event loop only.
+    """
+
+    def __init__(self, max_concurrent: int = 0, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.max_concurrent = max_concurrent
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests = float(requests_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.refilled_at = time.monotonic()
+        self.active = 0
+        self.peak_active = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self.refilled_at = now - self.refilled_at, now
+        self.requests = min(self.requests_per_minute, self.requests + elapsed * self.requests_per_minute / 60)
+        self.tokens = min(self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute / 60)
+
+    def admit(self, tokens: int) -> float | None:
+        """
+        Admit a request (call release() when it is done), or return the seconds to wait.
+        """
+        self._refill()
+        if self.max_concurrent and self.active >= self.max_concurrent:
+            return 0.5
+        if self.requests_per_minute and self.requests < 1:
+            return (1 - self.requests) * 60 / self.requests_per_minute
+        if self.tokens_per_minute and self.tokens < tokens:
+            return (tokens - self.tokens) * 60 / self.tokens_per_minute
+        self.requests -= 1
+        self.tokens -= tokens
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        return None
+
+    def release(self, reserved: int = 0, used: int = 0):
+        self.active -= 1
+        if self.tokens_per_minute:
+            self.tokens = min(self.tokens_per_minute, self.tokens + reserved - used)
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def request_key(body: dict) -> str:
+    """
+    Cassette key: everything that determines the answer, not the sampling or streaming flags.
+    """
+    relevant = {name: body.get(name) for name in ("model", "messages", "functions", "function_call", "tools", "tool_choice")}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# --------------------------------------------------------------------------- #
+# Synthetic answers
+# --------------------------------------------------------------------------- #
+
+def prompt_text(body: dict) -> str:
+    """
+    Concatenate the text parts of all messages.
+    """
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(part.get("text", "") for part in content if part.get("type") == "text")
+    return "\n".join(parts)
+
+
+def prompt_ingredients(text: str) -> list:
+    """
+    Pull "name (quantity)" entries out of the recipe prompt built by ML_functions.py.
+    """
+    match = re.search(r"ingredients in their (?:freezer|fridge):\s*\n(.+)", text)
+    if not match:
+        return []
+    return [name.strip() for name in re.findall(r"([^,()]+?)\s*\(\d+\)", match.group(1)) if name.strip()]
+
+
+def synthesize_value(name: str, schema: dict, context: dict):
+    """
+    Produce a plausible value for one JSON-schema node. `context` carries the prompt's
+    ingredients, a seeded random generator and a running recipe counter.
+    """
+    kind = schema.get("type", "string")
+    rnd = context["random"]
+
+    if kind == "object":
+        if re.fullmatch(r"recipe\d*", name or ""):
+            context["recipe_index"] += 1
+        return {prop: synthesize_value(prop, sub, context) for prop, sub in schema.get("properties", {}).items()}
+
+    if kind == "array":
+        item_schema = schema.get("items", {"type": "string"})
+        if name == "ingredients":
+            # Image scans: a handful of visible ingredients with quantities
+            count = rnd.randint(4, 9)
+            picks = rnd.sample(_PANTRY, count)
+            return [
+                {"name": pick, "quantity": f"{rnd.randint(1, 6)} {rnd.choice(['whole', 'cups', 'g', 'pieces'])}"}
+                if item_schema.get("type") == "object" else pick
+                for pick in picks
+            ]
+        return [synthesize_value(name, item_schema, context) for _ in range(rnd.randint(2, 5))]
+
+    if kind in ("integer", "number"):
+        return rnd.randint(1, 10)
+    if kind == "boolean":
+        return rnd.random() < 0.5
+
+    # Strings: recipe-aware by property name
+    ingredients = context["ingredients"] or _PANTRY[:6]
+    if name == "name" or name == "title":
+        main = rnd.choice(ingredients).title()
+        style = rnd.choice(["Skillet", "Bake", "Stir-Fry", "Soup", "Salad", "Frittata", "Bowl", "Curry"])
+        return f"{main} {style} #{context['recipe_index']}"
+    if name == "ingredients":
+        picks = rnd.sample(ingredients, min(len(ingredients), rnd.randint(3, 7)))
+        return ", ".join(f"{rnd.randint(1, 4)} {rnd.choice(['cups', 'tbsp', 'pieces', 'oz'])} {pick}" for pick in picks)
+    if name == "steps":
+        steps = []
+        for number in range(1, rnd.randint(6, 10) + 1):
+            pick = rnd.choice(ingredients)
+            steps.append(
+                f"{number}. {rnd.choice(['Chop', 'Saute', 'Whisk', 'Simmer', 'Roast', 'Season'])} the {pick} "
+                f"over medium heat, stirring occasionally, until it is done (about {rnd.randint(2, 15)} minutes)."
+            )
+        return "\n".join(steps)
+    if name == "quantity":
+        return f"{rnd.randint(1, 6)} {rnd.choice(['whole', 'cups', 'g'])}"
+    return f"Synthetic {name or 'value'} {rnd.randint(1, 999)}"
+
+
+def synthesize_call(body: dict) -> tuple:
+    """
+    Return (function name, arguments JSON string) for the requested function call.
+    """
+    functions = body.get("functions") or [tool["function"] for tool in body.get("tools", []) if "function" in tool]
+    wanted = body.get("function_call") or (body.get("tool_choice") or {}).get("function")
+    function = functions[0] if functions else {"name": "answer", "parameters": {"type": "object", "properties": {}}}
+    if isinstance(wanted, dict):
+        function = next((f for f in functions if f["name"] == wanted.get("name")), function)
+
+    text = prompt_text(body)
+    context = {
+        "ingredients": prompt_ingredients(text),
+        # Same request -> same answer, so runs are reproducible
+        "random": random.Random(request_key(body)),
+        "recipe_index": 0,
+    }
+    arguments = synthesize_value("", function.get("parameters", {"type": "object"}), context)
+    return function["name"], json.dumps(arguments)
+
+
+def build_message(body: dict, name: str, arguments: str) -> dict:
+    """
+    Wrap a function call in the assistant message shape the request asked for.
+    """
+    if body.get("tools"):
+        return {"role": "assistant", "content": None, "tool_calls": [
+            {"id": "call_fake_0", "type": "function", "function": {"name": name, "arguments": arguments}}
+        ]}
+    return {"role": "assistant", "content": None, "function_call": {"name": name, "arguments": arguments}}
+
+
+def completion_response(body: dict, message: dict, finish_reason: str, completion_tokens: int) -> dict:
+    prompt_tokens = count_tokens(json.dumps(body.get("messages", [])))
+    return {
+        "id": f"chatcmpl-fake-{random.getrandbits(48):012x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+# --------------------------------------------------------------------------- #
+# Cassettes
+# --------------------------------------------------------------------------- #
+
+class Cassette:
+    """
+    Append-only JSONL file of recorded exchanges, keyed by request_key().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as handle:
+                for line in handle:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+
+    def get(self, key: str) -> dict | None:
+        return self.entries.get(key)
+
+    def record(self, key: str, body: dict, response: dict, ttft_ms: float, total_ms: float):
+        # Image payloads are huge; keep only their length in the cassette
+        request = json.loads(json.dumps({k: v for k, v in body.items() if k != "stream"}))
+        for message in request.get("messages", []):
+            if isinstance(message.get("content"), list):
+                for part in message["content"]:
+                    url = part.get("image_url", {}).get("url", "")
+                    if url.startswith("data:"):
+                        part["image_url"]["url"] = f"<data url, {len(url)} chars>"
+        entry = {"key": key, "request": request, "response": response, "ttft_ms": ttft_ms, "total_ms": total_ms}
+        with self._lock:
+            self.entries[key] = entry
+            with open(self.path, "a", encoding="utf-8") as handle:
+                handle.write(json.dumps(entry) + "\n")
+
+
+# --------------------------------------------------------------------------- #
+# Server
+# --------------------------------------------------------------------------- #
+
+def create_app(latency: LatencyModel, cassette: Cassette | None = None, mode: str = "synthetic",
+               upstream: str | None = None, replay_timing: str = "recorded", error_rate: float = 0.0,
+               chunk_tokens: int = 8, model_latency: dict | None = None,
+               rate_limit: RateLimit | None = None) -> FastAPI:
+    """
+    Build the fake server. `mode` is "synthetic", "replay" or "record".
+    `model_latency` maps model names to their own LatencyModel (synthetic answers).
+    """
+    app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+    app.state.stats = {"requests": 0, "streamed": 0, "replayed": 0, "recorded": 0, "errors_injected": 0,
+                       "rate_limited": 0, "peak_concurrent": 0}
+    failure_random = random.Random(1234)
+
+    async def obtain(body: dict, authorization: str | None):
+        """
+        Produce (message, finish_reason, ttft_s, generation_s) for a request.
+        """
+        key = request_key(body)
+        if mode in ("replay", "record") and cassette and cassette.get(key):
+            entry = cassette.get(key)
+            app.state.stats["replayed"] += 1
+            choice = entry["response"]["choices"][0]
+            if replay_timing == "recorded":
+                ttft = entry["ttft_ms"] / 1000
+                return choice["message"], choice["finish_reason"], ttft, max(0.0, entry["total_ms"] / 1000 - ttft)
+            tokens = entry["response"].get("usage", {}).get("completion_tokens", 100)
+            return choice["message"], choice["finish_reason"], latency.first_token_delay(), latency.token_delay(tokens)
+
+        if mode == "record":
+            upstream_body = dict(body, stream=False)
+            start = time.perf_counter()
+            async with httpx.AsyncClient(timeout=120) as client:
+                response = await client.post(
+                    f"{upstream.rstrip('/')}/chat/completions",
+                    json=upstream_body,
+                    headers={"Authorization": authorization or ""},
+                )
+            total_ms = (time.perf_counter() - start) * 1000
+            response.raise_for_status()
+            data = response.json()
+            # Non-streamed upstream calls give no first-token time; estimate it as 20% of the total
+            cassette.record(key, body, data, ttft_ms=total_ms * 0.2, total_ms=total_ms)
+            app.state.stats["recorded"] += 1
+            choice = data["choices"][0]
+            return choice["message"], choice["finish_reason"], 0.0, 0.0  # we already waited
+
+        if mode == "replay":
+            raise LookupError("No cassette entry for this request.")
+
+        name, arguments = synthesize_call(body)
+        max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+        finish_reason = "function_call" if not body.get("tools") else "tool_calls"
+        if max_tokens and count_tokens(arguments) > max_tokens:
+            arguments = arguments[: max_tokens * CHARS_PER_TOKEN]
+            finish_reason = "length"
+        message = build_message(body, name, arguments)
+        prompt_tokens = count_tokens(json.dumps(body.get("messages", [])))
+        timing = (model_latency or {}).get(body.get("model"), latency)
+        return message, finish_reason, timing.first_token_delay(prompt_tokens), timing.token_delay(count_tokens(arguments))
+
+    async def stream(body: dict, message: dict, finish_reason: str, ttft: float, generation: float):
+        base = {
+            "id": f"chatcmpl-fake-{random.getrandbits(48):012x}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+        }
+
+        def chunk(delta: dict, finish=None) -> str:
+            payload = dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": finish}])
+            return f"data: {json.dumps(payload)}\n\n"
+
+        await asyncio.sleep(ttft)
+        if message.get("tool_calls"):
+            call = message["tool_calls"][0]
+            name, arguments = call["function"]["name"], call["function"]["arguments"]
+            yield chunk({"role": "assistant", "tool_calls": [
+                {"index": 0, "id": call["id"], "type": "function", "function": {"name": name, "arguments": ""}}
+            ]})
+            wrap = lambda piece: {"tool_calls": [{"index": 0, "function": {"arguments": piece}}]}
+        elif message.get("function_call"):
+            name, arguments = message["function_call"]["name"], message["function_call"]["arguments"]
+            yield chunk({"role": "assistant", "function_call": {"name": name, "arguments": ""}})
+            wrap = lambda piece: {"function_call": {"arguments": piece}}
+        else:
+            arguments = message.get("content") or ""
+            yield chunk({"role": "assistant", "content": ""})
+            wrap = lambda piece: {"content": piece}
+
+        step = chunk_tokens * CHARS_PER_TOKEN
+        pieces = [arguments[i:i + step] for i in range(0, len(arguments), step)] or [""]
+        delay = generation / len(pieces)
+        for piece in pieces:
+            await asyncio.sleep(delay)
+            yield chunk(wrap(piece))
+        yield chunk({}, finish=finish_reason)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = completion_response(body, message, finish_reason, count_tokens(arguments))["usage"]
+            yield f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    async def released(chunks, reserved: int, used: int):
+        try:
+            async for piece in chunks:
+                yield piece
+        finally:
+            rate_limit.release(reserved, used)
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.stats["requests"] += 1
+
+        if error_rate and failure_random.random() < error_rate:
+            app.state.stats["errors_injected"] += 1
+            return JSONResponse(status_code=500, content={"error": {"message": "Injected failure", "type": "server_error"}})
+
+        reserved = count_tokens(prompt_text(body)) + (body.get("max_completion_tokens") or body.get("max_tokens") or 0)
+        if rate_limit is not None:
+            wait = rate_limit.admit(reserved)
+            if wait is not None:
+                app.state.stats["rate_limited"] += 1
+                return JSONResponse(
+                    status_code=429,
+                    content={"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                    headers={"retry-after": str(max(1, round(wait))), "retry-after-ms": str(round(wait * 1000))},
+                )
+            app.state.stats["peak_concurrent"] = rate_limit.peak_active
+
+        try:
+            message, finish_reason, ttft, generation = await obtain(body, request.headers.get("authorization"))
+        except LookupError as e:
+            if rate_limit is not None:
+                rate_limit.release(reserved, 0)
+            return JSONResponse(status_code=404, content={"error": {"message": str(e), "type": "cassette_miss"}})
+
+        arguments = (message.get("function_call") or {}).get("arguments") \
+            or ((message.get("tool_calls") or [{}])[0].get("function") or {}).get("arguments") \
+            or message.get("content") or ""
+        used = count_tokens(prompt_text(body)) + count_tokens(arguments)
+
+        if body.get("stream"):
+            app.state.stats["streamed"] += 1
+            chunks = stream(body, message, finish_reason, ttft, generation)
+            return StreamingResponse(released(chunks, reserved, used) if rate_limit is not None else chunks,
+                                     media_type="text/event-stream")
+
+        try:
+            await asyncio.sleep(ttft + generation)
+        finally:
+            if rate_limit is not None:
+                rate_limit.release(reserved, used)
+        return completion_response(body, message, finish_reason, count_tokens(arguments))
+
+    for prefix in ("/v1", "/openai/v1"):
+        app.add_api_route(f"{prefix}/chat/completions", chat_completions, methods=["POST"])
+
+    @app.get("/stats")
+    def stats():
+        return app.state.stats
+
+    return app
+
+
+def start_in_thread(app: FastAPI, port: int = 0) -> tuple:
+    """
+    Run `app` with uvicorn in a daemon thread. Returns (base_url, server); call
+    `server.should_exit = True` to stop it. Port 0 picks a free port.
+    """
+    import socket
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", port))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}", server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft-ms", type=float, default=400, help="median time to first token")
+    parser.add_argument("--ttft-sigma", type=float, default=0.35, help="log-normal sigma of the first-token delay")
+    parser.add_argument("--tokens-per-second", type=float, default=250, help="completion token rate (0 = instant)")
+    parser.add_argument("--prefill-tokens-per-second", type=float, default=0,
+                        help="prompt token rate added to the first-token delay (0 = prompt size is free)")
+    parser.add_argument("--chunk-tokens", type=int, default=8, help="tokens per streamed chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--record", metavar="CASSETTE", help="record upstream answers into this JSONL file")
+    parser.add_argument("--upstream", help="real provider base URL for --record, e.g. https://api.groq.com/openai/v1")
+    parser.add_argument("--replay", metavar="CASSETTE", help="serve answers from this JSONL file")
+    parser.add_argument("--replay-timing", choices=["recorded", "model"], default="recorded")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="429 above this many requests at once")
+    parser.add_argument("--requests-per-minute", type=int, default=0, help="429 above this request rate")
+    parser.add_argument("--tokens-per-minute", type=int, default=0,
+                        help="429 above this token rate (prompt text + max_tokens)")
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=TTFT_MS:TOKENS_PER_SECOND",
+                        help="latency of one model's synthetic answers (repeatable)")
+    args = parser.parse_args()
+
+    if args.record and not args.upstream:
+        parser.error("--record needs --upstream")
+
+    mode, cassette = "synthetic", None
+    if args.record:
+        mode, cassette = "record", Cassette(args.record)
+    elif args.replay:
+        mode, cassette = "replay", Cassette(args.replay)
+
+    latency = LatencyModel(args.ttft_ms, args.ttft_sigma, args.tokens_per_second, args.seed,
+                           args.prefill_tokens_per_second)
+    model_latency = {}
+    for entry in args.model_latency:
+        model, _, timing = entry.partition("=")
+        ttft_ms, _, tokens_per_second = timing.partition(":")
+        model_latency[model] = LatencyModel(float(ttft_ms), args.ttft_sigma, float(tokens_per_second or args.tokens_per_second),
+                                            args.seed, args.prefill_tokens_per_second)
+    rate_limit = None
+    if args.max_concurrent or args.requests_per_minute or args.tokens_per_minute:
+        rate_limit = RateLimit(args.max_concurrent, args.requests_per_minute, args.tokens_per_minute)
+    app = create_app(latency, cassette, mode, args.upstream, args.replay_timing, args.error_rate, args.chunk_tokens,
+                     model_latency, rate_limit)
+
+    import uvicorn
+    print(f"Fake LLM server ({mode}) on http://{args.host}:{args.port}/v1 and /openai/v1")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Fuzz check: how many malformed recipe answers the tolerant parser (json_repair.py and
+parse_recipe_slots in ML_functions.py) recovers without asking the model again.
+
+A corpus of malformed create_recipe_list arguments is built from valid answers
+synthesized by the fake LLM (perf/fake_llm.py), by applying these mutations (seeded, so
+the corpus is the same on every run):
+  - truncate:         cut off somewhere in the second half (max tokens, closed stream)
+  - trailing_commas:  a comma before some "}" and "]"
+  - think:            <think> reasoning, with braces, before the JSON
+  - fence:            wrapped in a ```json code fence
+  - chatter:          text before and after the JSON
+  - quotes:           unescaped double quotes inside a recipe's steps
+  - newlines:         raw newlines instead of "\\n" escapes
+  - combo:            two of the above
+For each mutation this prints how often plain json.loads still works (the old parser),
+how often all three recipes are recovered, the share of slots recovered (the others
+would be regenerated one by one), and how many recovered recipes differ from the
+original, which a repair must never cause except by truncation.
+
+Usage (from the backend folder):
+
+    python -m perf.fuzz_recipe_json --samples 300 --seed 1
+    python -m perf.fuzz_recipe_json --write-corpus malformed.jsonl
+    python -m perf.fuzz_recipe_json --corpus recorded_failures.jsonl
+
+A --corpus file has one {"mutation": ..., "text": ...} object per line, e.g. raw
+arguments collected from production failures; there is no original to compare to.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from perf.common import print_table
+from perf.fake_llm import synthesize_call, _PANTRY
+
+MUTATIONS = ["truncate", "trailing_commas", "think", "fence", "chatter", "quotes", "newlines"]
+COMBINABLE = ["quotes", "trailing_commas", "newlines", "think", "fence", "chatter"]  # in the order they are applied
+
+
+def valid_answer(rnd: random.Random) -> str:
+    from ML_functions import RECIPE_FUNCTIONS, build_recipe_prompt, recipe_messages
+    fridge = [(name, rnd.randint(1, 5)) for name in rnd.sample(_PANTRY, rnd.randint(4, 10))]
+    body = {
+        "messages": recipe_messages(build_recipe_prompt(fridge)),
+        "functions": RECIPE_FUNCTIONS,
+        "function_call": {"name": "create_recipe_list"},
+    }
+    _, arguments = synthesize_call(body)
+    # Models usually pretty-print; the fuzzed JSON then has newlines between tokens
+    return json.dumps(json.loads(arguments), indent=2 if rnd.random() < 0.5 else None)
+
+
+def mutate(text: str, mutation: str, rnd: random.Random) -> str:
+    if mutation == "truncate":
+        return text[:rnd.randint(len(text) // 2, len(text) - 2)]
+    if mutation == "trailing_commas":
+        closers = [i for i, char in enumerate(text) if char in "}]"]
+        for i in sorted(rnd.sample(closers, max(1, len(closers) // 3)), reverse=True):
+            text = text[:i] + "," + text[i:]
+        return text
+    if mutation == "think":
+        return ("<think>The user has some ingredients. A recipe object looks like {\"name\": ...}. "
+                "Let me write three recipes.</think>\n" + text)
+    if mutation == "fence":
+        return f"```json\n{text}\n```"
+    if mutation == "chatter":
+        return f"Here are three recipes you can make:\n{text}\nEnjoy your meal!"
+    if mutation == "quotes":
+        answer = json.loads(text)
+        slot = rnd.choice(["recipe1", "recipe2", "recipe3"])
+        marker = "QUOTED_WORD_MARKER"
+        answer[slot]["steps"] = answer[slot]["steps"].replace(" the ", f" the {marker} ", 1)
+        return json.dumps(answer).replace(marker, '"signature" sauce,')
+    if mutation == "newlines":
+        return text.replace("\\n", "\n")
+    raise ValueError(mutation)
+
+
+def build_corpus(samples: int, seed: int) -> list:
+    """
+    [(mutation, malformed text, original text)]
+    """
+    rnd = random.Random(seed)
+    corpus = []
+    for i in range(samples):
+        original = valid_answer(rnd)
+        if i % (len(MUTATIONS) + 1) == len(MUTATIONS):
+            text = original
+            # "quotes" needs valid JSON, and the wrappers go around everything else
+            for mutation in sorted(rnd.sample(COMBINABLE, 2), key=COMBINABLE.index):
+                text = mutate(text, mutation, rnd)
+            corpus.append(("combo", text, original))
+        else:
+            mutation = MUTATIONS[i % (len(MUTATIONS) + 1)]
+            corpus.append((mutation, mutate(original, mutation, rnd), original))
+    return corpus
+
+
+def plain_json_ok(text: str) -> bool:
+    try:
+        answer = json.loads(text)
+        return all(slot in answer for slot in ("recipe1", "recipe2", "recipe3"))
+    except (json.JSONDecodeError, TypeError):
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=320)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--corpus", help="evaluate this JSONL corpus instead of the generated one")
+    parser.add_argument("--write-corpus", help="write the generated corpus to this JSONL file and exit")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore", DeprecationWarning)
+    from ML_functions import RECIPE_SLOTS, parse_recipe_slots
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = [(entry.get("mutation", "recorded"), entry["text"], None)
+                      for entry in map(json.loads, filter(str.strip, f))]
+    else:
+        corpus = build_corpus(args.samples, args.seed)
+    if args.write_corpus:
+        with open(args.write_corpus, "w") as f:
+            for mutation, text, _ in corpus:
+                f.write(json.dumps({"mutation": mutation, "text": text}) + "\n")
+        print(f"Wrote {len(corpus)} entries to {args.write_corpus}")
+        return
+
+    totals = {}
+    for mutation, text, original in corpus:
+        row = totals.setdefault(mutation, {"mutation": mutation, "n": 0, "json_loads_ok": 0, "all_recovered": 0,
+                                           "slots_recovered": 0, "changed": 0})
+        recipes, missing = parse_recipe_slots(text)
+        expected, _ = parse_recipe_slots(original) if original else ({}, None)
+        row["n"] += 1
+        row["json_loads_ok"] += plain_json_ok(text)
+        row["all_recovered"] += not missing
+        row["slots_recovered"] += len(recipes)
+        row["changed"] += sum(1 for slot, recipe in recipes.items() if expected and recipe != expected[slot])
+
+    rows = []
+    overall = {"mutation": "all", "n": 0, "json_loads_ok": 0, "all_recovered": 0, "slots_recovered": 0, "changed": 0}
+    for row in list(totals.values()):
+        for key in ("n", "json_loads_ok", "all_recovered", "slots_recovered", "changed"):
+            overall[key] += row[key]
+    for row in list(totals.values()) + [overall]:
+        rows.append({
+            "mutation": row["mutation"], "n": row["n"],
+            "json_loads_ok_pct": 100.0 * row["json_loads_ok"] / row["n"],
+            "all_recovered_pct": 100.0 * row["all_recovered"] / row["n"],
+            "slots_recovered_pct": 100.0 * row["slots_recovered"] / (row["n"] * len(RECIPE_SLOTS)),
+            "changed": row["changed"],
+        })
+    print_table(rows, ["mutation", "n", "json_loads_ok_pct", "all_recovered_pct", "slots_recovered_pct", "changed"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""
+Closed-loop load generator: how many concurrent app users does one backend survive?
+
+Each virtual user follows the real app flow in a loop: log in via /login (or with a
+locally signed token, see --distinct-users), fill a fridge whose size is drawn from a
+Zipf distribution, then repeatedly pick an action (fridge reads and CRUD, favorites,
+friend views, profile, recipe generation, image upload), wait for the answer, think,
+and pick the next one. Because the loop is closed, offered load grows only with the
+number of users, which is what the stages sweep.
+
+Before the timed part of a stage, every user is set up: logged in, with a fridge and
+--setup-favorites favorites, and (with distinct users) a stored profile and --friends
+friendships with other virtual users, so the friend view loads real friends and their
+favorites, as the profile screen does (/user/friends_with_favorites, every page).
+The setup requests are reported apart, not in the per-route numbers.
+
+For every stage (number of concurrent users) the report shows throughput, errors and
+per-route latency percentiles, then a saturation curve and per-route SLO pass/fail.
+
+Usage (from the backend folder):
+
+    # start a local stack with in-memory MongoDB and the fake LLM, then load it
+    python -m perf.loadgen --local --stages 1,4,16,64 --stage-seconds 30
+
+    # or load an already running backend
+    python -m perf.loadgen --target http://127.0.0.1:8000 --stages 8,16,32
+
+--local starts perf/stack.py in a subprocess (mongomock + fake LLM). mongomock cannot
+run the friend view's aggregation (MongoDB 5.2+), so that action is left out with
+--local-mongo mock; use --local-mongo real or --target to measure it. Use --json to
+save the raw results.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from perf.common import summarize, print_table
+
+# Per-route p95 latency objectives in milliseconds
+DEFAULT_SLOS_MS = {
+    "login": 300,
+    "fridge_get": 200,
+    "fridge_add": 300,
+    "fridge_update": 300,
+    "fridge_remove": 300,
+    "favorites_get": 200,
+    "favorite_toggle": 300,
+    "friends": 500,
+    "profile": 200,
+    "generate_recipes": 30000,
+    "image_upload": 20000,
+}
+
+# How often each action is chosen once a user is set up (relative weights)
+ACTION_WEIGHTS = {
+    "fridge_get": 30,
+    "fridge_add": 12,
+    "fridge_update": 10,
+    "fridge_remove": 5,
+    "favorites_get": 10,
+    "favorite_toggle": 5,
+    "friends": 5,
+    "profile": 8,
+    "generate_recipes": 10,
+    "image_upload": 5,
+}
+
+TEST_LOGINS = [("testuser1", "password1"), ("testuser2", "password2"), ("testuser3", "password3")]
+
+INGREDIENTS = [
+    "egg", "milk", "butter", "cheddar", "chicken breast", "broccoli", "carrot", "onion", "garlic",
+    "tomato", "spinach", "rice", "pasta", "bell pepper", "yogurt", "lemon", "potato", "mushroom",
+    "bacon", "tofu", "apple", "soy sauce", "ham", "salmon", "beef", "zucchini", "cucumber",
+    "lettuce", "basil", "parsley", "cilantro", "ginger", "chili", "corn", "peas", "beans",
+    "lentils", "quinoa", "oats", "flour", "sugar", "honey", "cream", "mozzarella", "parmesan",
+]
+
+# Page size of the profile screen's friend list (recipe/app/profile.tsx)
+FRIENDS_PAGE = 100
+FRIEND_RECIPES = 20
+
+# A tiny valid JPEG header is enough: the fake LLM never decodes the image
+FAKE_JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 2048 + b"\xff\xd9"
+
+
+def zipf_size(rnd: random.Random, s: float, minimum: int, maximum: int) -> int:
+    """
+    Draw a fridge size from a Zipf(s) distribution over [minimum, maximum].
+    """
+    weights = [1 / (rank ** s) for rank in range(1, maximum - minimum + 2)]
+    return minimum + rnd.choices(range(len(weights)), weights=weights)[0]
+
+
+def item_name(index: int) -> str:
+    base = INGREDIENTS[index % len(INGREDIENTS)]
+    return base if index < len(INGREDIENTS) else f"{base} {index // len(INGREDIENTS)}"
+
+
+class VirtualUser:
+    """
+    One simulated app user running the closed loop until `stop_at`.
+    """
+
+    def __init__(self, number: int, client: httpx.AsyncClient, args, results: list, rnd: random.Random):
+        self.number = number
+        self.client = client
+        self.args = args
+        self.results = results  # where call() records samples: the setup's, then the stage's
+        self.rnd = rnd
+        self.headers = {}
+        self.fridge = {}
+        self.favorites = set()
+
+    async def call(self, route: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, headers=self.headers, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            response, status = None, f"{type(e).__name__}"
+        self.results.append((route, (time.perf_counter() - start) * 1000, status, time.time()))
+        return response
+
+    async def login(self):
+        if self.args.distinct_users:
+            import jwt
+            token = jwt.encode(
+                {"sub": f"loadgen_user_{self.number}", "name": f"Load User {self.number}",
+                 "email": f"loadgen{self.number}@example.com", "exp": int(time.time()) + 86400},
+                os.getenv("SECRET_KEY", "default-secret-key"),
+                algorithm=os.getenv("ALGORITHM", "HS256"),
+            )
+            # Still exercise the login route, but use the per-user identity afterwards
+            username, password = TEST_LOGINS[self.number % len(TEST_LOGINS)]
+            await self.call("login", "POST", "/login", json={"username": username, "password": password})
+        else:
+            username, password = TEST_LOGINS[self.number % len(TEST_LOGINS)]
+            response = await self.call("login", "POST", "/login", json={"username": username, "password": password})
+            token = response.json()["access_token"] if response is not None and response.status_code == 200 else ""
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    async def setup(self):
+        await self.login()
+        if self.args.distinct_users:
+            # Friends are added by email, which needs a stored profile
+            await self.call("profile_setup", "POST", "/user/update-profile-picture",
+                            json={"picture_url": f"https://example.com/avatars/{self.number}.png"})
+        size = zipf_size(self.rnd, self.args.zipf_s, self.args.fridge_min, self.args.fridge_max)
+        for index in range(size):
+            name = item_name(index)
+            quantity = self.rnd.randint(1, 5)
+            await self.call("fridge_add", "POST", "/fridge/add", json={"name": name, "quantity": quantity})
+            self.fridge[name] = self.fridge.get(name, 0) + quantity
+        for number in range(self.args.setup_favorites):
+            title = f"Recipe {number}"
+            await self.call("favorite_toggle", "POST", "/recipes/favorite",
+                            json={"title": title, "description": "Synthetic favorite", "isFavorited": True})
+            self.favorites.add(title)
+
+    async def befriend(self, numbers: list):
+        """
+        Add up to --friends of the other virtual users (`numbers`) as friends.
+        """
+        others = [number for number in numbers if number != self.number]
+        for number in self.rnd.sample(others, min(self.args.friends, len(others))):
+            await self.call("add_friend", "POST", "/user/add_friend", json={"email": f"loadgen{number}@example.com"})
+
+    async def act(self, action: str):
+        if action == "fridge_get":
+            await self.call(action, "GET", "/fridge/get")
+        elif action == "fridge_add":
+            name = item_name(self.rnd.randrange(self.args.fridge_max))
+            await self.call(action, "POST", "/fridge/add", json={"name": name, "quantity": 1})
+            self.fridge[name] = self.fridge.get(name, 0) + 1
+        elif action == "fridge_update" and self.fridge:
+            name = self.rnd.choice(list(self.fridge))
+            quantity = self.rnd.randint(1, 6)
+            await self.call(action, "PUT", "/fridge/update_quantity", json={"name": name, "quantity": quantity})
+            self.fridge[name] = quantity
+        elif action == "fridge_remove" and self.fridge:
+            name = self.rnd.choice(list(self.fridge))
+            await self.call(action, "DELETE", "/fridge/remove", json={"name": name, "quantity": 1})
+            self.fridge[name] -= 1
+            if self.fridge[name] <= 0:
+                del self.fridge[name]
+        elif action == "favorites_get":
+            await self.call(action, "GET", "/fridge/get_favorite_recipes")
+        elif action == "favorite_toggle":
+            title = f"Recipe {self.rnd.randrange(20)}"
+            favorited = title not in self.favorites
+            await self.call(action, "POST", "/recipes/favorite",
+                            json={"title": title, "description": "Synthetic favorite", "isFavorited": favorited})
+            (self.favorites.add if favorited else self.favorites.discard)(title)
+        elif action == "friends":
+            # What the profile screen loads: every page of friends, with their favorites
+            skip = 0
+            while True:
+                response = await self.call(action, "GET", "/user/friends_with_favorites", params={
+                    "skip": skip, "limit": FRIENDS_PAGE, "recipes_per_friend": FRIEND_RECIPES
+                })
+                skip += FRIENDS_PAGE
+                if response is None or response.status_code != 200 \
+                        or skip >= int(response.headers.get("X-Total-Count", "0")):
+                    break
+        elif action == "profile":
+            await self.call(action, "GET", "/user/profile")
+        elif action == "generate_recipes" and self.fridge:
+            await self.call(action, "POST", "/fridge/generate_recipes", json={"isVegan": self.rnd.random() < 0.2})
+        elif action == "image_upload":
+            await self.call(action, "POST", "/fridge/load_from_image",
+                            files={"image_file": ("fridge.jpg", FAKE_JPEG, "image/jpeg")})
+
+    async def run(self, stop_at: float):
+        actions, weights = zip(*self.args.action_weights.items())
+        while time.time() < stop_at:
+            await self.act(self.rnd.choices(actions, weights=weights)[0])
+            await asyncio.sleep(self.rnd.expovariate(1000 / self.args.think_ms) if self.args.think_ms else 0)
+
+
+async def run_stage(args, users: int, seed: int) -> tuple:
+    """
+    Set up `users` virtual users, then run them for args.stage_seconds.
+    Returns (stage samples, setup samples, seconds of the timed part).
+    """
+    results, setup_results = [], []
+    limits = httpx.Limits(max_connections=users + 10, max_keepalive_connections=users + 10)
+    async with httpx.AsyncClient(base_url=args.target, timeout=args.timeout, limits=limits) as client:
+        virtual_users = [
+            VirtualUser(seed * 100000 + number, client, args, setup_results, random.Random(seed * 100000 + number))
+            for number in range(users)
+        ]
+        await asyncio.gather(*(user.setup() for user in virtual_users))
+        if args.distinct_users:
+            numbers = [user.number for user in virtual_users]
+            await asyncio.gather(*(user.befriend(numbers) for user in virtual_users))
+
+        for user in virtual_users:
+            user.results = results
+        started = time.time()
+        stop_at = started + args.stage_seconds
+        await asyncio.gather(*(user.run(stop_at) for user in virtual_users))
+    return results, setup_results, time.time() - started
+
+
+def setup_report(samples: list) -> dict:
+    """
+    Requests and errors per route of a stage's setup.
+    """
+    routes = defaultdict(lambda: {"n": 0, "errors": 0})
+    for route, _, status, _ in samples:
+        routes[route]["n"] += 1
+        routes[route]["errors"] += not (isinstance(status, int) and status < 400)
+    return dict(routes)
+
+
+def stage_report(users: int, samples: list, seconds: float, slos: dict) -> dict:
+    by_route = defaultdict(list)
+    errors = defaultdict(int)
+    for route, latency_ms, status, _ in samples:
+        by_route[route].append(latency_ms)
+        if not (isinstance(status, int) and status < 400):
+            errors[route] += 1
+
+    routes = {}
+    for route, latencies in sorted(by_route.items()):
+        stats = summarize(latencies)
+        stats["errors"] = errors[route]
+        stats["slo_p95_ms"] = slos.get(route)
+        stats["slo_pass"] = (
+            (slos.get(route) is None or stats["p95_ms"] <= slos[route]) and errors[route] / len(latencies) <= 0.01
+        )
+        routes[route] = stats
+
+    return {
+        "users": users,
+        "requests": len(samples),
+        "throughput_rps": len(samples) / seconds if seconds else 0.0,
+        "error_rate": sum(errors.values()) / len(samples) if samples else 0.0,
+        "slo_pass": all(stats["slo_pass"] for stats in routes.values()),
+        "routes": routes,
+    }
+
+
+def start_local_stack(args) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "perf.stack", "--port", str(args.local_port), "--mongo", args.local_mongo,
+        "--ttft-ms", str(args.ttft_ms), "--tokens-per-second", str(args.tokens_per_second),
+    ]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{args.target}/welcome", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    sys.exit("Local stack did not start within 60 seconds.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default=None, help="backend base URL (default with --local: the local stack)")
+    parser.add_argument("--local", action="store_true", help="start perf/stack.py and load it")
+    parser.add_argument("--local-port", type=int, default=8765)
+    parser.add_argument("--local-mongo", choices=["mock", "real"], default="mock")
+    parser.add_argument("--ttft-ms", type=float, default=400, help="fake LLM median first-token delay (--local)")
+    parser.add_argument("--tokens-per-second", type=float, default=250, help="fake LLM token rate (--local)")
+    parser.add_argument("--stages", default="1,2,4,8,16,32", help="comma-separated concurrent user counts")
+    parser.add_argument("--stage-seconds", type=float, default=30)
+    parser.add_argument("--think-ms", type=float, default=1000, help="mean think time between actions")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--fridge-min", type=int, default=3)
+    parser.add_argument("--fridge-max", type=int, default=200)
+    parser.add_argument("--setup-favorites", type=int, default=3, help="favorites each user starts with")
+    parser.add_argument("--friends", type=int, default=5,
+                        help="friendships each user adds with other virtual users (distinct users only)")
+    parser.add_argument("--distinct-users", action="store_true",
+                        help="sign a token per virtual user with SECRET_KEY instead of sharing the 3 test users")
+    parser.add_argument("--slo", action="append", default=[], metavar="ROUTE=P95_MS", help="override an SLO")
+    parser.add_argument("--json", help="write the full report to this file")
+    args = parser.parse_args()
+
+    slos = dict(DEFAULT_SLOS_MS)
+    for override in args.slo:
+        route, value = override.split("=", 1)
+        slos[route] = float(value)
+
+    stack = None
+    args.action_weights = dict(ACTION_WEIGHTS)
+    if args.local:
+        args.target = args.target or f"http://127.0.0.1:{args.local_port}"
+        args.distinct_users = True  # we control SECRET_KEY for the local stack
+        if args.local_mongo == "mock":
+            print("Leaving out the friend view: mongomock cannot run its aggregation (use --local-mongo real)")
+            del args.action_weights["friends"]
+        stack = start_local_stack(args)
+    elif not args.target:
+        parser.error("give --target URL or --local")
+
+    reports = []
+    try:
+        for seed, users in enumerate(int(n) for n in args.stages.split(",")):
+            print(f"\n=== Stage: {users} concurrent users for {args.stage_seconds:.0f}s ===")
+            samples, setup_samples, seconds = asyncio.run(run_stage(args, users, seed + 1))
+            report = stage_report(users, samples, seconds, slos)
+            report["setup"] = setup_report(setup_samples)
+            reports.append(report)
+            print("Setup (not in the numbers below): " + ", ".join(
+                f"{route} {counts['n']} ({counts['errors']} errors)" for route, counts in report["setup"].items()
+            ))
+            print_table(
+                [{"route": route, **stats} for route, stats in report["routes"].items()],
+                ["route", "n", "p50_ms", "p95_ms", "p99_ms", "errors", "slo_p95_ms", "slo_pass"],
+            )
+    finally:
+        if stack:
+            stack.terminate()
+
+    print("\n=== Saturation curve ===")
+    print_table(reports, ["users", "requests", "throughput_rps", "error_rate", "slo_pass"])
+    passing = [report["users"] for report in reports if report["slo_pass"]]
+    print(f"\nHighest stage meeting every SLO: {max(passing) if passing else 'none'} concurrent users")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump({"slos_ms": slos, "stages": reports}, handle, indent=2)
+
+
+if __name__ == "__main__":
+    main()
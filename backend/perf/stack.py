@@ -0,0 +1,84 @@
+"""
+Run the backend locally with its LLM providers replaced by the fake server from
+perf/fake_llm.py, and optionally MongoDB replaced by mongomock.
+
+Usage (from the backend folder):
+
+    python -m perf.stack --port 8000 --mongo mock --ttft-ms 400 --tokens-per-second 250
+
+--mongo mock needs the `mongomock` package (pip install mongomock); it is only used by
+this script, never by the app itself. With --mongo real (the default) the app uses
+MONGODB_URI as usual, and MONGODB_DB defaults to "fridge_loadtest" so production
+data is never touched.
+--llm-url points at an already running fake server instead of starting one.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _without_sort(add):
+    def add_without_sort(self, *args, sort=None, **kwargs):
+        if sort is not None:
+            raise NotImplementedError("mongomock cannot sort bulk updates")
+        return add(self, *args, **kwargs)
+    add_without_sort.accepts_sort = True
+    return add_without_sort
+
+
+def patch_mongomock():
+    """
+    Make `pymongo.MongoClient` (as imported by main.py) an in-memory mongomock client.
+    """
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("--mongo mock needs mongomock: pip install mongomock")
+    import pymongo
+    import pymongo.mongo_client
+
+    pymongo.MongoClient = mongomock.MongoClient
+    pymongo.mongo_client.MongoClient = mongomock.MongoClient
+    # Newer pymongo passes `sort` to every bulk update or replace; mongomock does not know it
+    bulk = mongomock.collection.BulkOperationBuilder
+    for name in ("add_update", "add_replace"):
+        if not getattr(getattr(bulk, name), "accepts_sort", False):
+            setattr(bulk, name, _without_sort(getattr(bulk, name)))
+    os.environ.setdefault("MONGODB_URI", "mongodb://mongomock.invalid:27017")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--mongo", choices=["real", "mock"], default="real")
+    parser.add_argument("--llm-url", help="base URL of a running fake LLM server (default: start one)")
+    parser.add_argument("--ttft-ms", type=float, default=400)
+    parser.add_argument("--tokens-per-second", type=float, default=250)
+    args = parser.parse_args()
+
+    if args.mongo == "mock":
+        patch_mongomock()
+    os.environ.setdefault("MONGODB_DB", "fridge_loadtest")
+
+    llm_url = args.llm_url
+    if not llm_url:
+        from perf.fake_llm import create_app, start_in_thread, LatencyModel
+        llm_url, _ = start_in_thread(create_app(LatencyModel(args.ttft_ms, tokens_per_second=args.tokens_per_second)))
+        print(f"Fake LLM server on {llm_url}")
+    os.environ["GROQ_BASE_URL"] = f"{llm_url}/openai/v1"
+    os.environ["OPENAI_BASE_URL"] = f"{llm_url}/v1"
+    os.environ.setdefault("GROQ_API_KEY", "fake")
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+    import uvicorn
+    import main as backend
+
+    uvicorn.run(backend.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
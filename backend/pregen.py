@@ -0,0 +1,270 @@
+"""
+This file implements optional speculative recipe pre-generation.
+
+The slow part of the recipe screen is the LLM call in generate_delicious_recipes, and
+it only starts when the user opens that screen. When pre-generation is enabled, every
+fridge change (re)starts a per-user debounce timer. Once the fridge has been quiet for
+RECIPE_PREGEN_DEBOUNCE_SECONDS, recipes are generated in the background for the user's
+last-used preferences and kept, so the next /fridge/generate_recipes with the same
+fridge and preferences returns immediately (or joins the call already in flight).
+
+  - Only users who have generated recipes before (so we know their preferences) are
+    pre-generated for.
+  - A global budget (RECIPE_PREGEN_MAX_CONCURRENT) caps background LLM calls; when it
+    is exhausted the pre-generation is skipped, never queued. Its LLM calls are
+    background work for the outbound scheduler (llm_scheduler.py), so they only use
+    provider capacity that interactive requests leave free.
+  - A fridge change while a pre-generation is running cancels it. The generation runs
+    as a task on the pre-generator's own event loop (one background thread), with the
+    cancellable, streamed recipe call: cancelling the task closes the upstream stream,
+    and its budget slot is free again as soon as the task has ended.
+  - Results are used at most once, so "regenerate" still produces new recipes.
+
+Enable with RECIPE_PREGEN_ENABLED=1. Results live in this process only.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+import llm_scheduler
+
+
+def fridge_fingerprint(fridge_contents: list, preferences: dict) -> str:
+    """
+    Identify a (fridge contents, preferences) pair; equal fingerprints get equal recipes.
+    """
+    payload = json.dumps([sorted(fridge_contents), preferences], sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _Pending:
+    """
+    A pre-generation in flight (or finished) for one user.
+    """
+    __slots__ = ("key", "epoch", "done", "result", "created_at", "task")
+
+    def __init__(self, key: str, epoch: int):
+        self.key = key
+        self.epoch = epoch
+        self.done = threading.Event()
+        self.result = None
+        self.created_at = time.monotonic()
+        self.task = None  # the generation task, on the pre-generator's event loop
+
+
+class RecipePregenerator:
+    """
+    Debounced, budgeted background recipe generation keyed by user.
+    """
+
+    def __init__(self, generate_fn, load_fridge_fn, debounce_seconds: float,
+                 max_concurrent: int, result_ttl_seconds: float, join_timeout_seconds: float):
+        self.generate_fn = generate_fn          # async (fridge_contents, preferences) -> recipes dict
+        self.load_fridge_fn = load_fridge_fn    # user_id -> [(name, quantity), ...]
+        self.debounce_seconds = debounce_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.join_timeout_seconds = join_timeout_seconds
+        self._budget = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._preferences = {}   # user_id -> last-used preferences dict
+        self._epochs = {}        # user_id -> number of fridge changes seen
+        self._timers = {}        # user_id -> pending debounce timer
+        self._pending = {}       # user_id -> _Pending (in flight or finished)
+        self._loop = None        # event loop of the generation tasks, started on first use
+        self._closed = False
+        self.counters = {
+            "scheduled": 0, "started": 0, "completed": 0, "cancelled": 0,
+            "skipped_budget": 0, "errors": 0, "hits": 0, "joined": 0, "misses": 0,
+        }
+
+    # --- Hooks called from the endpoints --- #
+
+    def remember_preferences(self, user_id: str, preferences: dict):
+        with self._lock:
+            self._preferences[user_id] = preferences
+
+    def fridge_changed(self, user_id: str):
+        """
+        Called after every fridge write: cancel what is running and restart the timer.
+        """
+        with self._lock:
+            self._epochs[user_id] = self._epochs.get(user_id, 0) + 1
+            pending = self._pending.pop(user_id, None)
+            if pending is not None:
+                self._cancel(pending)
+            timer = self._timers.pop(user_id, None)
+            if timer is not None:
+                timer.cancel()
+            if user_id not in self._preferences or self._closed:
+                return
+            timer = threading.Timer(self.debounce_seconds, self._run, args=(user_id,))
+            timer.daemon = True
+            self._timers[user_id] = timer
+            self.counters["scheduled"] += 1
+        timer.start()
+
+    def take(self, user_id: str, fridge_contents: list, preferences: dict, timeout: float | None = None):
+        """
+        Return pre-generated recipes for exactly this fridge and preferences, or None.
+        If the matching pre-generation is still running, wait for it (bounded by the
+        join timeout, and by `timeout` if given).
+        """
+        key = fridge_fingerprint(fridge_contents, preferences)
+        with self._lock:
+            pending = self._pending.get(user_id)
+            if pending is None or pending.key != key:
+                self.counters["misses"] += 1
+                return None
+        joined = not pending.done.is_set()
+        wait = self.join_timeout_seconds if timeout is None else min(timeout, self.join_timeout_seconds)
+        if joined and not pending.done.wait(wait):
+            with self._lock:
+                self.counters["misses"] += 1
+            return None
+        with self._lock:
+            # Use each result once, and only if it is still the current one and fresh
+            if self._pending.get(user_id) is not pending or pending.result is None \
+                    or time.monotonic() - pending.created_at > self.result_ttl_seconds:
+                self.counters["misses"] += 1
+                return None
+            del self._pending[user_id]
+            self.counters["joined" if joined else "hits"] += 1
+            return pending.result
+
+    # --- Background work --- #
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="recipe-pregen", daemon=True).start()
+            return self._loop
+
+    def _run(self, user_id: str):
+        """
+        Debounce timer fired: load the fridge and start the generation task, which owns
+        the budget slot from then on.
+        """
+        with self._lock:
+            self._timers.pop(user_id, None)
+            epoch = self._epochs.get(user_id, 0)
+            preferences = self._preferences.get(user_id)
+        if preferences is None:
+            return
+        if not self._budget.acquire(blocking=False):
+            with self._lock:
+                self.counters["skipped_budget"] += 1
+            return
+
+        started = False
+        try:
+            fridge_contents = self.load_fridge_fn(user_id)
+            if not fridge_contents:
+                return
+            pending = _Pending(fridge_fingerprint(fridge_contents, preferences), epoch)
+            loop = self._event_loop()
+            with self._lock:
+                if self._epochs.get(user_id, 0) != epoch or self._closed:
+                    self.counters["cancelled"] += 1
+                    return
+                # Started under the lock: a later cancellation is queued on the loop after it
+                loop.call_soon_threadsafe(self._start, user_id, pending, fridge_contents, preferences)
+                self._pending[user_id] = pending
+                self.counters["started"] += 1
+                started = True
+        except Exception as e:
+            print(f"Recipe pre-generation failed for {user_id}: {e}")
+            with self._lock:
+                self.counters["errors"] += 1
+        finally:
+            if not started:
+                self._budget.release()
+
+    def _start(self, user_id: str, pending: _Pending, fridge_contents: list, preferences: dict):
+        """
+        On the event loop: run the generation as a task. Whenever it ends, even cancelled
+        before its first step, `done` is set and the budget slot released.
+        """
+        pending.task = self._loop.create_task(self._generate(user_id, pending, fridge_contents, preferences))
+        pending.task.add_done_callback(lambda task: self._finished(task, pending))
+
+    def _finished(self, task: asyncio.Task, pending: _Pending):
+        if task.cancelled():
+            with self._lock:
+                self.counters["cancelled"] += 1
+        pending.done.set()
+        self._budget.release()
+
+    def _cancel(self, pending: _Pending):
+        """
+        Cancel a pre-generation from any thread; cancelling the task closes the upstream stream.
+        """
+        self._loop.call_soon_threadsafe(lambda: pending.task is not None and pending.task.cancel())
+
+    async def _generate(self, user_id: str, pending: _Pending, fridge_contents: list, preferences: dict):
+        try:
+            with llm_scheduler.caller(llm_scheduler.BACKGROUND, user_id):
+                result = await self.generate_fn(fridge_contents, preferences)
+
+            with self._lock:
+                if self._epochs.get(user_id, 0) != pending.epoch or self._pending.get(user_id) is not pending:
+                    self.counters["cancelled"] += 1   # the fridge changed meanwhile
+                elif not all(slot in result for slot in ("recipe1", "recipe2", "recipe3")):
+                    self.counters["errors"] += 1
+                    del self._pending[user_id]
+                else:
+                    pending.result = result
+                    pending.created_at = time.monotonic()
+                    self.counters["completed"] += 1
+        except Exception as e:
+            print(f"Recipe pre-generation failed for {user_id}: {e}")
+            with self._lock:
+                self.counters["errors"] += 1
+                if self._pending.get(user_id) is pending:
+                    del self._pending[user_id]
+
+    def close(self):
+        """
+        Stop scheduling pre-generations (the worker is draining) and cancel the running
+        ones; nobody could use their results.
+        """
+        with self._lock:
+            self._closed = True
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            for pending in self._pending.values():
+                self._cancel(pending)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            in_flight = sum(1 for p in self._pending.values() if not p.done.is_set())
+        served = counters["hits"] + counters["joined"]
+        lookups = served + counters["misses"]
+        counters["hit_rate"] = served / lookups if lookups else 0.0
+        counters["in_flight"] = in_flight
+        return counters
+
+
+def create_pregenerator(generate_fn, load_fridge_fn) -> RecipePregenerator | None:
+    """
+    Build the pre-generator from environment variables, or return None when disabled:
+      RECIPE_PREGEN_ENABLED (default "0"), RECIPE_PREGEN_DEBOUNCE_SECONDS (default 5),
+      RECIPE_PREGEN_MAX_CONCURRENT (default 2), RECIPE_PREGEN_TTL_SECONDS (default 1800),
+      RECIPE_PREGEN_JOIN_TIMEOUT_SECONDS (default 30).
+    """
+    if os.getenv("RECIPE_PREGEN_ENABLED", "0") != "1":
+        return None
+    return RecipePregenerator(
+        generate_fn,
+        load_fridge_fn,
+        debounce_seconds=float(os.getenv("RECIPE_PREGEN_DEBOUNCE_SECONDS", "5")),
+        max_concurrent=int(os.getenv("RECIPE_PREGEN_MAX_CONCURRENT", "2")),
+        result_ttl_seconds=float(os.getenv("RECIPE_PREGEN_TTL_SECONDS", "1800")),
+        join_timeout_seconds=float(os.getenv("RECIPE_PREGEN_JOIN_TIMEOUT_SECONDS", "30")),
+    )
@@ -0,0 +1,308 @@
+"""
+This file implements on-demand profiling of individual routes.
+
+An admin arms the profiler for one route (path + method) and a number of requests:
+
+    POST /admin/profile/arm  {"path": "/fridge/generate_recipes", "method": "POST", "requests": 20}
+
+The route's endpoint function is swapped for a profiling wrapper until that many
+requests have been profiled, then put back. Nothing else is touched, so when no route
+is armed there is no overhead at all: no middleware, no per-request check.
+
+Two modes:
+  - "sampling" (default): a background thread samples the request's thread stack every
+    `interval_ms` (sys._current_frames). Low overhead, good for production.
+  - "deterministic": cProfile on the request's thread, for exact call counts, plus the
+    same sampler for stacks. Slower; only one cProfile runs at a time.
+For async endpoints the sampled thread is the event loop, so samples taken while the
+request is awaiting show up as "[awaiting]" (the loop was doing other work).
+
+The aggregated profile is downloaded as collapsed stacks (flamegraph.pl / speedscope),
+a top-functions table, or a .pstats file (deterministic mode, for snakeviz).
+"""
+
+import cProfile
+import functools
+import inspect
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from fastapi.routing import APIRoute
+
+MODES = ("sampling", "deterministic")
+
+# Admins are listed by user ID (the JWT `sub`); with no admins the endpoints refuse everyone
+ADMIN_USER_IDS = {u.strip() for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip()}
+
+# cProfile is one-per-thread before 3.12 and one-per-process after; keep it simple
+_deterministic_lock = threading.Lock()
+
+
+def is_admin(user_id: str) -> bool:
+    return user_id in ADMIN_USER_IDS
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+class _Sampler:
+    """
+    Samples one thread's stack until stopped, keeping only frames below the wrapper.
+    """
+
+    def __init__(self, session, thread_id: int, stop_code):
+        self.session = session
+        self.thread_id = thread_id
+        self.stop_code = stop_code
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="route-profiler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        interval = self.session.interval_ms / 1000
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            found = False
+            while frame is not None:
+                if frame.f_code is self.stop_code:
+                    found = True
+                    break
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            self.session.add_sample(tuple(reversed(stack)) if found else None)
+
+
+class ProfileSession:
+    """
+    One armed route and the profile aggregated over its profiled requests.
+    """
+
+    def __init__(self, route: APIRoute, method: str, requests: int, mode: str, interval_ms: float):
+        self.route = route
+        self.method = method
+        self.mode = mode
+        self.interval_ms = interval_ms
+        self.requested = requests
+        self.remaining = requests
+        self.in_flight = 0
+        self.completed = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self.original_call = route.dependant.call
+        self.stacks = Counter()     # tuple of frame labels -> samples
+        self.awaiting_samples = 0
+        self.stats = None           # pstats.Stats, deterministic mode only
+        self.lock = threading.Lock()
+
+    @property
+    def armed(self) -> bool:
+        return self.route.dependant.call is not self.original_call
+
+    def claim(self) -> bool:
+        """
+        Reserve one of the remaining profiled requests. The last claim disarms the route.
+        """
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            self.in_flight += 1
+            if self.remaining == 0:
+                self.route.dependant.call = self.original_call
+            return True
+
+    def release(self, profile: cProfile.Profile | None):
+        with self.lock:
+            if profile is not None:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+            self.in_flight -= 1
+            self.completed += 1
+            if self.remaining == 0 and self.in_flight == 0:
+                self.finished_at = time.time()
+
+    def add_sample(self, stack: tuple | None):
+        with self.lock:
+            if stack is None:
+                self.awaiting_samples += 1
+            else:
+                self.stacks[stack] += 1
+
+    # --- Reports --- #
+
+    def collapsed(self) -> str:
+        """
+        One line per distinct stack: "outer;inner;leaf count".
+        """
+        with self.lock:
+            lines = [f"{';'.join(stack) or '[endpoint]'} {count}" for stack, count in self.stacks.most_common()]
+            if self.awaiting_samples:
+                lines.append(f"[awaiting] {self.awaiting_samples}")
+        return "\n".join(lines) + "\n"
+
+    def top(self, limit: int = 30) -> str:
+        """
+        Top functions: from cProfile when available, otherwise from the samples.
+        """
+        with self.lock:
+            if self.stats is not None:
+                out = io.StringIO()
+                stats = pstats.Stats(stream=out)
+                stats.add(self.stats)  # a copy, so sorting does not touch the session
+                stats.sort_stats("cumulative").print_stats(limit)
+                return out.getvalue()
+            total = sum(self.stacks.values()) + self.awaiting_samples
+            self_counts = Counter()
+            total_counts = Counter()
+            for stack, count in self.stacks.items():
+                if stack:
+                    self_counts[stack[-1]] += count
+                for label in set(stack):
+                    total_counts[label] += count
+
+        lines = [f"{total} samples every {self.interval_ms:g} ms, {self.awaiting_samples} awaiting",
+                 f"{'self %':>7} {'total %':>8}  function"]
+        for label, count in total_counts.most_common(limit):
+            lines.append(f"{100 * self_counts[label] / total:7.1f} {100 * count / total:8.1f}  {label}")
+        return "\n".join(lines) + "\n"
+
+    def pstats_bytes(self) -> bytes | None:
+        with self.lock:
+            if self.stats is None:
+                return None
+            return marshal.dumps(self.stats.stats)  # the format pstats.Stats(filename) loads
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "path": self.route.path,
+                "method": self.method,
+                "mode": self.mode,
+                "interval_ms": self.interval_ms,
+                "requested": self.requested,
+                "remaining": self.remaining,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "armed": self.armed,
+                "samples": sum(self.stacks.values()),
+                "awaiting_samples": self.awaiting_samples,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+@contextmanager
+def _profiling(session: ProfileSession, stop_code):
+    """
+    Sample (and in deterministic mode cProfile) the current thread for one request.
+    """
+    profile = None
+    if session.mode == "deterministic" and _deterministic_lock.acquire(blocking=False):
+        profile = cProfile.Profile()
+    try:
+        with _Sampler(session, threading.get_ident(), stop_code):
+            if profile is not None:
+                profile.enable()
+            try:
+                yield
+            finally:
+                if profile is not None:
+                    profile.disable()
+    finally:
+        if profile is not None:
+            _deterministic_lock.release()
+        session.release(profile)
+
+
+def _wrap_endpoint(session: ProfileSession):
+    """
+    Build the profiling wrapper for the session's endpoint, async or sync like the original.
+    FastAPI decides how to call the endpoint when the app starts, so the kind must match.
+    """
+    original = session.original_call
+
+    if inspect.iscoroutinefunction(original):
+        @functools.wraps(original)
+        async def wrapper(**kwargs):
+            if not session.claim():
+                return await original(**kwargs)
+            with _profiling(session, wrapper.__code__):
+                return await original(**kwargs)
+    else:
+        @functools.wraps(original)
+        def wrapper(**kwargs):
+            if not session.claim():
+                return original(**kwargs)
+            with _profiling(session, wrapper.__code__):
+                return original(**kwargs)
+    return wrapper
+
+
+class RouteProfiler:
+    """
+    Holds at most one profile session for the app: the armed one or the last finished one.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.session: ProfileSession | None = None
+        self._lock = threading.Lock()
+
+    def find_route(self, path: str, method: str) -> APIRoute | None:
+        for route in self.app.routes:
+            if isinstance(route, APIRoute) and route.path == path and method in route.methods:
+                return route
+        return None
+
+    def arm(self, path: str, method: str, requests: int, mode: str, interval_ms: float) -> ProfileSession:
+        """
+        Start profiling the next `requests` calls of the route. Raises ValueError when the
+        route does not exist or another route is still armed.
+        """
+        method = method.upper()
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        route = self.find_route(path, method)
+        if route is None:
+            raise ValueError(f"No route {method} {path}")
+        with self._lock:
+            if self.session is not None and self.session.armed:
+                raise ValueError(f"{self.session.method} {self.session.route.path} is already armed")
+            session = ProfileSession(route, method, requests, mode, interval_ms)
+            route.dependant.call = _wrap_endpoint(session)
+            self.session = session
+        print(f"Profiling the next {requests} requests to {method} {path} ({mode})")
+        return session
+
+    def disarm(self) -> ProfileSession | None:
+        """
+        Stop profiling early; what was collected so far stays downloadable.
+        """
+        with self._lock:
+            session = self.session
+            if session is not None:
+                with session.lock:
+                    session.remaining = 0
+                    session.route.dependant.call = session.original_call
+                    if session.in_flight == 0 and session.finished_at is None:
+                        session.finished_at = time.time()
+            return session
@@ -0,0 +1,141 @@
+"""
+This file keeps the recipe prompts within an input token budget, so users with
+hundreds of items in their fridge do not send (and pay for) prompts of thousands of
+tokens, or hit the model's context limit.
+
+`fit_ingredients` estimates the tokens of the prompt locally (about four characters
+per token, as in llm_calls.py) and, when the whole fridge does not fit in
+RECIPE_PROMPT_TOKEN_BUDGET (default 2000, 0 = no limit), keeps the most relevant
+ingredients. They are ranked by:
+  1) allergens: items matching one of the user's allergens go first, since no recipe
+     may use them anyway;
+  2) cuisine: items typical of one of the user's preferred cuisines are kept first;
+  3) staples (egg, onion, rice, ...) come next, as most recipes need some;
+  4) recency: among equals, items added most recently are kept. The ingredient list is
+     expected in the order the items were added (main.py sorts by item ID).
+The names of the dropped ingredients are returned, so the response can say what the
+recipes did not consider. GET /metrics shows the counters under "prompt_budget".
+"""
+
+import os
+import threading
+
+from ingredients import canonical_name
+from llm_calls import CHARS_PER_TOKEN
+
+TOKEN_BUDGET = int(os.getenv("RECIPE_PROMPT_TOKEN_BUDGET", "2000"))
+
+# Ingredients (canonical names, as single words or phrases) that signal an allergen.
+# Allergens not in this table are matched by their own name.
+ALLERGEN_TERMS = {
+    "nut": ("nut", "peanut", "almond", "cashew", "walnut", "pecan", "hazelnut", "pistachio", "macadamia",
+            "peanut butter", "nutella", "pesto"),
+    "dairy": ("milk", "cheese", "butter", "cream", "yogurt", "yoghurt", "ghee", "whey", "mozzarella",
+              "parmesan", "cheddar", "feta", "ricotta", "sour cream", "ice cream", "cream cheese"),
+    "gluten": ("flour", "bread", "pasta", "wheat", "barley", "rye", "couscous", "noodle", "spaghetti",
+               "tortilla", "cracker", "breadcrumb", "bulgur", "seitan", "pie crust"),
+    "shellfish": ("shrimp", "prawn", "crab", "lobster", "clam", "mussel", "oyster", "scallop", "crawfish"),
+    "egg": ("egg", "mayonnaise", "mayo", "meringue"),
+    "soy": ("soy", "tofu", "edamame", "tempeh", "miso", "soy sauce", "soybean"),
+}
+
+# Ingredients typical of the cuisines the app offers
+CUISINE_TERMS = {
+    "american": ("beef", "bacon", "potato", "corn", "cheddar", "bun", "ketchup", "bbq sauce", "ground beef"),
+    "italian": ("pasta", "spaghetti", "tomato", "basil", "mozzarella", "parmesan", "olive oil", "garlic",
+                "oregano", "risotto", "prosciutto", "zucchini"),
+    "mexican": ("tortilla", "black bean", "bean", "avocado", "jalapeno", "chili", "cilantro", "lime", "corn",
+                "salsa", "cumin", "bell pepper"),
+    "asian": ("rice", "soy sauce", "ginger", "noodle", "tofu", "sesame oil", "scallion", "bok choy",
+              "coconut milk", "fish sauce", "lemongrass"),
+    "indian": ("rice", "lentil", "chickpea", "cumin", "turmeric", "garam masala", "ginger", "yogurt",
+               "paneer", "coconut milk", "cauliflower", "spinach"),
+    "mediterranean": ("olive oil", "chickpea", "feta", "olive", "lemon", "cucumber", "tomato", "eggplant",
+                      "yogurt", "couscous", "hummus", "oregano"),
+    "french": ("butter", "cream", "shallot", "thyme", "mushroom", "wine", "leek", "dijon mustard",
+               "baguette", "gruyere"),
+    "japanese": ("rice", "soy sauce", "miso", "nori", "tofu", "ginger", "mirin", "salmon", "noodle",
+                 "scallion", "sesame"),
+}
+CUISINE_TERMS["janpanese"] = CUISINE_TERMS["japanese"]  # as spelled by the app
+
+STAPLES = frozenset((
+    "salt", "pepper", "black pepper", "oil", "olive oil", "vegetable oil", "butter", "flour", "sugar",
+    "egg", "milk", "onion", "garlic", "rice", "pasta", "potato", "tomato", "lemon", "vinegar",
+))
+
+_lock = threading.Lock()
+_counters = {"prompts": 0, "truncated": 0, "ingredients_dropped": 0, "tokens_dropped": 0}
+
+
+def estimate_tokens(text: str) -> float:
+    return len(text) / CHARS_PER_TOKEN
+
+
+def _matches(name: str, terms) -> bool:
+    padded = f" {name} "
+    return any(f" {term} " in padded for term in terms)
+
+
+def _preference_terms(preferences: dict | None, key: str, table: dict) -> list:
+    terms = []
+    for value in (preferences or {}).get(key) or []:
+        value = canonical_name(value)
+        terms.extend(table.get(value, (value,)) if value else ())
+    return terms
+
+
+def ingredient_entry(name: str, quantity) -> str:
+    """
+    How one ingredient is written in the prompt (see build_recipe_prompt).
+    """
+    return f"{name} ({quantity}), "
+
+
+def fit_ingredients(ingredients_list: list, preferences: dict | None, fixed_tokens: float,
+                    token_budget: int | None = None) -> tuple:
+    """
+    Choose the ingredients to put in a prompt whose other text costs `fixed_tokens`.
+    Returns (kept ingredients in their original order, names of the dropped ones).
+    """
+    token_budget = TOKEN_BUDGET if token_budget is None else token_budget
+    costs = [estimate_tokens(ingredient_entry(name, quantity)) for name, quantity in ingredients_list]
+    with _lock:
+        _counters["prompts"] += 1
+    if token_budget <= 0 or fixed_tokens + sum(costs) <= token_budget:
+        return ingredients_list, []
+
+    # --- Step 1: Score every ingredient (higher is kept first) --- #
+    allergen_terms = _preference_terms(preferences, "allergens", ALLERGEN_TERMS)
+    cuisine_terms = _preference_terms(preferences, "cuisines", CUISINE_TERMS)
+    count = len(ingredients_list)
+    scores = []
+    for position, (name, _) in enumerate(ingredients_list):
+        canonical = canonical_name(name)
+        if allergen_terms and _matches(canonical, allergen_terms):
+            score = -10
+        else:
+            score = (3 if cuisine_terms and _matches(canonical, cuisine_terms) else 0) + \
+                    (2 if canonical in STAPLES else 0)
+        scores.append(score + position / count)  # recency breaks ties
+
+    # --- Step 2: Keep the best ones while they fit --- #
+    remaining = token_budget - fixed_tokens
+    keep = set()
+    for index in sorted(range(count), key=lambda i: scores[i], reverse=True):
+        if costs[index] <= remaining:
+            keep.add(index)
+            remaining -= costs[index]
+
+    kept = [ingredient for index, ingredient in enumerate(ingredients_list) if index in keep]
+    dropped = [ingredient[0] for index, ingredient in enumerate(ingredients_list) if index not in keep]
+    with _lock:
+        _counters["truncated"] += 1
+        _counters["ingredients_dropped"] += len(dropped)
+        _counters["tokens_dropped"] += round(sum(costs[i] for i in range(count) if i not in keep))
+    return kept, dropped
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_counters, token_budget=TOKEN_BUDGET)
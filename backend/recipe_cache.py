@@ -0,0 +1,240 @@
+"""
+This file implements an optional near-duplicate cache in front of recipe generation.
+
+Exact-match caching misses when two fridges differ by one condiment, yet recipes made
+for {chicken, rice, broccoli, soy sauce} are just as good for the same fridge plus
+garlic. Generated recipes are therefore kept with the canonical ingredient set of the
+fridge they were made for (ingredients.ingredient_key, pantry basics left out), and:
+
+  1) each set is MinHash-signed (RECIPE_CACHE_PERMUTATIONS hash functions) and put in
+     LSH buckets, one per band of the signature; the band size is chosen so sets at
+     about RECIPE_CACHE_JACCARD similarity collide in at least one band;
+  2) a lookup takes the entries sharing a bucket with the current fridge, keeps those
+     whose exact Jaccard similarity is at least RECIPE_CACHE_JACCARD and whose
+     preferences are compatible (RECIPE_CACHE_MATCH, below), most similar first;
+  3) from them it reuses recipes whose ingredients are all in the current fridge
+     (covered as in favorites_index.covers). Three distinct recipes make a hit; they
+     may come from different entries.
+
+Preference compatibility, for the keys listed in RECIPE_CACHE_MATCH (default
+"isVegan,allergens"): vegan recipes may serve a non-vegan request but not the reverse,
+recipes made avoiding a superset of the requested allergens are fine, and any other
+key (isSpicy, cuisines) must be equal.
+
+A user is never given the same entry twice for the same ingredients (whether it was
+generated for them or served from the cache), so asking again without changing the
+fridge still produces new recipes. Entries expire after
+RECIPE_CACHE_TTL_SECONDS and at most RECIPE_CACHE_MAX_ENTRIES are kept (LRU).
+Enable with RECIPE_CACHE_ENABLED=1. GET /metrics shows the counters under
+"recipe_cache".
+"""
+
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from favorites_index import covers
+from pairings import basket
+
+RECIPE_SLOTS = ("recipe1", "recipe2", "recipe3")
+_PRIME = 4294967311  # the smallest prime above 2**32
+
+
+def lsh_shape(permutations: int, threshold: float) -> tuple:
+    """
+    (bands, rows) with bands * rows == permutations whose collision threshold
+    (1 / bands) ** (1 / rows) is the highest one not above `threshold`.
+    """
+    shapes = [(permutations // rows, rows) for rows in range(1, permutations + 1) if permutations % rows == 0]
+    below = [shape for shape in shapes if (1 / shape[0]) ** (1 / shape[1]) <= threshold]
+    return max(below, key=lambda shape: shape[1]) if below else shapes[0]
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class _Entry:
+    __slots__ = ("key", "names", "preferences", "recipes", "recipe_keys", "bands", "served", "created_at")
+
+    def __init__(self, key, names, preferences, recipes, recipe_keys, bands, user_id):
+        self.key = key
+        self.names = names                # frozenset of canonical ingredient names
+        self.preferences = preferences
+        self.recipes = recipes            # [recipe dict]
+        self.recipe_keys = recipe_keys    # [set of canonical ingredients], per recipe
+        self.bands = bands                # LSH bucket keys
+        self.served = {(user_id, names)}  # (user, ingredients) that already got these recipes
+        self.created_at = time.monotonic()
+
+
+class SimilarRecipeCache:
+    """
+    MinHash/LSH index of recently generated recipes.
+    """
+
+    def __init__(self, threshold: float, match_keys: tuple, max_entries: int, ttl_seconds: float,
+                 permutations: int = 32, seed: int = 1):
+        self.threshold = threshold
+        self.match_keys = match_keys
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.bands, self.rows = lsh_shape(permutations, threshold)
+        rnd = random.Random(seed)
+        self._a = np.array([rnd.randrange(1, 2 ** 32) for _ in range(permutations)], dtype=np.uint64)
+        self._b = np.array([rnd.randrange(0, 2 ** 32) for _ in range(permutations)], dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # entry key -> _Entry
+        self._buckets = {}             # band key -> set of entry keys
+        self._next_key = 0
+        self.counters = {"lookups": 0, "hits": 0, "partial": 0, "misses": 0, "added": 0, "evicted": 0,
+                         "candidates": 0, "partial_served": 0}
+
+    # --- Signatures --- #
+
+    def signature(self, names: frozenset) -> np.ndarray:
+        """
+        MinHash signature of a set of names: one minimum per hash function
+        (a * h + b) mod p, with h a 32-bit hash of the name.
+        """
+        hashes = np.array([int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=4).digest(), "little")
+                           for name in names], dtype=np.uint64)
+        return ((hashes[:, None] * self._a + self._b) % _PRIME).min(axis=0)
+
+    def band_keys(self, names: frozenset) -> list:
+        if not names:
+            return []
+        signature = self.signature(names)
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    # --- Preferences --- #
+
+    def compatible(self, cached: dict, requested: dict) -> bool:
+        for key in self.match_keys:
+            have, want = cached.get(key), requested.get(key)
+            if key == "isVegan":
+                if want and not have:
+                    return False
+            elif key == "allergens":
+                if not {a.lower() for a in want or []} <= {a.lower() for a in have or []}:
+                    return False
+            elif (sorted(have) if isinstance(have, list) else have) != \
+                    (sorted(want) if isinstance(want, list) else want):
+                return False
+        return True
+
+    # --- Cache operations --- #
+
+    def lookup(self, user_id: str, fridge_contents: list, preferences: dict, minimum: int = 3) -> dict | None:
+        """
+        Three cached recipes usable with this fridge and preferences, or None. With a
+        `minimum` below three (a request out of time), fewer recipes will do; the
+        slots left are missing from the answer.
+        """
+        names = frozenset(basket(name for name, _ in fridge_contents))
+        bands = self.band_keys(names)
+        now = time.monotonic()
+        with self._lock:
+            self.counters["lookups"] += 1
+            candidate_keys = set().union(*(self._buckets.get(band, ()) for band in bands)) if bands else set()
+            self.counters["candidates"] += len(candidate_keys)
+            candidates = []
+            for key in candidate_keys:
+                entry = self._entries[key]
+                if now - entry.created_at > self.ttl_seconds:
+                    self._remove(key)
+                    continue
+                if (user_id, names) in entry.served:
+                    continue
+                similarity = jaccard(entry.names, names)
+                if similarity >= self.threshold and self.compatible(entry.preferences, preferences):
+                    candidates.append((similarity, entry))
+
+            chosen, used = [], []
+            for _, entry in sorted(candidates, key=lambda candidate: -candidate[0]):
+                for recipe, keys in zip(entry.recipes, entry.recipe_keys):
+                    if len(chosen) == len(RECIPE_SLOTS):
+                        break
+                    if recipe["name"] in (r["name"] for r in chosen):
+                        continue
+                    if all(any(covers(name, key) for name in names) for key in keys):
+                        chosen.append(recipe)
+                        if entry not in used:
+                            used.append(entry)
+            if len(chosen) < max(minimum, 1):
+                self.counters["partial" if chosen else "misses"] += 1
+                return None
+            for entry in used:
+                entry.served.add((user_id, names))
+                self._entries.move_to_end(entry.key)
+            self.counters["hits" if len(chosen) == len(RECIPE_SLOTS) else "partial_served"] += 1
+        return dict(zip(RECIPE_SLOTS, chosen), omitted_ingredients=[])
+
+    def add(self, user_id: str, fridge_contents: list, preferences: dict, recipes: dict):
+        """
+        Keep freshly generated recipes (complete ones only, not pending slots).
+        """
+        usable = [recipes.get(slot) for slot in RECIPE_SLOTS]
+        if not all(isinstance(recipe, dict) and recipe.get("name") and isinstance(recipe.get("ingredients"), list)
+                   for recipe in usable):
+            return
+        names = frozenset(basket(name for name, _ in fridge_contents))
+        recipe_keys = [set(basket(recipe["ingredients"])) for recipe in usable]
+        bands = self.band_keys(names)
+        if not bands:
+            return
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            entry = _Entry(key, names, dict(preferences or {}), usable, recipe_keys, bands, user_id)
+            self._entries[key] = entry
+            for band in bands:
+                self._buckets.setdefault(band, set()).add(key)
+            self.counters["added"] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.counters["evicted"] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for band in entry.bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            counters["entries"] = len(self._entries)
+        lookups = counters["lookups"]
+        counters["hit_rate"] = counters["hits"] / lookups if lookups else 0.0
+        counters["candidates_per_lookup"] = counters.pop("candidates") / lookups if lookups else 0.0
+        counters.update(jaccard=self.threshold, bands=self.bands, rows=self.rows)
+        return counters
+
+
+def create_recipe_cache() -> SimilarRecipeCache | None:
+    """
+    Build the cache from environment variables, or return None when disabled:
+      RECIPE_CACHE_ENABLED (default "0"), RECIPE_CACHE_JACCARD (default 0.6),
+      RECIPE_CACHE_MATCH (default "isVegan,allergens"), RECIPE_CACHE_MAX_ENTRIES
+      (default 5000), RECIPE_CACHE_TTL_SECONDS (default 3600),
+      RECIPE_CACHE_PERMUTATIONS (default 32).
+    """
+    if os.getenv("RECIPE_CACHE_ENABLED", "0") != "1":
+        return None
+    return SimilarRecipeCache(
+        threshold=float(os.getenv("RECIPE_CACHE_JACCARD", "0.6")),
+        match_keys=tuple(key.strip() for key in os.getenv("RECIPE_CACHE_MATCH", "isVegan,allergens").split(",")
+                         if key.strip()),
+        max_entries=int(os.getenv("RECIPE_CACHE_MAX_ENTRIES", "5000")),
+        ttl_seconds=float(os.getenv("RECIPE_CACHE_TTL_SECONDS", "3600")),
+        permutations=int(os.getenv("RECIPE_CACHE_PERMUTATIONS", "32")),
+    )
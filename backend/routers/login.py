@@ -7,6 +7,7 @@ import httpx
 from datetime import datetime, timedelta, timezone
 import jwt
 from typing import Optional
+import tracing
 
 router = APIRouter()
 
@@ -156,18 +157,33 @@ def get_current_user(token: str = Security(oauth2_scheme)):
     Extract the Google user ID (`sub`) from the JWT token.
     """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with tracing.span("jwt.decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload["sub"]  # Return the Google user ID
     except jwt.DecodeError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
+def decode_user_id(token: str) -> Optional[str]:
+    """
+    Return the user ID (`sub`) from a JWT token, or None if the token is invalid.
+    Used where there is no HTTP request to fail with a 401 (e.g. WebSockets).
+    """
+    try:
+        with tracing.span("jwt.decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        return payload.get("sub")
+    except jwt.InvalidTokenError:
+        return None
+
+
 def get_user_profile(token: str = Security(oauth2_scheme)):
     """
     Extract the full user profile from the JWT token.
     """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with tracing.span("jwt.decode"):
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return {
             "user_id": payload["sub"],
             "email": payload.get("email"),
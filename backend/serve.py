@@ -0,0 +1,267 @@
+"""
+Production entry point: serve main:app from a pre-forked pool of uvicorn workers.
+
+The master process binds the socket and forks the workers. It never imports the app:
+MongoClient and the HTTP clients are not fork-safe, so each worker loads main:app
+after the fork and warms up in the lifespan (MongoDB pool, LLM client connections,
+pairing model; see lifecycle.py) before it accepts connections on the shared socket.
+GET /ready answers 200 from then on. The master then only supervises:
+
+  1) A worker that exits is replaced. One that fails during startup stops the master
+     (the app is broken; restarting would fail the same way).
+  2) Recycling: a worker stops after SERVE_MAX_REQUESTS requests, plus a random
+     0-SERVE_MAX_REQUESTS_JITTER so the workers do not restart together; this bounds
+     what caches and fragmentation can make a process grow to. The worker tells the
+     master when it starts draining, so its replacement is forked and warmed while it
+     finishes its requests. 0 disables recycling.
+  3) SIGTERM / SIGINT are forwarded to the workers, which drain: /ready answers 503
+     right away; after SERVE_DRAIN_NOTICE_SECONDS (time for a load balancer to notice)
+     they stop accepting, give in-flight requests (LLM calls included) up to
+     SERVE_DRAIN_SECONDS to finish, cancel the rest, flush buffered fridge writes and
+     exit. Workers still running 5 seconds after that are killed.
+
+One worker is the default. Several workers only agree on what they serve when the
+state they would otherwise each keep is shared, so serve.py refuses to start more than
+one unless READ_CACHE_BACKEND=shared (one read cache for all, see shared_cache.py) and
+FRIDGE_EVENTS_SOURCE=changestream with FRIDGE_LAYOUT=items (every worker pushes every
+fridge change, see events.py). Some state stays per worker even then:
+  - pending recipe slots (GET /fridge/recipe_slot/{slot_id}) live on the worker that
+    answered /fridge/recipes, so the load balancer must route a client to the same
+    worker (sticky sessions) for its polls to find them;
+  - the route profiler is armed, and pre-generated recipes are kept, per worker.
+
+Usage (from the backend folder; flags override the SERVE_* variables):
+
+    python serve.py
+    READ_CACHE_BACKEND=shared FRIDGE_EVENTS_SOURCE=changestream \\
+        python serve.py --workers 4 --max-requests 5000 --drain-seconds 30
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import uvicorn
+from uvicorn.config import STARTUP_FAILURE
+
+import lifecycle
+
+KILL_GRACE_SECONDS = 5
+# A worker that dies younger than this is restarted after a pause, not in a tight loop
+MIN_WORKER_LIFETIME = 5.0
+
+
+class WorkerServer(uvicorn.Server):
+    """
+    uvicorn.Server that reports draining to lifecycle.py (and, when recycled, to the
+    master), and keeps serving during the drain notice period after SIGTERM.
+    """
+
+    def __init__(self, config: uvicorn.Config, notice_seconds: float, retiring_fd: int):
+        super().__init__(config)
+        self.notice_seconds = notice_seconds
+        self.retiring_fd = retiring_fd
+        self.exit_requested_at = None
+
+    def handle_exit(self, sig, frame):
+        if self.exit_requested_at is None:
+            self.exit_requested_at = time.monotonic()
+            lifecycle.start_draining(self.notice_seconds + self.config.timeout_graceful_shutdown)
+            if self.notice_seconds > 0:
+                self._captured_signals.append(sig)
+                return  # on_tick stops the server when the notice period is over
+        super().handle_exit(sig, frame)
+
+    async def on_tick(self, counter: int) -> bool:
+        if self.exit_requested_at is not None and \
+                time.monotonic() - self.exit_requested_at >= self.notice_seconds:
+            self.should_exit = True
+        stop = await super().on_tick(counter)
+        if stop and not lifecycle.is_draining():
+            # The request limit is reached: this worker is being recycled
+            lifecycle.start_draining(self.config.timeout_graceful_shutdown)
+            os.write(self.retiring_fd, f"{os.getpid()}\n".encode())
+        return stop
+
+
+def shared_state_problems() -> list:
+    """
+    What keeps several workers from serving the same data (empty when nothing does).
+    """
+    problems = []
+    if os.getenv("READ_CACHE_BACKEND", "memory") != "shared":
+        problems.append("READ_CACHE_BACKEND=shared (each worker would serve its own stale cached reads)")
+    if os.getenv("FRIDGE_EVENTS_SOURCE", "local") != "changestream" or os.getenv("FRIDGE_LAYOUT", "items") != "items":
+        problems.append("FRIDGE_EVENTS_SOURCE=changestream with FRIDGE_LAYOUT=items "
+                        "(fridge changes would only reach clients of the worker that made them)")
+    return problems
+
+
+def bind(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock: socket.socket, retiring_fd: int, args):
+    """
+    Body of a forked worker: load main:app, warm up, serve until told to stop.
+    """
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)  # the master's handlers are not ours
+    lifecycle.forked()
+    config = uvicorn.Config(
+        "main:app",
+        lifespan="on",
+        log_level=args.log_level,
+        limit_max_requests=args.max_requests or None,
+        limit_max_requests_jitter=args.max_requests_jitter,
+        timeout_graceful_shutdown=args.drain_seconds,
+    )
+    WorkerServer(config, args.drain_notice_seconds, retiring_fd).run(sockets=[sock])
+
+
+class Master:
+    """
+    Keeps `args.workers` workers serving, and stops them on SIGTERM / SIGINT.
+    """
+
+    def __init__(self, sock: socket.socket, args):
+        self.sock = sock
+        self.args = args
+        self.workers = {}       # pid -> time started
+        self.retiring = set()   # pids of workers draining before being recycled
+        self.stopping = False
+        self.kill_at = None
+        self.respawn_at = 0.0
+        self.retiring_read, self.retiring_write = os.pipe()
+        os.set_blocking(self.retiring_read, False)
+
+    def spawn(self):
+        sys.stdout.flush()  # or the worker would print the master's buffered output again
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(self.retiring_read)
+                run_worker(self.sock, self.retiring_write, self.args)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+        print(f"Started worker {pid} ({len(self.workers)} running)")
+
+    def stop(self, sig, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        self.kill_at = time.monotonic() + self.args.drain_notice_seconds + self.args.drain_seconds + KILL_GRACE_SECONDS
+        print(f"Received {signal.Signals(sig).name}, draining {len(self.workers)} workers")
+        for pid in self.workers:
+            self.signal(pid, signal.SIGTERM)
+
+    def signal(self, pid: int, sig: int):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def read_retiring(self):
+        try:
+            data = os.read(self.retiring_read, 4096)
+        except BlockingIOError:
+            return
+        for line in data.decode().split():
+            if int(line) in self.workers:
+                self.retiring.add(int(line))
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+            recycled = pid in self.retiring
+            self.retiring.discard(pid)
+            code = os.waitstatus_to_exitcode(status)
+            lifetime = time.monotonic() - started
+            print(f"Worker {pid} exited with {code} after {lifetime:.0f}s" + (" (recycled)" if recycled else ""))
+            if self.stopping:
+                continue
+            if code == STARTUP_FAILURE:
+                print("A worker failed to start, stopping")
+                self.stop(signal.SIGTERM, None)
+            elif not recycled and lifetime < MIN_WORKER_LIFETIME:
+                self.respawn_at = time.monotonic() + 1.0
+
+    def run(self):
+        # Identifies this run to the workers' shared state (shared_cache.py)
+        os.environ["SERVE_GENERATION"] = f"{os.getpid()}-{time.time_ns()}"
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        print(f"Master {os.getpid()} serving main:app on {self.args.host}:{self.args.port} "
+              f"with {self.args.workers} workers")
+        while True:
+            self.read_retiring()
+            self.reap()
+            if self.stopping:
+                if not self.workers:
+                    break
+                if time.monotonic() >= self.kill_at:
+                    for pid in self.workers:
+                        print(f"Worker {pid} did not finish draining, killing it")
+                        self.signal(pid, signal.SIGKILL)
+                    self.kill_at = float("inf")
+            elif time.monotonic() >= self.respawn_at:
+                # Workers being recycled do not count: their replacement starts right away
+                while len(self.workers) - len(self.retiring) < self.args.workers:
+                    self.spawn()
+            time.sleep(0.1)
+        print("All workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("SERVE_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVE_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVE_WORKERS", "1")),
+                        help="more than 1 needs the shared read cache and change-stream events (see above)")
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("SERVE_MAX_REQUESTS", "5000")),
+                        help="recycle a worker after this many requests (0 = never)")
+    parser.add_argument("--max-requests-jitter", type=int,
+                        default=int(os.getenv("SERVE_MAX_REQUESTS_JITTER", "500")))
+    parser.add_argument("--drain-seconds", type=float, default=lifecycle.DRAIN_SECONDS,
+                        help="how long in-flight requests get to finish on shutdown (SERVE_DRAIN_SECONDS)")
+    parser.add_argument("--drain-notice-seconds", type=float,
+                        default=float(os.getenv("SERVE_DRAIN_NOTICE_SECONDS", "0")),
+                        help="keep serving this long after SIGTERM while /ready answers 503")
+    parser.add_argument("--log-level", default=os.getenv("SERVE_LOG_LEVEL", "info"))
+    args = parser.parse_args()
+    if args.workers > 1:
+        problems = shared_state_problems()
+        if problems:
+            parser.error(f"--workers {args.workers} needs " + " and ".join(problems))
+
+    Master(bind(args.host, args.port), args).run()
+
+
+if __name__ == "__main__":
+    main()
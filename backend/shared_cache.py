@@ -0,0 +1,324 @@
+"""
+This file implements a read cache shared by all the worker processes of a container,
+with the same interface as cache.LRUCache (get, put, get_or_load, invalidate, clear,
+stats), so create_read_cache can return either (READ_CACHE_BACKEND=shared).
+
+With serve.py running several workers, per-process caches hold N copies of every
+profile, fridge and favorites list, and each worker misses on its own. Here the
+entries live in one memory-mapped file (in /dev/shm by default, so RAM), which every
+worker maps after the fork:
+
+  - A fixed-slot hash table: the file is a 64-byte header, one invalidation counter
+    per bucket, then slots of READ_CACHE_SLOT_BYTES (default 2048), grouped in
+    buckets of WAYS slots. A key hashes to one bucket and lives in any of its slots.
+    Each slot is a 32-byte header (sequence number, key hash, expiry, key and value
+    lengths, CRC32, flags) followed by the key (its repr) and the value (pickled, and
+    zlib-compressed if that is what it takes to fit). Values that still do not fit are
+    not cached ("too_large").
+  - Reads take no lock. A writer makes the slot's sequence number odd while it writes,
+    and even again after; a reader retries if it saw an odd number, if the number
+    changed while it copied the slot, or if the CRC does not match (a torn copy).
+  - Writes lock one of STRIPES stripes of buckets: a thread lock for this process and
+    an fcntl byte-range lock on the file for the other workers.
+  - A load that an invalidation overtook is not cached: `get_or_load` reads the
+    bucket's invalidation counter before calling the loader, and only puts the result
+    if the counter has not moved when it holds the stripe lock (an invalidation of any
+    key of the bucket, in any worker, drops it; the next read simply loads again).
+  - Entries expire after the TTL (wall clock, the same in every worker). A put into a
+    full bucket evicts the entry closest to expiring, that is the oldest one.
+
+An invalidation reaches every worker at once, instead of leaving the other workers'
+copies stale until their TTL. The file outlives the workers; the first worker of a new
+serve.py run (a new SERVE_GENERATION) clears it, so entries never survive a restart
+(or a deploy that changes what is cached). Its name includes the table geometry, so
+a configuration change starts a new file.
+The counters in the stats are this worker's (and approximate: they are not locked).
+"""
+
+import fcntl
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from cache import MISSING
+
+MAGIC = b"FRIDGE-SHARED-CACHE-2"
+FILE_HEADER_BYTES = 64
+# sequence, key hash, expires at, key length, value length, CRC32 of key + value, flags
+SLOT_HEADER = struct.Struct("<IQdHIIH")
+COMPRESSED = 1  # flag: the value is zlib-compressed
+SEQUENCE = struct.Struct("<I")
+KEY_HASH = struct.Struct("<Q")  # at offset 4 of the slot header
+INVALIDATIONS = struct.Struct("<Q")  # per bucket, after the file header
+WAYS = 4             # slots per bucket
+STRIPES = 64         # write locks
+READ_RETRIES = 8     # attempts at a consistent copy of a slot being written
+INIT_LOCK_OFFSET = STRIPES  # byte locked while a worker sizes and stamps the file
+GENERATION_OFFSET = 32      # in the file header, after MAGIC
+
+
+def default_directory() -> str:
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def key_bytes(key) -> bytes:
+    """
+    The stored form of a key: its repr, the same in every process (unlike hash()).
+    """
+    return repr(key).encode("utf-8")
+
+
+def key_hash(encoded_key: bytes) -> int:
+    # Two cheap checksums make 64 bits (keys are compared in full anyway). Never 0:
+    # a slot with hash 0 is empty.
+    return (zlib.crc32(encoded_key) << 32 | zlib.adler32(encoded_key)) | 1
+
+
+class SharedCache:
+    """
+    Cross-process cache in a memory-mapped file, bounded by `max_bytes` of slots.
+    Keys are hashable tuples of strings and numbers, e.g. ("fridge", user_id).
+    """
+
+    def __init__(self, name: str, max_bytes: int, ttl_seconds: float, slot_bytes: int = 2048,
+                 directory: str | None = None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.slot_bytes = max(slot_bytes, SLOT_HEADER.size + 64)
+        self.buckets = max(1, max_bytes // (self.slot_bytes * WAYS))
+        self.max_bytes = self.buckets * WAYS * self.slot_bytes
+        counters_bytes = -(-self.buckets * INVALIDATIONS.size // 64) * 64
+        self.slots_offset = FILE_HEADER_BYTES + counters_bytes
+        self.path = os.path.join(directory or default_directory(),
+                                 f"{name}-{self.buckets * WAYS}x{self.slot_bytes}.cache")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.too_large = 0
+        self.retries = 0
+        self.stale_loads = 0
+        # Workers forked by one serve.py master share a generation; anything else starts afresh
+        self.generation = os.getenv("SERVE_GENERATION") or f"pid-{os.getpid()}"
+        self._locks = [threading.Lock() for _ in range(STRIPES)]
+        self._open()
+
+    def _open(self):
+        """
+        Map the file, creating it if needed. The first worker of a new generation
+        clears what an earlier run left behind.
+        """
+        size = self.slots_offset + self.max_bytes
+        header = MAGIC.ljust(GENERATION_OFFSET, b"\0") + self.generation.encode()[:FILE_HEADER_BYTES - GENERATION_OFFSET]
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, INIT_LOCK_OFFSET)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)  # zero-filled: every slot empty
+            self._map = mmap.mmap(self._fd, size)
+            if self._map[:len(header)] != header:
+                self.clear()
+                self._map[:FILE_HEADER_BYTES] = header.ljust(FILE_HEADER_BYTES, b"\0")
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, INIT_LOCK_OFFSET)
+
+    def _bucket_offset(self, hashed: int) -> tuple:
+        """
+        (stripe, offset of the first slot, offset of the invalidation counter) of a key's bucket.
+        """
+        bucket = (hashed >> 32) % self.buckets  # the CRC32 half: Adler-32 spreads short keys badly
+        return (bucket % STRIPES, self.slots_offset + bucket * WAYS * self.slot_bytes,
+                FILE_HEADER_BYTES + bucket * INVALIDATIONS.size)
+
+    def _invalidated(self, counter: int):
+        INVALIDATIONS.pack_into(self._map, counter, INVALIDATIONS.unpack_from(self._map, counter)[0] + 1)
+
+    @contextmanager
+    def _locked(self, stripe: int):
+        with self._locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+
+    # --- Reads (no lock) --- #
+
+    def _read(self, offset: int, hashed: int, encoded_key: bytes, now: float):
+        """
+        The value in the slot at `offset` if it holds `encoded_key` unexpired, else MISSING.
+        """
+        shared = self._map
+        for _ in range(READ_RETRIES):
+            sequence, slot_hash, expires_at, key_length, value_length, crc, flags = SLOT_HEADER.unpack_from(shared, offset)
+            if sequence & 1:
+                self.retries += 1
+                continue  # being written
+            if slot_hash != hashed or expires_at < now:
+                return MISSING
+            start = offset + SLOT_HEADER.size
+            payload = shared[start:start + key_length + value_length]
+            if SEQUENCE.unpack_from(shared, offset)[0] != sequence or zlib.crc32(payload) != crc:
+                self.retries += 1
+                continue  # rewritten while we copied it
+            if payload[:key_length] != encoded_key:
+                return MISSING  # another key with the same hash
+            value = payload[key_length:]
+            return pickle.loads(zlib.decompress(value) if flags & COMPRESSED else value)
+        return MISSING
+
+    def get(self, key):
+        """
+        Return the cached value for `key`, or MISSING.
+        """
+        encoded_key = key_bytes(key)
+        hashed = key_hash(encoded_key)
+        _, offset, _ = self._bucket_offset(hashed)
+        now = time.time()
+        for slot in range(offset, offset + WAYS * self.slot_bytes, self.slot_bytes):
+            if KEY_HASH.unpack_from(self._map, slot + 4)[0] != hashed:
+                continue  # cheap first look; a slot caught mid-write is at worst a miss
+            value = self._read(slot, hashed, encoded_key, now)
+            if value is not MISSING:
+                self.hits += 1
+                return value
+        self.misses += 1
+        return MISSING
+
+    # --- Writes (stripe lock) --- #
+
+    def _find(self, offset: int, hashed: int, encoded_key: bytes) -> int | None:
+        """
+        Offset of the slot holding `encoded_key` in the bucket at `offset`, if any.
+        """
+        for way in range(WAYS):
+            slot = offset + way * self.slot_bytes
+            _, slot_hash, _, key_length, _, _, _ = SLOT_HEADER.unpack_from(self._map, slot)
+            start = slot + SLOT_HEADER.size
+            if slot_hash == hashed and self._map[start:start + key_length] == encoded_key:
+                return slot
+        return None
+
+    def _victim(self, offset: int, now: float) -> tuple:
+        """
+        (offset, evicting) of the slot to write a new key into: an empty or expired
+        one, else the one closest to expiring.
+        """
+        oldest, oldest_expiry = offset, float("inf")
+        for way in range(WAYS):
+            slot = offset + way * self.slot_bytes
+            _, slot_hash, expires_at, _, _, _, _ = SLOT_HEADER.unpack_from(self._map, slot)
+            if slot_hash == 0 or expires_at < now:
+                return slot, False
+            if expires_at < oldest_expiry:
+                oldest, oldest_expiry = slot, expires_at
+        return oldest, True
+
+    def _write(self, slot: int, hashed: int, expires_at: float, encoded_key: bytes = b"", value: bytes = b"",
+               flags: int = 0):
+        shared = self._map
+        sequence = SEQUENCE.unpack_from(shared, slot)[0]
+        SEQUENCE.pack_into(shared, slot, (sequence + 1) & 0xFFFFFFFF)  # odd: readers keep off
+        payload = encoded_key + value
+        start = slot + SLOT_HEADER.size
+        shared[start:start + len(payload)] = payload
+        SLOT_HEADER.pack_into(shared, slot, (sequence + 1) & 0xFFFFFFFF, hashed, expires_at,
+                              len(encoded_key), len(value), zlib.crc32(payload), flags)
+        SEQUENCE.pack_into(shared, slot, (sequence + 2) & 0xFFFFFFFF)
+
+    def put(self, key, value):
+        self._put(key, value)
+
+    def _put(self, key, value, invalidations: int | None = None):
+        """
+        Write `key`, unless `invalidations` is given and the bucket's counter moved past it.
+        """
+        encoded_key = key_bytes(key)
+        encoded_value = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        room = self.slot_bytes - SLOT_HEADER.size - len(encoded_key)
+        flags = 0
+        if len(encoded_value) > room:
+            encoded_value, flags = zlib.compress(encoded_value, 1), COMPRESSED
+            if len(encoded_value) > room:
+                self.too_large += 1
+                return
+        hashed = key_hash(encoded_key)
+        stripe, offset, counter = self._bucket_offset(hashed)
+        now = time.time()
+        with self._locked(stripe):
+            if invalidations is not None and INVALIDATIONS.unpack_from(self._map, counter)[0] != invalidations:
+                self.stale_loads += 1
+                return
+            slot = self._find(offset, hashed, encoded_key)
+            if slot is None:
+                slot, evicting = self._victim(offset, now)
+                if evicting:
+                    self.evictions += 1
+            self._write(slot, hashed, now + self.ttl_seconds, encoded_key, encoded_value, flags)
+
+    def get_or_load(self, key, loader):
+        """
+        Read-through: return the cached value, or call `loader()` and cache its result,
+        unless the key's bucket was invalidated while it was loading (in any worker).
+        """
+        value = self.get(key)
+        if value is MISSING:
+            _, _, counter = self._bucket_offset(key_hash(key_bytes(key)))
+            invalidations = INVALIDATIONS.unpack_from(self._map, counter)[0]
+            value = loader()
+            self._put(key, value, invalidations)
+        return value
+
+    def invalidate(self, key):
+        encoded_key = key_bytes(key)
+        hashed = key_hash(encoded_key)
+        stripe, offset, counter = self._bucket_offset(hashed)
+        with self._locked(stripe):
+            self._invalidated(counter)
+            slot = self._find(offset, hashed, encoded_key)
+            if slot is not None:
+                self._write(slot, 0, 0.0)
+        self.invalidations += 1
+
+    def clear(self):
+        for bucket in range(self.buckets):
+            offset = self.slots_offset + bucket * WAYS * self.slot_bytes
+            with self._locked(bucket % STRIPES):
+                self._invalidated(FILE_HEADER_BYTES + bucket * INVALIDATIONS.size)
+                for way in range(WAYS):
+                    self._write(offset + way * self.slot_bytes, 0, 0.0)
+
+    def stats(self) -> dict:
+        entries = used_bytes = 0
+        now = time.time()
+        for slot in range(self.slots_offset, self.slots_offset + self.max_bytes, self.slot_bytes):
+            _, slot_hash, expires_at, key_length, value_length, _, _ = SLOT_HEADER.unpack_from(self._map, slot)
+            if slot_hash and expires_at >= now:
+                entries += 1
+                used_bytes += SLOT_HEADER.size + key_length + value_length
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "backend": "shared",
+            "path": self.path,
+            "entries": entries,
+            "slots": self.buckets * WAYS,
+            "slot_bytes": self.slot_bytes,
+            "bytes": used_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "too_large": self.too_large,
+            "read_retries": self.retries,
+            "stale_loads": self.stale_loads,
+        }
@@ -0,0 +1,11 @@
+"""
+Shared setup for the backend tests (run `pytest tests/` from the backend folder).
+
+The backend modules are imported by their flat names (`import llm_scheduler`), as
+main.py does, so the backend folder goes on the import path.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,111 @@
+"""
+Tests for the fridge event bus and the change-stream watcher (events.py), with the
+fridge_items collection and its change streams replaced by unittest.mock objects.
+"""
+
+import asyncio
+import threading
+from unittest import mock
+
+from pymongo.errors import AutoReconnect, OperationFailure
+
+import events
+from events import FridgeEventBus, start_change_stream
+
+
+def upsert(user_id: str, name: str, quantity: int) -> dict:
+    return {"operationType": "update", "documentKey": {"_id": f"id-{name}"},
+            "fullDocument": {"user_id": user_id, "name": name, "quantity": quantity}}
+
+
+class FakeStream:
+    """
+    A change stream that delivers `changes` (advancing its resume token with each), then
+    raises `error`, or blocks for good when there is none.
+    """
+
+    def __init__(self, changes, error=None, token=None):
+        self.changes = changes
+        self.error = error
+        self.resume_token = token
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __iter__(self):
+        for change in self.changes:
+            self.resume_token = {"_data": change["documentKey"]["_id"]}
+            yield change
+        if self.error is not None:
+            raise self.error
+        threading.Event().wait()
+
+
+def watch_calls(streams):
+    """
+    A collection whose watch() returns (or raises) the given items in order.
+    """
+    collection = mock.MagicMock()
+    collection.name = "fridge_items"
+    collection.watch.side_effect = streams
+    return collection
+
+
+def receive(bus: FridgeEventBus, user_id: str, count: int, start) -> list:
+    """
+    Subscribe as `user_id`, call start(), and return the first `count` events delivered.
+    """
+    async def subscriber():
+        subscription = bus.subscribe(user_id)
+        start()
+        return [await asyncio.wait_for(subscription.get(), timeout=5) for _ in range(count)]
+    return asyncio.run(subscriber())
+
+
+def test_a_restarted_stream_resumes_after_the_last_change():
+    bus = FridgeEventBus()
+    collection = watch_calls([
+        FakeStream([upsert("user-1", "egg", 2)], error=AutoReconnect("connection reset")),
+        FakeStream([upsert("user-1", "milk", 1)]),
+    ])
+
+    with mock.patch.object(events, "RESTART_SECONDS", 0):
+        received = receive(bus, "user-1", 2, lambda: start_change_stream(collection, bus))
+
+    assert [event["item"]["name"] for event in received] == ["egg", "milk"]
+    first, second = collection.watch.call_args_list
+    assert first.kwargs["resume_after"] is None
+    assert second.kwargs["resume_after"] == {"_data": "id-egg"}
+
+
+def test_a_stream_that_cannot_resume_asks_clients_to_resync():
+    bus = FridgeEventBus()
+    history_lost = OperationFailure("Resume of change stream was not possible", code=286)
+    collection = watch_calls([
+        FakeStream([upsert("user-1", "egg", 2)], error=AutoReconnect("connection reset")),
+        history_lost,
+        FakeStream([upsert("user-1", "milk", 1)]),
+    ])
+
+    with mock.patch.object(events, "RESTART_SECONDS", 0):
+        received = receive(bus, "user-1", 3, lambda: start_change_stream(collection, bus))
+
+    assert received[0]["item"]["name"] == "egg"
+    assert received[1] == {"type": "resync"}
+    assert received[2]["item"]["name"] == "milk"
+    resumed_after = [call.kwargs["resume_after"] for call in collection.watch.call_args_list]
+    assert resumed_after == [None, {"_data": "id-egg"}, None]
+
+
+def test_publish_all_reaches_every_user():
+    bus = FridgeEventBus()
+
+    async def subscribers():
+        first, second = bus.subscribe("user-1"), bus.subscribe("user-2")
+        bus.publish_all({"type": "resync"})
+        return [await asyncio.wait_for(subscription.get(), timeout=5) for subscription in (first, second)]
+
+    assert asyncio.run(subscribers()) == [{"type": "resync"}, {"type": "resync"}]
@@ -0,0 +1,214 @@
+"""
+Tests for the outbound LLM scheduler (llm_scheduler.py), against a fake provider that
+enforces its rate limits the way the real ones do: a call over the limit gets a 429.
+"""
+
+import asyncio
+import time
+from unittest import mock
+
+import httpx
+import openai
+import pytest
+
+import llm_scheduler
+from perf.fake_llm import RateLimit
+
+PROVIDER = "fake"
+TOKENS = 100
+
+
+def rate_limit_error(retry_after: float) -> openai.RateLimitError:
+    response = httpx.Response(429, headers={"retry-after-ms": str(int(retry_after * 1000))},
+                              request=httpx.Request("POST", "http://fake-llm/v1/chat/completions"))
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class FakeProvider:
+    """
+    Answers after `latency` seconds, or 429 right away when a call is over its RateLimit.
+    reject() makes it answer 429 to the next call (after `latency`) whatever the limits.
+    """
+
+    def __init__(self, max_concurrent: int = 0, latency: float = 0.02):
+        self.limit = RateLimit(max_concurrent)
+        self.latency = latency
+        self.rejections = []  # retry-after of the calls to answer 429 to, in order
+        self.rate_limited = []  # when each 429 was sent
+        self.started = []  # (when, user, priority) of every call answered
+
+    def reject(self, retry_after: float):
+        self.rejections.append(retry_after)
+
+    async def complete(self, user, priority):
+        if self.rejections:
+            retry_after = self.rejections.pop(0)
+            await asyncio.sleep(self.latency)
+            self.rate_limited.append(time.monotonic())
+            raise rate_limit_error(retry_after)
+        wait = self.limit.admit(TOKENS)
+        if wait is not None:
+            self.rate_limited.append(time.monotonic())
+            raise rate_limit_error(wait)
+        self.started.append((time.monotonic(), user, priority))
+        try:
+            await asyncio.sleep(self.latency)
+            return user
+        finally:
+            self.limit.release()
+
+
+@pytest.fixture(autouse=True)
+def schedulers():
+    """
+    Keep the schedulers configured by a test out of the process-wide registry.
+    """
+    with mock.patch.dict(llm_scheduler._schedulers, clear=True):
+        yield
+
+
+async def call(provider: FakeProvider, user, priority=llm_scheduler.INTERACTIVE):
+    with llm_scheduler.caller(priority, user):
+        return await llm_scheduler.run(PROVIDER, TOKENS, lambda: provider.complete(user, priority))
+
+
+async def hold_the_slot(provider: FakeProvider, release: asyncio.Event):
+    """
+    Take the only slot until `release` is set, so the calls started next all queue.
+    """
+    async def blocked():
+        await release.wait()
+        return await provider.complete("holder", llm_scheduler.INTERACTIVE)
+
+    with llm_scheduler.caller(llm_scheduler.INTERACTIVE, "holder"):
+        task = asyncio.create_task(llm_scheduler.run(PROVIDER, TOKENS, blocked))
+    await asyncio.sleep(0.01)
+    return task
+
+
+def test_never_more_calls_than_the_concurrency_cap():
+    provider = FakeProvider(max_concurrent=3)
+    scheduler = llm_scheduler.configure(PROVIDER, 3)
+
+    async def burst():
+        return await asyncio.gather(*(call(provider, f"user-{i % 5}") for i in range(30)))
+
+    results = asyncio.run(burst())
+
+    assert results == [f"user-{i % 5}" for i in range(30)]
+    assert provider.rate_limited == []
+    assert provider.limit.peak_active == 3
+    assert scheduler.stats()["running"] == {llm_scheduler.INTERACTIVE: 0, llm_scheduler.BACKGROUND: 0}
+
+
+def test_the_fake_provider_enforces_its_cap():
+    provider = FakeProvider(max_concurrent=3)
+    llm_scheduler.configure(PROVIDER, 10)  # more than the provider allows
+
+    async def burst():
+        return await asyncio.gather(*(call(provider, f"user-{i}") for i in range(10)), return_exceptions=True)
+
+    with mock.patch.object(llm_scheduler, "RATE_LIMIT_RETRIES", 0):
+        results = asyncio.run(burst())
+
+    assert sum(isinstance(result, openai.RateLimitError) for result in results) == 7
+    assert provider.limit.peak_active == 3
+
+
+def test_background_calls_keep_to_their_share():
+    provider = FakeProvider(max_concurrent=4)
+    llm_scheduler.configure(PROVIDER, 4)  # LLM_BACKGROUND_SHARE 0.5: 2 background calls at a time
+
+    async def burst():
+        await asyncio.gather(*(call(provider, f"pregen-{i}", llm_scheduler.BACKGROUND) for i in range(12)))
+
+    asyncio.run(burst())
+
+    assert provider.rate_limited == []
+    assert provider.limit.peak_active == 2
+
+
+def test_a_429_pauses_the_provider_for_everybody():
+    provider = FakeProvider(max_concurrent=4, latency=0.05)
+    scheduler = llm_scheduler.configure(PROVIDER, 4)
+    provider.reject(retry_after=0.3)
+
+    async def burst():
+        return await asyncio.gather(*(call(provider, f"user-{i}") for i in range(12)))
+
+    results = asyncio.run(burst())
+
+    # The call that got the 429 was queued again and answered; nobody else got one
+    assert results == [f"user-{i}" for i in range(12)]
+    assert len(provider.rate_limited) == 1
+    assert scheduler.stats()["rate_limited"] == 1
+    # Calls in flight before the 429 finished, but none started during the pause
+    paused_at = provider.rate_limited[0]
+    started_after = [when for when, _, _ in provider.started if when > paused_at]
+    assert started_after
+    assert min(started_after) >= paused_at + 0.3 - 0.01
+
+
+def test_users_take_turns():
+    provider = FakeProvider(max_concurrent=1)
+    llm_scheduler.configure(PROVIDER, 1)
+
+    async def burst():
+        release = asyncio.Event()
+        holder = await hold_the_slot(provider, release)
+        heavy = [asyncio.create_task(call(provider, "heavy")) for _ in range(6)]
+        await asyncio.sleep(0.01)
+        light = [asyncio.create_task(call(provider, user)) for user in ("light-1", "light-2")]
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(holder, *heavy, *light)
+
+    asyncio.run(burst())
+
+    order = [user for _, user, _ in provider.started]
+    # The light users queued behind six heavy calls, but each waits for one of them only
+    assert order == ["holder", "heavy", "light-1", "light-2", "heavy", "heavy", "heavy", "heavy", "heavy"]
+    assert provider.rate_limited == []
+
+
+def test_interactive_calls_go_before_background_ones():
+    provider = FakeProvider(max_concurrent=1)
+    llm_scheduler.configure(PROVIDER, 1)
+
+    async def burst():
+        release = asyncio.Event()
+        holder = await hold_the_slot(provider, release)
+        background = [asyncio.create_task(call(provider, f"pregen-{i}", llm_scheduler.BACKGROUND))
+                      for i in range(3)]
+        await asyncio.sleep(0.01)
+        interactive = [asyncio.create_task(call(provider, f"user-{i}")) for i in range(2)]
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(holder, *background, *interactive)
+
+    asyncio.run(burst())
+
+    priorities = [priority for _, user, priority in provider.started if user != "holder"]
+    assert priorities == [llm_scheduler.INTERACTIVE] * 2 + [llm_scheduler.BACKGROUND] * 3
+
+
+def test_a_cancelled_wait_leaves_the_queue():
+    provider = FakeProvider(max_concurrent=1)
+    scheduler = llm_scheduler.configure(PROVIDER, 1)
+
+    async def burst():
+        release = asyncio.Event()
+        holder = await hold_the_slot(provider, release)
+        waiting = asyncio.create_task(call(provider, "gone"))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        await holder
+        return await call(provider, "next")
+
+    assert asyncio.run(burst()) == "next"
+    assert [user for _, user, _ in provider.started] == ["holder", "next"]
+    stats = scheduler.stats()
+    assert stats["abandoned"] == 1
+    assert stats["waiting"] == {llm_scheduler.INTERACTIVE: 0, llm_scheduler.BACKGROUND: 0}
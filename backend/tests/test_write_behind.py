@@ -0,0 +1,183 @@
+"""
+Tests for the fridge write-behind buffer (writebehind.py): the same sequence of fridge
+changes is applied directly to one store and through the buffer to another, and the
+documents left in MongoDB (mongomock) must be the same.
+"""
+
+import os
+import random
+from unittest import mock
+
+import pytest
+
+from fridge_store import ITEMS, DOCUMENT, ItemsFridgeStore, DocumentFridgeStore
+from perf.stack import patch_mongomock
+from writebehind import WriteBehindBuffer
+
+USER = "wb-test-user"
+NAMES = ["egg", "milk", "tomato", "onion", "olive.oil"]
+
+
+@pytest.fixture(scope="module")
+def mongomock_db():
+    patch_mongomock()
+    import mongomock
+    return mongomock.MongoClient().db
+
+
+def create_store(db, layout: str, collection: str):
+    if layout == ITEMS:
+        store = ItemsFridgeStore(db[collection])
+    else:
+        store = DocumentFridgeStore(db[collection])
+    store.ensure_indexes()
+    return store
+
+
+def random_operations(seed: int, steps: int) -> list:
+    rng = random.Random(seed)
+    operations = []
+    for _ in range(steps):
+        kind = rng.choices(["add", "remove", "remove_all", "update", "flush"], weights=[5, 4, 1, 2, 1])[0]
+        operations.append((kind, rng.choice(NAMES), rng.randint(1, 3)))
+    return operations
+
+
+def apply(operation, read_rows, increment, set_quantity):
+    """
+    One fridge change, the way the /fridge/add, /fridge/remove and
+    /fridge/update_quantity endpoints make it.
+    """
+    kind, name, quantity = operation
+    current = {row_name: row_quantity for _, row_name, row_quantity in read_rows()}.get(name)
+    if kind == "add":
+        increment(USER, name, quantity)
+    elif kind == "remove_all" and current is not None:
+        set_quantity(USER, name, 0)
+    elif kind == "remove" and current is not None and current >= quantity:
+        set_quantity(USER, name, current - quantity)
+    elif kind == "update" and current is not None:
+        set_quantity(USER, name, quantity)
+
+
+def fridge_state(rows) -> list:
+    return sorted((name, quantity) for _, name, quantity in rows)
+
+
+def stored_documents(store) -> list:
+    """
+    What the store holds in MongoDB for USER, without the generated ids.
+    """
+    if store.layout == ITEMS:
+        return sorted((doc["user_id"], doc["name"], doc["quantity"])
+                      for doc in store.collection.find({"user_id": USER}))
+    document = store.collection.find_one({"_id": USER}) or {"items": {}}
+    return sorted((key, item["name"], item["quantity"]) for key, item in document["items"].items())
+
+
+@pytest.mark.parametrize("layout", [ITEMS, DOCUMENT])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_buffered_writes_leave_the_same_documents_as_direct_ones(mongomock_db, layout, seed):
+    direct = create_store(mongomock_db, layout, f"direct_{layout}_{seed}")
+    buffered = create_store(mongomock_db, layout, f"buffered_{layout}_{seed}")
+    buffer = WriteBehindBuffer(buffered.apply_changes, window_seconds=60)  # flushed by hand
+
+    def read_buffered():
+        return buffer.read(USER, lambda: buffered.load_rows(USER))
+
+    for step, operation in enumerate(random_operations(seed, 400)):
+        if operation[0] == "flush":
+            ids_before = {name: item_id for item_id, name, _ in read_buffered()}
+            buffer.flush_user(USER)
+            # Items created while buffered keep the id they were shown with
+            assert {name: item_id for item_id, name, _ in buffered.load_rows(USER)} == ids_before
+            continue
+        apply(operation, lambda: direct.load_rows(USER), direct.increment, direct.set_quantity)
+        apply(operation, read_buffered, buffer.increment, buffer.set_quantity)
+        # Reads through the buffer see the pending changes
+        assert fridge_state(read_buffered()) == fridge_state(direct.load_rows(USER)), f"step {step}: {operation}"
+
+    buffer.close()
+    assert buffer.stats()["pending_changes"] == 0
+    assert buffer.stats()["flush_errors"] == 0
+    assert stored_documents(buffered) == stored_documents(direct)
+
+
+def test_coalesced_changes_are_one_write(mongomock_db):
+    store = create_store(mongomock_db, ITEMS, "coalesced")
+    store.increment(USER, "egg", 2)
+    writes = []
+
+    def flush(user_id, changes):
+        writes.append({name: (change.kind, change.quantity) for name, change in changes.items()})
+        store.apply_changes(user_id, changes)
+
+    buffer = WriteBehindBuffer(flush, window_seconds=60)
+    for _ in range(3):
+        buffer.increment(USER, "egg", 1)
+    buffer.increment(USER, "egg", -1)
+    buffer.set_quantity(USER, "milk", 0)
+    buffer.increment(USER, "milk", 4)
+    buffer.close()
+
+    assert writes == [{"egg": ("inc", 2), "milk": ("set", 4)}]
+    assert fridge_state(store.load_rows(USER)) == [("egg", 4), ("milk", 4)]
+
+
+@pytest.fixture(scope="module")
+def app_module(mongomock_db):
+    """
+    main.py with the write-behind buffer on, against mongomock.
+    """
+    environment = {"MONGODB_DB": "fridge_test", "FRIDGE_WRITE_BEHIND_MS": "20", "TRACING_ENABLED": "0"}
+    with mock.patch.dict(os.environ, environment):
+        import main
+    if main.fridge_write_buffer is None:
+        pytest.skip("main.py was imported without the write-behind buffer")
+    return main
+
+
+def test_endpoints_buffered_and_direct_agree(app_module):
+    import jwt
+    from fastapi.testclient import TestClient
+    from routers.login import SECRET_KEY, ALGORITHM
+
+    backend = app_module
+    buffer = backend.fridge_write_buffer
+    users = {"direct": "wb-test-direct", "buffered": "wb-test-buffered"}
+    headers = {
+        mode: {"Authorization": "Bearer " + jwt.encode({"sub": user_id, "name": mode}, SECRET_KEY, algorithm=ALGORITHM)}
+        for mode, user_id in users.items()
+    }
+    requests = {
+        "add": lambda name, quantity: ("POST", "/fridge/add", {"name": name, "quantity": quantity}),
+        "remove": lambda name, quantity: ("DELETE", "/fridge/remove", {"name": name, "quantity": quantity}),
+        "remove_all": lambda name, quantity: ("DELETE", "/fridge/remove", {"name": name, "quantity": 1000000000}),
+        "update": lambda name, quantity: ("PUT", "/fridge/update_quantity", {"name": name, "quantity": quantity}),
+    }
+
+    def call(client, mode, method, path, body):
+        # The endpoints read the module-level buffer, so switch it per call
+        with mock.patch.object(backend, "fridge_write_buffer", buffer if mode == "buffered" else None):
+            return client.request(method, path, json=body, headers=headers[mode])
+
+    with TestClient(backend.app) as client:  # runs the lifespan, so the flusher thread is on
+        for step, (kind, name, quantity) in enumerate(random_operations(1, 300)):
+            if kind == "flush":
+                buffer.flush_all()
+                continue
+            method, path, body = requests[kind](name, quantity)
+            direct = call(client, "direct", method, path, body)
+            buffered = call(client, "buffered", method, path, body)
+            assert direct.status_code == buffered.status_code, f"step {step}: {method} {path} {body}"
+            if direct.status_code == 200:
+                assert fridge_state((None, item["name"], item["quantity"]) for item in direct.json()["all_items"]) == \
+                    fridge_state((None, item["name"], item["quantity"]) for item in buffered.json()["all_items"])
+    # Leaving the TestClient ran the shutdown flush
+
+    assert buffer.stats()["pending_changes"] == 0
+    backend.read_cache.clear()
+    assert fridge_state(backend.load_fridge_rows(users["direct"])) == \
+        fridge_state(backend.load_fridge_rows(users["buffered"]))
+    for user_id in users.values():
+        backend.fridge_store.delete_user(user_id)
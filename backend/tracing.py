@@ -0,0 +1,355 @@
+"""
+This file implements lightweight per-request tracing.
+
+Every HTTP request gets a trace: a tree of timed spans (JWT decode, each MongoDB
+command, prompt building, the upstream LLM call, JSON parsing, Pydantic validation...).
+Code opens spans with:
+
+    with tracing.span("llm.chat_completions", model="gpt-4o"):
+        ...
+
+which is a cheap no-op when there is no active trace. MongoDB commands are traced
+automatically through a pymongo CommandListener (see `register_mongo_listener`).
+
+The request ID comes from the X-Request-ID header (nginx forwards it) or is generated,
+and is echoed back in the response. Finished traces are:
+  - exported when sampled (TRACE_SAMPLE_RATE, default 0.01): appended to a JSONL file
+    (TRACE_EXPORT_FILE) and/or sent to an OTLP/HTTP collector (TRACE_OTLP_ENDPOINT,
+    e.g. http://otel-collector:4318/v1/traces) from a background thread;
+  - printed as an indented span tree when slower than TRACE_SLOW_MS (default 2000),
+    whether sampled or not.
+Set TRACING_ENABLED=0 to turn all of it off.
+"""
+
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") == "1"
+SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))
+EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")
+OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "recipe-backend")
+
+# The trace of the request being handled, and the innermost open span
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """
+    All spans recorded for one request. Spans may be added from worker threads.
+    """
+    __slots__ = ("request_id", "trace_id", "sampled", "spans", "lock", "mongo_spans")
+
+    def __init__(self, request_id: str, sampled: bool):
+        self.request_id = request_id
+        # OTLP wants 32 hex chars; reuse the request ID when it already is one
+        self.trace_id = request_id if _is_hex(request_id, 32) else uuid.uuid5(uuid.NAMESPACE_OID, request_id).hex
+        self.sampled = sampled
+        self.spans = []
+        self.lock = threading.Lock()
+        self.mongo_spans = {}  # pymongo request_id -> (Span, token)
+
+    def add(self, span: Span):
+        with self.lock:
+            self.spans.append(span)
+
+
+def _is_hex(value: str, length: int) -> bool:
+    return len(value) == length and all(c in "0123456789abcdef" for c in value.lower())
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a block as a child of the current span. No-op outside a traced request.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent else None, attributes)
+    trace.add(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+
+def current_request_id() -> str | None:
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+# --------------------------------------------------------------------------- #
+# MongoDB commands
+# --------------------------------------------------------------------------- #
+
+def register_mongo_listener():
+    """
+    Trace every MongoDB command. Must run before the MongoClient is created.
+    """
+    if not TRACING_ENABLED:
+        return
+    from pymongo import monitoring
+
+    class _MongoCommandListener(monitoring.CommandListener):
+        def started(self, event):
+            trace = _current_trace.get()
+            if trace is None:
+                return
+            parent = _current_span.get()
+            attributes = {"db.operation": event.command_name, "db.name": event.database_name}
+            collection = event.command.get(event.command_name)
+            if isinstance(collection, str):
+                attributes["db.collection"] = collection
+            current = Span(f"mongo.{event.command_name}", parent.span_id if parent else None, attributes)
+            trace.add(current)
+            with trace.lock:
+                trace.mongo_spans[event.request_id] = current
+
+        def _finish(self, event, **attributes):
+            trace = _current_trace.get()
+            if trace is None:
+                return
+            with trace.lock:
+                current = trace.mongo_spans.pop(event.request_id, None)
+            if current is not None:
+                current.end_ns = time.time_ns()
+                current.set(**attributes)
+
+        def succeeded(self, event):
+            self._finish(event)
+
+        def failed(self, event):
+            self._finish(event, error=str(event.failure))
+
+    monitoring.register(_MongoCommandListener())
+
+
+# --------------------------------------------------------------------------- #
+# Export
+# --------------------------------------------------------------------------- #
+
+class _Exporter:
+    """
+    Background thread that writes sampled traces to the JSONL file and/or OTLP collector.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=1000)
+        self._thread = None
+        self.dropped = 0
+        self.exported = 0
+
+    def submit(self, trace: Trace):
+        if not (EXPORT_FILE or OTLP_ENDPOINT):
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1  # never slow down requests because the sink is slow
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if EXPORT_FILE:
+                    with open(EXPORT_FILE, "a", encoding="utf-8") as handle:
+                        for trace in batch:
+                            handle.write(json.dumps(trace_to_dict(trace), default=str) + "\n")
+                if OTLP_ENDPOINT:
+                    import httpx
+                    httpx.post(OTLP_ENDPOINT, json=traces_to_otlp(batch), timeout=5)
+                self.exported += len(batch)
+            except Exception as e:
+                print(f"Trace export failed: {e}")
+
+
+_exporter = _Exporter()
+
+
+def trace_to_dict(trace: Trace) -> dict:
+    return {
+        "request_id": trace.request_id,
+        "trace_id": trace.trace_id,
+        "spans": [s.to_dict() for s in trace.spans],
+    }
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def traces_to_otlp(traces: list) -> dict:
+    """
+    Convert traces to the OTLP/HTTP JSON request body.
+    """
+    spans = []
+    for trace in traces:
+        for s in trace.spans:
+            otlp_span = {
+                "traceId": trace.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": 2 if s.parent_id is None else 1,  # SERVER for the root, INTERNAL otherwise
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns or s.start_ns),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+            }
+            if s.parent_id:
+                otlp_span["parentSpanId"] = s.parent_id
+            spans.append(otlp_span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "recipe-backend.tracing"}, "spans": spans}],
+    }]}
+
+
+def format_tree(trace: Trace) -> str:
+    """
+    Render a trace as an indented tree, children in start order.
+    """
+    children = {}
+    for s in sorted(trace.spans, key=lambda s: s.start_ns):
+        children.setdefault(s.parent_id, []).append(s)
+    root_start = min((s.start_ns for s in trace.spans), default=0)
+
+    lines = []
+
+    def walk(parent_id, depth):
+        for s in children.get(parent_id, []):
+            offset_ms = (s.start_ns - root_start) / 1e6
+            attributes = " ".join(f"{k}={v}" for k, v in s.attributes.items())
+            lines.append(f"{'  ' * depth}{s.name}  {s.duration_ms:.1f} ms  (+{offset_ms:.1f} ms)  {attributes}".rstrip())
+            walk(s.span_id, depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def _finish_trace(trace: Trace, root: Span):
+    root.end_ns = time.time_ns()
+    if root.duration_ms >= SLOW_MS:
+        print(f"Slow request {trace.request_id} ({root.duration_ms:.0f} ms):\n{format_tree(trace)}")
+    if trace.sampled:
+        _exporter.submit(trace)
+
+
+# --------------------------------------------------------------------------- #
+# ASGI middleware
+# --------------------------------------------------------------------------- #
+
+class TracingMiddleware:
+    """
+    Start a trace for every HTTP request and propagate X-Request-ID.
+    A client (or nginx) can force sampling with the header X-Trace-Sample: 1.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:128] or uuid.uuid4().hex
+        sampled = headers.get(b"x-trace-sample") == b"1" or random.random() < SAMPLE_RATE
+
+        trace = Trace(request_id, sampled)
+        root = Span(f"{scope['method']} {scope['path']}", None, {"http.method": scope["method"], "http.path": scope["path"]})
+        trace.add(root)
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                root.set(**{"http.status_code": message["status"]})
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            _finish_trace(trace, root)
+
+
+def stats() -> dict:
+    return {
+        "enabled": TRACING_ENABLED,
+        "sample_rate": SAMPLE_RATE,
+        "slow_ms": SLOW_MS,
+        "exported": _exporter.exported,
+        "dropped": _exporter.dropped,
+    }
@@ -0,0 +1,78 @@
+"""
+This file defines per-user version counters used to answer conditional GETs
+(ETag / If-None-Match) without re-reading the underlying collections.
+
+Each user has one document in the `resource_versions` collection:
+    {"user_id": "...", "fridge": 12, "favorites": 3, "profile": 1, "friends": 4}
+
+Write paths call `bump()` AFTER their write succeeds, so a reader that sees a
+version never gets data older than that version. Read paths call `get()` (one
+small indexed lookup) and compare the resulting ETag with the client's
+If-None-Match header; on a match they answer 304 without querying the data.
+"""
+
+import hashlib
+
+from pymongo import ReturnDocument
+
+# The resources that carry a version counter
+FRIDGE = "fridge"
+FAVORITES = "favorites"
+PROFILE = "profile"
+FRIENDS = "friends"
+
+
+class ResourceVersions:
+    """
+    Thin wrapper around the `resource_versions` collection.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        self.collection.create_index("user_id", unique=True)
+
+    def bump(self, user_id: str, resource: str) -> int:
+        """
+        Atomically increment `resource`'s version for one user. Returns the new version.
+        """
+        document = self.collection.find_one_and_update(
+            {"user_id": user_id}, {"$inc": {resource: 1}},
+            projection={"_id": 0, resource: 1}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return document[resource]
+
+    def bump_many(self, user_ids: list, resource: str):
+        """
+        Increment `resource`'s version for several users (e.g. all friends of someone
+        whose profile picture changed).
+        """
+        for user_id in user_ids:
+            self.bump(user_id, resource)
+
+    def get(self, user_id: str, resource: str) -> int:
+        document = self.collection.find_one({"user_id": user_id}, {"_id": 0, resource: 1})
+        return document.get(resource, 0) if document else 0
+
+
+def make_etag(user_id: str, resource: str, version: int, extra: str = "") -> str:
+    """
+    Build a strong ETag for one user's resource at a version. `extra` lets callers mix
+    in anything else the response depends on (e.g. claims from the JWT).
+    """
+    digest = hashlib.blake2b(f"{user_id}|{extra}".encode("utf-8"), digest_size=6).hexdigest()
+    return f'"{resource}-{version}-{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Check an If-None-Match header value against our ETag (supports lists, "*" and W/ tags).
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
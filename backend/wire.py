@@ -0,0 +1,201 @@
+"""
+This file implements response encoding negotiation for the API (WireFormatMiddleware).
+
+Endpoints keep returning JSON. Based on the request headers, the middleware then:
+  - re-encodes JSON bodies as MessagePack when the client sends
+    `Accept: application/msgpack` (or application/x-msgpack);
+  - compresses bodies of at least WIRE_MIN_COMPRESS_BYTES (default 1024) with brotli
+    or gzip, whichever the client's Accept-Encoding prefers (brotli wins a tie, and is
+    only offered when the `brotli` package is installed).
+Clients that send neither header get exactly the bytes they got before.
+
+Streaming responses (more than one body message, e.g. server-sent events) and bodies
+that already have a Content-Encoding are passed through untouched. Re-encoded
+responses get a weak ETag, as nginx does for gzip, so If-None-Match keeps working.
+
+Set WIRE_FORMAT_ENABLED=0 to turn it off. GET /metrics shows bytes before and after
+under "wire".
+"""
+
+import gzip
+import json
+import os
+import threading
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is then simply not offered
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+WIRE_FORMAT_ENABLED = os.getenv("WIRE_FORMAT_ENABLED", "1") == "1"
+MIN_COMPRESS_BYTES = int(os.getenv("WIRE_MIN_COMPRESS_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("WIRE_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("WIRE_BROTLI_QUALITY", "4"))  # 4-5 is the sweet spot for dynamic content
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+COMPRESSIBLE_TYPES = ("application/json", "application/msgpack", "text/")
+
+_lock = threading.Lock()
+_counters = {"responses": 0, "msgpack": 0, "gzip": 0, "br": 0, "bytes_before": 0, "bytes_after": 0}
+
+
+def _parse_qualities(header: str) -> dict:
+    """
+    Parse an Accept or Accept-Encoding header into {value: q}.
+    """
+    qualities = {}
+    for part in header.split(","):
+        value, _, params = part.strip().partition(";")
+        value = value.strip().lower()
+        if not value:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, number = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        qualities[value] = q
+    return qualities
+
+
+def wants_msgpack(accept: str) -> bool:
+    """
+    True if the client asks for MessagePack and prefers it over JSON.
+    """
+    if msgpack is None or not accept:
+        return False
+    qualities = _parse_qualities(accept)
+    msgpack_q = max(qualities.get(t, 0.0) for t in MSGPACK_TYPES)
+    return msgpack_q > 0 and msgpack_q >= qualities.get("application/json", 0.0)
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    """
+    Pick "br", "gzip" or None from an Accept-Encoding header.
+    """
+    if not accept_encoding:
+        return None
+    qualities = _parse_qualities(accept_encoding)
+    wildcard = qualities.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = qualities.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encode_body(body: bytes, content_type: str, to_msgpack: bool, encoding: str | None) -> tuple:
+    """
+    Re-encode one complete response body. Returns (body, content type, content encoding
+    or None). JSON becomes MessagePack if `to_msgpack`; the result is compressed with
+    `encoding` if it is compressible and at least MIN_COMPRESS_BYTES long.
+    """
+    if to_msgpack and content_type.startswith("application/json") and body:
+        body = msgpack.packb(json.loads(body), use_bin_type=True)
+        content_type = "application/msgpack"
+    if encoding and len(body) >= MIN_COMPRESS_BYTES and content_type.startswith(COMPRESSIBLE_TYPES):
+        return compress(body, encoding), content_type, encoding
+    return body, content_type, None
+
+
+class WireFormatMiddleware:
+    """
+    Pure ASGI middleware applying `encode_body` to every non-streaming HTTP response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not WIRE_FORMAT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        to_msgpack = wants_msgpack(headers.get(b"accept", b"").decode("latin-1"))
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if not (to_msgpack or encoding):
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        passthrough = False
+
+        async def send_encoded(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                start = message  # hold it until we know the body
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            response_headers = [(k.lower(), v) for k, v in start.get("headers", [])]
+            header_map = dict(response_headers)
+            if message.get("more_body") or b"content-encoding" in header_map:
+                # Streaming or already encoded: leave it alone
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            content_type = header_map.get(b"content-type", b"").decode("latin-1")
+            new_body, new_type, content_encoding = encode_body(body, content_type, to_msgpack, encoding)
+
+            changed = new_body is not body
+            dropped = (b"content-length", b"content-type", b"vary") if changed else (b"vary",)
+            rewritten = [(k, v) for k, v in response_headers if k not in dropped]
+            if changed:
+                rewritten.append((b"content-type", new_type.encode("latin-1")))
+                rewritten.append((b"content-length", str(len(new_body)).encode("latin-1")))
+            vary = header_map.get(b"vary", b"").decode("latin-1")
+            rewritten.append((b"vary", ", ".join(filter(None, [vary, "Accept", "Accept-Encoding"])).encode("latin-1")))
+            if content_encoding:
+                rewritten.append((b"content-encoding", content_encoding.encode("latin-1")))
+            if changed:
+                # Same resource version, different bytes: the ETag can only be weak
+                rewritten = [
+                    (k, b"W/" + v if k == b"etag" and not v.startswith(b"W/") else v) for k, v in rewritten
+                ]
+
+            with _lock:
+                _counters["responses"] += 1
+                _counters["bytes_before"] += len(body)
+                _counters["bytes_after"] += len(new_body)
+                if new_type != content_type:
+                    _counters["msgpack"] += 1
+                if content_encoding:
+                    _counters[content_encoding] += 1
+
+            await send(dict(start, headers=rewritten))
+            await send({"type": "http.response.body", "body": new_body, "more_body": False})
+
+        await self.app(scope, receive, send_encoded)
+
+
+def stats() -> dict:
+    with _lock:
+        counters = dict(_counters)
+    counters["msgpack_available"] = msgpack is not None
+    counters["brotli_available"] = brotli is not None
+    return counters
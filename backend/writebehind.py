@@ -0,0 +1,215 @@
+"""
+This file implements an optional write-behind buffer for fridge quantity changes.
+
+Tapping + and - in the swipeable fridge list sends a burst of /fridge/add,
+/fridge/update_quantity and /fridge/remove calls for the same item. With the buffer
+enabled, those writes are recorded in memory, coalesced per (user_id, name), and
+written to MongoDB in one bulk_write per user once the user's oldest pending change is
+FRIDGE_WRITE_BEHIND_MS old.
+
+  - Coalescing: +1 +1 -1 becomes a single $inc of 1; anything followed by a
+    "set quantity" or a delete becomes just that set or delete.
+  - Reads are read-your-writes: main.py merges the pending changes over the rows read
+    from MongoDB (`read`), under the same per-user lock a flush holds, so a read never
+    sees a change twice or not at all.
+  - Shutdown flushes everything (`close`, called from the app lifespan). A failed flush
+    keeps the changes pending and retries on the next tick.
+
+The pending changes live in this process only: another worker process reading the same
+user's fridge sees them once they are flushed, up to one window later.
+Enable with FRIDGE_WRITE_BEHIND_MS=<window> (default 0, disabled).
+"""
+
+import os
+import threading
+import time
+from collections import defaultdict
+
+from bson.objectid import ObjectId
+
+INC = "inc"
+SET = "set"
+DELETE = "delete"
+
+
+class PendingChange:
+    """
+    The coalesced change for one (user_id, name). `item_id` is the _id to insert with
+    when the item does not exist yet, so its id stays the same after the flush.
+    """
+    __slots__ = ("kind", "quantity", "item_id")
+
+    def __init__(self, kind: str, quantity: int, item_id: str):
+        self.kind = kind
+        self.quantity = quantity
+        self.item_id = item_id
+
+    def __repr__(self):
+        return f"PendingChange({self.kind!r}, {self.quantity!r}, {self.item_id!r})"
+
+
+def apply_changes(rows: tuple, changes: dict) -> tuple:
+    """
+    Merge pending changes ({name: PendingChange}) over (id, name, quantity) rows.
+    """
+    if not changes:
+        return rows
+    merged = {name: (item_id, name, quantity) for item_id, name, quantity in rows}
+    for name, change in changes.items():
+        current = merged.get(name)
+        if change.kind == DELETE:
+            merged.pop(name, None)
+        elif change.kind == SET:
+            merged[name] = (current[0] if current else change.item_id, name, change.quantity)
+        elif current is not None:
+            merged[name] = (current[0], name, current[2] + change.quantity)
+        else:
+            merged[name] = (change.item_id, name, change.quantity)
+    return tuple(merged.values())
+
+
+class WriteBehindBuffer:
+    """
+    Per-user buffer of coalesced fridge changes, flushed by a background thread.
+    """
+
+    def __init__(self, flush_fn, window_seconds: float, on_flushed=None):
+        self.flush_fn = flush_fn            # (user_id, {name: PendingChange}) -> None, one bulk write
+        self.on_flushed = on_flushed        # user_id -> None, e.g. drop the cached rows
+        self.window_seconds = window_seconds
+        self._pending = {}                  # user_id -> {name: PendingChange}
+        self._first_change_at = {}          # user_id -> monotonic time of the oldest pending change
+        self._user_locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()       # guards the three dicts above
+        self._stop = threading.Event()
+        self._thread = None
+        self.counters = {"changes": 0, "coalesced": 0, "flushes": 0, "flushed_changes": 0, "flush_errors": 0}
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        with self._lock:
+            return self._user_locks[user_id]
+
+    # --- Writes --- #
+
+    def _record(self, user_id: str, name: str, kind: str, quantity: int):
+        with self._user_lock(user_id):
+            with self._lock:
+                changes = self._pending.setdefault(user_id, {})
+                self._first_change_at.setdefault(user_id, time.monotonic())
+                previous = changes.get(name)
+                self.counters["changes"] += 1
+                if previous is None:
+                    changes[name] = PendingChange(kind, quantity, str(ObjectId()))
+                    return
+                self.counters["coalesced"] += 1
+                if kind != INC:
+                    previous.kind, previous.quantity = kind, quantity
+                elif previous.kind == INC:
+                    previous.quantity += quantity
+                elif previous.kind == SET:
+                    previous.quantity += quantity
+                else:  # increment after a delete: the item comes back with just this quantity
+                    previous.kind, previous.quantity = SET, quantity
+
+    def increment(self, user_id: str, name: str, delta: int):
+        self._record(user_id, name, INC, delta)
+
+    def set_quantity(self, user_id: str, name: str, quantity: int):
+        """
+        Set the item's quantity; zero or less deletes it.
+        """
+        if quantity <= 0:
+            self._record(user_id, name, DELETE, 0)
+        else:
+            self._record(user_id, name, SET, quantity)
+
+    # --- Reads --- #
+
+    def read(self, user_id: str, load_rows) -> tuple:
+        """
+        Load the user's (id, name, quantity) rows with `load_rows()` and merge the
+        pending changes over them. Waits for a flush of this user in progress.
+        """
+        with self._user_lock(user_id):
+            rows = load_rows()
+            with self._lock:
+                changes = self._pending.get(user_id)
+                return apply_changes(rows, changes)
+
+    # --- Flushing --- #
+
+    def flush_user(self, user_id: str):
+        with self._user_lock(user_id):
+            with self._lock:
+                changes = self._pending.get(user_id)
+                if not changes:
+                    return
+            try:
+                self.flush_fn(user_id, changes)
+            except Exception as e:
+                # Keep the changes pending; the next tick retries them
+                print(f"Write-behind flush failed for {user_id}: {e}")
+                with self._lock:
+                    self.counters["flush_errors"] += 1
+                return
+            with self._lock:
+                del self._pending[user_id]
+                self._first_change_at.pop(user_id, None)
+                self.counters["flushes"] += 1
+                self.counters["flushed_changes"] += len(changes)
+            if self.on_flushed:
+                self.on_flushed(user_id)
+
+    def flush_due(self):
+        deadline = time.monotonic() - self.window_seconds
+        with self._lock:
+            due = [user_id for user_id, first in self._first_change_at.items() if first <= deadline]
+        for user_id in due:
+            self.flush_user(user_id)
+
+    def flush_all(self):
+        with self._lock:
+            users = list(self._pending)
+        for user_id in users:
+            self.flush_user(user_id)
+
+    def _run(self):
+        tick = max(self.window_seconds / 4, 0.01)
+        while not self._stop.wait(tick):
+            self.flush_due()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="fridge-write-behind", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """
+        Stop the background thread and flush everything still pending.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush_all()
+        with self._lock:
+            left = sum(len(changes) for changes in self._pending.values())
+        if left:
+            print(f"Write-behind: {left} fridge changes could not be flushed at shutdown")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            counters["pending_users"] = len(self._pending)
+            counters["pending_changes"] = sum(len(changes) for changes in self._pending.values())
+        return counters
+
+
+def create_write_behind_buffer(flush_fn, on_flushed=None) -> WriteBehindBuffer | None:
+    """
+    Build the buffer from FRIDGE_WRITE_BEHIND_MS, or return None when it is 0 (the default).
+    """
+    window_ms = float(os.getenv("FRIDGE_WRITE_BEHIND_MS", "0"))
+    if window_ms <= 0:
+        return None
+    return WriteBehindBuffer(flush_fn, window_ms / 1000, on_flushed)
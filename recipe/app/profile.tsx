@@ -17,7 +17,7 @@ import { User } from "./login";
 import { GoogleSignin } from "@react-native-google-signin/google-signin";
 import AsyncStorage from "@react-native-async-storage/async-storage";
 import * as ImagePicker from "expo-image-picker";
-import { apiRequest, getApiUrl } from "./api";
+import { getApiUrl } from "./api";
 import { useNavigation } from "@react-navigation/native";
 import { EventRegister } from "react-native-event-listeners";
 
@@ -30,6 +30,7 @@ interface Friend {
   id: string;
   name: string;
   recipes: (string | { title: string; description?: string })[];
+  recipes_count?: number; // total favorites, when recipes holds only the first few
   email?: string;
   picture?: string;
 }
@@ -250,12 +251,36 @@ export default function ProfilePage({ setUser, user }: ProfilePageProps) {
   useEffect(() => {
     const fetchFriends = async () => {
       try {
-        const data = await apiRequest("/user/friends");
-        if (Array.isArray(data)) {
-          setFriends(data);
-        } else {
-          console.error("Unexpected friend list data", data);
+        // Friends come back with their favorites already filled in, a page at a
+        // time; X-Total-Count says how many there are in all. A page can hold fewer
+        // than pageSize friends (friends without a profile are left out), so pages
+        // are counted by position, not by how many friends came back
+        const pageSize = 100;
+        const allFriends: Friend[] = [];
+        for (let skip = 0; ; skip += pageSize) {
+          const response = await fetch(
+            getApiUrl(
+              `user/friends_with_favorites?skip=${skip}&limit=${pageSize}&recipes_per_friend=20`
+            ),
+            {
+              headers: {
+                "Content-Type": "application/json",
+                Authorization: `Bearer ${user?.token}`,
+              },
+            }
+          );
+          const data = await response.json();
+          if (!response.ok || !Array.isArray(data)) {
+            console.error("Unexpected friend list data", data);
+            break;
+          }
+          allFriends.push(...data);
+          const total = Number(response.headers.get("X-Total-Count"));
+          if (!(skip + pageSize < total)) {
+            break;
+          }
         }
+        setFriends(allFriends);
       } catch (error) {
         console.error("Error fetching friends:", error);
       }
@@ -386,6 +411,15 @@ export default function ProfilePage({ setUser, user }: ProfilePageProps) {
         return;
       }
 
+      // Favorites were preloaded with the friend list; only fetch if some were cut off
+      if (
+        friend.recipes_count !== undefined &&
+        friend.recipes.length >= friend.recipes_count
+      ) {
+        setSelectedFriend(friend);
+        return;
+      }
+
       // For regular friends, fetch recipes from the backend
       const response = await fetch(
         getApiUrl(`user/friend_favorites?friend_id=${friend.id}`),
@@ -112,6 +112,9 @@ function Recipe({ text, fetchSavedRecipes }: RecipeProps) {
       await apiRequest("/recipes/favorite", "POST", {
         title: recipeData.name,
         description: description,
+        // The full recipe, so favorites can be viewed and searched later
+        ingredients: recipeData.ingredients || [],
+        steps: recipeData.steps || recipeData.detail || "",
         isFavorited: !isFavorited,
       } as any); // Using type assertion to bypass strict typing temporarily
       console.log("Favorite toggle successful for:", recipeData.name);